@@ -1,6 +1,9 @@
 """This module provides a convenience wrapper for loading all
 'app' blocks, which may or may not be available.
 
+App blocks (and block plugins) are registered in `BLOCK_TYPES` without being
+imported; see `pydatalab.blocks.registry` for details.
+
 """
 
 from typing import TYPE_CHECKING
@@ -10,116 +13,69 @@ if TYPE_CHECKING:
     from pydatalab.blocks.base import DataBlock  # noqa
 
 from pydatalab.blocks import COMMON_BLOCKS
-
-
-def _check_error(e):
-    if "circular" in str(e):
-        raise ImportError(e) from e
+from pydatalab.blocks.registry import BlockRegistry, _check_error, import_block
+
+APP_BLOCKS: dict[str, tuple[str, ...]] = {
+    # A dummy block that is used to check that bad blocks do not break the import
+    "pydatalab.apps._canary:CanaryBlock": (),
+    "pydatalab.apps.chat:ChatBlock": ("langchain_core", "langchain_openai", "langchain_anthropic"),
+    "pydatalab.apps.echem:CycleBlock": ("navani",),
+    "pydatalab.apps.eis:EISBlock": (),
+    "pydatalab.apps.ftir:FTIRBlock": (),
+    "pydatalab.apps.nmr:NMRBlock": ("nmrglue", "scipy"),
+    "pydatalab.apps.raman:RamanBlock": ("pybaselines", "renishawWiRE", "scipy"),
+    "pydatalab.apps.tga:MassSpecBlock": ("dateutil", "scipy"),
+    "pydatalab.apps.uvvis:UVVisBlock": (),
+    "pydatalab.apps.xrd:XRDBlock": ("scipy",),
+}
+"""The location of each app block, as `<module>:<class name>`, and the
+(top-level) modules that must be installed for it to be available."""
+
+PLUGIN_ENTRY_POINT_GROUP = "pydatalab.apps.plugins"
+
+BLOCK_TYPES: BlockRegistry = BlockRegistry(
+    COMMON_BLOCKS, APP_BLOCKS, plugin_group=PLUGIN_ENTRY_POINT_GROUP
+)
+"""The available block types, each of which is imported on first lookup."""
+
+
+def __getattr__(name: str):
+    # `BLOCKS` requires every block to be imported, so is only created on request
+    if name == "BLOCKS":
+        return list(BLOCK_TYPES.values())
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def load_app_blocks():
+    """Import and return all of the app blocks that are available."""
     app_blocks: list[type["DataBlock"]] = []
 
-    try:
-        # A dummy block that is used to check that bad blocks do not break the import
-        from pydatalab.apps._canary import CanaryBlock
-
-        app_blocks.append(CanaryBlock)
-    except ImportError as e:
-        _check_error(e)
-
-    try:
-        from pydatalab.apps.chat import ChatBlock
-
-        app_blocks.append(ChatBlock)
-    except ImportError as e:
-        _check_error(e)
-
-    try:
-        from pydatalab.apps.echem import CycleBlock
-
-        app_blocks.append(CycleBlock)
-    except ImportError as e:
-        _check_error(e)
-
-    try:
-        from pydatalab.apps.eis import EISBlock
-
-        app_blocks.append(EISBlock)
-    except ImportError as e:
-        _check_error(e)
-
-    try:
-        from pydatalab.apps.ftir import FTIRBlock
-
-        app_blocks.append(FTIRBlock)
-    except ImportError as e:
-        _check_error(e)
-
-    try:
-        from pydatalab.apps.nmr import NMRBlock
-
-        app_blocks.append(NMRBlock)
-    except ImportError as e:
-        _check_error(e)
-
-    try:
-        from pydatalab.apps.raman import RamanBlock
-
-        app_blocks.append(RamanBlock)
-    except ImportError as e:
-        _check_error(e)
-
-    try:
-        from pydatalab.apps.tga import MassSpecBlock
-
-        app_blocks.append(MassSpecBlock)
-    except ImportError as e:
-        _check_error(e)
-
-    try:
-        from pydatalab.apps.uvvis import UVVisBlock
-
-        app_blocks.append(UVVisBlock)
-    except ImportError as e:
-        _check_error(e)
-
-    try:
-        from pydatalab.apps.xrd import XRDBlock
-
-        app_blocks.append(XRDBlock)
-    except ImportError as e:
-        _check_error(e)
+    for target in APP_BLOCKS:
+        try:
+            app_blocks.append(import_block(target))
+        except ImportError as e:
+            _check_error(e)
 
     return app_blocks
 
 
-BLOCKS = COMMON_BLOCKS + load_app_blocks()
-BLOCK_TYPES: dict[str, type["DataBlock"]] = {block.blocktype: block for block in BLOCKS}
-
-
 def load_block_plugins():
     """Search through any registered entrypoints at 'pydatalab.apps.plugins'
-    and load them as DataBlock subclasses.
+    and load them as DataBlock subclasses, adding any new block types to
+    `BLOCK_TYPES`.
     """
     from importlib.metadata import entry_points
 
     from pydatalab.blocks.base import DataBlock
 
     block_plugins: dict[str, type[DataBlock]] = {}
-    for entry_point in entry_points(group="pydatalab.apps.plugins"):
+    for entry_point in entry_points(group=PLUGIN_ENTRY_POINT_GROUP):
         block = entry_point.load()
 
         if not issubclass(block, DataBlock):
             raise ValueError(f"Plugin {block} must be a subclass of DataBlock")
 
         block_plugins[block.blocktype] = block
-
-        if block.blocktype not in BLOCK_TYPES:
-            BLOCK_TYPES[block.blocktype] = block
-            BLOCKS.append(block)
+        BLOCK_TYPES.register(block)
 
     return block_plugins
-
-
-load_block_plugins()
@@ -9,14 +9,18 @@ from bson import ObjectId
 from navani import echem as ec
 
 from pydatalab import bokeh_plots
+from pydatalab.blobs import parsed_data_cache_path
 from pydatalab.blocks.base import DataBlock
 from pydatalab.file_utils import get_file_info_by_id
 from pydatalab.logger import LOGGER
+from pydatalab.metrics import record_cache
 from pydatalab.mongo import flask_mongo
 
 from .utils import (
+    APPENDABLE_ECHEM_EXTENSIONS,
     compute_gpcl_differential,
     filter_df_by_cycle_index,
+    load_appendable_echem_file,
     reduce_echem_cycle_sampling,
 )
 
@@ -135,14 +139,28 @@ class CycleBlock(DataBlock):
                 )
 
             parsed_file_loc = Path(file_info["location"]).with_suffix(".RAW_PARSED.pkl")
+            digest = (file_info.get("metadata") or {}).get("sha256")
+            if digest and not file_info.get("is_live"):
+                # The parsed data of content-addressed files is cached by their hash, so is
+                # always current and shared by every copy of the same data
+                parsed_file_loc = parsed_data_cache_path(digest, ".RAW_PARSED.pkl")
+                reload = False
 
             if not reload:
                 if parsed_file_loc.exists():
                     raw_df = pd.read_pickle(parsed_file_loc)  # noqa: S301
+            record_cache("echem_parsed_data", hit=raw_df is not None)
 
             if raw_df is None:
                 try:
-                    raw_df = ec.echem_file_loader(file_info["location"])
+                    if ext in APPENDABLE_ECHEM_EXTENSIONS and file_info.get("is_live"):
+                        # Text exports are appended to during a measurement, so only parse new rows
+                        raw_df = load_appendable_echem_file(
+                            file_info["location"],
+                            Path(file_info["location"]).with_suffix(".RAW_ROWS.pkl"),
+                        )
+                    else:
+                        raw_df = ec.echem_file_loader(file_info["location"])
                 except Exception as exc:
                     raise RuntimeError(f"Navani raised an error when parsing: {exc}") from exc
                 raw_df.to_pickle(parsed_file_loc)
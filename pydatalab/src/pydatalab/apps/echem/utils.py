@@ -1,9 +1,69 @@
+from pathlib import Path
+
 import navani.echem as ec
 import numpy as np
 import pandas as pd
 
 from pydatalab.logger import LOGGER
 from pydatalab.utils import reduce_df_size
+from pydatalab.utils.parsing import read_appended_table
+
+APPENDABLE_ECHEM_EXTENSIONS = (".txt", ".csv")
+"""Text formats that cyclers append to during a measurement, which can be parsed incrementally."""
+
+
+def load_appendable_echem_file(location: str | Path, cache_path: str | Path) -> pd.DataFrame:
+    """Load a text-based echem file (Ivium/Maccor `.txt` or navani-processed `.csv`)
+    into the same form as `navani.echem.echem_file_loader`, only parsing the rows
+    appended since the last call (see `read_appended_table`).
+
+    The navani post-processing (e.g., capacity integration and cycle detection)
+    is then applied to the whole table, as it depends on the preceding rows.
+
+    Parameters:
+        location: The path of the file to load.
+        cache_path: Where to cache the raw parsed rows between calls.
+
+    Returns:
+        The processed echem dataframe.
+
+    """
+    location = str(location)
+    ext = Path(location).suffix.lower()
+    if ext not in APPENDABLE_ECHEM_EXTENSIONS:
+        raise ValueError(
+            f"Cannot incrementally parse {ext!r} files, must be one of {APPENDABLE_ECHEM_EXTENSIONS}"
+        )
+
+    if ext == ".txt":
+        with open(location) as f:
+            first_line = f.readline()
+        if first_line.startswith("Today's Date"):
+            from navani.maccor import maccor_reader
+
+            raw_df = read_appended_table(location, cache_path, sep="\t", skiprows=1)
+            df = maccor_reader(raw_df.copy())
+        else:
+            raw_df = read_appended_table(location, cache_path, sep="\t")
+            if {"time /s", "I /mA", "E /V"} - set(raw_df.columns):
+                raise ValueError("Columns do not match expected columns for an ivium .txt file")
+            df = ec.ivium_processing(raw_df.copy())
+
+    else:
+        df = read_appended_table(location, cache_path, low_memory=False).copy()
+        expected_columns = ["Capacity", "Voltage", "half cycle", "full cycle", "Current", "state"]
+        if not all(col in df.columns for col in expected_columns):
+            raise ValueError("Columns do not match expected columns for navani processed csv")
+        df["state"] = df["state"].replace("1", 1).replace("0", 0)
+        df[["Capacity", "Voltage", "Current"]] = df[["Capacity", "Voltage", "Current"]].astype(
+            float
+        )
+        df[["full cycle", "half cycle"]] = df[["full cycle", "half cycle"]].astype(int)
+
+    if "half cycle" in df.columns:
+        df["full cycle"] = (df["half cycle"] / 2).apply(np.ceil)
+
+    return df
 
 
 def reduce_echem_cycle_sampling(df: pd.DataFrame, num_samples: int = 100) -> pd.DataFrame:
@@ -12,6 +12,7 @@ from pydatalab.bokeh_plots import DATALAB_BOKEH_THEME, selectable_axes_plot
 from pydatalab.file_utils import get_file_info_by_id
 from pydatalab.logger import LOGGER
 from pydatalab.mongo import flask_mongo
+from pydatalab.utils.parsing import cached_read_csv_kwargs, read_appended_table
 
 from .models import PeakInformation
 from .utils import compute_cif_pxrd, parse_rasx_zip, parse_xrdml
@@ -47,7 +48,7 @@ class XRDBlock(DataBlock):
 
     @classmethod
     def load_pattern(
-        cls, location: str | Path, wavelength: float | None = None
+        cls, location: str | Path, wavelength: float | None = None, incremental: bool = False
     ) -> tuple[pd.DataFrame, list[str], dict]:
         """Load the XRD pattern at the given file location, returning
         a DataFrame with the pattern data, a list of y-axis options for plotting
@@ -56,6 +57,8 @@ class XRDBlock(DataBlock):
         Parameters:
             location: The file location of the XRD pattern.
             wavelength: The wavelength of the X-ray source. Defaults to CuKa.
+            incremental: For text-based patterns, cache the parsed rows next to the file
+                so that later calls only parse the data appended since (e.g., for live files).
 
         """
 
@@ -94,32 +97,52 @@ class XRDBlock(DataBlock):
                 except (ValueError, RuntimeError):
                     return None
 
-            possible_separators = (r"\s+", ",")
-            df = pd.DataFrame()
-            # Try to parse the file by incrementing skiprows until all lines can be cast to np.float64
-            # Set arbitrary limit to avoid infinite loop; a header of >1,000 lines is unlikely to be useful
-            max_skiprows: int = 1_000
             final_skiprows: int = 0
-            for skiprows in range(max_skiprows):
-                for sep in possible_separators:
-                    df = _try_read_csv(sep, skiprows)
+            cache_path = Path(location).with_suffix(".XRD_ROWS.pkl")
+            read_csv_kwargs = cached_read_csv_kwargs(cache_path) if incremental else None
+            if read_csv_kwargs:
+                try:
+                    df = read_appended_table(location, cache_path, **read_csv_kwargs)
+                except (ValueError, RuntimeError):
+                    df = pd.DataFrame()
+                final_skiprows = read_csv_kwargs["skiprows"]
+
+            if not read_csv_kwargs or df.empty:
+                possible_separators = (r"\s+", ",")
+                df = pd.DataFrame()
+                # Try to parse the file by incrementing skiprows until all lines can be cast to np.float64
+                # Set arbitrary limit to avoid infinite loop; a header of >1,000 lines is unlikely to be useful
+                max_skiprows: int = 1_000
+                for skiprows in range(max_skiprows):
+                    for sep in possible_separators:
+                        df = _try_read_csv(sep, skiprows)
+                        if df is not None and not df.empty:
+                            final_skiprows = skiprows
+                            break
+
                     if df is not None and not df.empty:
                         final_skiprows = skiprows
                         break
 
-                if df is not None and not df.empty:
-                    final_skiprows = skiprows
-                    break
+                # If no valid separator/skiprows combo was found, raise an error
+                else:
+                    raise RuntimeError(
+                        f"Unable to extract XRD data from file {location}; check file header for irregularities"
+                    )
 
-            # If no valid separator/skiprows combo was found, raise an error
-            else:
-                raise RuntimeError(
-                    f"Unable to extract XRD data from file {location}; check file header for irregularities"
-                )
+                if incremental:
+                    df = read_appended_table(
+                        location,
+                        cache_path,
+                        sep=sep,
+                        skiprows=final_skiprows,
+                        dtype=np.float64,
+                        names=columns,
+                    )
 
             if final_skiprows > 0:
                 with open(location) as f:
-                    header = "".join([next(f) for _ in range(skiprows)])
+                    header = "".join([next(f) for _ in range(final_skiprows)])
                     df.attrs["header"] = header
 
         if len(df) == 0:
@@ -283,6 +306,7 @@ class XRDBlock(DataBlock):
             pattern_df, y_options, peak_data = self.load_pattern(
                 file_info["location"],
                 wavelength=float(self.data.get("wavelength", self.defaults["wavelength"])),
+                incremental=bool(file_info.get("is_live")),
             )
             pattern_df.attrs["item_id"] = self.data.get("item_id", "unknown")
             pattern_df.attrs["original_filename"] = file_info.get("name", "unknown")
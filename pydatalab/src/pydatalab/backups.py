@@ -1,11 +1,31 @@
 import datetime
+import hashlib
+import io
+import json
+import os
+import shutil
 import subprocess
 import tarfile
 import tempfile
+import time
+from collections import Counter
+from collections.abc import Callable, Iterable, Iterator
 from pathlib import Path
+from typing import IO
 
+from pydatalab import __version__
+from pydatalab.blobs import BLOB_DIRECTORY
 from pydatalab.config import CONFIG, BackupStrategy
 from pydatalab.logger import LOGGER
+from pydatalab.metrics import observe
+
+INCREMENTAL_OBJECTS_DIR = "objects"
+"""The directory under an incremental backup location in which file contents are stored by hash."""
+
+INCREMENTAL_SNAPSHOTS_DIR = "snapshots"
+"""The directory under an incremental backup location in which snapshot manifests are stored."""
+
+SNAPSHOT_MANIFEST_NAME = "manifest.json"
 
 
 def check_mongodump_available() -> None:
@@ -31,19 +51,172 @@ def check_mongodump_available() -> None:
         ) from e
 
 
+SNAPSHOT_SUFFIXES = (".tar", ".tar.gz", ".tar.zst")
+"""The supported file extensions for (non-incremental) snapshots, in order of compression."""
+
+_ARCHIVE_PART_SIZE = 64 * 1024 * 1024
+"""The maximum size of each tar member holding a slice of the streamed database archive,
+which bounds the memory used when adding the archive to a snapshot.
+"""
+
+_COPY_BUFSIZE = 1024 * 1024
+
+
+def _snapshot_suffix(snapshot_path: Path) -> str:
+    for suffix in sorted(SNAPSHOT_SUFFIXES, key=len, reverse=True):
+        if snapshot_path.name.endswith(suffix):
+            return suffix
+    raise RuntimeError(
+        f"Snapshot path should be one of {', '.join(SNAPSHOT_SUFFIXES)} files, not {snapshot_path}"
+    )
+
+
+def _compression_command(suffix: str, decompress: bool = False) -> list[str] | None:
+    """Return the command of an external, multi-threaded (de)compressor for the
+    given snapshot suffix that reads from stdin and writes to stdout, or `None`
+    if the (de)compression should be done in-process.
+
+    zstd is required for `.tar.zst` snapshots; `.tar.gz` snapshots use `pigz`
+    when it is installed and fall back to Python's gzip otherwise.
+
+    """
+    threads = str(os.cpu_count() or 1)
+    if suffix == ".tar.zst":
+        if shutil.which("zstd") is None:
+            raise RuntimeError(
+                "zstd is not installed or not in PATH, cannot use .tar.zst snapshots"
+            )
+        if decompress:
+            return ["zstd", "--decompress", "--stdout", "--quiet"]
+        return ["zstd", f"-T{threads}", "--stdout", "--quiet"]
+    if suffix == ".tar.gz" and shutil.which("pigz") is not None:
+        if decompress:
+            return ["pigz", "--decompress", "--stdout"]
+        return ["pigz", "--processes", threads, "--stdout"]
+    return None
+
+
+def _database_archive_parts() -> Iterator[bytes]:
+    """Stream `mongodump --archive`, yielding it in consecutive parts so that no
+    temporary files are written and at most `_ARCHIVE_PART_SIZE` bytes are held
+    in memory. At least one (possibly empty) part is always yielded.
+
+    Raises:
+        subprocess.CalledProcessError: If mongodump fails, once its output has been consumed.
+
+    """
+    command = ["mongodump", CONFIG.MONGO_URI, "--archive"]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)  # noqa: S603
+    archive: IO[bytes] = process.stdout  # type: ignore[assignment]
+
+    parts = 0
+    try:
+        while True:
+            part = archive.read(_ARCHIVE_PART_SIZE)
+            if not part and parts:
+                break
+            yield part
+            parts += 1
+            if len(part) < _ARCHIVE_PART_SIZE:
+                break
+    finally:
+        archive.close()
+        returncode = process.wait()
+
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+
+
+def _archive_part_name(index: int) -> str:
+    return f"dump.archive.{index:05d}"
+
+
+def _add_database_archive(tar: tarfile.TarFile) -> int:
+    """Stream `mongodump --archive` into the tar file, split across as many
+    `mongodb/dump.archive.<n>` members as needed.
+
+    Returns:
+        The number of parts written.
+
+    """
+    parts = 0
+    for part in _database_archive_parts():
+        info = tarfile.TarInfo(str(Path("mongodb") / _archive_part_name(parts)))
+        info.size = len(part)
+        info.mtime = int(datetime.datetime.now(tz=datetime.timezone.utc).timestamp())
+        tar.addfile(info, io.BytesIO(part))
+        parts += 1
+
+    return parts
+
+
+def _restore_command() -> list[str]:
+    """Return the `mongorestore` command used to restore the database from a snapshot,
+    to which either `--archive` (reading from stdin) or a dump directory is appended.
+
+    """
+    return [
+        "mongorestore",
+        CONFIG.MONGO_URI,
+        "--drop",
+        f"--numParallelCollections={os.cpu_count() or 1}",
+    ]
+
+
+def _fetch_stored_files() -> None:
+    """If files are kept in an object store, make sure that the local copies in
+    `CONFIG.FILE_DIRECTORY` are complete and current before they are backed up.
+
+    """
+    if CONFIG.FILE_STORAGE:
+        from pydatalab.storage import fetch_stored_files
+
+        LOGGER.info("Fetching stored files from %s", CONFIG.FILE_STORAGE.bucket)
+        count = fetch_stored_files()
+        LOGGER.debug("Checked %s stored files", count)
+
+
+def _excluded_from_backup(relative_path: str) -> bool:
+    """Return whether the given path, relative to `CONFIG.FILE_DIRECTORY`, holds
+    transient or regenerable data that is not backed up, i.e., partial uploads,
+    image derivatives and the caches of data parsed from blobs.
+
+    """
+    from pydatalab.derivatives import DERIVATIVES_DIRECTORY
+    from pydatalab.uploads import UPLOADS_DIRECTORY
+
+    parts = relative_path.split("/")
+    if parts[0] in (UPLOADS_DIRECTORY, DERIVATIVES_DIRECTORY):
+        return True
+    # Caches derived from a blob are stored alongside it, as `<digest>.<suffix>`
+    return parts[0] == BLOB_DIRECTORY and len(parts) == 3 and "." in parts[2]
+
+
+def _backup_filter(tarinfo: tarfile.TarInfo) -> tarfile.TarInfo | None:
+    """Exclude transient and regenerable data from the `files/` section of a snapshot."""
+    if _excluded_from_backup(tarinfo.name.removeprefix("files/")):
+        return None
+    return tarinfo
+
+
 def take_snapshot(snapshot_path: Path, encrypt: bool = False) -> None:
     """Make a compressed snapshot of the entire datalab deployment that
     can be restored from with sufficient granularity, e.g., including
     config files.
 
     Creates a tar file with the following structure:
-        - `./files/` - contains all files in `CONFIG.FILE_DIRECTORY`
-        - `./mongodb/` - contains a dump of the mongodb database
+        - `./files/` - contains all files in `CONFIG.FILE_DIRECTORY`, except partial
+          uploads and caches (see `_excluded_from_backup`)
+        - `./mongodb/` - contains a `mongodump --archive` of the mongodb database,
+          split into `dump.archive.<n>` parts
         - `./config/` - contains a dump of the server config
 
+    The tar file is written as a single stream, compressed by multi-threaded
+    `zstd` for `.tar.zst` files or `pigz` (if available) for `.tar.gz` files.
+
     Arguments:
-        snapshot_path: Desired path to the .tar or .tar.gz output file, will raise
-            a `FileExistsError` error if the file already exists.
+        snapshot_path: Desired path to the .tar, .tar.gz or .tar.zst output file, will
+            raise a `FileExistsError` error if the file already exists.
         encrypt: Whether to encrypt the snapshot on write.
 
     """
@@ -53,54 +226,330 @@ def take_snapshot(snapshot_path: Path, encrypt: bool = False) -> None:
     if encrypt:
         raise NotImplementedError("Snapshot encryption not yet implemented")
 
-    if "".join(snapshot_path.suffixes) == ".tar.gz":
-        mode = "w:gz"
-    elif snapshot_path.suffixes == ".tar":
-        mode = "w"
-    else:
-        raise RuntimeError(
-            f"Output path should either be a .tar or .tar.gz file, not {snapshot_path} with {snapshot_path.suffix}"
-        )
+    suffix = _snapshot_suffix(snapshot_path)
+    compressor = _compression_command(suffix)
 
     # Check mongodump is available before starting
     check_mongodump_available()
 
     LOGGER.info("Creating snapshot of entire datalab instance.")
-    LOGGER.debug("Creating snapshot of %s", CONFIG.FILE_DIRECTORY)
-    # Add contents of `CONFIG.FILE_DIRECTORY` to the tar file
-    with tarfile.open(snapshot_path, mode=mode) as tar:  # type: ignore[call-overload]
-        for file in Path(CONFIG.FILE_DIRECTORY).iterdir():
-            tar.add(file, arcname=Path("files") / file.relative_to(CONFIG.FILE_DIRECTORY))
+    with open(snapshot_path, "wb") as output:
+        process = None
+        if compressor is not None:
+            process = subprocess.Popen(compressor, stdin=subprocess.PIPE, stdout=output)  # noqa: S603
+            tar = tarfile.open(fileobj=process.stdin, mode="w|")
+        elif suffix == ".tar.gz":
+            tar = tarfile.open(fileobj=output, mode="w|gz")
+        else:
+            tar = tarfile.open(fileobj=output, mode="w|")
+
+        try:
+            _fetch_stored_files()
+            LOGGER.debug("Creating snapshot of %s", CONFIG.FILE_DIRECTORY)
+            # Add contents of `CONFIG.FILE_DIRECTORY` to the tar file
+            for file in Path(CONFIG.FILE_DIRECTORY).iterdir():
+                tar.add(
+                    file,
+                    arcname=Path("files") / file.relative_to(CONFIG.FILE_DIRECTORY),
+                    filter=_backup_filter,
+                )
+            LOGGER.debug("Snapshot of %s created.", CONFIG.FILE_DIRECTORY)
 
-        LOGGER.debug("Snapshot of %s created.", CONFIG.FILE_DIRECTORY)
+            # Stream a database dump into the tar file
+            LOGGER.debug("Taking dump of database %s", CONFIG.MONGO_URI)
+            parts = _add_database_archive(tar)
+            LOGGER.debug("Dump of database %s created in %s parts.", CONFIG.MONGO_URI, parts)
 
-        # Take a database dump and add it to the tar file
-        LOGGER.debug("Taking dump of database %s", CONFIG.MONGO_URI)
+            LOGGER.debug("Dumping server config.")
+            data = CONFIG.json(indent=2, exclude_unset=True).encode("utf-8")
+            info = tarfile.TarInfo(str(Path("config") / "config.json"))
+            info.size = len(data)
+            info.mtime = int(datetime.datetime.now(tz=datetime.timezone.utc).timestamp())
+            tar.addfile(info, io.BytesIO(data))
+            LOGGER.debug("Config dump created.")
 
-        # Check that mongodump is available
-        subprocess.check_output(["mongodump", "--version"])  # noqa: S603, S607
+            tar.close()
+            if process is not None:
+                process.stdin.close()  # type: ignore[union-attr]
+                if (returncode := process.wait()) != 0:
+                    raise subprocess.CalledProcessError(returncode, compressor)  # type: ignore[arg-type]
 
-        with tempfile.TemporaryDirectory() as temp_dir:
-            command = ["mongodump", CONFIG.MONGO_URI, "--out", str(Path(temp_dir).resolve())]
-            subprocess.check_output(command)  # noqa: S603
+        except BaseException:
+            if process is not None:
+                process.kill()
+                process.wait()
+            output.close()
+            snapshot_path.unlink(missing_ok=True)
+            raise
 
-            for file in Path(temp_dir).iterdir():
-                tar.add(file, arcname=Path("mongodb"))
+    LOGGER.info("Snapshot saved at %s", snapshot_path)
 
-        LOGGER.debug("Dump of database %s created.", CONFIG.MONGO_URI)
 
-        LOGGER.debug("Dumping server config.")
-        with tempfile.TemporaryDirectory() as temp_dir:
-            with open(tmp_config := Path(temp_dir) / "config.json", "w") as f:
-                data = CONFIG.json(indent=2, exclude_unset=True)
-                f.write(data)
+def _hash_file(path: Path) -> str:
+    """Return the hex SHA-256 digest of the file at the given path."""
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1024 * 1024):
+            sha256.update(chunk)
+    return sha256.hexdigest()
 
-                tar.add(
-                    tmp_config,
-                    arcname=Path("config") / "config.json",
+
+def _object_path(object_store: Path, digest: str) -> Path:
+    return object_store / digest[:2] / digest
+
+
+def _walk_files(root: Path, exclude: Callable[[str], bool] | None = None) -> Iterator[Path]:
+    """Yield the paths of all files under the given directory, in sorted order,
+    skipping any (files or whole directories) whose path relative to `root` is excluded.
+
+    """
+    for directory, dirnames, filenames in os.walk(root):
+        relative_directory = Path(directory).relative_to(root)
+        if exclude is not None:
+            dirnames[:] = [
+                name for name in dirnames if not exclude((relative_directory / name).as_posix())
+            ]
+        dirnames.sort()
+        for name in sorted(filenames):
+            if exclude is None or not exclude((relative_directory / name).as_posix()):
+                yield Path(directory) / name
+
+
+def _add_tree_to_store(
+    root: Path,
+    object_store: Path,
+    previous: dict[str, dict] | None = None,
+    exclude: Callable[[str], bool] | None = None,
+) -> tuple[dict[str, dict], int]:
+    """Add all files under the given directory to the content-addressed object store.
+
+    Files whose size and modification time match their entry in a previous manifest
+    are assumed to be unchanged and are not read again.
+
+    Arguments:
+        root: The directory to add.
+        object_store: The directory in which file contents are stored by hash.
+        previous: The manifest entries for this directory from the previous snapshot.
+        exclude: A function of the path of each file or directory relative to
+            `root`, returning whether it should be left out.
+
+    Returns:
+        The manifest entries for each file, keyed by path relative to `root`,
+        and the number of new objects written to the store.
+
+    """
+    previous = previous or {}
+    entries: dict[str, dict] = {}
+    written = 0
+    for path in _walk_files(root, exclude):
+        if not path.is_file():
+            continue
+        relative_path = path.relative_to(root).as_posix()
+        stat = path.stat()
+
+        entry = previous.get(relative_path)
+        if (
+            entry is not None
+            and entry["size"] == stat.st_size
+            and entry["mtime_ns"] == stat.st_mtime_ns
+            and _object_path(object_store, entry["sha256"]).exists()
+        ):
+            digest = entry["sha256"]
+        else:
+            digest = _hash_file(path)
+            object_path = _object_path(object_store, digest)
+            if not object_path.exists():
+                object_path.parent.mkdir(parents=True, exist_ok=True)
+                partial_path = object_path.with_name(f"{digest}.partial")
+                shutil.copyfile(path, partial_path)
+                os.replace(partial_path, object_path)
+                written += 1
+
+        entries[relative_path] = {
+            "sha256": digest,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        }
+
+    return entries, written
+
+
+def take_incremental_snapshot(
+    snapshot_path: Path, object_store: Path, previous_manifest: Path | None = None
+) -> dict:
+    """Make an incremental snapshot of the entire datalab deployment, storing the
+    contents of each file once in a content-addressed object store and writing a
+    manifest that maps each path in the snapshot to its content.
+
+    Creates a directory containing a `manifest.json` with the following sections:
+        - `files` - the files in `CONFIG.FILE_DIRECTORY`, except partial uploads
+          and caches (see `_excluded_from_backup`)
+        - `mongodb` - the parts of a `mongodump --archive` of the mongodb database
+        - `config` - a dump of the server config
+
+    The manifest is written last, so a snapshot directory without one is incomplete.
+
+    Arguments:
+        snapshot_path: Desired path of the snapshot directory, will raise a
+            `FileExistsError` if it already exists.
+        object_store: The directory in which file contents are stored by hash.
+        previous_manifest: The manifest of the previous snapshot, if any, used to
+            skip hashing files that have not changed.
+
+    Returns:
+        The snapshot manifest.
+
+    """
+    if snapshot_path.exists():
+        raise FileExistsError(f"Not overwriting existing snapshot at {snapshot_path}")
+
+    check_mongodump_available()
+
+    previous: dict = {}
+    if previous_manifest is not None and previous_manifest.exists():
+        previous = json.loads(previous_manifest.read_text())
+
+    LOGGER.info("Creating incremental snapshot of entire datalab instance.")
+    object_store.mkdir(parents=True, exist_ok=True)
+
+    _fetch_stored_files()
+    files, written = _add_tree_to_store(
+        Path(CONFIG.FILE_DIRECTORY),
+        object_store,
+        previous.get("files"),
+        exclude=_excluded_from_backup,
+    )
+    LOGGER.debug("Snapshot of %s created with %s new objects.", CONFIG.FILE_DIRECTORY, written)
+
+    LOGGER.debug("Taking dump of database %s", CONFIG.MONGO_URI)
+    mongodb: dict[str, dict] = {}
+    for index, part in enumerate(_database_archive_parts()):
+        digest = hashlib.sha256(part).hexdigest()
+        object_path = _object_path(object_store, digest)
+        if not object_path.exists():
+            object_path.parent.mkdir(parents=True, exist_ok=True)
+            partial_path = object_path.with_name(f"{digest}.partial")
+            partial_path.write_bytes(part)
+            os.replace(partial_path, object_path)
+        mongodb[_archive_part_name(index)] = {"sha256": digest, "size": len(part)}
+    LOGGER.debug("Dump of database %s created in %s parts.", CONFIG.MONGO_URI, len(mongodb))
+
+    manifest = {
+        "created_at": datetime.datetime.now(tz=datetime.timezone.utc).isoformat(),
+        "datalab_version": __version__,
+        "files": files,
+        "mongodb": mongodb,
+        "config": json.loads(CONFIG.json(exclude_unset=True)),
+    }
+
+    snapshot_path.mkdir(parents=True)
+    partial_manifest = snapshot_path / f"{SNAPSHOT_MANIFEST_NAME}.partial"
+    partial_manifest.write_text(json.dumps(manifest, indent=2))
+    os.replace(partial_manifest, snapshot_path / SNAPSHOT_MANIFEST_NAME)
+
+    LOGGER.info("Incremental snapshot saved at %s", snapshot_path)
+    return manifest
+
+
+def prune_object_store(object_store: Path, manifests: Iterable[Path]) -> int:
+    """Remove all objects from the store that are not referenced by any of the given
+    snapshot manifests.
+
+    Arguments:
+        object_store: The directory in which file contents are stored by hash.
+        manifests: The manifests of all snapshots to keep.
+
+    Returns:
+        The number of objects removed.
+
+    """
+    references: Counter[str] = Counter()
+    for manifest_path in manifests:
+        manifest = json.loads(manifest_path.read_text())
+        for section in ("files", "mongodb"):
+            references.update(entry["sha256"] for entry in manifest.get(section, {}).values())
+
+    removed = 0
+    for object_path in object_store.glob("*/*"):
+        if references[object_path.name] == 0:
+            object_path.unlink()
+            removed += 1
+
+    LOGGER.debug("Pruned %s unreferenced objects from %s", removed, object_store)
+    return removed
+
+
+def _restore_incremental_snapshot(snapshot_path: Path) -> None:
+    """Restore an incremental snapshot from its manifest and the object store
+    alongside it.
+
+    """
+    manifest = json.loads((snapshot_path / SNAPSHOT_MANIFEST_NAME).read_text())
+    object_store = snapshot_path.parent.parent / INCREMENTAL_OBJECTS_DIR
+
+    def _restore_tree(entries: dict[str, dict], root: Path, relink_blobs: bool = False) -> None:
+        blobs: dict[str, Path] = {}
+        # Blobs are restored first, so that the files sharing their contents can be
+        # linked to them again rather than stored as separate copies
+        for relative_path, entry in sorted(
+            entries.items(), key=lambda item: not item[0].startswith(f"{BLOB_DIRECTORY}/")
+        ):
+            object_path = _object_path(object_store, entry["sha256"])
+            if not object_path.exists():
+                raise FileNotFoundError(
+                    f"Object {entry['sha256']} for {relative_path} missing from {object_store}"
                 )
-        LOGGER.debug("Config dump created.")
-        LOGGER.info("Snapshot saved at %s", snapshot_path)
+            destination = root / relative_path
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            destination.unlink(missing_ok=True)
+            blob = blobs.get(entry["sha256"])
+            if blob is not None:
+                try:
+                    os.link(blob, destination)
+                    continue
+                except OSError:
+                    pass
+            shutil.copyfile(object_path, destination)
+            os.utime(destination, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+            if (
+                relink_blobs
+                and relative_path.startswith(f"{BLOB_DIRECTORY}/")
+                and destination.name == entry["sha256"]
+            ):
+                blobs[entry["sha256"]] = destination
+
+    LOGGER.debug("Restoring files from %s", snapshot_path)
+    _restore_tree(manifest["files"], Path(CONFIG.FILE_DIRECTORY), relink_blobs=True)
+    LOGGER.debug("Files restored from %s", snapshot_path)
+
+    LOGGER.debug("Restoring database from %s", snapshot_path)
+    mongodb: dict[str, dict] = manifest["mongodb"]
+    if mongodb and all(name.startswith("dump.archive.") for name in mongodb):
+        parts = [_object_path(object_store, mongodb[name]["sha256"]) for name in sorted(mongodb)]
+        for part in parts:
+            if not part.exists():
+                raise FileNotFoundError(f"Object {part.name} missing from {object_store}")
+
+        command = [*_restore_command(), "--archive"]
+        restore = subprocess.Popen(command, stdin=subprocess.PIPE)  # noqa: S603
+        try:
+            for part in parts:
+                with open(part, "rb") as f:
+                    shutil.copyfileobj(f, restore.stdin, _COPY_BUFSIZE)  # type: ignore[misc]
+            restore.stdin.close()  # type: ignore[union-attr]
+            if (returncode := restore.wait()) != 0:
+                raise subprocess.CalledProcessError(returncode, command)
+        except BaseException:
+            if restore.poll() is None:
+                restore.kill()
+                restore.wait()
+            raise
+    elif mongodb:
+        # Snapshots made before archives were streamed contain the dump directory
+        with tempfile.TemporaryDirectory() as temp_dir:
+            _restore_tree(mongodb, Path(temp_dir) / "mongodb")
+            subprocess.check_output([*_restore_command(), str(Path(temp_dir) / "mongodb")])  # noqa: S603
+    LOGGER.debug("Database restored from %s", snapshot_path)
 
 
 def restore_snapshot(snapshot_path: Path, decrypt: bool = False):
@@ -111,7 +560,8 @@ def restore_snapshot(snapshot_path: Path, decrypt: bool = False):
     name.
 
     Arguments:
-        snapshot_path: Path to the .tar or .tar.gz snapshot file.
+        snapshot_path: Path to the .tar or .tar.gz snapshot file, or to the
+            directory of an incremental snapshot.
 
     """
     LOGGER.info("Attempting to restore snapshot from %s", snapshot_path)
@@ -120,30 +570,126 @@ def restore_snapshot(snapshot_path: Path, decrypt: bool = False):
     if not snapshot_path.exists():
         raise FileNotFoundError(f"Snapshot file not found at {snapshot_path}")
 
-    if "".join(snapshot_path.suffixes) == ".tar.gz":
-        mode = "r:gz"
-    elif snapshot_path.suffixes == ".tar":
-        mode = "r"
-    else:
-        raise RuntimeError(
-            f"Snapshot path should either be a .tar or .tar.gz file, not {snapshot_path} with {snapshot_path.suffix}"
-        )
+    if snapshot_path.is_dir():
+        if not (snapshot_path / SNAPSHOT_MANIFEST_NAME).exists():
+            raise RuntimeError(f"Incremental snapshot at {snapshot_path} has no manifest")
+        _restore_incremental_snapshot(snapshot_path)
+        LOGGER.info("Snapshot restored from %s", snapshot_path)
+        return
+
+    suffix = _snapshot_suffix(snapshot_path)
+    decompressor = _compression_command(suffix, decompress=True)
+
+    with open(snapshot_path, "rb") as snapshot, tempfile.TemporaryDirectory() as temp_dir:
+        process = None
+        if decompressor is not None:
+            process = subprocess.Popen(decompressor, stdin=snapshot, stdout=subprocess.PIPE)  # noqa: S603
+            tar = tarfile.open(fileobj=process.stdout, mode="r|")
+        elif suffix == ".tar.gz":
+            tar = tarfile.open(fileobj=snapshot, mode="r|gz")
+        else:
+            tar = tarfile.open(fileobj=snapshot, mode="r|")
+
+        restore = None
+        restore_command = _restore_command()
+        legacy_dump = Path(temp_dir) / "mongodb"
+
+        # Members are read in a single pass over the stream: files are extracted
+        # as they are found and the database archive is piped into mongorestore
+        LOGGER.debug("Restoring files and database from %s", snapshot_path)
+        try:
+            with tar:
+                for member in tar:
+                    if member.name.startswith("files/"):
+                        member.name = member.name.removeprefix("files/")
+                        if member.islnk():
+                            # Stored files are hardlinks to blobs, so are archived as links
+                            # to whichever path of the same file was added first
+                            member.linkname = member.linkname.removeprefix("files/")
+                        target = Path(CONFIG.FILE_DIRECTORY) / member.name
+                        if not member.isdir() and (target.is_file() or target.is_symlink()):
+                            # Replace, rather than overwrite, any existing file, as it
+                            # may share its contents with other hardlinked paths
+                            target.unlink()
+                        tar.extract(member, path=CONFIG.FILE_DIRECTORY)  # noqa: S202
+                    elif member.name.startswith("mongodb/dump.archive."):
+                        if restore is None:
+                            restore = subprocess.Popen(  # noqa: S603
+                                [*restore_command, "--archive"], stdin=subprocess.PIPE
+                            )
+                        shutil.copyfileobj(
+                            tar.extractfile(member),  # type: ignore[arg-type]
+                            restore.stdin,  # type: ignore[arg-type]
+                            _COPY_BUFSIZE,
+                        )
+                    elif member.name.startswith("mongodb/"):
+                        # Snapshots made before archives were streamed contain the dump directory
+                        tar.extract(member, path=temp_dir)  # noqa: S202
+
+            if restore is not None:
+                restore.stdin.close()  # type: ignore[union-attr]
+                if (returncode := restore.wait()) != 0:
+                    raise subprocess.CalledProcessError(returncode, restore_command)
+            elif legacy_dump.exists():
+                subprocess.check_output([*restore_command, str(legacy_dump)])  # noqa: S603
+
+            if process is not None and (returncode := process.wait()) != 0:
+                raise subprocess.CalledProcessError(returncode, decompressor)  # type: ignore[arg-type]
+
+        except BaseException:
+            for proc in (restore, process):
+                if proc is not None and proc.poll() is None:
+                    proc.kill()
+                    proc.wait()
+            raise
+
+        LOGGER.debug("Files and database restored from %s", snapshot_path)
 
-    with tarfile.open(snapshot_path, mode=mode) as tar:  # type: ignore[call-overload]
-        LOGGER.debug("Restoring files from %s", snapshot_path)
-        files = [m for m in tar.getmembers() if m.name.startswith("files/")]
-        tar.extractall(path=CONFIG.FILE_DIRECTORY, members=files)  # noqa: S202
-        LOGGER.debug("Files restored from %s", snapshot_path)
+    LOGGER.info("Snapshot restored from %s", snapshot_path)
 
-        LOGGER.debug("Restoring database from %s", snapshot_path)
-        with tempfile.TemporaryDirectory() as temp_dir:
-            database = [m for m in tar.getmembers() if m.name.startswith("mongodb/")]
-            tar.extractall(path=temp_dir, members=database)  # noqa: S202
-            command = ["mongorestore", CONFIG.MONGO_URI, "--drop", str(Path(temp_dir) / "mongodb")]
-            subprocess.check_output(command)  # noqa: S603
-        LOGGER.debug("Database restored from %s", snapshot_path)
 
-    LOGGER.info("Snapshot restored from %s", snapshot_path)
+def _create_incremental_backup(strategy: BackupStrategy, snapshot_name: str) -> None:
+    """Take an incremental snapshot under the strategy location, then apply the
+    retention limit and prune any objects no longer referenced by a snapshot.
+
+    """
+    snapshots_dir = strategy.location / INCREMENTAL_SNAPSHOTS_DIR
+    object_store = strategy.location / INCREMENTAL_OBJECTS_DIR
+    snapshots_dir.mkdir(parents=True, exist_ok=True)
+
+    def _complete_snapshots() -> list[Path]:
+        return sorted(
+            path
+            for path in snapshots_dir.iterdir()
+            if path.name.startswith("datalab-snapshot-")
+            and (path / SNAPSHOT_MANIFEST_NAME).exists()
+        )
+
+    existing_snapshots = _complete_snapshots()
+    take_incremental_snapshot(
+        snapshots_dir / snapshot_name,
+        object_store,
+        previous_manifest=existing_snapshots[-1] / SNAPSHOT_MANIFEST_NAME
+        if existing_snapshots
+        else None,
+    )
+
+    existing_snapshots = _complete_snapshots()
+    retention = strategy.retention or 100
+    if len(existing_snapshots) > retention:
+        LOGGER.info(
+            "Cleaning up old snapshots: found %s, retention set to %s",
+            len(existing_snapshots),
+            strategy.retention,
+        )
+        for snapshot_to_delete in existing_snapshots[: len(existing_snapshots) - retention]:
+            LOGGER.debug("Cleaning up snapshot %s", snapshot_to_delete)
+            shutil.rmtree(snapshot_to_delete)
+
+    prune_object_store(
+        object_store,
+        [snapshot / SNAPSHOT_MANIFEST_NAME for snapshot in _complete_snapshots()],
+    )
 
 
 def create_backup(strategy: BackupStrategy) -> bool:
@@ -157,11 +703,30 @@ def create_backup(strategy: BackupStrategy) -> bool:
         bool: Whether the backup was successful.
 
     """
+    backup_type = "incremental" if strategy.incremental else "snapshot"
+    start = time.perf_counter()
+    status = "failed"
+    try:
+        _create_backup(strategy)
+        status = "completed"
+    finally:
+        observe("backup_duration", time.perf_counter() - start, type=backup_type, status=status)
 
-    snapshot_name = f"datalab-snapshot-{datetime.datetime.now(tz=datetime.timezone.utc).strftime('%Y-%m-%d-%H-%M-%S')}.tar.gz"
+    return True
 
-    if strategy.hostname is None:
-        snapshot_path = strategy.location / snapshot_name
+
+def _create_backup(strategy: BackupStrategy) -> None:
+    snapshot_name = f"datalab-snapshot-{datetime.datetime.now(tz=datetime.timezone.utc).strftime('%Y-%m-%d-%H-%M-%S')}"
+
+    if strategy.hostname is None and strategy.incremental:
+        _create_incremental_backup(strategy, snapshot_name)
+
+    elif strategy.hostname is None:
+        snapshot_path = strategy.location / (
+            f"{snapshot_name}.tar.zst"
+            if strategy.compression == "zstd"
+            else f"{snapshot_name}.tar.gz"
+        )
 
         if not strategy.location.is_dir():
             strategy.location.mkdir(parents=True, exist_ok=True)
@@ -189,5 +754,3 @@ def create_backup(strategy: BackupStrategy) -> bool:
         raise NotImplementedError(
             "Direct remote backup functionality has been removed and superseded."
         )
-
-    return True
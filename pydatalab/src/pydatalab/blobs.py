@@ -0,0 +1,154 @@
+"""Content-addressed storage of file contents, so that identical data attached
+to many items (or re-synced from a remote) is only stored once.
+
+Each distinct file content is stored once as a blob under
+`CONFIG.FILE_DIRECTORY/.blobs/<sha256[:2]>/<sha256>`, and the per-file path
+(`FILE_DIRECTORY/ab/cd/<file_id>/<filename>`) is a hardlink to it, so that existing
+code reading file locations is unaffected. The `blobs` collection holds the
+number of file entries that reference each blob; a blob is deleted when its
+last reference is released.
+
+As hardlinked copies share their contents, a content-addressed file must never
+be modified in place: `release_blob` must be called (and the per-file path
+unlinked) before the file is replaced. Files that change over time, i.e., live
+files synced from a remote, are not content-addressed. On filesystems that do
+not support hardlinks, files are hashed but not deduplicated.
+
+Backups (see `pydatalab.backups`) include `.blobs`: tar snapshots store each
+content once, with its other paths archived as hardlinks that are recreated on
+restore, and restored incremental snapshots link each file back to its blob.
+When files are kept in an object store (`CONFIG.FILE_STORAGE`), only the
+per-file paths are uploaded: `.blobs` is local to each server, holding blobs of
+the files saved by that server only, and is never uploaded, nor pruned when a
+file is deleted via another server.
+
+"""
+
+import datetime
+import hashlib
+import os
+import shutil
+from pathlib import Path
+
+from pymongo import ReturnDocument
+
+from pydatalab.config import CONFIG
+from pydatalab.logger import LOGGER
+from pydatalab.mongo import get_database
+
+__all__ = ("hash_file", "blob_path", "store_blob", "release_blob", "parsed_data_cache_path")
+
+BLOB_DIRECTORY = ".blobs"
+"""The subdirectory of `CONFIG.FILE_DIRECTORY` holding the content-addressed blobs."""
+
+_READ_BUFSIZE = 1024 * 1024
+
+
+def hash_file(path: str | Path) -> str:
+    """Return the hex SHA-256 digest of the file at the given path."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while data := f.read(_READ_BUFSIZE):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def blob_path(digest: str) -> Path:
+    """Return the path of the blob with the given SHA-256 digest."""
+    return Path(CONFIG.FILE_DIRECTORY) / BLOB_DIRECTORY / digest[:2] / digest
+
+
+def parsed_data_cache_path(digest: str, suffix: str) -> Path:
+    """Return a path at which to cache data parsed or derived from the blob with
+    the given digest, e.g., `.RAW_PARSED.pkl`, or a directory of several files.
+    As the digest identifies the file contents, such caches are valid for every
+    file with the same contents, and are removed along with the blob.
+
+    """
+    return blob_path(digest).with_name(f"{digest}{suffix}")
+
+
+def _replace_with_link(source: Path, target: Path) -> None:
+    """Atomically replace `target` with a hardlink to `source`."""
+    partial = target.with_name(f".{target.name}.partial")
+    partial.unlink(missing_ok=True)
+    os.link(source, partial)
+    os.replace(partial, target)
+
+
+def store_blob(path: str | Path, digest: str | None = None) -> str:
+    """Add a reference from the file at `path` to the blob of its contents,
+    creating the blob from the file if it does not exist, or otherwise
+    replacing the file with a hardlink to the existing blob.
+
+    Parameters:
+        path: The per-file location of the file in the file store.
+        digest: The SHA-256 digest of the file, if already known.
+
+    Returns:
+        The SHA-256 digest of the file.
+
+    """
+    path = Path(path)
+    if digest is None:
+        digest = hash_file(path)
+
+    # Take the reference first, so that a concurrent `release_blob` cannot delete the blob
+    get_database().blobs.update_one(
+        {"_id": digest},
+        {
+            "$inc": {"refcount": 1},
+            "$setOnInsert": {
+                "size": path.stat().st_size,
+                "created_at": datetime.datetime.now(tz=datetime.timezone.utc),
+            },
+        },
+        upsert=True,
+    )
+
+    blob = blob_path(digest)
+    try:
+        if blob.exists():
+            if not blob.samefile(path):
+                _replace_with_link(blob, path)
+                LOGGER.debug("Deduplicated %s against blob %s", path, digest)
+        else:
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            _replace_with_link(path, blob)
+    except FileNotFoundError:
+        # The blob was removed after checking for it, so recreate it from this file
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        _replace_with_link(path, blob)
+    except OSError as exc:
+        LOGGER.warning("Unable to hardlink %s into the blob store: %s", path, exc)
+
+    return digest
+
+
+def release_blob(digest: str) -> bool:
+    """Release a reference to the blob with the given digest, deleting it (and
+    any parsed data cached for it) when no references remain.
+
+    Returns:
+        Whether the blob was deleted.
+
+    """
+    blobs = get_database().blobs
+    updated = blobs.find_one_and_update(
+        {"_id": digest}, {"$inc": {"refcount": -1}}, return_document=ReturnDocument.AFTER
+    )
+    if updated is None or updated["refcount"] > 0:
+        return False
+
+    if not blobs.delete_one({"_id": digest, "refcount": {"$lte": 0}}).deleted_count:
+        return False
+
+    blob = blob_path(digest)
+    blob.unlink(missing_ok=True)
+    for cache in blob.parent.glob(f"{digest}.*"):
+        if cache.is_dir():
+            shutil.rmtree(cache, ignore_errors=True)
+        else:
+            cache.unlink(missing_ok=True)
+    LOGGER.debug("Deleted unreferenced blob %s", digest)
+    return True
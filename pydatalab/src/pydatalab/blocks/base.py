@@ -1,6 +1,7 @@
 import functools
 import pprint
 import random
+import time
 import traceback
 import warnings
 from collections.abc import Callable, Sequence
@@ -8,6 +9,7 @@ from typing import Any
 
 from pydatalab import __version__
 from pydatalab.logger import LOGGER
+from pydatalab.metrics import observe
 from pydatalab.models.blocks import DataBlockResponse
 
 __all__ = ("generate_random_id", "DataBlock", "generate_js_callback_single_float_parameter")
@@ -216,6 +218,7 @@ class DataBlock:
         """Returns a JSON serializable dictionary to render the data block on the web."""
         block_errors = []
         block_warnings = []
+        start = time.perf_counter()
         if self.plot_functions:
             for plot in self.plot_functions:
                 with warnings.catch_warnings(record=True) as captured_warnings:
@@ -247,6 +250,7 @@ class DataBlock:
                                     for w in captured_warnings
                                 ]
                             )
+            observe("block_render_duration", time.perf_counter() - start, blocktype=self.blocktype)
 
         # If the last plotting run did not raise any errors or warnings, remove any old ones
         if block_errors:
@@ -1,5 +1,3 @@
-import base64
-import io
 import os
 import warnings
 from pathlib import Path
@@ -49,28 +47,27 @@ class MediaBlock(DataBlock):
 
     @property
     def plot_functions(self):
-        return (self.encode_tiff,)
+        return (self.generate_image_derivatives,)
 
-    def encode_tiff(self):
-        from PIL import Image
+    def generate_image_derivatives(self):
+        """Generate the reduced-resolution derivatives of the selected image
+        ahead of time, if they do not exist for its current revision; these are
+        then served by the file endpoint (with `?derivative=web`, etc.) rather
+        than embedded in the block data.
 
+        """
+        from pydatalab.derivatives import RASTER_IMAGE_EXTENSIONS, generate_image_derivatives
         from pydatalab.file_utils import get_file_info_by_id
 
         if "file_id" not in self.data:
-            LOGGER.warning("ImageBlock.encode_tiff(): No file set in the DataBlock")
+            LOGGER.warning("MediaBlock.generate_image_derivatives(): No file set in the DataBlock")
             return
-        if not self.data.get("b64_encoded_image"):
-            self.data["b64_encoded_image"] = {}
         file_info = get_file_info_by_id(self.data["file_id"], update_if_live=True)
         ext = os.path.splitext(file_info["location"].split("/")[-1])[-1].lower()
-        if ext in (".tif", ".tiff"):
-            im = Image.open(file_info["location"])
-            with io.BytesIO() as f:
-                im.save(f, format="PNG")
-                f.seek(0)
-                self.data["b64_encoded_image"][str(self.data["file_id"])] = base64.b64encode(
-                    f.getvalue()
-                ).decode()
+        if ext in RASTER_IMAGE_EXTENSIONS:
+            generate_image_derivatives(
+                {**file_info, "_id": self.data["file_id"]}, file_info["location"]
+            )
 
 
 class TabularDataBlock(DataBlock):
@@ -0,0 +1,292 @@
+"""A registry of the available block types that defers importing the
+implementation of each block until it is first used.
+
+Block implementations (particularly those of the apps, which may depend on,
+e.g., `navani`, `nmrglue` or `langchain`, as well as `bokeh` and `matplotlib`)
+are expensive to import, and most server processes only ever use a few of them.
+The registry instead reads the metadata of each block (its `blocktype`, `name`,
+`description`, `version` and `accepted_file_extensions`) statically from the
+source of the module that defines it, so that the available block types can be
+listed without importing any of them. Each block class is then imported the
+first time it is looked up in the registry.
+
+Blocks whose metadata cannot be read statically (e.g., because it is computed
+at import time) are imported when the registry is first populated instead.
+
+"""
+
+import ast
+import importlib
+import importlib.util
+import sys
+import threading
+from collections.abc import Iterator, Mapping
+from importlib.machinery import ModuleSpec, PathFinder
+from typing import Any
+
+from pydantic import BaseModel
+
+from pydatalab.blocks.base import DataBlock
+from pydatalab.logger import LOGGER
+
+__all__ = ("BlockInfo", "BlockRegistry", "import_block")
+
+_METADATA_ATTRIBUTES = ("blocktype", "name", "description", "version", "accepted_file_extensions")
+
+
+class BlockInfo(BaseModel):
+    """The metadata of a block type, available without importing it."""
+
+    target: str
+    """The location of the block class, as `<module>:<class name>`."""
+
+    blocktype: str
+    name: str
+    description: str
+    version: str
+    accepted_file_extensions: tuple[str, ...] | None = None
+
+    @classmethod
+    def from_block(cls, block: type[DataBlock]) -> "BlockInfo":
+        return cls(
+            target=f"{block.__module__}:{block.__qualname__}",
+            **{attr: getattr(block, attr, None) for attr in _METADATA_ATTRIBUTES},
+        )
+
+
+def _check_error(e: ImportError) -> None:
+    if "circular" in str(e):
+        raise ImportError(e) from e
+
+
+def _find_module_spec(module_name: str) -> ModuleSpec | None:
+    """Find the spec of a module without importing it (or any of its parent
+    packages that are not already imported).
+
+    """
+    if module_name in sys.modules:
+        return getattr(sys.modules[module_name], "__spec__", None)
+
+    parent, _, name = module_name.rpartition(".")
+    if not parent:
+        return importlib.util.find_spec(module_name)
+
+    parent_spec = _find_module_spec(parent)
+    if parent_spec is None or not parent_spec.submodule_search_locations:
+        return None
+    return PathFinder.find_spec(module_name, list(parent_spec.submodule_search_locations))
+
+
+def _static_value(node: ast.expr, namespace: dict[str, Any]) -> Any:
+    """Evaluate a literal expression, which may also refer to, and concatenate,
+    literals assigned to names in the module namespace.
+
+    Raises:
+        ValueError: If the expression cannot be evaluated statically.
+
+    """
+    if isinstance(node, ast.Name):
+        if node.id not in namespace:
+            raise ValueError(f"Cannot statically evaluate {node.id!r}")
+        return namespace[node.id]
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        return _static_value(node.left, namespace) + _static_value(node.right, namespace)
+    return ast.literal_eval(node)
+
+
+def _assignments(body: list[ast.stmt], namespace: dict[str, Any]) -> dict[str, Any]:
+    """Return the names in the given statements that are assigned static values."""
+    values: dict[str, Any] = {}
+    for statement in body:
+        if isinstance(statement, ast.Assign) and len(statement.targets) == 1:
+            target, value = statement.targets[0], statement.value
+        elif isinstance(statement, ast.AnnAssign) and statement.value is not None:
+            target, value = statement.target, statement.value
+        else:
+            continue
+        if isinstance(target, ast.Name):
+            try:
+                values[target.id] = _static_value(value, {**namespace, **values})
+            except (ValueError, TypeError, SyntaxError):
+                values.pop(target.id, None)
+    return values
+
+
+def _read_block_info(target: str, _depth: int = 0) -> BlockInfo | None:
+    """Read the metadata of the block class at `target` from the source of its
+    module, following relative and absolute `from ... import` statements to the
+    module that defines it.
+
+    Returns:
+        The metadata of the block, or `None` if it cannot be read statically.
+
+    """
+    module_name, _, class_name = target.partition(":")
+    spec = _find_module_spec(module_name)
+    if spec is None or not spec.origin or not spec.origin.endswith(".py") or _depth > 3:
+        return None
+
+    with open(spec.origin, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), filename=spec.origin)
+
+    namespace = _assignments(tree.body, {})
+    for statement in tree.body:
+        if isinstance(statement, ast.ClassDef) and statement.name == class_name:
+            # Only direct subclasses of `DataBlock` can have their metadata read,
+            # as anything else may inherit it from elsewhere
+            if [ast.unparse(base) for base in statement.bases] != ["DataBlock"]:
+                return None
+            attributes = _assignments(statement.body, namespace)
+            if "blocktype" not in attributes:
+                return None
+            metadata = {attr: getattr(DataBlock, attr, None) for attr in _METADATA_ATTRIBUTES}
+            metadata.update({k: v for k, v in attributes.items() if k in _METADATA_ATTRIBUTES})
+            return BlockInfo(target=target, **metadata)
+
+        if isinstance(statement, ast.ImportFrom) and any(
+            alias.name == class_name and alias.asname in (None, class_name)
+            for alias in statement.names
+        ):
+            source = statement.module or ""
+            if statement.level:
+                package = module_name if spec.submodule_search_locations else spec.parent
+                base = package.rsplit(".", statement.level - 1)[0] if package else ""
+                source = f"{base}.{source}" if source else base
+            return _read_block_info(f"{source}:{class_name}", _depth + 1)
+
+    return None
+
+
+def import_block(target: str) -> type[DataBlock]:
+    """Import the block class at `target`, i.e., `<module>:<class name>`."""
+    module_name, _, class_name = target.partition(":")
+    block = getattr(importlib.import_module(module_name), class_name)
+    if not isinstance(block, type) or not issubclass(block, DataBlock):
+        raise ValueError(f"Plugin {block} must be a subclass of DataBlock")
+    return block
+
+
+class BlockRegistry(Mapping[str, type[DataBlock]]):
+    """A mapping from each available block type to its class, which is only
+    imported when it is first looked up.
+
+    The registry is populated on first use from:
+
+    1. the given block classes, which are already imported,
+    2. the given targets (`<module>:<class name>`) of app blocks, each with the
+       top-level modules they require, which must be installed,
+    3. any block plugins registered under the `plugin_group` entry point group,
+       unless they clash with an existing block type.
+
+    """
+
+    def __init__(
+        self,
+        blocks: list[type[DataBlock]],
+        targets: dict[str, tuple[str, ...]],
+        plugin_group: str | None = None,
+    ):
+        self._blocks = list(blocks)
+        self._targets = dict(targets)
+        self._plugin_group = plugin_group
+        self._info: dict[str, BlockInfo] | None = None
+        self._classes: dict[str, type[DataBlock]] = {}
+        self._lock = threading.RLock()
+
+    def _block_info(self, target: str) -> BlockInfo | None:
+        try:
+            info = _read_block_info(target)
+        except (OSError, SyntaxError) as exc:
+            LOGGER.debug("Unable to read block metadata from %s: %s", target, exc)
+            info = None
+        if info is not None:
+            return info
+
+        LOGGER.debug("Importing %s to read its block metadata", target)
+        try:
+            block = import_block(target)
+        except ImportError as exc:
+            _check_error(exc)
+            LOGGER.debug("Unable to import block %s: %s", target, exc)
+            return None
+        self._classes[block.blocktype] = block
+        return BlockInfo.from_block(block)
+
+    def info(self) -> dict[str, BlockInfo]:
+        """Return the metadata of each available block type, without importing
+        any blocks that can be described statically.
+
+        """
+        if self._info is not None:
+            return self._info
+
+        with self._lock:
+            if self._info is not None:
+                return self._info
+
+            info: dict[str, BlockInfo] = {}
+            for block in self._blocks:
+                info[block.blocktype] = BlockInfo.from_block(block)
+                self._classes[block.blocktype] = block
+
+            for target, requires in self._targets.items():
+                if not all(_find_module_spec(module) for module in requires):
+                    LOGGER.debug("Skipping block %s, which requires %s", target, requires)
+                    continue
+                block_info = self._block_info(target)
+                if block_info is not None:
+                    info.setdefault(block_info.blocktype, block_info)
+
+            if self._plugin_group:
+                from importlib.metadata import entry_points
+
+                for entry_point in entry_points(group=self._plugin_group):
+                    block_info = self._block_info(entry_point.value.replace(" ", ""))
+                    if block_info is not None:
+                        info.setdefault(block_info.blocktype, block_info)
+
+            self._info = info
+            return info
+
+    def register(self, block: type[DataBlock]) -> bool:
+        """Add an imported block class to the registry, unless its block type is
+        already registered.
+
+        Returns:
+            Whether the block was added.
+
+        """
+        with self._lock:
+            info = self.info()
+            if block.blocktype in info:
+                return False
+            info[block.blocktype] = BlockInfo.from_block(block)
+            self._classes[block.blocktype] = block
+            return True
+
+    def __getitem__(self, blocktype: str) -> type[DataBlock]:
+        if blocktype in self._classes:
+            return self._classes[blocktype]
+
+        block_info = self.info()[blocktype]
+        with self._lock:
+            if blocktype not in self._classes:
+                LOGGER.debug("Importing block %s from %s", blocktype, block_info.target)
+                try:
+                    block = import_block(block_info.target)
+                except ImportError as exc:
+                    _check_error(exc)
+                    LOGGER.warning("Unable to import block %s: %s", block_info.target, exc)
+                    self.info().pop(blocktype, None)
+                    raise KeyError(blocktype) from exc
+                self._classes[blocktype] = block
+        return self._classes[blocktype]
+
+    def __contains__(self, blocktype: object) -> bool:
+        return blocktype in self.info()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self.info()))
+
+    def __len__(self) -> int:
+        return len(self.info())
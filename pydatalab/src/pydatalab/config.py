@@ -4,7 +4,7 @@ import logging
 import os
 import platform
 from pathlib import Path
-from typing import Any
+from typing import Any, Literal
 
 from pydantic import (
     AnyUrl,
@@ -19,7 +19,13 @@ from pydantic import (
 from pydatalab.models import Person
 from pydatalab.models.utils import RandomAlphabeticalRefcodeFactory, RefCodeFactory
 
-__all__ = ("CONFIG", "ServerConfig", "DeploymentMetadata", "RemoteFilesystem")
+__all__ = (
+    "CONFIG",
+    "ServerConfig",
+    "DeploymentMetadata",
+    "RemoteFilesystem",
+    "ObjectStorage",
+)
 
 config_logger = logging.getLogger("pydatalab.config")
 
@@ -89,6 +95,14 @@ class BackupStrategy(BaseModel):
         description="The frequency of the backup, described in the crontab syntax.",
         pattern=r"^(?:\*|\d+(?:-\d+)?)(?:\/\d+)?(?:,\d+(?:-\d+)?(?:\/\d+)?)*$",
     )
+    compression: Literal["gzip", "zstd"] = Field(
+        "gzip",
+        description="The compression to use for (non-incremental) snapshots. `zstd` requires the `zstd` executable; `gzip` will use `pigz` for multi-threaded compression if it is installed.",
+    )
+    incremental: bool = Field(
+        False,
+        description="Whether to store backups incrementally: each file is stored once under its content hash and each snapshot is a manifest referencing those files, so that a backup only writes files that have changed since the previous snapshot.",
+    )
     notification_email_address: str | None = Field(
         None, description="An email address to send backup notifications to."
     )
@@ -111,6 +125,20 @@ class RemoteFilesystem(BaseModel):
     path: Path = Field(description="The path to the base of the filesystem to include.")
 
 
+class ObjectStorage(BaseModel):
+    """Configuration for storing files in an S3-compatible object store."""
+
+    bucket: str = Field(description="The name of the bucket in which to store files.")
+    endpoint_url: AnyUrl | None = Field(
+        None,
+        description="The URL of the object store, e.g., of a MinIO server (`None` indicates AWS S3).",
+    )
+    region_name: str | None = Field(None, description="The region of the bucket, if required.")
+    prefix: str = Field(
+        "", description="A prefix to add to the key of each file, e.g., `datalab/files/`."
+    )
+
+
 class SMTPSettings(BaseModel):
     """Configuration for specifying SMTP settings for sending emails."""
 
@@ -162,6 +190,21 @@ class ServerConfig(BaseSettings):
         description="The path under which to place stored files uploaded to the server.",
     )
 
+    FILE_STORAGE: ObjectStorage | None = Field(
+        None,
+        description="An S3-compatible object store in which to store files, allowing several servers to share them. If set, `FILE_DIRECTORY` is used as a local cache of the stored files. Credentials are read from the standard AWS environment variables, e.g., `AWS_ACCESS_KEY_ID` and `AWS_SECRET_ACCESS_KEY`.",
+    )
+
+    FILE_SENDFILE: Literal["x-accel-redirect", "x-sendfile"] | None = Field(
+        None,
+        description="Offload sending stored files to a fronting web server once the API has checked permissions: `x-accel-redirect` for nginx (see `FILE_ACCEL_REDIRECT_PREFIX`), or `x-sendfile` for, e.g., Apache with `mod_xsendfile`.",
+    )
+
+    FILE_ACCEL_REDIRECT_PREFIX: str = Field(
+        "/_files/",
+        description="The internal nginx location that serves the contents of `FILE_DIRECTORY`, used when `FILE_SENDFILE` is `x-accel-redirect`.",
+    )
+
     LOG_FILE: str | Path | None = Field(
         None,
         description="The path to the log file to use for the server and all associated processes (e.g., invoke tasks)",
@@ -169,6 +212,16 @@ class ServerConfig(BaseSettings):
 
     DEBUG: bool = Field(True, description="Whether to enable debug-level logging in the server.")
 
+    METRICS_ENABLED: bool = Field(
+        False,
+        description="Whether to collect Prometheus metrics (request latencies, database command durations, block render times, cache hit rates and background job durations) and expose them at `/metrics`. Requires the `prometheus_client` package. When the server runs in multiple processes (e.g., gunicorn workers), the `PROMETHEUS_MULTIPROC_DIR` environment variable must be set to a directory shared by all processes (including any backup tasks) that is emptied before the server starts, so that metrics are aggregated across them. The metrics are only served to active admin users, or to requests presenting `METRICS_TOKEN`.",
+    )
+
+    METRICS_TOKEN: str | None = Field(
+        None,
+        description="A secret token that allows the metrics at `/metrics` to be read without logging in, by sending it in an `Authorization: Bearer <token>` header (e.g., from a Prometheus scrape config). If unset, only active admin users can read the metrics.",
+    )
+
     IDENTIFIER_PREFIX: str = Field(
         None,
         description="The prefix to use for identifiers in this deployment, e.g., 'grey' in `grey:AAAAAA`",
@@ -193,6 +246,42 @@ class ServerConfig(BaseSettings):
         description="The minimum age, in minutes, of the remote filesystem cache, below which the cache will not be invalidated if an update is manually requested.",
     )
 
+    SSH_CONTROL_PERSIST: int | None = Field(
+        600,
+        description="How long, in seconds, to keep idle SSH connections to remote filesystems open for reuse by later commands (via OpenSSH connection multiplexing). Set to `None` to open a new connection for every command.",
+    )
+
+    LIVE_FILE_CHECK_INTERVAL: int = Field(
+        60,
+        description="The minimum time, in seconds, between checks of the remote for newer versions of a live file.",
+    )
+
+    REMOTE_TRANSFER_CONCURRENCY: int = Field(
+        4,
+        ge=1,
+        description="The maximum number of files to transfer at once when attaching many remote files to an item in one request.",
+    )
+
+    JOB_QUEUES: dict[str, int] = Field(
+        {"default": 1, "exports": 2, "prewarm": 1},
+        description="The background job queues to run in each server process, mapped to the number of worker threads for each queue. Jobs are stored in the database, so any process running a queue can pick up its jobs. Removing the `prewarm` queue disables the prewarming of caches for newly stored files. The workers of each process are started by its first request, and each idle worker polls the database every 2 seconds.",
+    )
+
+    JOB_LEASE_SECONDS: int = Field(
+        300,
+        description="How long, in seconds, a running background job is leased to its worker without a heartbeat, after which it can be claimed by another worker (e.g., if the original process died).",
+    )
+
+    EXPORT_ARTIFACT_TTL: int = Field(
+        24,
+        description="The time, in hours, after its last use for which a generated export archive is kept on disk and reused for identical export requests. Expired archives are removed by an hourly background job.",
+    )
+
+    EXPORT_ARTIFACT_MAX_BYTES: int = Field(
+        10 * 1000**3,
+        description="The maximum total size, in bytes, of stored export archives, above which the least recently used archives are removed.",
+    )
+
     BEHIND_REVERSE_PROXY: bool = Field(
         False,
         description="Whether the Flask app is being deployed behind a reverse proxy. If `True`, the reverse proxy middleware described in the [Flask docs](https://flask.palletsprojects.com/en/2.2.x/deploying/proxy_fix/) will be attached to the app.",
@@ -246,6 +335,17 @@ Warning: this value will overwrite any other values passed to `FLASK_MAX_CONTENT
 its importance when deploying a datalab instance.""",
     )
 
+    UPLOAD_CHUNK_SIZE: int = Field(
+        64 * 1024**2,
+        ge=1,
+        description="The chunk size, in bytes, suggested to clients for resumable chunked uploads (capped at `MAX_CONTENT_LENGTH`, which applies to each chunk).",
+    )
+
+    UPLOAD_EXPIRY: int = Field(
+        24 * 60 * 60,
+        description="The time, in seconds, after its last chunk at which an incomplete chunked upload is discarded.",
+    )
+
     MAX_BATCH_CREATE_SIZE: int = Field(
         10_000,
         description="Maximum number of items that can be created in a single batch operation.",
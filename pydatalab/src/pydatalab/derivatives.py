@@ -0,0 +1,256 @@
+"""Cached, reduced-resolution derivatives of stored images, so that large images
+(e.g., microscopy TIFFs) are decoded once per file revision rather than on every
+view, and can be displayed in the browser in formats it supports.
+
+For each image, a `thumbnail` and a `web` resolution derivative are generated
+(as WebP, or PNG if Pillow lacks WebP support). Images larger than
+`PYRAMID_MIN_SIZE` also get a tiled pyramid, i.e., square tiles of
+`TILE_SIZE` pixels at successively halved resolutions, for deep-zoom viewers.
+
+Derivatives of content-addressed files are stored alongside the blob of their
+contents (and so removed with it); those of other files are stored under
+`CONFIG.FILE_DIRECTORY/.derivatives/<file_id>/<revision>/`, with those of
+older revisions removed when a new revision is processed. As they can be
+regenerated on demand, derivatives are not included in backups.
+
+"""
+
+import json
+import math
+import os
+import shutil
+from pathlib import Path
+from typing import Any
+
+from pydatalab.blobs import parsed_data_cache_path
+from pydatalab.config import CONFIG
+from pydatalab.logger import LOGGER
+from pydatalab.metrics import record_cache
+
+__all__ = (
+    "RASTER_IMAGE_EXTENSIONS",
+    "DERIVATIVE_SIZES",
+    "image_derivative",
+    "image_pyramid",
+    "pyramid_tile",
+    "generate_image_derivatives",
+)
+
+RASTER_IMAGE_EXTENSIONS: tuple[str, ...] = (".png", ".jpeg", ".jpg", ".tif", ".tiff")
+"""The extensions of image files for which derivatives can be generated."""
+
+DERIVATIVE_SIZES: dict[str, int] = {"thumbnail": 256, "web": 2048}
+"""The maximum width/height, in pixels, of each named derivative."""
+
+PYRAMID_MIN_SIZE = 8192
+"""The width/height, in pixels, above which a tiled pyramid is also generated."""
+
+TILE_SIZE = 512
+"""The width/height, in pixels, of each pyramid tile."""
+
+DERIVATIVES_DIRECTORY = ".derivatives"
+"""The subdirectory of `CONFIG.FILE_DIRECTORY` holding derivatives of files
+that are not content-addressed."""
+
+_PYRAMID_MANIFEST = "pyramid.json"
+_NO_PYRAMID = "no-pyramid"
+"""A marker file recording that an image is too small to need a pyramid."""
+
+
+def _image_format() -> tuple[str, str]:
+    """Return the Pillow format and extension to store derivatives with."""
+    from PIL import features
+
+    if features.check("webp"):
+        return "WEBP", ".webp"
+    return "PNG", ".png"
+
+
+def derivative_directory(file_doc: dict) -> Path:
+    """Return the directory holding the derivatives of the current revision of
+    the file with the given database document.
+
+    """
+    digest = (file_doc.get("metadata") or {}).get("sha256")
+    if digest:
+        return parsed_data_cache_path(digest, ".derivatives")
+    return (
+        Path(CONFIG.FILE_DIRECTORY)
+        / DERIVATIVES_DIRECTORY
+        / str(file_doc["_id"])
+        / str(file_doc.get("revision") or 1)
+    )
+
+
+def _to_displayable(image):
+    """Convert an image to a mode that can be saved as WebP/PNG, rescaling the
+    intensities of high bit-depth greyscale images (e.g., 16-bit TIFFs) to 8 bits.
+
+    """
+    if image.mode in ("I;16", "I;16B", "I;16L", "I", "F"):
+        if image.mode != "F":
+            image = image.convert("I")
+        low, high = image.getextrema()
+        scale = 255 / (high - low) if high > low else 1
+        return image.point(lambda value: value * scale - low * scale).convert("L")
+    if image.mode in ("RGB", "RGBA", "L", "LA"):
+        return image
+    if image.mode == "P" or "transparency" in image.info:
+        return image.convert("RGBA")
+    return image.convert("RGB")
+
+
+def _save(image, path: Path, image_format: str) -> None:
+    partial = path.with_name(f".{path.name}.partial")
+    image.save(partial, format=image_format)
+    os.replace(partial, path)
+
+
+def _reduce_to(image, max_size: int):
+    """Return a copy of the image reduced to fit within `max_size` pixels."""
+    from PIL import Image
+
+    image = image.copy()
+    image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS, reducing_gap=3.0)
+    return image
+
+
+def _build_pyramid(image, directory: Path, image_format: str, extension: str) -> dict[str, Any]:
+    """Write the tiles of each level of the pyramid, from level 0 at full
+    resolution down to the first level that fits in a single tile, returning
+    the manifest describing it.
+
+    """
+    from PIL import Image
+
+    levels = []
+    level = 0
+    tiles_directory = directory / "tiles"
+    while True:
+        columns = math.ceil(image.width / TILE_SIZE)
+        rows = math.ceil(image.height / TILE_SIZE)
+        level_directory = tiles_directory / str(level)
+        level_directory.mkdir(parents=True, exist_ok=True)
+        for x in range(columns):
+            for y in range(rows):
+                box = (
+                    x * TILE_SIZE,
+                    y * TILE_SIZE,
+                    min((x + 1) * TILE_SIZE, image.width),
+                    min((y + 1) * TILE_SIZE, image.height),
+                )
+                _save(image.crop(box), level_directory / f"{x}_{y}{extension}", image_format)
+        levels.append(
+            {"width": image.width, "height": image.height, "columns": columns, "rows": rows}
+        )
+
+        if columns == 1 and rows == 1:
+            break
+        image = image.resize(
+            (max(image.width // 2, 1), max(image.height // 2, 1)), Image.Resampling.BOX
+        )
+        level += 1
+
+    return {"tile_size": TILE_SIZE, "format": extension.lstrip("."), "levels": levels}
+
+
+def generate_image_derivatives(file_doc: dict, location: str | Path) -> Path:
+    """Generate any missing derivatives of the current revision of an image,
+    decoding the image at most once.
+
+    Parameters:
+        file_doc: The database document of the file, with its `_id`, `revision`
+            and `metadata.sha256`, if known.
+        location: A local path of the file.
+
+    Returns:
+        The directory holding the derivatives.
+
+    """
+    from PIL import Image
+
+    if os.path.splitext(str(location))[-1].lower() not in RASTER_IMAGE_EXTENSIONS:
+        raise ValueError(f"Cannot generate image derivatives of {location}")
+
+    directory = derivative_directory(file_doc)
+    image_format, extension = _image_format()
+    if all((directory / f"{name}{extension}").is_file() for name in DERIVATIVE_SIZES) and (
+        (directory / _PYRAMID_MANIFEST).is_file() or (directory / _NO_PYRAMID).is_file()
+    ):
+        record_cache("image_derivatives", hit=True)
+        return directory
+
+    record_cache("image_derivatives", hit=False)
+    LOGGER.debug("Generating image derivatives of %s in %s", location, directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    with Image.open(location) as image:
+        image = _to_displayable(image)
+
+        previous = image
+        for name, size in sorted(DERIVATIVE_SIZES.items(), key=lambda item: -item[1]):
+            # Reduce each size from the next largest, rather than the original
+            previous = _reduce_to(previous, size)
+            _save(previous, directory / f"{name}{extension}", image_format)
+
+        if max(image.size) > PYRAMID_MIN_SIZE:
+            manifest = _build_pyramid(image, directory, image_format, extension)
+            manifest.update({"width": image.width, "height": image.height})
+            partial = directory / f".{_PYRAMID_MANIFEST}.partial"
+            partial.write_text(json.dumps(manifest))
+            os.replace(partial, directory / _PYRAMID_MANIFEST)
+        else:
+            (directory / _NO_PYRAMID).touch()
+
+    if not (file_doc.get("metadata") or {}).get("sha256"):
+        # Derivatives of previous revisions will no longer be used
+        for other in directory.parent.iterdir():
+            if other != directory:
+                shutil.rmtree(other, ignore_errors=True)
+
+    return directory
+
+
+def image_derivative(file_doc: dict, location: str | Path, name: str) -> Path:
+    """Return the path of the named derivative (see `DERIVATIVE_SIZES`) of the
+    current revision of an image, generating it if required.
+
+    """
+    if name not in DERIVATIVE_SIZES:
+        raise ValueError(f"Unknown image derivative {name!r}")
+    _, extension = _image_format()
+    path = derivative_directory(file_doc) / f"{name}{extension}"
+    if not path.is_file():
+        generate_image_derivatives(file_doc, location)
+    return path
+
+
+def image_pyramid(file_doc: dict, location: str | Path) -> dict[str, Any] | None:
+    """Return the manifest of the tiled pyramid of the current revision of an
+    image, generating it if required, or `None` if the image is small enough
+    to be displayed from its `web` derivative.
+
+    """
+    directory = generate_image_derivatives(file_doc, location)
+    manifest = directory / _PYRAMID_MANIFEST
+    if not manifest.is_file():
+        return None
+    return json.loads(manifest.read_text())
+
+
+def pyramid_tile(file_doc: dict, location: str | Path, level: int, x: int, y: int) -> Path:
+    """Return the path of a tile of the pyramid of an image, generating the
+    pyramid if required.
+
+    Raises:
+        FileNotFoundError: If the image has no pyramid, or no such tile.
+
+    """
+    if image_pyramid(file_doc, location) is None:
+        raise FileNotFoundError(f"No tiled pyramid exists for {location}")
+    _, extension = _image_format()
+    path = (
+        derivative_directory(file_doc) / "tiles" / str(int(level)) / f"{int(x)}_{int(y)}{extension}"
+    )
+    if not path.is_file():
+        raise FileNotFoundError(f"No tile {level}/{x}_{y} exists for {location}")
+    return path
@@ -3,33 +3,119 @@ to other formats, such as .eln files.
 
 """
 
+import hashlib
 import json
-import shutil
 import tempfile
+import time
 import zipfile
+from collections.abc import Callable, Iterable
 from datetime import datetime, timezone
 from pathlib import Path
+from typing import Any
 
-from bson import ObjectId
+from bson import ObjectId, json_util
 
+from pydatalab import __version__
 from pydatalab.config import CONFIG
 from pydatalab.logger import LOGGER
 from pydatalab.models import ITEM_MODELS
+from pydatalab.models.export_task import ExportStatus
 from pydatalab.mongo import flask_mongo
+from pydatalab.storage import ensure_local_file
+
+__all__ = (
+    "generate_ro_crate_metadata",
+    "create_eln_file",
+    "get_export_digest",
+    "get_export_directory",
+    "cleanup_export_artifacts",
+)
+
+INCOMPRESSIBLE_EXTENSIONS: frozenset[str] = frozenset(
+    {
+        # archives and compressed data
+        ".7z",
+        ".bz2",
+        ".eln",
+        ".gz",
+        ".npz",
+        ".rar",
+        ".tgz",
+        ".xz",
+        ".zip",
+        ".zst",
+        # zip-based office formats
+        ".docx",
+        ".odp",
+        ".ods",
+        ".odt",
+        ".pptx",
+        ".xlsx",
+        # compressed images, audio and video
+        ".avif",
+        ".gif",
+        ".heic",
+        ".jpeg",
+        ".jpg",
+        ".mkv",
+        ".mov",
+        ".mp3",
+        ".mp4",
+        ".ogg",
+        ".pdf",
+        ".png",
+        ".webm",
+        ".webp",
+    }
+)
+"""File extensions of formats that are already compressed, which are stored
+in exported archives without further compression."""
+
+
+def _compression_for(filename: str) -> int:
+    """Return the zip compression method to use for a file with the given name."""
+    if Path(filename).suffix.lower() in INCOMPRESSIBLE_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
 
-__all__ = ("generate_ro_crate_metadata", "create_eln_file")
+
+def _get_files_by_id(items: Iterable[dict]) -> dict[ObjectId, dict]:
+    """Fetch the metadata of all files attached to the given items in a single query."""
+    file_ids = {
+        ObjectId(file_id) if isinstance(file_id, str) else file_id
+        for item in items
+        for file_id in item.get("file_ObjectIds") or []
+    }
+    if not file_ids:
+        return {}
+
+    return {
+        file_data["_id"]: file_data
+        for file_data in flask_mongo.db.files.find(
+            {"_id": {"$in": list(file_ids)}},
+            projection={"name": 1, "location": 1, "metadata.sha256": 1},
+        )
+    }
 
 
-def generate_ro_crate_metadata(collection_data: dict, child_items: list[dict]) -> dict:
+def generate_ro_crate_metadata(
+    collection_data: dict,
+    child_items: list[dict],
+    files_by_id: dict[ObjectId, dict] | None = None,
+) -> dict:
     """Generate RO-Crate metadata for the .eln file.
 
     Parameters:
         collection_data: The collection metadata
         child_items: List of items in the collection
+        files_by_id: The metadata of the files attached to the items, keyed by
+            their IDs; if not provided, this will be fetched from the database.
 
     Returns:
         RO-Crate metadata as a dictionary
     """
+    if files_by_id is None:
+        files_by_id = _get_files_by_id(child_items)
 
     experiments: list[dict] = []
     for item in child_items:
@@ -78,7 +164,7 @@ def generate_ro_crate_metadata(collection_data: dict, child_items: list[dict]) -
         if item.get("file_ObjectIds"):
             files = []
             for file_id in item["file_ObjectIds"]:
-                file_data = flask_mongo.db.files.find_one({"_id": ObjectId(file_id)})
+                file_data = files_by_id.get(ObjectId(file_id))
                 if file_data:
                     files.append({"@id": f"./{item['item_id']}/{file_data['name']}"})
             if files:
@@ -89,24 +175,18 @@ def generate_ro_crate_metadata(collection_data: dict, child_items: list[dict]) -
     return metadata
 
 
-def create_eln_file(
-    output_path: str,
+def _get_export_scope(
     collection_id: str | None = None,
     item_id: str | None = None,
     related_item_ids: list[str] | None = None,
-) -> None:
-    """Create a .eln file for a collection, item, or set of items.
+) -> tuple[dict, dict, str]:
+    """Resolve the items included in an export of a collection, item, or set of items.
 
-    Parameters:
-        collection_id: ID of the collection to export
-        output_path: Path where the .eln file should be saved
-        item_id: ID of the item to export
-        related_item_ids: List of related item IDs to include in the export.
+    Returns:
+        The collection metadata for the archive root, a query matching the exported
+        items and the name of the root folder in the archive.
 
     """
-    if not collection_id and not item_id:
-        raise ValueError("Either collection_id or item_id must be provided")
-
     if collection_id:
         # We are outside the request context here, so cannot easily apply permissions baesd on the user.
         # TODO: Extra safeguards here -- refactor default permissions finder to be able to use
@@ -116,85 +196,235 @@ def create_eln_file(
         if not collection_data:
             raise ValueError(f"Collection {collection_id} not found")
 
-        collection_immutable_id = collection_data["_id"]
-        child_items = list(
-            flask_mongo.db.items.find(
-                {
-                    "relationships": {
-                        "$elemMatch": {
-                            "type": "collections",
-                            "immutable_id": collection_immutable_id,
-                        }
-                    }
+        items_query = {
+            "relationships": {
+                "$elemMatch": {
+                    "type": "collections",
+                    "immutable_id": collection_data["_id"],
                 }
-            )
-        )
-        root_folder_name = collection_id
+            }
+        }
+        return collection_data, items_query, collection_id
 
-    elif item_id:
+    if item_id:
         # TODO: same comment about permissions as above
-        item_data = flask_mongo.db.items.find_one({"item_id": item_id})
+        item_data = flask_mongo.db.items.find_one({"item_id": item_id}, projection={"name": 1})
         if not item_data:
             raise ValueError(f"Item {item_id} not found")
 
-        if related_item_ids:
-            child_items = list(
-                flask_mongo.db.items.find({"item_id": {"$in": [item_id] + related_item_ids}})
-            )
-        else:
-            child_items = [item_data]
-
         collection_data = {
             "collection_id": item_id,
             "title": item_data.get("name", item_id),
             "description": f"Export of item {item_id}"
             + (" and related items" if related_item_ids else ""),
         }
-        root_folder_name = item_id
+        items_query = {"item_id": {"$in": [item_id] + (related_item_ids or [])}}
+        return collection_data, items_query, item_id
 
-    else:
-        raise ValueError("Either collection_id or item_id must be provided")
+    raise ValueError("Either collection_id or item_id must be provided")
 
-    with tempfile.TemporaryDirectory() as temp_dir:
-        temp_path = Path(temp_dir)
 
-        root_folder = temp_path / root_folder_name
-        root_folder.mkdir()
+def get_export_digest(
+    collection_id: str | None = None,
+    item_id: str | None = None,
+    related_item_ids: list[str] | None = None,
+) -> str:
+    """Compute a digest of the current state of everything included in an export,
+    i.e., the exported item documents and the revisions of their files, so that
+    identical exports can reuse a previously generated archive.
 
-        ro_crate_metadata = generate_ro_crate_metadata(collection_data, child_items)
-        with open(root_folder / "ro-crate-metadata.json", "w", encoding="utf-8") as f:
-            json.dump(ro_crate_metadata, f, indent=2, ensure_ascii=False)
+    The whole item documents are hashed (rather than just their versions), as
+    some edits, e.g., to data blocks, do not change the item version; files are
+    identified by lightweight projections of their metadata only.
 
-        for item in child_items:
-            item_folder = root_folder / item["item_id"]
-            item_folder.mkdir()
+    Parameters:
+        collection_id: ID of the collection to export
+        item_id: ID of the item to export
+        related_item_ids: List of related item IDs to include in the export.
 
-            item_metadata = ITEM_MODELS[item.get("type")](**item).json(indent=2)
+    Returns:
+        A hex SHA-256 digest.
+
+    """
+    collection_data, items_query, root_folder_name = _get_export_scope(
+        collection_id=collection_id, item_id=item_id, related_item_ids=related_item_ids
+    )
 
-            with open(item_folder / "metadata.json", "w", encoding="utf-8") as f:
-                f.write(item_metadata)
-
-            if item.get("file_ObjectIds"):
-                for file_id in item.get("file_ObjectIds", []):
-                    file_id_obj = ObjectId(file_id) if isinstance(file_id, str) else file_id
-                    file_data = flask_mongo.db.files.find_one({"_id": file_id_obj})
-                    if file_data:
-                        source_path = Path(file_data["location"])
-                        if source_path.exists():
-                            dest_file = item_folder / file_data["name"]
-                            shutil.copy2(source_path, dest_file)
-                        else:
-                            LOGGER.warning(
-                                "ELN export: File not found on disk: %s", file_data["location"]
-                            )
-                    else:
-                        LOGGER.warning(
-                            "ELN export: File metadata not found in database for file_id: %s",
-                            file_id,
-                        )
-
-        with zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-            for file_path in root_folder.rglob("*"):
-                if file_path.is_file():
-                    arcname = file_path.relative_to(temp_path)
-                    zipf.write(file_path, arcname)
+    digest = hashlib.sha256()
+
+    def _update(state: Any) -> None:
+        digest.update(json_util.dumps(state, sort_keys=True).encode("utf-8"))
+
+    _update(
+        {
+            "datalab_version": __version__,
+            "export": "collection" if collection_id else "item",
+            "root": root_folder_name,
+            "title": collection_data.get("title"),
+            "description": collection_data.get("description"),
+        }
+    )
+
+    file_ids: set[ObjectId] = set()
+    for item in flask_mongo.db.items.find(items_query).sort("item_id", 1):
+        file_ids.update(
+            ObjectId(file_id) if isinstance(file_id, str) else file_id
+            for file_id in item.get("file_ObjectIds") or []
+        )
+        _update(item)
+
+    files = (
+        flask_mongo.db.files.find(
+            {"_id": {"$in": list(file_ids)}},
+            projection={"name": 1, "revision": 1, "last_modified": 1, "size": 1},
+        )
+        if file_ids
+        else []
+    )
+    _update(
+        sorted(
+            (
+                str(file_data["_id"]),
+                file_data.get("name"),
+                file_data.get("revision"),
+                file_data.get("last_modified"),
+                file_data.get("size"),
+            )
+            for file_data in files
+        )
+    )
+    return digest.hexdigest()
+
+
+def get_export_directory() -> Path:
+    """Return the directory in which generated export archives are stored."""
+    return Path(tempfile.gettempdir()) / "eln-exports"
+
+
+def _expire_export_artifact(path: Path) -> None:
+    """Remove an export archive from disk and mark the tasks that produced it as expired."""
+    path.unlink(missing_ok=True)
+    flask_mongo.db.export_tasks.update_many(
+        {"file_path": str(path), "status": ExportStatus.READY},
+        {"$set": {"status": ExportStatus.EXPIRED}},
+    )
+
+
+def cleanup_export_artifacts() -> None:
+    """Remove export archives that have not been used within `EXPORT_ARTIFACT_TTL`
+    hours, then the least recently used archives until their total size is within
+    `EXPORT_ARTIFACT_MAX_BYTES`.
+
+    Archives are marked as used (via their modification time) whenever they are
+    reused or downloaded.
+
+    """
+    export_dir = get_export_directory()
+    if not export_dir.exists():
+        return
+
+    max_age = CONFIG.EXPORT_ARTIFACT_TTL * 3600
+    now = time.time()
+    artifacts: list[tuple[float, int, Path]] = []
+    for path in export_dir.iterdir():
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        if not path.is_file():
+            continue
+        if now - stat.st_mtime > max_age:
+            LOGGER.debug("Removing expired export archive %s", path)
+            _expire_export_artifact(path)
+        elif path.suffix == ".eln":
+            artifacts.append((stat.st_mtime, stat.st_size, path))
+
+    total_size = sum(size for _, size, _ in artifacts)
+    for _, size, path in sorted(artifacts):
+        if total_size <= CONFIG.EXPORT_ARTIFACT_MAX_BYTES:
+            break
+        LOGGER.debug("Removing export archive %s to stay within the disk quota", path)
+        _expire_export_artifact(path)
+        total_size -= size
+
+
+def create_eln_file(
+    output_path: str,
+    collection_id: str | None = None,
+    item_id: str | None = None,
+    related_item_ids: list[str] | None = None,
+    progress_callback: Callable[[float], None] | None = None,
+) -> None:
+    """Create a .eln file for a collection, item, or set of items.
+
+    Parameters:
+        collection_id: ID of the collection to export
+        output_path: Path where the .eln file should be saved
+        item_id: ID of the item to export
+        related_item_ids: List of related item IDs to include in the export.
+        progress_callback: An optional function that will be called with the
+            fraction of items exported so far.
+
+    """
+    collection_data, items_query, root_folder_name = _get_export_scope(
+        collection_id=collection_id, item_id=item_id, related_item_ids=related_item_ids
+    )
+    child_items = list(flask_mongo.db.items.find(items_query))
+
+    files_by_id = _get_files_by_id(child_items)
+
+    # Stream everything directly into the archive: metadata is generated in memory
+    # and attached files are read from their stored location, so no scratch copies
+    # are needed
+    with zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as zipf:
+        ro_crate_metadata = generate_ro_crate_metadata(
+            collection_data, child_items, files_by_id=files_by_id
+        )
+        zipf.writestr(
+            f"{root_folder_name}/ro-crate-metadata.json",
+            json.dumps(ro_crate_metadata, indent=2, ensure_ascii=False),
+        )
+
+        for ind, item in enumerate(child_items):
+            if progress_callback is not None:
+                progress_callback(ind / len(child_items))
+
+            item_folder = f"{root_folder_name}/{item['item_id']}"
+
+            item_metadata = ITEM_MODELS[item.get("type")](**item).json(indent=2)
+            zipf.writestr(f"{item_folder}/metadata.json", item_metadata)
+
+            written_names: set[str] = set()
+            for file_id in item.get("file_ObjectIds") or []:
+                file_id_obj = ObjectId(file_id) if isinstance(file_id, str) else file_id
+                file_data = files_by_id.get(file_id_obj)
+                if not file_data:
+                    LOGGER.warning(
+                        "ELN export: File metadata not found in database for file_id: %s",
+                        file_id,
+                    )
+                    continue
+
+                source_path = Path(
+                    ensure_local_file(
+                        file_data["location"], (file_data.get("metadata") or {}).get("sha256")
+                    )
+                )
+                if not source_path.exists():
+                    LOGGER.warning("ELN export: File not found on disk: %s", file_data["location"])
+                    continue
+
+                if file_data["name"] in written_names:
+                    LOGGER.warning(
+                        "ELN export: Skipping duplicate file name %r in item %s",
+                        file_data["name"],
+                        item["item_id"],
+                    )
+                    continue
+
+                written_names.add(file_data["name"])
+                zipf.write(
+                    source_path,
+                    f"{item_folder}/{file_data['name']}",
+                    compress_type=_compression_for(file_data["name"]),
+                )
@@ -2,21 +2,35 @@ import datetime
 import os
 import pathlib
 import re
+import shlex
 import shutil
 import subprocess
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
 
 from bson.objectid import ObjectId
-from pymongo import ReturnDocument
+from flask import copy_current_request_context, has_request_context
+from pymongo import ReturnDocument, UpdateOne
 from werkzeug.datastructures import FileStorage
 from werkzeug.utils import secure_filename
 
+from pydatalab.blobs import release_blob, store_blob
 from pydatalab.config import CONFIG, RemoteFilesystem
 from pydatalab.logger import LOGGER, logged_route
 from pydatalab.models import File
 from pydatalab.models.utils import PyObjectId
 from pydatalab.mongo import _get_active_mongo_client, flask_mongo
 from pydatalab.permissions import get_default_permissions
+from pydatalab.prewarm import enqueue_prewarm
+from pydatalab.ssh import run_ssh_command, ssh_options, stat_remote_files
+from pydatalab.storage import (
+    delete_stored_file,
+    ensure_local_file,
+    file_directory,
+    legacy_file_directory,
+    persist_file,
+)
 
 LIVE_FILE_CUTOFF = datetime.timedelta(days=31)
 
@@ -35,6 +49,79 @@ def get_space_available_bytes() -> int:
     return stats.f_bsize * stats.f_bavail
 
 
+def migrate_file_layout(batch_size: int = 1000, max_batches: int | None = None) -> int:
+    """Move the directories of files stored in the legacy flat layout into the
+    sharded layout (see `file_directory`), a batch at a time.
+
+    For each batch, the stored locations of the files are updated before their
+    directories are moved, so that an interrupted migration can simply be run
+    again; in the meantime, files are found in either layout by
+    `resolve_file_directory`.
+
+    Parameters:
+        batch_size: The number of file directories to move per database update.
+        max_batches: The maximum number of batches to move, or `None` to move all.
+
+    Returns:
+        The number of file directories moved.
+
+    """
+    from pydatalab.mongo import get_database
+
+    file_collection = get_database().files
+    moved = 0
+    batches = 0
+
+    with os.scandir(CONFIG.FILE_DIRECTORY) as entries:
+        legacy_ids = (
+            entry.name
+            for entry in entries
+            if ObjectId.is_valid(entry.name) and entry.is_dir(follow_symlinks=False)
+        )
+        while max_batches is None or batches < max_batches:
+            batch = [file_id for _, file_id in zip(range(batch_size), legacy_ids)]
+            if not batch:
+                break
+            batches += 1
+
+            updates = [
+                UpdateOne(
+                    {"_id": file_doc["_id"]},
+                    {
+                        "$set": {
+                            "location": str(
+                                file_directory(file_doc["_id"])
+                                / os.path.basename(file_doc["location"])
+                            )
+                        }
+                    },
+                )
+                for file_doc in file_collection.find(
+                    {"_id": {"$in": [ObjectId(file_id) for file_id in batch]}},
+                    projection={"location": 1},
+                )
+                if file_doc.get("location")
+                and pathlib.Path(file_doc["location"]).parent
+                == legacy_file_directory(file_doc["_id"])
+            ]
+            if updates:
+                file_collection.bulk_write(updates, ordered=False)
+
+            for file_id in batch:
+                directory = file_directory(file_id)
+                try:
+                    directory.parent.mkdir(parents=True, exist_ok=True)
+                    os.rename(legacy_file_directory(file_id), directory)
+                except OSError as exc:
+                    LOGGER.warning("Unable to move the directory of file %s: %s", file_id, exc)
+                    continue
+                moved += 1
+
+            LOGGER.info("Moved %s file directories into the sharded layout", moved)
+
+    return moved
+
+
 def _escape_spaces_scp_path(remote_path: str) -> str:
     r"""Takes a remote path prefixed by 'ssh://' and encloses
     the filename in quotes and escapes spaces to allow for
@@ -54,24 +141,68 @@ def _escape_spaces_scp_path(remote_path: str) -> str:
     return f'{protocol}:{host}:"{path}"'
 
 
-@logged_route
-def _sync_file_with_remote(remote_path: str, src: str) -> None:
-    """Copy a file from a mounted volume or ssh-able remote to the
-    local file store.
+SYNC_VERIFY_BYTES = 1024 * 1024
+"""The number of bytes at the end of a local copy that must match the remote file
+before only the newly appended bytes are copied from a mounted remote.
+"""
+
+_COPY_BUFSIZE = 1024 * 1024
+
+
+def _read_range(path: str, offset: int, length: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return f.read(length)
+
+
+def _sync_mounted_file(remote_path: str, src: str) -> dict[str, Any]:
+    """Sync a file from a mounted remote, copying only the appended bytes if the
+    local copy is still a prefix of the remote file.
+
+    Appends are written directly to the local file, so an interrupted sync leaves a
+    valid (shorter) prefix that the next sync resumes from. Any other change is
+    copied in full to a temporary file that then replaces the local copy.
 
-    Arguments:
-        remote_path: The original location of the file.
-        src: The local location of the file.
     """
-    if os.path.isfile(remote_path):
-        shutil.copy(remote_path, src)
-    elif remote_path.startswith("ssh://"):
-        # Unescape spaces are we are now quoting the whole path
-        remote_path = _escape_spaces_scp_path(remote_path)
-        scp_command = f"scp {re.sub('^ssh://', '', remote_path)} {src}"
+    remote_size = os.path.getsize(remote_path)
+    local_size = os.path.getsize(src) if os.path.isfile(src) else 0
+
+    # Never append to a copy that is hardlinked to a content-addressed blob
+    if 0 < local_size <= remote_size and os.stat(src).st_nlink == 1:
+        verify_offset = max(local_size - SYNC_VERIFY_BYTES, 0)
+        verify_length = local_size - verify_offset
+        if _read_range(src, verify_offset, verify_length) == _read_range(
+            remote_path, verify_offset, verify_length
+        ):
+            with open(remote_path, "rb") as remote, open(src, "ab") as local:
+                remote.seek(local_size)
+                shutil.copyfileobj(remote, local, _COPY_BUFSIZE)
+            if os.path.getsize(src) != remote_size:
+                raise RuntimeError(f"Size mismatch after appending {remote_path} to {src}.")
+            return {"method": "append", "bytes_transferred": remote_size - local_size}
+
+    partial = f"{src}.partial"
+    shutil.copyfile(remote_path, partial)
+    os.replace(partial, src)
+    return {"method": "copy", "bytes_transferred": remote_size}
+
 
-        pathlib.Path(src).parent.mkdir(parents=False, exist_ok=True)
+def _sync_ssh_file(remote_path: str, src: str) -> dict[str, Any]:
+    """Sync a file from an SSH-accessible remote.
 
+    If `rsync` is installed, only the changed parts of the file are transferred
+    (rsync's delta algorithm, which also handles appended data), with a
+    whole-file checksum verification and any interrupted transfer kept in
+    `.rsync-partial/` to be resumed by the next sync. Otherwise the file is
+    copied in full with `scp`.
+
+    """
+    pathlib.Path(src).parent.mkdir(parents=False, exist_ok=True)
+
+    if shutil.which("rsync") is None:
+        # Unescape spaces are we are now quoting the whole path
+        escaped_path = _escape_spaces_scp_path(remote_path)
+        scp_command = f"scp {shlex.join(ssh_options())} {re.sub('^ssh://', '', escaped_path)} {src}"
         LOGGER.debug("Syncing file with '%s'", scp_command)
         proc = subprocess.Popen(  # noqa: S602
             scp_command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
@@ -81,42 +212,184 @@ def _sync_file_with_remote(remote_path: str, src: str) -> None:
             raise RuntimeError(
                 f"scp command {scp_command} raised the the following errors: {stderr!r}"
             )
+        return {
+            "method": "scp",
+            "bytes_transferred": os.path.getsize(src) if os.path.isfile(src) else 0,
+        }
+
+    hostname, file_path = _split_remote_path(remote_path)
+    rsync_command = [
+        "rsync",
+        "--partial-dir=.rsync-partial",
+        "--protect-args",
+        "--stats",
+        "-e",
+        shlex.join(["ssh", *ssh_options()]),
+        f"{hostname}:{file_path}",
+        src,
+    ]
+    LOGGER.debug("Syncing file with '%s'", rsync_command)
+    proc = subprocess.run(rsync_command, capture_output=True, check=False)  # noqa: S603
+    if proc.returncode != 0:
+        raise RuntimeError(
+            f"rsync command {rsync_command} raised the the following errors: {proc.stderr!r}"
+        )
+
+    match = re.search(r"Total bytes received: ([\d,]+)", proc.stdout.decode("utf-8"))
+    return {
+        "method": "rsync",
+        "bytes_transferred": int(match.group(1).replace(",", "")) if match else None,
+    }
+
+
+@logged_route
+def _sync_file_with_remote(remote_path: str, src: str) -> dict[str, Any]:
+    """Copy a file from a mounted volume or ssh-able remote to the
+    local file store, transferring only new or changed data where possible.
+
+    Arguments:
+        remote_path: The original location of the file.
+        src: The local location of the file.
+
+    Returns:
+        A summary of the transfer, with keys `method`, `bytes_transferred`
+        and `synced_at`, to be stored in the file metadata.
+
+    """
+    sync_info: dict[str, Any] = {"method": None, "bytes_transferred": 0}
+    if os.path.isfile(remote_path):
+        sync_info = _sync_mounted_file(remote_path, src)
+    elif remote_path.startswith("ssh://"):
+        sync_info = _sync_ssh_file(remote_path, src)
 
     if not os.path.isfile(src):
         raise RuntimeError("Something went wrong copying {remote_path} to {src}.")
 
+    sync_info["synced_at"] = datetime.datetime.now(tz=datetime.timezone.utc)
+    LOGGER.debug("Synced %s to %s: %s", remote_path, src, sync_info)
+    return sync_info
+
+
+def _split_remote_path(path: str) -> tuple[str, str]:
+    """Split a full remote path of the form `ssh://hostname:/path/to/file` into
+    the hostname and the (unescaped) path on the remote.
+
+    """
+    hostname, file_path = re.sub("^ssh://", "", path).split(":", 1)
+    return hostname, file_path.replace(r"\ ", " ")
+
 
 @logged_route
-def _call_remote_stat(path: str):
+def _call_remote_stat(path: str) -> datetime.datetime:
     """Call `stat` on a remote file.
 
     Args:
         path: The full remote path.
 
     Returns:
-        A dictionary of the `tree` output.
+        The last modified time of the remote file.
 
     """
+    hostname, file_path = _split_remote_path(path)
+    timestamps = stat_remote_files(hostname, [file_path])
+    if file_path not in timestamps:
+        raise RuntimeError(f"Remote stat of {file_path!r} on {hostname} failed")
+
+    return timestamps[file_path]
 
-    path = path.strip("ssh://")
-    path = path.replace(r"\ ", " ").replace(" ", r"\ ")
-    hostname, file_path = path.split(":", 1)
-    command = f"ssh {hostname} 'stat -c %Y {file_path}'"
-    process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)  # noqa: S602
-    LOGGER.debug("Calling %s", command)
-    try:
-        stdout, stderr = process.communicate(timeout=20)
-        timestamp = int(stdout.decode("utf-8"))
-    except Exception as exc:
-        raise RuntimeError(f"Remote stat process {command!r} returned: {exc!r}")
-    if stderr:
-        raise RuntimeError(f"Remote statprocess {command!r} returned: {stderr!r}")
 
-    return datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc)
+def _checked_recently(file_info: File) -> bool:
+    """Whether the remote of the given file was checked for a newer version within
+    the configured `LIVE_FILE_CHECK_INTERVAL`.
+
+    """
+    last_checked = file_info.last_checked_remote
+    if last_checked is None:
+        return False
+    if last_checked.tzinfo is None:
+        last_checked = last_checked.replace(tzinfo=datetime.timezone.utc)
+    return datetime.datetime.now(tz=datetime.timezone.utc) - last_checked < datetime.timedelta(
+        seconds=CONFIG.LIVE_FILE_CHECK_INTERVAL
+    )
+
+
+def _get_full_remote_path(file_info: File) -> str | None:
+    """Return the full path of a file on its remote (prefixed by the hostname of
+    SSH-accessible remotes), or `None` if its remote is not configured.
+
+    """
+    directories_dict = {fs.name: fs for fs in CONFIG.REMOTE_FILESYSTEMS}
+    remote: RemoteFilesystem | None = directories_dict.get(file_info.source_server_name or "")
+    if not remote or not file_info.source_path:
+        return None
+
+    full_remote_path = os.path.join(remote.path, file_info.source_path)
+    if remote.hostname:
+        full_remote_path = f"{remote.hostname}:{full_remote_path}"
+
+    return full_remote_path
+
+
+def sync_live_files(file_infos: list[File]) -> list[File]:
+    """Check all of the given live files for newer versions on their remotes
+    and sync any that have changed.
+
+    The modification times of all files on each SSH-accessible remote host are
+    fetched with a single remote command, so that the cost of checking is
+    independent of the number of files. Files that are not live, or that have
+    been checked within `CONFIG.LIVE_FILE_CHECK_INTERVAL`, are not checked.
+
+    Args:
+        file_infos: The `File` metadata objects to check.
+
+    Returns:
+        The file info for each file, updated if it was checked.
+
+    """
+    to_check: list[tuple[int, str]] = []
+    remote_paths: dict[str, list[str]] = defaultdict(list)
+    for ind, file_info in enumerate(file_infos):
+        if not file_info.is_live or _checked_recently(file_info):
+            continue
+        full_remote_path = _get_full_remote_path(file_info)
+        if full_remote_path is None:
+            continue
+        to_check.append((ind, full_remote_path))
+        if full_remote_path.startswith("ssh://"):
+            hostname, file_path = _split_remote_path(full_remote_path)
+            remote_paths[hostname].append(file_path)
+
+    timestamps: dict[str, dict[str, datetime.datetime]] = {}
+    for hostname, paths in remote_paths.items():
+        try:
+            timestamps[hostname] = stat_remote_files(hostname, paths)
+        except RuntimeError as exc:
+            LOGGER.warning("Unable to check live files on %s: %s", hostname, exc)
+            timestamps[hostname] = {}
+
+    updated = list(file_infos)
+    for ind, full_remote_path in to_check:
+        file_info = file_infos[ind]
+        remote_timestamp = None
+        if full_remote_path.startswith("ssh://"):
+            hostname, file_path = _split_remote_path(full_remote_path)
+            remote_timestamp = timestamps[hostname].get(file_path)
+            if remote_timestamp is None:
+                continue
+        try:
+            updated[ind] = _check_and_sync_file(
+                file_info, file_info.immutable_id, remote_timestamp=remote_timestamp
+            )
+        except RuntimeError as exc:
+            LOGGER.warning("Unable to check live file %s: %s", file_info.source_path, exc)
+
+    return updated
 
 
 @logged_route
-def _check_and_sync_file(file_info: File, file_id: ObjectId) -> File:
+def _check_and_sync_file(
+    file_info: File, file_id: ObjectId, remote_timestamp: datetime.datetime | None = None
+) -> File:
     """For a given file, check if the remote version is newer
     than the stored version and sync them if so.
 
@@ -124,6 +397,9 @@ def _check_and_sync_file(file_info: File, file_id: ObjectId) -> File:
         file_info: The `File` metadata object.
         file_id: The `bson.ObjectId` of the file stored in the database
             (used to update the file collection).
+        remote_timestamp: The last modified time of the remote file, if already
+            known (e.g., from a batched `stat`), otherwise it will be requested
+            unless the file was checked within `CONFIG.LIVE_FILE_CHECK_INTERVAL`.
 
     Returns:
         The updated file info, if an update was required,
@@ -156,7 +432,11 @@ def _check_and_sync_file(file_info: File, file_id: ObjectId) -> File:
     if remote.hostname:
         full_remote_path = f"{remote.hostname}:{full_remote_path}"
 
-    if full_remote_path.startswith("ssh://"):
+    if remote_timestamp is None and _checked_recently(file_info):
+        LOGGER.debug("File %s was checked recently, not checking again", file_info.source_path)
+        return file_info
+
+    if remote_timestamp is None and full_remote_path.startswith("ssh://"):
         # For ssh-able remotes, check age of the local file, rather than the last time the remote file was modified
         remote_timestamp = _call_remote_stat(full_remote_path)
         LOGGER.debug(
@@ -166,7 +446,7 @@ def _check_and_sync_file(file_info: File, file_id: ObjectId) -> File:
             datetime.datetime.now(tz=datetime.timezone.utc) - remote_timestamp,
         )
 
-    else:
+    elif remote_timestamp is None:
         try:
             stat_results = os.stat(full_remote_path)
             remote_timestamp = datetime.datetime.fromtimestamp(
@@ -185,7 +465,8 @@ def _check_and_sync_file(file_info: File, file_id: ObjectId) -> File:
         LOGGER.debug("Updating file %s to latest version", file_info.source_path)
 
         try:
-            _sync_file_with_remote(full_remote_path, file_info.location)
+            sync_info = _sync_file_with_remote(full_remote_path, file_info.location)
+            persist_file(file_info.location)
         except RuntimeError:
             LOGGER.warning(
                 "Unable to sync file %s with %s on server.", file_info.location, full_remote_path
@@ -193,6 +474,7 @@ def _check_and_sync_file(file_info: File, file_id: ObjectId) -> File:
             return file_info
 
     else:
+        sync_info = None
         LOGGER.debug("File %s is recent enough, not updating", file_info.source_path)
 
     if file_info.location is not None:
@@ -212,9 +494,14 @@ def _check_and_sync_file(file_info: File, file_id: ObjectId) -> File:
                         local_stat_results.st_mtime, tz=datetime.timezone.utc
                     ),
                     "last_modified_remote": remote_timestamp,
+                    "last_checked_remote": datetime.datetime.now(tz=datetime.timezone.utc),
                     "is_live": is_live,
+                    **({"metadata.last_sync": sync_info} if sync_info else {}),
+                },
+                "$inc": {
+                    "revision": 1,
+                    "metadata.bytes_transferred": (sync_info or {}).get("bytes_transferred") or 0,
                 },
-                "$inc": {"revision": 1},
             },
             return_document=ReturnDocument.AFTER,
         )
@@ -281,8 +568,9 @@ def get_file_info_by_id(file_id: str | ObjectId, update_if_live: bool = True) ->
         ]
     )
 
+    item = next(result, None)
     file_info = (
-        [d for d in next(result)["files"] if str(d["_id"]) == str(file_id)][0] if result else None
+        next((d for d in item["files"] if str(d["_id"]) == str(file_id)), None) if item else None
     )
 
     if not file_info:
@@ -290,8 +578,15 @@ def get_file_info_by_id(file_id: str | ObjectId, update_if_live: bool = True) ->
 
     file_info = File(**file_info)
 
+    if file_info.location is not None:
+        file_info.location = ensure_local_file(
+            file_info.location, (file_info.metadata or {}).get("sha256")
+        )
+
     if update_if_live and file_info.is_live:
+        location = file_info.location
         file_info = _check_and_sync_file(file_info, file_id)
+        file_info.location = location
 
     return file_info.dict()
 
@@ -332,13 +627,26 @@ def update_uploaded_file(file: FileStorage, file_id: ObjectId, size_bytes: int |
     if updated_file_entry.location is None:
         raise RuntimeError("Cannot update file with no location set: %s", updated_file_entry)
 
+    # The old contents may be shared with other files, so unlink rather than overwrite them
+    previous_digest = (updated_file_entry.metadata or {}).get("sha256")
+    if previous_digest:
+        pathlib.Path(updated_file_entry.location).unlink(missing_ok=True)
+
     file.save(updated_file_entry.location)
     size_bytes = os.path.getsize(updated_file_entry.location)  # type: ignore[arg-type]
+    digest = store_blob(updated_file_entry.location)  # type: ignore[arg-type]
+    persist_file(updated_file_entry.location)  # type: ignore[arg-type]
+    if previous_digest:
+        release_blob(previous_digest)
 
     file_collection.update_one(
-        {"_id": file_id, **get_default_permissions(user_only=False)}, {"$set": {"size": size_bytes}}
+        {"_id": file_id, **get_default_permissions(user_only=False)},
+        {"$set": {"size": size_bytes, "metadata.sha256": digest}},
     )
 
+    item_ids = updated_file_entry.item_ids or [None]
+    enqueue_prewarm(file_id, item_ids[0], updated_file_entry.name)
+
     ret = updated_file_entry.dict()
     ret.update({"_id": file_id})
     return ret
@@ -438,17 +746,21 @@ def save_uploaded_file(
 
         inserted_id = result.inserted_id
 
-        new_directory = os.path.join(CONFIG.FILE_DIRECTORY, str(inserted_id))
-        file_location = os.path.join(new_directory, filename)
-        pathlib.Path(new_directory).mkdir(exist_ok=False)
+        new_directory = file_directory(inserted_id)
+        file_location = str(new_directory / filename)
+        new_directory.mkdir(parents=True, exist_ok=False)
         file.save(file_location)
 
+    digest = store_blob(file_location)
+    persist_file(file_location)
+
     updated_file_entry = flask_mongo.db.files.find_one_and_update(
         {"_id": inserted_id, **get_default_permissions(user_only=False)},
         {
             "$set": {
                 "location": file_location,
                 "size": os.path.getsize(file_location),
+                "metadata.sha256": digest,
             }
         },
         return_document=ReturnDocument.AFTER,
@@ -467,22 +779,23 @@ def save_uploaded_file(
                 f"db operation failed when trying to insert new file ObjectId into sample: {item_id}"
             )
 
+    enqueue_prewarm(inserted_id, item_ids[0] if item_ids else None, updated_file_entry.name)
+
     ret = updated_file_entry.dict()
     ret.update({"_id": inserted_id})
     return ret
 
 
-def add_file_from_remote_directory(
+def _new_remote_file_document(
     file_entry: dict,
     item_id: str,
     block_ids: list[str] | None = None,
     creator_ids: list[ObjectId | str] | None = None,
-):
-    """Attaches the file `file_entry` to the item with ID `item_id`."""
-    from pydatalab.permissions import get_default_permissions
+) -> tuple[File, str]:
+    """Create the database document for a file on a remote filesystem, as listed
+    in its directory structure, returning it with the full path of the remote file.
 
-    file_collection = flask_mongo.db.files
-    sample_collection = flask_mongo.db.items
+    """
     directories_dict = {fs.name: fs for fs in CONFIG.REMOTE_FILESYSTEMS}
 
     if not block_ids:
@@ -543,25 +856,59 @@ def add_file_from_remote_directory(
         creator_ids=creator_ids if creator_ids is not None else [],
     )
 
+    return new_file_document, full_remote_path
+
+
+def _synced_file_update(
+    location: str, sync_info: dict[str, Any], digest: str | None = None
+) -> dict[str, Any]:
+    """The update to apply to a remote file's document after its first sync."""
+    update: dict[str, Any] = {
+        "$set": {
+            "location": location,
+            "url_path": location,
+            "metadata.last_sync": sync_info,
+            "metadata.bytes_transferred": sync_info.get("bytes_transferred") or 0,
+        }
+    }
+    if digest is not None:
+        update["$set"]["metadata.sha256"] = digest
+    return update
+
+
+def add_file_from_remote_directory(
+    file_entry: dict,
+    item_id: str,
+    block_ids: list[str] | None = None,
+    creator_ids: list[ObjectId | str] | None = None,
+):
+    """Attaches the file `file_entry` to the item with ID `item_id`."""
+    from pydatalab.permissions import get_default_permissions
+
+    file_collection = flask_mongo.db.files
+    sample_collection = flask_mongo.db.items
+
+    new_file_document, full_remote_path = _new_remote_file_document(
+        file_entry, item_id, block_ids=block_ids, creator_ids=creator_ids
+    )
+
     result = file_collection.insert_one(new_file_document.dict())
     if not result.acknowledged:
         raise OSError(f"db operation failed when trying to insert new file. Result: {result}")
 
     inserted_id = result.inserted_id
 
-    new_directory = os.path.join(CONFIG.FILE_DIRECTORY, str(inserted_id))
-    new_file_location = os.path.join(new_directory, filename)
-    pathlib.Path(new_directory).mkdir(exist_ok=True)
-    _sync_file_with_remote(full_remote_path, new_file_location)
+    new_directory = file_directory(inserted_id)
+    new_file_location = str(new_directory / new_file_document.name)
+    new_directory.mkdir(parents=True, exist_ok=True)
+    sync_info = _sync_file_with_remote(full_remote_path, new_file_location)
+    # Live files are updated in place, so only files that will not change are deduplicated
+    digest = None if new_file_document.is_live else store_blob(new_file_location)
+    persist_file(new_file_location)
 
     updated_file_entry = file_collection.find_one_and_update(
         {"_id": inserted_id, **get_default_permissions(user_only=False)},
-        {
-            "$set": {
-                "location": new_file_location,
-                "url_path": new_file_location,
-            }
-        },
+        _synced_file_update(new_file_location, sync_info, digest),
         return_document=ReturnDocument.AFTER,
     )
 
@@ -574,9 +921,146 @@ def add_file_from_remote_directory(
             f"db operation failed when trying to insert new file ObjectId into sample: {item_id}"
         )
 
+    enqueue_prewarm(inserted_id, item_id, new_file_document.name)
+
     return updated_file_entry
 
 
+def add_files_from_remote_directory(
+    file_entries: list[dict],
+    item_id: str,
+    block_ids: list[str] | None = None,
+    creator_ids: list[ObjectId | str] | None = None,
+) -> tuple[list[dict], list[dict]]:
+    """Attaches many files from remote filesystems to the item with ID `item_id`.
+
+    The file documents are inserted together, the files are then transferred
+    in parallel (at most `CONFIG.REMOTE_TRANSFER_CONCURRENCY` at once) over one
+    multiplexed SSH connection per host, and the successfully transferred files
+    are attached to the item with a single update. The documents of any files
+    that failed to transfer are removed.
+
+    Parameters:
+        file_entries: The entries of the files to attach, as listed in the
+            directory structure of their remote filesystem.
+        item_id: The ID of the item to attach the files to.
+        block_ids: Any block IDs to attach the files to.
+        creator_ids: The IDs of the users to register as the creators of the files.
+
+    Returns:
+        The documents of the attached files, and a list of errors for the files
+        that could not be attached, each with the `name`, `relative_path` and `error`.
+
+    """
+    from pydatalab.permissions import get_default_permissions
+
+    file_collection = flask_mongo.db.files
+
+    if not file_entries:
+        return [], []
+
+    if not flask_mongo.db.items.find_one(
+        {"item_id": item_id, **get_default_permissions(user_only=True)}, projection={"_id": 1}
+    ):
+        raise ValueError(f"item_id is invalid: {item_id}")
+
+    documents = []
+    remote_paths = []
+    for file_entry in file_entries:
+        new_file_document, full_remote_path = _new_remote_file_document(
+            file_entry, item_id, block_ids=block_ids, creator_ids=creator_ids
+        )
+        documents.append(new_file_document)
+        remote_paths.append(full_remote_path)
+
+    result = file_collection.insert_many([document.dict() for document in documents])
+    if not result.acknowledged:
+        raise OSError(f"db operation failed when trying to insert new files. Result: {result}")
+    inserted_ids = result.inserted_ids
+
+    # Open the shared connection to each host before starting parallel transfers,
+    # otherwise every transfer would race to become the master connection
+    if ssh_options():
+        for hostname in {
+            _split_remote_path(path)[0] for path in remote_paths if path.startswith("ssh://")
+        }:
+            try:
+                run_ssh_command(hostname, "true")
+            except RuntimeError as exc:
+                LOGGER.warning("Unable to open shared connection to %s: %s", hostname, exc)
+
+    def _transfer(
+        inserted_id: ObjectId, document: File, full_remote_path: str
+    ) -> tuple[str, dict, str | None]:
+        new_directory = file_directory(inserted_id)
+        new_file_location = str(new_directory / document.name)
+        new_directory.mkdir(parents=True, exist_ok=True)
+        sync_info = _sync_file_with_remote(full_remote_path, new_file_location)
+        digest = None if document.is_live else store_blob(new_file_location)
+        persist_file(new_file_location)
+        return new_file_location, sync_info, digest
+
+    if has_request_context():
+        _transfer = copy_current_request_context(_transfer)
+
+    with ThreadPoolExecutor(max_workers=CONFIG.REMOTE_TRANSFER_CONCURRENCY) as executor:
+        futures = [
+            executor.submit(_transfer, inserted_id, document, full_remote_path)
+            for inserted_id, document, full_remote_path in zip(
+                inserted_ids, documents, remote_paths
+            )
+        ]
+
+    updates = []
+    attached_ids = []
+    failed_ids = []
+    errors = []
+    for inserted_id, file_entry, future in zip(inserted_ids, file_entries, futures):
+        try:
+            new_file_location, sync_info, digest = future.result()
+        except Exception as exc:
+            LOGGER.warning("Failed to transfer remote file %s: %s", file_entry["name"], exc)
+            failed_ids.append(inserted_id)
+            errors.append(
+                {
+                    "name": file_entry["name"],
+                    "relative_path": file_entry["relative_path"],
+                    "error": str(exc),
+                }
+            )
+            shutil.rmtree(file_directory(inserted_id), ignore_errors=True)
+            continue
+
+        attached_ids.append(inserted_id)
+        updates.append(
+            UpdateOne(
+                {"_id": inserted_id}, _synced_file_update(new_file_location, sync_info, digest)
+            )
+        )
+
+    if failed_ids:
+        file_collection.delete_many({"_id": {"$in": failed_ids}})
+
+    if not attached_ids:
+        return [], errors
+
+    file_collection.bulk_write(updates, ordered=False)
+
+    sample_update_result = flask_mongo.db.items.update_one(
+        {"item_id": item_id, **get_default_permissions(user_only=True)},
+        {"$push": {"file_ObjectIds": {"$each": attached_ids}}},
+    )
+    if sample_update_result.modified_count != 1:
+        raise OSError(
+            f"db operation failed when trying to insert new file ObjectIds into sample: {item_id}"
+        )
+
+    attached = {doc["_id"]: doc for doc in file_collection.find({"_id": {"$in": attached_ids}})}
+    for _id, doc in attached.items():
+        enqueue_prewarm(_id, item_id, doc["name"])
+    return [attached[_id] for _id in attached_ids], errors
+
+
 def retrieve_file_path(immutable_id):
     """Retrieve the `location` of the file with ID `immutable_id`."""
     file_collection = flask_mongo.db.files
@@ -590,20 +1074,29 @@ def retrieve_file_path(immutable_id):
 
     result = File(**result)
 
-    return result.location
+    if not result.location:
+        return None
+    return ensure_local_file(result.location, (result.metadata or {}).get("sha256"))
 
 
-def remove_file_from_sample(item_id: str | ObjectId, file_id: str | ObjectId) -> None:
+def remove_file_from_sample(item_id: str, file_id: str | ObjectId) -> dict | None:
     """Detach the file at `file_id` from the item at `item_id`.
 
+    If the file is then no longer attached to any item and its contents are
+    content-addressed, its local copy is removed and its reference to the blob
+    released, deleting the stored contents if no other file shares them.
+
     Args:
-        item_id: The database ID of the item to alter.
+        item_id: The ID of the item to alter.
         file_id: The database ID of the file to remove from the item.
 
+    Returns:
+        The updated file document, if found.
+
     """
     from pydatalab.permissions import get_default_permissions
 
-    item_id, file_id = ObjectId(item_id), ObjectId(file_id)
+    file_id = ObjectId(file_id)
     sample_collection = flask_mongo.db.items
     file_collection = flask_mongo.db.files
     sample_result = sample_collection.update_one(
@@ -616,7 +1109,33 @@ def remove_file_from_sample(item_id: str | ObjectId, file_id: str | ObjectId) ->
             f"Failed to remove {file_id!r} from item {item_id!r}. Result: {sample_result.raw_result}"
         )
 
-    file_collection.update_one(
+    updated_file_entry = file_collection.find_one_and_update(
         {"_id": file_id},
         {"$pull": {"item_ids": item_id}},
+        return_document=ReturnDocument.AFTER,
     )
+    if not updated_file_entry or updated_file_entry.get("item_ids"):
+        return updated_file_entry
+
+    digest = (updated_file_entry.get("metadata") or {}).get("sha256")
+    if not digest or not updated_file_entry.get("location"):
+        return updated_file_entry
+
+    # Atomically claim the release, so that the reference is only released once
+    released_file_entry = file_collection.find_one_and_update(
+        {"_id": file_id, "item_ids": {"$size": 0}, "location": updated_file_entry["location"]},
+        {"$set": {"location": None}},
+        return_document=ReturnDocument.AFTER,
+    )
+    if released_file_entry:
+        location = pathlib.Path(updated_file_entry["location"])
+        location.unlink(missing_ok=True)
+        delete_stored_file(location)
+        try:
+            location.parent.rmdir()
+        except OSError:
+            pass
+        release_blob(digest)
+        updated_file_entry = released_file_entry
+
+    return updated_file_entry
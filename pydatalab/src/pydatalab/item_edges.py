@@ -0,0 +1,178 @@
+"""Utilities for maintaining the `item_edges` collection, which mirrors the
+`relationships` of every item as normalized edge documents so that
+relationships can be resolved from either end with an index seek.
+
+The edges are derived data: the `relationships` field of each item (as
+normalized by the model traits, e.g., `IsCollectable`) remains the source of
+truth, and the collection can be rebuilt at any time with
+`rebuild_item_edges` (or the `admin.repair-item-edges` task).
+
+"""
+
+from collections.abc import Iterable
+from typing import Any
+
+from pydantic import ValidationError
+from pymongo import DeleteMany, InsertOne
+from pymongo.cursor import Cursor
+from pymongo.database import Database
+from pymongo.errors import PyMongoError
+
+from pydatalab.item_graph import invalidate_item_graph
+from pydatalab.logger import LOGGER
+from pydatalab.models.edges import ItemEdge
+from pydatalab.models.relationships import TypedRelationship
+from pydatalab.mongo import flask_mongo, get_database
+
+__all__ = (
+    "backfill_item_edges",
+    "get_incoming_edges",
+    "rebuild_item_edges",
+    "remove_incoming_edges",
+    "remove_item_edges",
+    "sync_item_edges",
+    "sync_item_edges_matching",
+)
+
+_EDGE_SOURCE_PROJECTION = {"_id": 1, "item_id": 1, "refcode": 1, "relationships": 1}
+
+
+def _edges_from_item(item: dict) -> list[dict]:
+    """Return the edge documents described by the relationships of a raw item document."""
+    edges = []
+    for relationship in item.get("relationships") or []:
+        try:
+            edge = ItemEdge.from_relationship(item, TypedRelationship(**relationship))
+        except ValidationError as exc:
+            LOGGER.warning(
+                "Skipping invalid relationship %s on item %s: %s",
+                relationship,
+                item.get("item_id") or item["_id"],
+                exc,
+            )
+            continue
+        edges.append(edge.dict())
+    return edges
+
+
+def sync_item_edges(items: Iterable[dict], database: Database | None = None) -> None:
+    """Replace the outgoing edges of each of the given items with those
+    described by their current `relationships`, in a single bulk write.
+
+    Failures are logged rather than raised, as the item write that triggered
+    the sync has already succeeded and the edges can be rebuilt later.
+    On success, the cached item graph is also invalidated.
+
+    Parameters:
+        items: Raw item documents, requiring at least the `_id`, `item_id`,
+            `refcode` and `relationships` fields.
+        database: The database to use, defaulting to the Flask app database.
+
+    """
+    if database is None:
+        database = flask_mongo.db
+
+    operations: list[Any] = []
+    for item in items:
+        operations.append(DeleteMany({"source": item["_id"]}))
+        operations.extend(InsertOne(edge) for edge in _edges_from_item(item))
+
+    if not operations:
+        return
+
+    try:
+        database.item_edges.bulk_write(operations, ordered=True)
+        invalidate_item_graph(database)
+    except PyMongoError as exc:
+        LOGGER.error(
+            "Failed to sync item edges, run `invoke admin.repair-item-edges` to rebuild them: %s",
+            exc,
+        )
+
+
+def sync_item_edges_matching(query: dict) -> None:
+    """Resync the outgoing edges of all items matching the given query, e.g.,
+    after a bulk update of their relationships.
+
+    """
+    sync_item_edges(flask_mongo.db.items.find(query, projection=_EDGE_SOURCE_PROJECTION))
+
+
+def remove_item_edges(immutable_id) -> None:
+    """Remove all outgoing edges of the item with the given immutable ID,
+    i.e., after it has been deleted.
+
+    """
+    flask_mongo.db.item_edges.delete_many({"source": immutable_id})
+    invalidate_item_graph()
+
+
+def remove_incoming_edges(immutable_id, target_type: str) -> None:
+    """Remove all edges that point at the entry of the given type and immutable ID,
+    i.e., after it has been deleted and pulled from the relationships of other items.
+
+    """
+    flask_mongo.db.item_edges.delete_many({"targets": immutable_id, "target_type": target_type})
+    invalidate_item_graph()
+
+
+def get_incoming_edges(identifiers: Iterable) -> Cursor:
+    """Return all edges that point at an entry referenced by any of the given identifiers.
+
+    Parameters:
+        identifiers: The immutable ID, item ID and/or refcode of the entry;
+            `None` values are ignored.
+
+    """
+    return flask_mongo.db.item_edges.find(
+        {"targets": {"$in": [identifier for identifier in identifiers if identifier is not None]}}
+    )
+
+
+def rebuild_item_edges(database: Database | None = None, batch_size: int = 1000) -> int:
+    """Rebuild the entire `item_edges` collection from the relationships of all items.
+
+    Parameters:
+        database: The database to use, defaulting to the configured database.
+        batch_size: The number of items to sync per bulk write.
+
+    Returns:
+        The number of items processed.
+
+    """
+    if database is None:
+        database = get_database()
+
+    database.item_edges.delete_many({})
+
+    count = 0
+    batch: list[dict] = []
+    for item in database.items.find({}, projection=_EDGE_SOURCE_PROJECTION):
+        batch.append(item)
+        if len(batch) >= batch_size:
+            sync_item_edges(batch, database=database)
+            count += len(batch)
+            batch = []
+
+    if batch:
+        sync_item_edges(batch, database=database)
+        count += len(batch)
+
+    return count
+
+
+def backfill_item_edges(database: Database | None = None) -> None:
+    """Build the `item_edges` collection if it is empty but items with
+    relationships exist, e.g., on the first start-up of an existing deployment.
+
+    """
+    if database is None:
+        database = get_database()
+
+    if database.item_edges.find_one({}, projection={"_id": 1}) is not None:
+        return
+
+    if database.items.find_one({"relationships.0": {"$exists": True}}, projection={"_id": 1}):
+        LOGGER.info("Building item edges collection from existing item relationships")
+        count = rebuild_item_edges(database=database)
+        LOGGER.info("Built item edges for %s items", count)
@@ -0,0 +1,126 @@
+"""An in-process cache of the projected item documents that make up the
+whole-deployment item graph, used to serve `/item-graph` without reloading
+every item from the database on each request.
+
+The cache is invalidated by a generation counter stored in the database,
+which is bumped by every write that can change the graph (see
+`invalidate_item_graph`), so that all server processes see the change. As a
+safeguard against writes made directly to the database, the cache is also
+rebuilt whenever the number of items changes or it reaches `_MAX_CACHE_AGE`.
+
+"""
+
+import datetime
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable
+
+from bson import json_util
+from pymongo.database import Database
+
+from pydatalab.logger import LOGGER
+from pydatalab.mongo import flask_mongo
+
+__all__ = ("get_item_graph_documents", "invalidate_item_graph")
+
+GRAPH_PROJECTION = {
+    "item_id": 1,
+    "name": 1,
+    "type": 1,
+    "relationships": 1,
+    "date": 1,
+    "creator_ids": 1,
+}
+"""The fields of each item that are needed to build (and filter) the graph."""
+
+_MAX_CACHE_AGE = datetime.timedelta(minutes=10)
+_MAX_PERMISSION_SETS = 32
+
+_CACHE_STATE_ID = "item_graph"
+
+_lock = threading.Lock()
+_cache: dict = {}
+_visible_ids: OrderedDict[tuple, frozenset[str]] = OrderedDict()
+
+
+def invalidate_item_graph(database: Database | None = None) -> None:
+    """Mark the cached item graph as stale in all server processes.
+
+    Parameters:
+        database: The database to use, defaulting to the Flask app database.
+
+    """
+    if database is None:
+        database = flask_mongo.db
+
+    database.cache_state.update_one(
+        {"_id": _CACHE_STATE_ID}, {"$inc": {"generation": 1}}, upsert=True
+    )
+
+
+def _cache_key(database: Database) -> tuple:
+    state = database.cache_state.find_one({"_id": _CACHE_STATE_ID}) or {}
+    return (database.name, state.get("generation", 0), database.items.estimated_document_count())
+
+
+def _load_documents(database: Database, key: tuple) -> list[dict]:
+    """Return the cached graph documents for the given key, reloading them if stale."""
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    with _lock:
+        if _cache.get("key") == key and now - _cache["loaded_at"] < _MAX_CACHE_AGE:
+            return _cache["documents"]
+
+        LOGGER.debug("Rebuilding item graph cache for %s", key)
+        documents = list(database.items.find({}, projection=GRAPH_PROJECTION))
+        _cache.update(key=key, loaded_at=now, documents=documents)
+        _visible_ids.clear()
+        return documents
+
+
+def _get_visible_item_ids(database: Database, key: tuple, permissions: dict) -> frozenset[str]:
+    """Return the IDs of all items matching the given permissions query,
+    cached per graph generation so that repeat views only cost one lookup.
+
+    """
+    permissions_key = (key, json_util.dumps(permissions, sort_keys=True))
+    with _lock:
+        if permissions_key in _visible_ids:
+            _visible_ids.move_to_end(permissions_key)
+            return _visible_ids[permissions_key]
+
+    visible = frozenset(
+        document["item_id"]
+        for document in database.items.find(permissions, projection={"item_id": 1, "_id": 0})
+    )
+
+    with _lock:
+        _visible_ids[permissions_key] = visible
+        while len(_visible_ids) > _MAX_PERMISSION_SETS:
+            _visible_ids.popitem(last=False)
+
+    return visible
+
+
+def get_item_graph_documents(permissions: dict, database: Database | None = None) -> Iterable[dict]:
+    """Return the projected documents of all items in the deployment that
+    match the given permissions query, from the cache where possible.
+
+    The returned documents are shared between requests and must not be modified.
+
+    Parameters:
+        permissions: The MongoDB permissions query for the current user, as
+            returned by `get_default_permissions`.
+        database: The database to use, defaulting to the Flask app database.
+
+    """
+    if database is None:
+        database = flask_mongo.db
+
+    key = _cache_key(database)
+    documents = _load_documents(database, key)
+
+    if not permissions:
+        return documents
+
+    visible = _get_visible_item_ids(database, key, permissions)
+    return (document for document in documents if document["item_id"] in visible)
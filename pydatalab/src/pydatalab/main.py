@@ -2,6 +2,7 @@ import datetime
 import logging
 import os
 import pathlib
+import time
 from typing import Any
 
 from dotenv import dotenv_values
@@ -11,12 +12,15 @@ from flask_cors import CORS
 from flask_login import current_user, logout_user
 from werkzeug.middleware.proxy_fix import ProxyFix
 
+import pydatalab.item_edges
+import pydatalab.metrics
 import pydatalab.mongo
 from pydatalab import __version__
 from pydatalab.config import CONFIG
 from pydatalab.feature_flags import check_feature_flags
 from pydatalab.logger import LOGGER, setup_log
 from pydatalab.login import LOGIN_MANAGER
+from pydatalab.scheduler import job_scheduler
 from pydatalab.send_email import MAIL
 from pydatalab.utils import BSONProvider
 
@@ -36,6 +40,7 @@ def create_app(
         The `Flask` app with all associated endpoints.
 
     """
+    start = time.perf_counter()
     setup_log("werkzeug", log_level=logging.INFO)
     setup_log("", log_level=logging.INFO)
 
@@ -46,6 +51,7 @@ def create_app(
 
     app.config.from_prefixed_env()
     app.config.update(CONFIG.dict())
+    app.config["USE_X_SENDFILE"] = CONFIG.FILE_SENDFILE == "x-sendfile"
 
     # This value will still be overwritten by any dotenv values
     app.config["MAIL_DEBUG"] = app.config.get("MAIL_DEBUG") or CONFIG.TESTING
@@ -98,6 +104,9 @@ def create_app(
     # Make the session permanent so that it doesn't expire on browser close, but instead adds a lifetime
     app.permanent_session_lifetime = datetime.timedelta(hours=CONFIG.SESSION_LIFETIME)
 
+    # Registers the database command listener, so must precede any client creation
+    pydatalab.metrics.init_app(app)
+
     # Must use the full path so that this object can be mocked for testing
     flask_mongo = pydatalab.mongo.flask_mongo
     flask_mongo.init_app(app, connectTimeoutMS=100, serverSelectionTimeoutMS=100)
@@ -105,13 +114,34 @@ def create_app(
     for extension in (LOGIN_MANAGER, MAIL, COMPRESS):
         extension.init_app(app)
 
-    pydatalab.mongo.create_default_indices()
+    # Only missing or changed indexes are created, so this is cheap on restarts
+    created_indexes = pydatalab.mongo.create_default_indices()
+    if created_indexes:
+        LOGGER.info("Created database indexes: %s", created_indexes)
+    pydatalab.item_edges.backfill_item_edges()
 
     if CONFIG.FILE_DIRECTORY is not None:
         pathlib.Path(CONFIG.FILE_DIRECTORY).mkdir(parents=False, exist_ok=True)
 
     register_endpoints(app)
-    LOGGER.info("App created.")
+    if CONFIG.REMOTE_FILESYSTEMS:
+        job_scheduler.add_periodic_job(
+            "pydatalab.remote_filesystems:refresh_stale_directory_structures",
+            interval=60,
+            job_id="refresh-stale-remote-filesystems",
+        )
+    job_scheduler.add_periodic_job(
+        "pydatalab.uploads:remove_expired_uploads",
+        interval=60 * 60,
+        job_id="remove-expired-uploads",
+    )
+    job_scheduler.add_periodic_job(
+        "pydatalab.export:cleanup_export_artifacts",
+        interval=60 * 60,
+        job_id="cleanup-export-artifacts",
+    )
+    job_scheduler.init_app(app)
+    LOGGER.info("App created in %.2f s.", time.perf_counter() - start)
 
     @app.route(f"{CONFIG.ROOT_PATH}logout")
     def logout():
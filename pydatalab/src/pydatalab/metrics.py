@@ -0,0 +1,362 @@
+"""Prometheus metrics for the server, exposed at `/metrics` when
+`CONFIG.METRICS_ENABLED` is set and the `prometheus_client` package is installed.
+
+The following metrics are collected:
+
+- `datalab_http_request_duration_seconds` and `datalab_http_requests_total`:
+  the latency and number of requests to each endpoint (by response status),
+- `datalab_mongodb_command_duration_seconds`: the duration of each database
+  command, by collection and command, via a `pymongo` command listener,
+- `datalab_block_render_duration_seconds`: the time taken to render each type of block,
+- `datalab_cache_requests_total`: lookups in each of the server's caches, by
+  whether they hit, from which hit ratios can be derived,
+- `datalab_job_duration_seconds`: the duration of each background job (e.g.,
+  exports), by queue, function and outcome,
+- `datalab_backup_duration_seconds`: the duration of each backup, by type and outcome,
+- `datalab_job_queue_depth`: the number of pending and running jobs in each
+  queue, queried from the database when metrics are scraped.
+
+If the `PROMETHEUS_MULTIPROC_DIR` environment variable is set, metrics are
+written to files in that directory by each process and aggregated when scraped
+(see the `prometheus_client` documentation on multiprocess mode), so that
+`/metrics` reports on every worker process rather than whichever one handles
+the scrape.
+
+The metrics describe the usage of the whole deployment, so `/metrics` is only
+served to requests that present `CONFIG.METRICS_TOKEN` as a bearer token
+(e.g., via the `authorization` setting of a Prometheus scrape config), or that
+are made by an active admin user (e.g., with their API key).
+
+"""
+
+import hmac
+import os
+import threading
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+from pymongo import monitoring
+
+from pydatalab.config import CONFIG
+from pydatalab.logger import LOGGER
+
+__all__ = (
+    "init_app",
+    "observe",
+    "increment",
+    "measure",
+    "record_cache",
+    "generate_metrics",
+    "MongoCommandMetrics",
+)
+
+_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+_JOB_DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+_METRICS: dict[str, Any] | None = None
+_METRICS_LOCK = threading.Lock()
+_UNAVAILABLE = False
+
+
+def _create_metrics() -> dict[str, Any]:
+    from prometheus_client import Counter, Histogram
+
+    return {
+        "http_request_duration": Histogram(
+            "datalab_http_request_duration_seconds",
+            "The time taken to handle each request.",
+            ["method", "endpoint"],
+            buckets=_DURATION_BUCKETS,
+        ),
+        "http_requests": Counter(
+            "datalab_http_requests",
+            "The number of requests handled, by response status.",
+            ["method", "endpoint", "status"],
+        ),
+        "mongodb_command_duration": Histogram(
+            "datalab_mongodb_command_duration_seconds",
+            "The duration of each database command.",
+            ["collection", "command"],
+            buckets=_DURATION_BUCKETS,
+        ),
+        "block_render_duration": Histogram(
+            "datalab_block_render_duration_seconds",
+            "The time taken to render each type of block.",
+            ["blocktype"],
+            buckets=_DURATION_BUCKETS,
+        ),
+        "cache_requests": Counter(
+            "datalab_cache_requests",
+            "The number of lookups in each cache, by whether they hit.",
+            ["cache", "result"],
+        ),
+        "job_duration": Histogram(
+            "datalab_job_duration_seconds",
+            "The duration of each background job, by outcome.",
+            ["queue", "func", "status"],
+            buckets=_JOB_DURATION_BUCKETS,
+        ),
+        "backup_duration": Histogram(
+            "datalab_backup_duration_seconds",
+            "The duration of each backup, by outcome.",
+            ["type", "status"],
+            buckets=_JOB_DURATION_BUCKETS,
+        ),
+    }
+
+
+def _get_metrics() -> dict[str, Any] | None:
+    """Return the metrics to record to, creating them on first use, or `None`
+    if metrics are disabled or `prometheus_client` is not installed.
+
+    """
+    global _METRICS, _UNAVAILABLE
+    if not CONFIG.METRICS_ENABLED or _UNAVAILABLE:
+        return None
+    if _METRICS is None:
+        with _METRICS_LOCK:
+            if _METRICS is None and not _UNAVAILABLE:
+                try:
+                    _METRICS = _create_metrics()
+                except ImportError:
+                    LOGGER.warning(
+                        "`METRICS_ENABLED` is set but `prometheus_client` is not installed; "
+                        "no metrics will be collected."
+                    )
+                    _UNAVAILABLE = True
+    return _METRICS
+
+
+def observe(metric: str, value: float, **labels: str) -> None:
+    """Record a value (e.g., a duration in seconds) in the named histogram, if
+    metrics are enabled.
+
+    """
+    metrics = _get_metrics()
+    if metrics is not None:
+        metrics[metric].labels(**labels).observe(value)
+
+
+def increment(metric: str, **labels: str) -> None:
+    """Increment the named counter, if metrics are enabled."""
+    metrics = _get_metrics()
+    if metrics is not None:
+        metrics[metric].labels(**labels).inc()
+
+
+@contextmanager
+def measure(metric: str, **labels: str) -> Iterator[None]:
+    """Record the time taken by the body of the `with` statement in the named
+    histogram, whether or not it raises.
+
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(metric, time.perf_counter() - start, **labels)
+
+
+def record_cache(cache: str, hit: bool) -> None:
+    """Record a lookup in the named cache."""
+    increment("cache_requests", cache=cache, result="hit" if hit else "miss")
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """A `pymongo` command listener that records the duration of each database
+    command, by collection and command name.
+
+    """
+
+    def __init__(self):
+        self._collections: dict[tuple, str] = {}
+
+    @staticmethod
+    def _key(event) -> tuple:
+        return (event.connection_id, event.request_id, event.operation_id)
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        if not CONFIG.METRICS_ENABLED:
+            return
+        collection = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        if isinstance(collection, str):
+            self._collections[self._key(event)] = collection
+
+    def _finished(self, event) -> None:
+        collection = self._collections.pop(self._key(event), None)
+        if collection is not None:
+            observe(
+                "mongodb_command_duration",
+                event.duration_micros / 1e6,
+                collection=collection,
+                command=event.command_name,
+            )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._finished(event)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._finished(event)
+
+
+_COMMAND_LISTENER: MongoCommandMetrics | None = None
+
+
+def _job_queue_depths() -> dict[tuple[str, str], int]:
+    """Return the number of pending and running jobs in each queue."""
+    from pydatalab.models.jobs import JobStatus
+    from pydatalab.mongo import get_database
+
+    depths = {
+        (queue, status): 0
+        for queue in CONFIG.JOB_QUEUES
+        for status in (JobStatus.PENDING, JobStatus.RUNNING)
+    }
+    for group in get_database().jobs.aggregate(
+        [
+            {"$match": {"status": {"$in": [JobStatus.PENDING, JobStatus.RUNNING]}}},
+            {"$group": {"_id": {"queue": "$queue", "status": "$status"}, "count": {"$sum": 1}}},
+        ]
+    ):
+        depths[(group["_id"]["queue"], group["_id"]["status"])] = group["count"]
+    return depths
+
+
+class _JobQueueCollector:
+    """Reports the depth of each job queue, as queried when metrics are scraped."""
+
+    def collect(self):
+        from prometheus_client.core import GaugeMetricFamily
+        from pymongo.errors import PyMongoError
+
+        gauge = GaugeMetricFamily(
+            "datalab_job_queue_depth",
+            "The number of pending and running jobs in each queue.",
+            labels=["queue", "status"],
+        )
+        try:
+            depths = _job_queue_depths()
+        except PyMongoError as exc:
+            LOGGER.warning("Unable to query job queue depths for metrics: %s", exc)
+            depths = {}
+        for (queue, status), count in sorted(depths.items()):
+            gauge.add_metric([queue, str(getattr(status, "value", status))], count)
+        yield gauge
+
+
+def generate_metrics() -> tuple[bytes, str]:
+    """Return the current metrics of all processes in the Prometheus text format,
+    along with its content type.
+
+    """
+    from prometheus_client import (
+        CONTENT_TYPE_LATEST,
+        REGISTRY,
+        CollectorRegistry,
+        generate_latest,
+        multiprocess,
+    )
+
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    queue_registry = CollectorRegistry()
+    queue_registry.register(_JobQueueCollector())
+
+    return generate_latest(registry) + generate_latest(queue_registry), CONTENT_TYPE_LATEST
+
+
+def _endpoint_label() -> str:
+    from flask import request
+
+    if request.endpoint is None:
+        return "unmatched"
+    # Blueprints are registered under each API version, so strip the version prefix
+    return request.endpoint.rsplit("/", 1)[-1]
+
+
+def _metrics_request_authorized() -> bool:
+    """Return whether the current request may read the metrics, i.e., whether it
+    presents `CONFIG.METRICS_TOKEN` as a bearer token or is made by an active admin.
+
+    """
+    from flask import current_app, request
+
+    if CONFIG.METRICS_TOKEN:
+        scheme, _, token = (request.headers.get("Authorization") or "").partition(" ")
+        if scheme.lower() == "bearer" and hmac.compare_digest(
+            token.strip().encode(), CONFIG.METRICS_TOKEN.encode()
+        ):
+            return True
+
+    if getattr(current_app, "login_manager", None) is None:
+        return False
+
+    from flask_login import current_user
+
+    from pydatalab.login import UserRole
+    from pydatalab.models.people import AccountStatus
+
+    return bool(
+        current_user.is_authenticated
+        and current_user.role == UserRole.ADMIN
+        and current_user.account_status == AccountStatus.ACTIVE
+    )
+
+
+def init_app(app) -> None:
+    """Record request metrics for the given app and add the `/metrics` endpoint.
+
+    Metrics are only recorded while `CONFIG.METRICS_ENABLED` is set, and the
+    endpoint returns a 404 otherwise, or a 401 to requests that are not allowed
+    to read them (see `_metrics_request_authorized`).
+
+    """
+    from flask import Response, g, request
+    from werkzeug.exceptions import NotFound
+
+    global _COMMAND_LISTENER
+    if _COMMAND_LISTENER is None:
+        # Only applies to database clients created after registration
+        _COMMAND_LISTENER = MongoCommandMetrics()
+        monitoring.register(_COMMAND_LISTENER)
+
+    @app.before_request
+    def _start_request_timer():
+        g._metrics_request_start = time.perf_counter()
+
+    @app.after_request
+    def _record_request_metrics(response):
+        start = g.pop("_metrics_request_start", None)
+        if start is not None and CONFIG.METRICS_ENABLED:
+            endpoint = _endpoint_label()
+            observe(
+                "http_request_duration",
+                time.perf_counter() - start,
+                method=request.method,
+                endpoint=endpoint,
+            )
+            increment(
+                "http_requests",
+                method=request.method,
+                endpoint=endpoint,
+                status=str(response.status_code),
+            )
+        return response
+
+    @app.route(f"{CONFIG.ROOT_PATH}metrics")
+    def metrics():
+        """Returns the server metrics in the Prometheus text format."""
+        if _get_metrics() is None:
+            raise NotFound("Metrics are not enabled for this server.")
+        if not _metrics_request_authorized():
+            return {"error": "Unauthorized"}, 401
+        body, content_type = generate_metrics()
+        return Response(body, content_type=content_type)
@@ -0,0 +1,65 @@
+"""Pydantic models for the normalized relationship edges between entries."""
+
+from pydantic import BaseModel, Field
+
+from pydatalab.models.relationships import RelationshipType, TypedRelationship
+from pydatalab.models.utils import KnownType, PyObjectId
+
+
+class ItemEdge(BaseModel):
+    """A single directed relationship from one item to another entry.
+
+    This model represents a document in the `item_edges` collection, which
+    mirrors the `relationships` stored on each item so that relationships can be
+    looked up from either end via an index, rather than scanning item documents.
+    """
+
+    source: PyObjectId = Field(
+        ..., description="The immutable ID of the item holding the relationship"
+    )
+    source_item_id: str | None = Field(None, description="The item ID of the source item")
+    source_refcode: str | None = Field(None, description="The refcode of the source item")
+    target_type: KnownType = Field(..., description="The type of the related entry")
+    target_immutable_id: PyObjectId | None = Field(
+        None, description="The immutable ID of the related entry, if referenced this way"
+    )
+    target_item_id: str | None = Field(
+        None, description="The item ID of the related entry, if referenced this way"
+    )
+    target_refcode: str | None = Field(
+        None, description="The refcode of the related entry, if referenced this way"
+    )
+    targets: list[str | PyObjectId] = Field(
+        [], description="All identifiers of the related entry, used for indexed reverse lookups"
+    )
+    relation: RelationshipType | None = Field(None, description="The type of relationship")
+    description: str | None = Field(None, description="A description of the relationship")
+
+    @classmethod
+    def from_relationship(cls, item: dict, relationship: TypedRelationship) -> "ItemEdge":
+        """Create the edge described by a relationship stored on the given raw item document."""
+        targets = [
+            identifier
+            for identifier in (
+                relationship.immutable_id,
+                relationship.item_id,
+                relationship.refcode,
+            )
+            if identifier is not None
+        ]
+        return cls(
+            source=item["_id"],
+            source_item_id=item.get("item_id"),
+            source_refcode=item.get("refcode"),
+            target_type=relationship.type,
+            target_immutable_id=relationship.immutable_id,
+            target_item_id=relationship.item_id,
+            target_refcode=relationship.refcode,
+            targets=targets,
+            relation=relationship.relation,
+            description=relationship.description,
+        )
+
+    class Config:
+        extra = "ignore"  # Allow MongoDB's _id field
+        use_enum_values = True
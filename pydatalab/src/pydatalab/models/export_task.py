@@ -13,6 +13,7 @@ class ExportStatus(str, Enum):
     PROCESSING = "processing"
     READY = "ready"
     ERROR = "error"
+    EXPIRED = "expired"
 
 
 class ExportTask(BaseModel):
@@ -34,6 +35,10 @@ class ExportTask(BaseModel):
     )
     completed_at: datetime | None = Field(None, description="When the task was completed")
     file_path: str | None = Field(None, description="Path to the generated .eln file")
+    content_digest: str | None = Field(
+        None,
+        description="Digest of the state of the exported items and files, used to reuse existing archives for identical exports",
+    )
     error_message: str | None = Field(None, description="Error message if status is ERROR")
 
     class Config:
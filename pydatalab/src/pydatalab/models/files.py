@@ -18,6 +18,9 @@ class File(Entry, HasOwner, HasRevisionControl):
     last_modified_remote: IsoformatDateTime | None
     """The last date/time at which the remote file was modified."""
 
+    last_checked_remote: IsoformatDateTime | None
+    """The last date/time at which the remote was checked for a newer version of the file."""
+
     item_ids: list[str]
     """A list of item IDs associated with this file."""
 
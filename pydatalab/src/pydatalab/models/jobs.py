@@ -0,0 +1,64 @@
+"""Pydantic models for the persistent background job queue."""
+
+from datetime import datetime, timezone
+from enum import Enum
+from typing import Any
+
+from pydantic import BaseModel, Field
+
+
+class JobStatus(str, Enum):
+    """Status of a background job."""
+
+    PENDING = "pending"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+
+class Job(BaseModel):
+    """A unit of background work, stored in the `jobs` collection so that it
+    survives restarts and can be claimed by any server process.
+    """
+
+    job_id: str = Field(..., description="Unique identifier for the job")
+    queue: str = Field("default", description="The name of the queue that will run the job")
+    func: str = Field(
+        ...,
+        description="The import path of the function to run, in the form `module:qualname`",
+    )
+    args: list[Any] = Field([], description="Positional arguments to pass to the function")
+    kwargs: dict[str, Any] = Field({}, description="Keyword arguments to pass to the function")
+    priority: int = Field(0, description="Jobs with a higher priority are run first")
+    status: JobStatus = Field(JobStatus.PENDING, description="Current status of the job")
+    attempts: int = Field(0, ge=0, description="The number of times the job has been started")
+    max_attempts: int = Field(
+        1, ge=1, description="The number of times to try the job before marking it as failed"
+    )
+    retry_delay: float = Field(
+        30, ge=0, description="Seconds to wait before the first retry, doubling on each attempt"
+    )
+    progress: float | None = Field(
+        None, ge=0, le=1, description="Fraction of the job completed, if reported"
+    )
+    progress_message: str | None = Field(None, description="A description of the current step")
+    run_after: datetime = Field(
+        default_factory=lambda: datetime.now(tz=timezone.utc),
+        description="The job will not be started before this time",
+    )
+    lease_owner: str | None = Field(None, description="The worker currently running the job")
+    lease_expires_at: datetime | None = Field(
+        None,
+        description="When the lease of the running worker expires, after which the job can be claimed by another worker",
+    )
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(tz=timezone.utc),
+        description="When the job was created",
+    )
+    started_at: datetime | None = Field(None, description="When the latest attempt started")
+    completed_at: datetime | None = Field(None, description="When the job completed or failed")
+    error_message: str | None = Field(None, description="The error raised by the latest attempt")
+
+    class Config:
+        use_enum_values = True
+        extra = "ignore"  # Allow MongoDB's _id field
@@ -0,0 +1,54 @@
+"""Pydantic models for resumable, chunked file uploads."""
+
+from datetime import datetime, timezone
+from enum import Enum
+
+from pydantic import BaseModel, Field
+
+from pydatalab.models.utils import PyObjectId
+
+
+class UploadStatus(str, Enum):
+    """Status of a chunked upload."""
+
+    UPLOADING = "uploading"
+    FINALIZING = "finalizing"
+
+
+class Upload(BaseModel):
+    """An in-progress chunked upload, stored in the `uploads` collection so that
+    it can be resumed from any server process after an interruption.
+    """
+
+    upload_id: str = Field(..., description="Unique identifier for the upload")
+    filename: str = Field(..., description="The (escaped) filename to save the upload as")
+    original_name: str = Field(..., description="The raw filename as uploaded")
+    size: int = Field(..., ge=0, description="The total size of the file in bytes")
+    received: int = Field(
+        0, ge=0, description="The number of bytes received so far, i.e., the next chunk offset"
+    )
+    item_id: str = Field(..., description="The item to attach the file to")
+    replace_file: PyObjectId | None = Field(
+        None, description="The database ID of an existing file to replace, if any"
+    )
+    creator_id: PyObjectId = Field(..., description="The user who initiated the upload")
+    last_modified: str | None = Field(
+        None, description="The last modification time of the file on the client, in isoformat"
+    )
+    status: UploadStatus = Field(UploadStatus.UPLOADING, description="Status of the upload")
+    writer: str | None = Field(None, description="The request currently writing a chunk")
+    writer_expires_at: datetime | None = Field(
+        None, description="When the current writer's claim expires, if it did not finish"
+    )
+    created_at: datetime = Field(
+        default_factory=lambda: datetime.now(tz=timezone.utc),
+        description="When the upload was initiated",
+    )
+    expires_at: datetime = Field(
+        ..., description="When the upload will be discarded if no further chunks are received"
+    )
+
+    class Config:
+        use_enum_values = True
+        validate_all = True
+        extra = "ignore"  # Allow MongoDB's _id field
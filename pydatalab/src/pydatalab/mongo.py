@@ -14,29 +14,41 @@ __all__ = (
     "create_default_indices",
     "_get_active_mongo_client",
     "insert_pydantic_model_fork_safe",
-    "ITEMS_FTS_FIELDS",
+    "get_items_fts_fields",
 )
 
 flask_mongo = PyMongo()
 """This is the primary database interface used by the Flask app."""
 
-"""One-liner that pulls all non-semantic string fields out of all item
-models implemented for this server.
-"""
-ITEMS_FTS_FIELDS: set[str] = set().union(
-    *(
-        {
-            f
-            for f, p in model.schema(by_alias=False)["properties"].items()
-            if (
-                p.get("type") == "string"
-                and p.get("format") not in ("date-time", "uuid")
-                and f != "type"
-            )
-        }
-        for model in ITEM_MODELS.values()
+
+@lru_cache(maxsize=1)
+def get_items_fts_fields() -> frozenset[str]:
+    """Returns all non-semantic string fields of all item models implemented for
+    this server, which are used for full-text and regex searches.
+
+    These are generated from the model schemas on first use, rather than on import.
+
+    """
+    return frozenset().union(
+        *(
+            {
+                f
+                for f, p in model.schema(by_alias=False)["properties"].items()
+                if (
+                    p.get("type") == "string"
+                    and p.get("format") not in ("date-time", "uuid")
+                    and f != "type"
+                )
+            }
+            for model in ITEM_MODELS.values()
+        )
     )
-)
+
+
+def __getattr__(name: str):
+    if name == "ITEMS_FTS_FIELDS":
+        return get_items_fts_fields()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def insert_pydantic_model_fork_safe(model: BaseModel, collection: str) -> str:
@@ -105,6 +117,124 @@ def check_mongo_connection() -> None:
         raise RuntimeError from exc
 
 
+def _text_index(fields, name: str, weights: dict[str, int] | None = None) -> pymongo.IndexModel:
+    kwargs = {"weights": weights} if weights else {}
+    return pymongo.IndexModel([(k, pymongo.TEXT) for k in sorted(fields)], name=name, **kwargs)
+
+
+def default_index_models() -> dict[str, list[pymongo.IndexModel]]:
+    """Returns the default indexes to create for each collection, as described in
+    `create_default_indices`.
+
+    """
+    ASC, DESC = pymongo.ASCENDING, pymongo.DESCENDING
+    index = pymongo.IndexModel
+
+    return {
+        "items": [
+            _text_index(
+                get_items_fts_fields(),
+                "items full-text search",
+                weights={"refcode": 3, "item_id": 3, "name": 3, "chemform": 3},
+            ),
+            index("type", name="item type"),
+            index("item_id", unique=True, name="unique item ID"),
+            index("refcode", unique=True, name="unique refcode"),
+            index("last_modified", name="last modified"),
+            index("date", name="date"),
+            index("relationships.item_id", name="related item IDs"),
+        ],
+        "collections": [
+            _text_index(
+                ["collection_id", "title", "description"],
+                "collections full-text search",
+                weights={"collection_id": 3, "title": 3, "description": 3},
+            ),
+        ],
+        "users": [
+            index(
+                [("identities.identifier", ASC), ("identities.identity_type", ASC)],
+                unique=True,
+                partialFilterExpression={"identities": {"$exists": True}},
+                name="unique user identifiers",
+            ),
+            _text_index(["identities.name", "display_name"], "user identities full-text search"),
+        ],
+        "groups": [
+            index("group_id", unique=True, name="unique group identifiers"),
+            _text_index(["display_name", "description"], "group full-text search"),
+        ],
+        "export_tasks": [
+            index("task_id", unique=True, name="unique task ID"),
+            index("creator_id", name="export task creator"),
+            index("created_at", name="export task created at"),
+            index("status", name="export task status"),
+            index([("content_digest", ASC), ("status", ASC)], name="export task content digest"),
+        ],
+        "item_versions": [
+            index("refcode", name="version refcode"),
+            index("user_id", name="version user_id"),
+            index([("refcode", ASC), ("version", DESC)], name="refcode and version"),
+        ],
+        "version_counters": [
+            index("refcode", unique=True, name="unique refcode counter"),
+        ],
+        "item_edges": [
+            index([("source", ASC), ("relation", ASC)], name="outgoing item edges"),
+            index([("targets", ASC), ("relation", ASC)], name="incoming item edges"),
+        ],
+        "remoteFilesystems": [
+            index("name", unique=True, name="unique remote name"),
+        ],
+        "remoteDirectories": [
+            index(
+                [("remote", ASC), ("path", ASC)],
+                unique=True,
+                name="unique remote directory path",
+            ),
+        ],
+        "uploads": [
+            index("upload_id", unique=True, name="unique upload ID"),
+            index("expires_at", name="upload expiry"),
+        ],
+        "jobs": [
+            index("job_id", unique=True, name="unique job ID"),
+            index(
+                [("queue", ASC), ("status", ASC), ("priority", DESC), ("created_at", ASC)],
+                name="job queue order",
+            ),
+        ],
+    }
+
+
+def _index_matches(existing: dict | None, document: dict) -> bool:
+    """Returns whether an existing index (as described by `index_information()`)
+    matches the given index specification.
+
+    """
+    if existing is None:
+        return False
+
+    keys = list(document["key"].items())
+    text_fields = [field for field, direction in keys if direction == pymongo.TEXT]
+    if text_fields:
+        # Text indexes are stored as a single key, with the indexed fields as weights
+        weights = {field: 1 for field in text_fields}
+        weights.update(document.get("weights", {}))
+        if existing.get("weights") != weights:
+            return False
+    elif [
+        (field, int(direction) if isinstance(direction, float) else direction)
+        for field, direction in existing["key"]
+    ] != keys:
+        return False
+
+    return all(
+        existing.get(option) == document.get(option)
+        for option in ("unique", "partialFilterExpression")
+    )
+
+
 def create_default_indices(
     client: pymongo.MongoClient | None = None,
     background: bool = False,
@@ -121,12 +251,26 @@ def create_default_indices(
             - Index on item_versions.user_id for fast user contribution queries
             - Compound index on (refcode, version) for sorted version history
             - Unique index on version_counters.refcode for atomic version numbering
+        - Relationship indexes:
+            - Compound indexes on item_edges for outgoing (source) and incoming (targets) edges
+            - Index on items.relationships.item_id for graph traversal
+        - Remote filesystem indexes:
+            - Unique index on remoteFilesystems.name, used to lease refreshes atomically
+            - Unique compound index on remoteDirectories (remote, path) for per-directory listings
+        - Background job indexes:
+            - Unique index on jobs.job_id
+            - Compound index on jobs (queue, status, priority, created_at) for claiming jobs in order
+
+    Indexes that already exist with the same specification are left untouched,
+    so that this is cheap to call on every server start; those that exist with
+    a different specification (e.g., a text index over a different set of
+    fields) are dropped and recreated.
 
     Parameters:
         background: If true, indexes will be created as background jobs.
 
     Returns:
-        A list of messages returned by each `create_index` call.
+        A list of the names of the indexes that were created.
 
     """
 
@@ -134,136 +278,25 @@ def create_default_indices(
         client = _get_active_mongo_client()
     db = client.get_database()
 
-    def create_or_recreate_text_index(collection, fields, weights):
-        fts_index_name = f"{collection.name} full-text search"
-
-        def create_fts():
-            return collection.create_index(
-                [(k, pymongo.TEXT) for k in fields],
-                name=fts_index_name,
-                weights=weights,
-            )
-
-        try:
-            return create_fts()
-        except pymongo.errors.OperationFailure:
-            collection.drop_index(fts_index_name)
-            return create_fts()
-
     ret = []
-
-    ret += create_or_recreate_text_index(
-        db.items,
-        ITEMS_FTS_FIELDS,
-        weights={"refcode": 3, "item_id": 3, "name": 3, "chemform": 3},
-    )
-
-    ret += create_or_recreate_text_index(
-        db.collections,
-        ["collection_id", "title", "description"],
-        weights={"collection_id": 3, "title": 3, "description": 3},
-    )
-
-    ret += db.items.create_index("type", name="item type", background=background)
-    ret += db.items.create_index(
-        "item_id", unique=True, name="unique item ID", background=background
-    )
-    ret += db.items.create_index(
-        "refcode", unique=True, name="unique refcode", background=background
-    )
-    ret += db.items.create_index("last_modified", name="last modified", background=background)
-
-    ret += db.items.create_index("date", name="date", background=background)
-
-    user_fts_fields = {"identities.name", "display_name"}
-
-    user_index_name = "unique user identifiers"
-
-    def create_user_index(user_index_name):
-        return db.users.create_index(
-            [
-                ("identities.identifier", pymongo.ASCENDING),
-                ("identities.identity_type", pymongo.ASCENDING),
-            ],
-            unique=True,
-            partialFilterExpression={"identities": {"$exists": True}},
-            name=user_index_name,
-            background=background,
-        )
-
-    try:
-        ret += create_user_index(user_index_name)
-    except pymongo.errors.OperationFailure:
-        db.users.drop_index(user_index_name)
-        ret += create_user_index(user_index_name)
-
-    user_fts_name = "user identities full-text search"
-
-    def create_user_fts():
-        return db.users.create_index(
-            [(k, pymongo.TEXT) for k in user_fts_fields],
-            name=user_fts_name,
-            background=background,
-        )
-
-    try:
-        ret += create_user_fts()
-    except pymongo.errors.OperationFailure:
-        db.users.drop_index(user_fts_name)
-        ret += create_user_fts()
-
-    group_fts_fields = {"display_name", "description"}
-    group_fts_name = "group full-text search"
-    group_index_name = "unique group identifiers"
-
-    def create_group_index(group_index_name):
-        return db.groups.create_index(
-            "group_id",
-            unique=True,
-            name=group_index_name,
-            background=background,
-        )
-
-    try:
-        ret += create_group_index(group_index_name)
-    except pymongo.errors.OperationFailure:
-        db.users.drop_index(group_index_name)
-        ret += create_group_index(group_index_name)
-
-    def create_group_fts():
-        return db.groups.create_index(
-            [(k, pymongo.TEXT) for k in group_fts_fields],
-            name=group_fts_name,
-            background=background,
-        )
-
-    try:
-        ret += create_group_fts()
-    except pymongo.errors.OperationFailure:
-        db.users.drop_index(group_fts_name)
-        ret += create_group_fts()
-
-    ret += db.export_tasks.create_index(
-        "task_id", unique=True, name="unique task ID", background=background
-    )
-    ret += db.export_tasks.create_index(
-        "creator_id", name="export task creator", background=background
-    )
-    ret += db.export_tasks.create_index(
-        "created_at", name="export task created at", background=background
-    )
-    ret += db.export_tasks.create_index("status", name="export task status", background=background)
-
-    # Version control indexes
-    ret += db.item_versions.create_index("refcode", name="version refcode", background=background)
-    ret += db.item_versions.create_index("user_id", name="version user_id", background=background)
-    ret += db.item_versions.create_index(
-        [("refcode", pymongo.ASCENDING), ("version", pymongo.DESCENDING)],
-        name="refcode and version",
-        background=background,
-    )
-    ret += db.version_counters.create_index(
-        "refcode", unique=True, name="unique refcode counter", background=background
-    )
+    for collection_name, index_models in default_index_models().items():
+        collection = db[collection_name]
+        existing = collection.index_information()
+
+        for index_model in index_models:
+            document = index_model.document
+            name = document["name"]
+            if _index_matches(existing.get(name), document):
+                continue
+
+            if background:
+                document["background"] = True
+            try:
+                ret += collection.create_indexes([index_model])
+            except pymongo.errors.OperationFailure:
+                if name not in existing:
+                    raise
+                collection.drop_index(name)
+                ret += collection.create_indexes([index_model])
 
     return ret
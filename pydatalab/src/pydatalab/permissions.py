@@ -1,3 +1,6 @@
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
 from functools import wraps
 from hashlib import sha512
 from typing import Any
@@ -14,6 +17,25 @@ from pydatalab.mongo import flask_mongo, get_database
 
 PUBLIC_USER_ID = ObjectId(24 * "0")
 
+_SERVER_PERMISSIONS: ContextVar[bool] = ContextVar("server_permissions", default=False)
+
+
+@contextmanager
+def server_permissions() -> Iterator[None]:
+    """Run the enclosed database queries on behalf of the server itself, rather
+    than the current user, i.e., with open permissions.
+
+    This is intended for background jobs, which run outside of any request and
+    act on records that the requesting user was allowed to access when the job
+    was queued.
+
+    """
+    token = _SERVER_PERMISSIONS.set(True)
+    try:
+        yield
+    finally:
+        _SERVER_PERMISSIONS.reset(token)
+
 
 def active_users_or_get_only(func):
     """Decorator to ensure that only active user accounts can access the route,
@@ -150,8 +172,9 @@ def get_default_permissions(
     """Return the MongoDB query terms corresponding to the current user.
 
     Will return open permissions if a) the `CONFIG.TESTING` parameter is `True`,
-    or b) if the current user is registered as an admin and has opted into super-user
-    mode via `?sudo=1` (for GET requests) or is performing a write operation.
+    b) if called within `server_permissions()`, e.g., by a background job, or c) if
+    the current user is registered as an admin and has opted into super-user mode via
+    `?sudo=1` (for GET requests) or is performing a write operation.
 
     Parameters:
         user_only: Whether to exclude items that also have no attached user (`False`),
@@ -165,6 +188,9 @@ def get_default_permissions(
     if CONFIG.TESTING:
         return {}
 
+    if _SERVER_PERMISSIONS.get():
+        return {}
+
     # Super-user mode for admins: only activates on GET with ?sudo=1
     # For non-GET methods, admins always have full access
     if (
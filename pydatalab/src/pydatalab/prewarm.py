@@ -0,0 +1,115 @@
+"""Background "prewarming" of newly stored files, so that the first view of an
+item does not pay for parsing its files and generating image derivatives.
+
+When a file is uploaded or attached from a remote filesystem, a job is queued
+on the `prewarm` job queue (if it has workers configured in
+`CONFIG.JOB_QUEUES`) that renders, but does not save, a block of each type
+that accepts the file's extension. This fills the caches used by those blocks,
+e.g., the parsed-data caches of cycling data and the derivatives of images,
+which are then reused when a real block displays the file.
+
+"""
+
+import os
+
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+
+from pydatalab.config import CONFIG
+from pydatalab.logger import LOGGER
+
+__all__ = ("PREWARM_QUEUE", "block_types_for_file", "enqueue_prewarm", "prewarm_file")
+
+PREWARM_QUEUE = "prewarm"
+"""The job queue on which prewarm jobs are run."""
+
+
+def block_types_for_file(filename: str) -> list[str]:
+    """Return the block types that accept files with the extension of the given
+    filename, without importing the blocks themselves.
+
+    """
+    from pydatalab.apps import BLOCK_TYPES
+
+    extension = os.path.splitext(filename)[-1].lower()
+    if not extension:
+        return []
+
+    return [
+        blocktype
+        for blocktype, info in BLOCK_TYPES.info().items()
+        if extension in (ext.lower() for ext in info.accepted_file_extensions or ())
+    ]
+
+
+def enqueue_prewarm(file_id: ObjectId | str, item_id: str | None, filename: str) -> str | None:
+    """Queue a job to prewarm the caches for the given file, if any block type
+    accepts it and the prewarm queue is enabled. Failures to queue the job are
+    logged rather than raised, so that they never fail the upload itself.
+
+    Parameters:
+        file_id: The database ID of the file.
+        item_id: The item the file is attached to, with which to render blocks.
+        filename: The name of the file, used to select the block types.
+
+    Returns:
+        The ID of the queued job, if any.
+
+    """
+    from pydatalab.scheduler import job_scheduler
+
+    if PREWARM_QUEUE not in CONFIG.JOB_QUEUES or item_id is None:
+        return None
+    if not block_types_for_file(filename):
+        return None
+
+    try:
+        return job_scheduler.add_job(
+            prewarm_file,
+            args=[str(file_id), item_id],
+            job_id=f"prewarm-{file_id}",
+            queue=PREWARM_QUEUE,
+        )
+    except PyMongoError as exc:
+        LOGGER.warning("Unable to queue prewarm job for file %s: %s", file_id, exc)
+        return None
+
+
+def prewarm_file(file_id: str, item_id: str) -> list[str]:
+    """Render a block of each type that accepts the given file, without saving
+    it, to fill the caches that those blocks use.
+
+    Parameters:
+        file_id: The database ID of the file.
+        item_id: The item the file is attached to.
+
+    Returns:
+        The block types that were rendered without errors.
+
+    """
+    from pydatalab.apps import BLOCK_TYPES
+    from pydatalab.file_utils import get_file_info_by_id
+    from pydatalab.permissions import server_permissions
+
+    # The job runs outside of any request, and the file was accessible to the user
+    # who stored it, so the file and the blocks rendering it are read by the server
+    with server_permissions():
+        try:
+            file_info = get_file_info_by_id(file_id, update_if_live=False)
+        except OSError:
+            LOGGER.debug("Not prewarming file %s, which no longer exists", file_id)
+            return []
+
+        warmed = []
+        for blocktype in block_types_for_file(file_info["name"]):
+            try:
+                block = BLOCK_TYPES[blocktype](item_id=item_id, init_data={"file_id": file_id})
+                data = block.to_web()
+            except Exception as exc:
+                LOGGER.debug("Unable to prewarm %s block for file %s: %s", blocktype, file_id, exc)
+                continue
+            if not data.get("errors"):
+                warmed.append(blocktype)
+
+    LOGGER.debug("Prewarmed file %s for blocks %s", file_id, warmed)
+    return warmed
@@ -1,15 +1,43 @@
+"""Scanning and caching the directory structures of the configured remote filesystems.
+
+Directory structures are stored in the `remoteDirectories` collection as one
+document per directory, holding that directory's entries (without the contents of
+any subdirectories) and its last modification time, alongside a summary document
+per remote in `remoteFilesystems`. After an initial full scan, a refresh only lists
+the mtimes of all directories and then rescans the directories whose mtime has
+changed. As directory mtimes only change when entries are added, removed or
+renamed, the sizes and times of files modified in place are only updated when their
+parent directory is next rescanned.
+
+Requests are always served from the stored index (stale-while-revalidate): stale
+remotes are refreshed by background jobs, and periodically by
+`refresh_stale_directory_structures`, with a lease on each remote ensuring that only
+one process scans it at a time.
+
+"""
+
 import datetime
+import fnmatch
 import functools
 import json
 import multiprocessing
 import os
+import posixpath
+import shlex
+import socket
 import subprocess
-import time
+import threading
+from collections.abc import Iterable
 from typing import Any, Union
 
+from pymongo import DeleteMany, ReplaceOne
+from pymongo.errors import DuplicateKeyError
+
 import pydatalab.mongo
 from pydatalab.config import CONFIG, RemoteFilesystem
 from pydatalab.logger import LOGGER
+from pydatalab.scheduler import job_scheduler
+from pydatalab.ssh import run_ssh_command
 
 
 def get_directory_structures(
@@ -48,14 +76,26 @@ def get_directory_structures(
         return [get_directory_structure(d, invalidate_cache=invalidate_cache) for d in directories]
 
 
+REMOTE_DIRECTORY_BATCH_SIZE = 100
+"""The maximum number of changed directories to list in a single call to `tree`."""
+
+_REFRESH_LEASE = datetime.timedelta(minutes=5)
+"""How long a process may hold the lease on refreshing a remote before it can be taken over."""
+
+
 def get_directory_structure(
     directory: RemoteFilesystem,
     invalidate_cache: bool | None = False,
-    max_retries: int = 5,
+    path: str | None = None,
 ) -> dict[str, Any]:
-    """For the given remote directory, either reconstruct the directory
-    structure in full, or access the cached version if is it recent
-    enough.
+    """For the given remote directory, return the last successfully indexed
+    directory structure, scheduling a background refresh if it is stale
+    (stale-while-revalidate).
+
+    The directory is only scanned inline if it has never been indexed, in
+    which case there is nothing to serve; if another process is already
+    scanning it, an empty structure with status `"refreshing"` is returned
+    rather than waiting.
 
     Any errors will be returned in the `contents` key for a given
     directory.
@@ -63,144 +103,425 @@ def get_directory_structure(
     Args:
         directory: A RemoteFilesystem object the directory to scan, with attributes
             `'name'`, `'path'` and optionally `'hostname'`.
-        invalidate_cache: If `True`, then the cached directory structure will
-            be reset, provided the cache was not updated very recently. If `False`,
-            the cache will not be reset, even if it is older than the maximum configured
+        invalidate_cache: If `True`, then a refresh of the cached directory structure
+            will be scheduled, provided the cache was not updated very recently. If `False`,
+            no refresh will be scheduled, even if it is older than the maximum configured
             age.
-        max_retries: Used when called recursively to limit the number of attempts each PID
-            will make to acquire the lock on the directory structure before returning an error.
+        path: If provided, only return the entries of this subdirectory (relative to the
+            top-level directory, e.g., `/data/2024/`) rather than the full nested tree.
 
     Returns:
-        A dictionary with keys "name", "type" and "contents" for the
-        top-level directory.
+        A dictionary with keys "name", "type", "contents", "last_updated", "age" (in
+        seconds), and "status" (one of "cached", "refreshing", "updated" or "error")
+        for the top-level directory (and "path", if provided).
 
     """
 
     LOGGER.debug("Accessing directory structure of %s", directory)
 
+    result: dict[str, Any] = {"name": directory.name, "type": "toplevel"}
+    last_updated: datetime.datetime | None = None
+    dir_structure: list[dict[str, Any]] = []
+
     try:
+        if path is not None:
+            path = result["path"] = _normalize_directory_path(path)
+
         cached_dir_structure = _get_cached_directory_structure(directory)
-        cache_last_updated = None
         if cached_dir_structure:
-            cache_last_updated = cached_dir_structure["last_updated"]
-            if cache_last_updated.tzinfo is None:
-                cache_last_updated = cache_last_updated.replace(tzinfo=datetime.timezone.utc)
-            cache_age = datetime.datetime.now(tz=datetime.timezone.utc) - cache_last_updated
-            if invalidate_cache and cache_age < datetime.timedelta(
-                minutes=CONFIG.REMOTE_CACHE_MIN_AGE
-            ):
-                LOGGER.debug(
-                    "Not invalidating cache as its age (%s) is less than the configured %s.",
-                    cache_age,
-                    CONFIG.REMOTE_CACHE_MIN_AGE,
+            last_updated = cached_dir_structure.get("last_updated")
+            if not cached_dir_structure.get("indexed"):
+                # Caches from before the per-directory index must be rebuilt in full
+                last_updated = None
+
+        if last_updated is None:
+            if refresh_directory_structure(directory):
+                status = "updated"
+                last_updated = (_get_cached_directory_structure(directory) or {}).get(
+                    "last_updated"
                 )
+                LOGGER.debug("Remote filesystems cache miss for '%s'", directory.name)
+            else:
+                LOGGER.debug("Remote filesystem '%s' is being indexed elsewhere", directory.name)
+                status = "refreshing"
 
-        # If either:
-        #     1) no cache for this directory,
-        #     2) the cache is older than the max cache age and
-        #        `invalidate_cache` has not been explicitly set to false,
-        #     3) the `invalidate_cache` parameter is true, and the cache
-        #        is older than the min age,
-        # AND, if no other processes is updating the cache,
-        # then rebuild the cache.
-        if (
-            (not cached_dir_structure)
-            or (
+        else:
+            if last_updated.tzinfo is None:
+                last_updated = last_updated.replace(tzinfo=datetime.timezone.utc)
+            cache_age = datetime.datetime.now(tz=datetime.timezone.utc) - last_updated
+
+            # Schedule a refresh if either:
+            #     1) the cache is older than the max cache age and
+            #        `invalidate_cache` has not been explicitly set to false,
+            #     2) the `invalidate_cache` parameter is true, and the cache
+            #        is older than the min age,
+            # but serve the current cache in the meantime.
+            if (
                 invalidate_cache is not False
                 and cache_age > datetime.timedelta(minutes=CONFIG.REMOTE_CACHE_MAX_AGE)
-            )
-            or (
+            ) or (
                 invalidate_cache
                 and cache_age > datetime.timedelta(minutes=CONFIG.REMOTE_CACHE_MIN_AGE)
-            )
-        ):
-            owns_lock = _acquire_lock_dir_structure(directory)
-            if owns_lock:
-                dir_structure = _get_latest_directory_structure(directory.path, directory.hostname)
-                # Save the directory structure to the database, which also releases the lock
-                last_updated = _save_directory_structure(
-                    directory,
-                    dir_structure,
-                )
-                LOGGER.debug(
-                    "Remote filesystems cache miss for '%s': last updated %s",
-                    directory.name,
-                    cache_last_updated,
-                )
-                status = "updated"
+            ):
+                schedule_directory_refresh(directory)
+                status = "refreshing"
             else:
-                if max_retries <= 0:
-                    raise RuntimeError(
-                        f"Failed to acquire lock for {directory.name} after the max number of attempts. This may indicate something wrong with the filesystem; please try again later."
+                if invalidate_cache:
+                    LOGGER.debug(
+                        "Not invalidating cache as its age (%s) is less than the configured %s.",
+                        cache_age,
+                        CONFIG.REMOTE_CACHE_MIN_AGE,
                     )
-                LOGGER.debug(
-                    "PID %s waiting 5 seconds until FS %s is updated", os.getpid(), directory.name
-                )
-                time.sleep(5)
-                return get_directory_structure(
-                    directory, invalidate_cache=invalidate_cache, max_retries=max_retries - 1
-                )
+                status = "cached"
 
-        else:
-            last_updated = cached_dir_structure["last_updated"]
-            if last_updated.tzinfo is None:
-                last_updated = last_updated.replace(tzinfo=datetime.timezone.utc)
-            dir_structure = cached_dir_structure["contents"]
             LOGGER.debug(
                 "Remote filesystems cache hit for '%s': last updated %s",
                 directory.name,
                 last_updated,
             )
-            status = "cached"
+
+        if last_updated is not None:
+            dir_structure = _load_directory_structure(directory, path)
 
     except Exception as exc:
         dir_structure = [{"type": "error", "name": directory.name, "details": str(exc)}]
         last_updated = datetime.datetime.now(tz=datetime.timezone.utc)
         status = "error"
 
-    finally:
-        _release_lock_dir_structure(directory)
+    if last_updated is not None and last_updated.tzinfo is None:
+        last_updated = last_updated.replace(tzinfo=datetime.timezone.utc)
+
+    result.update(
+        contents=dir_structure,
+        last_updated=last_updated,
+        age=(datetime.datetime.now(tz=datetime.timezone.utc) - last_updated).total_seconds()
+        if last_updated is not None and status != "error"
+        else None,
+        status=status,
+    )
+    return result
+
+
+def refresh_directory_structure(directory: RemoteFilesystem) -> bool:
+    """Refresh the stored index of the given remote, if no other process is
+    already doing so.
+
+    The refresh is guarded by a lease on the remote's document in the
+    `remoteFilesystems` collection, which is acquired atomically and expires
+    after `_REFRESH_LEASE` in case the refreshing process dies.
+
+    Args:
+        directory: The remote filesystem to refresh.
+
+    Returns:
+        Whether the refresh was performed by this call.
+
+    """
+    owner = f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    if not _acquire_refresh_lease(directory, owner):
+        return False
+
+    try:
+        _refresh_directory_index(directory)
+    except Exception as exc:
+        _release_refresh_lease(directory, owner, error=str(exc))
+        raise
+
+    _release_refresh_lease(directory, owner)
+    return True
+
+
+def _refresh_directory_structure_job(directory: dict[str, Any]) -> None:
+    """Background job wrapper for `refresh_directory_structure`, taking the
+    serialized remote filesystem config.
+
+    """
+    refresh_directory_structure(RemoteFilesystem(**directory))
+
+
+def schedule_directory_refresh(directory: RemoteFilesystem) -> None:
+    """Queue a background refresh of the given remote, unless one is already queued."""
+    job_scheduler.add_job(
+        _refresh_directory_structure_job,
+        args=[json.loads(directory.json())],
+        job_id=f"refresh-remote-{directory.name}",
+    )
+
+
+def refresh_stale_directory_structures() -> None:
+    """Refresh each configured remote whose cache is older than the maximum cache
+    age, run periodically in the background so that the cache is rarely stale
+    when it is requested.
+
+    """
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    for directory in CONFIG.REMOTE_FILESYSTEMS:
+        cached = _get_cached_directory_structure(directory) or {}
+        last_updated = cached.get("last_updated") if cached.get("indexed") else None
+        if last_updated is not None and last_updated.tzinfo is None:
+            last_updated = last_updated.replace(tzinfo=datetime.timezone.utc)
+        if last_updated is None or now - last_updated > datetime.timedelta(
+            minutes=CONFIG.REMOTE_CACHE_MAX_AGE
+        ):
+            try:
+                refresh_directory_structure(directory)
+            except Exception as exc:
+                LOGGER.warning("Unable to refresh remote filesystem %s: %s", directory.name, exc)
+
+
+def find_remote_files(
+    directory: RemoteFilesystem,
+    paths: Iterable[str] | None = None,
+    pattern: str | None = None,
+) -> list[dict[str, Any]]:
+    """Find files on a remote by path or by a glob pattern, listing their parent
+    directories directly (rather than from the index) so that recently written
+    files are found with their current sizes and times.
+
+    Args:
+        directory: The remote filesystem.
+        paths: The paths of files relative to the top level of the remote.
+        pattern: A glob pattern (in the syntax of `fnmatch`) for the file names in a
+            single directory, relative to the top level, e.g., `/data/run42/*.xy`.
+
+    Raises:
+        FileNotFoundError: If any of the requested paths are not files on the remote.
+        ValueError: If any of the paths, or the pattern, are not valid paths of files.
+
+    Returns:
+        The entries of the matching files, in the same form as the directory
+        structure, with an added `toplevel_name` key.
+
+    """
+    requested: dict[str, list[str]] = {}
+    for path in paths or []:
+        parent, name = posixpath.split("/" + path.replace("\\ ", " ").strip("/"))
+        requested.setdefault(_normalize_directory_path(parent), []).append(_check_file_name(name))
+
+    pattern_parent: str | None = None
+    name_pattern = "*"
+    if pattern is not None:
+        parent, name_pattern = posixpath.split("/" + pattern.strip("/"))
+        pattern_parent = _normalize_directory_path(parent)
+        _check_file_name(name_pattern)
+        requested.setdefault(pattern_parent, [])
+
+    listings = _list_directories(directory, requested)
+
+    entries = []
+    missing = []
+    for parent, names in requested.items():
+        files = {
+            entry["name"]: entry
+            for entry in listings.get(parent, [])
+            if entry.get("type") == "file"
+        }
+        if parent == pattern_parent:
+            names = names + sorted(fnmatch.filter(files, name_pattern))
+        for name in dict.fromkeys(names):
+            if name not in files:
+                missing.append(f"{parent}{name}")
+                continue
+            entries.append({**files[name], "toplevel_name": directory.name})
+
+    if missing:
+        raise FileNotFoundError(f"No files found in {directory.name!r} at {missing}")
+
+    return entries
+
+
+def _check_file_name(name: str) -> str:
+    """Return the given file name (or pattern of file names), raising a `ValueError`
+    if it is not a single, valid path component.
+
+    """
+    if name in ("", ".", "..") or "/" in name or "\0" in name:
+        raise ValueError(f"Invalid file name {name!r}")
+    return name
+
+
+def _normalize_directory_path(path: str) -> str:
+    """Return the given path relative to a remote in the form used as index keys, i.e.,
+    with leading and trailing slashes and without escaped spaces (`/` for the top level).
+
+    """
+    parts = [part for part in path.replace("\\ ", " ").split("/") if part and part != "."]
+    if ".." in parts or "\0" in path:
+        raise ValueError(f"Invalid directory path {path!r}")
+    return "/" + "".join(f"{part}/" for part in parts)
+
+
+def _index_directory_tree(dir_tree: list[dict[str, Any]]) -> dict[str, list[dict[str, Any]]]:
+    """Split a nested directory tree into the entries of each directory, keyed by
+    the path of the directory relative to the top level.
+
+    Subdirectory entries are kept in the listing of their parent without their contents.
+
+    """
+    listings: dict[str, list[dict[str, Any]]] = {}
+
+    def _walk(entries: list[dict[str, Any]], path: str) -> None:
+        listing = listings.setdefault(path, [])
+        for entry in entries:
+            if entry.get("type") == "directory":
+                _walk(entry.get("contents", []), f"{path}{entry['name']}/")
+                entry = {key: value for key, value in entry.items() if key != "contents"}
+            listing.append(entry)
+
+    _walk(dir_tree, "/")
+    return listings
+
+
+def _directory_mtimes(dir_tree: list[dict[str, Any]]) -> dict[str, str | None]:
+    """Return the modification time of every directory in a nested directory tree,
+    keyed by the path of the directory relative to the top level.
+
+    `tree` does not report the time of the top-level directory itself, so it
+    is always `None`.
+
+    """
+    mtimes: dict[str, str | None] = {"/": None}
+
+    def _walk(entries: list[dict[str, Any]], path: str) -> None:
+        for entry in entries:
+            if entry.get("type") == "directory":
+                entry_path = f"{path}{entry['name']}/"
+                mtimes[entry_path] = entry.get("time")
+                _walk(entry.get("contents", []), entry_path)
+
+    _walk(dir_tree, "/")
+    return mtimes
+
+
+def _assemble_directory_tree(
+    listings: dict[str, list[dict[str, Any]]], path: str = "/"
+) -> list[dict[str, Any]]:
+    """Rebuild the nested directory tree below `path` from per-directory listings."""
+    contents = []
+    for entry in listings.get(path, []):
+        if entry.get("type") == "directory":
+            entry = {
+                **entry,
+                "contents": _assemble_directory_tree(listings, f"{path}{entry['name']}/"),
+            }
+        contents.append(entry)
+    return contents
+
+
+def _list_directories(
+    directory: RemoteFilesystem, paths: Iterable[str]
+) -> dict[str, list[dict[str, Any]]]:
+    """List the entries of each of the given directories of a remote, without
+    descending into subdirectories, in batches of `REMOTE_DIRECTORY_BATCH_SIZE`.
+
+    Args:
+        directory: The remote filesystem.
+        paths: The paths of the directories to list, relative to the top level.
+
+    Returns:
+        The entries of each directory, keyed by its relative path.
+
+    """
+    paths = list(paths)
+    listings: dict[str, list[dict[str, Any]]] = {}
+    for start in range(0, len(paths), REMOTE_DIRECTORY_BATCH_SIZE):
+        batch = paths[start : start + REMOTE_DIRECTORY_BATCH_SIZE]
+        absolute_paths = [posixpath.join(str(directory.path), path.strip("/")) for path in batch]
+        results = _call_tree(
+            ["-Jsf", "-L", "1"], absolute_paths, directory.hostname, allow_missing=True
+        )
+        results = [result for result in results if result.get("type") != "report"]
+        for path, result in zip(batch, results):
+            contents = result.get("contents", [])
+            _fix_tree_paths(contents, directory.path)
+            listings[path] = [
+                {key: value for key, value in entry.items() if key != "contents"}
+                for entry in contents
+            ]
+
+    return listings
+
+
+def _refresh_directory_index(directory: RemoteFilesystem) -> datetime.datetime:
+    """Bring the stored index of the given remote up to date.
+
+    If the remote has not been indexed before, the full tree is scanned. Otherwise,
+    only the mtimes of all directories are fetched, and only the directories whose
+    mtime has changed (or which are new) are rescanned.
 
-    return {
-        "name": directory.name,
-        "type": "toplevel",
-        "contents": dir_structure,
-        "last_updated": last_updated,
-        "status": status,
+    Args:
+        directory: The remote filesystem to index.
+
+    Returns:
+        The last updated timestamp.
+
+    """
+    collection = pydatalab.mongo.get_database().remoteDirectories
+    existing = {
+        doc["path"]: doc.get("mtime")
+        for doc in collection.find(
+            {"remote": directory.name}, projection={"path": 1, "mtime": 1, "_id": 0}
+        )
     }
 
+    if not existing:
+        dir_tree = _get_latest_directory_structure(directory.path, directory.hostname)
+        listings = _index_directory_tree(dir_tree)
+        mtimes = _directory_mtimes(dir_tree)
+    else:
+        dir_tree = _get_latest_directory_structure(
+            directory.path, directory.hostname, tree_args=["-Jdf"]
+        )
+        mtimes = _directory_mtimes(dir_tree)
+        changed = [
+            path
+            for path, mtime in mtimes.items()
+            if mtime is None or path not in existing or existing[path] != mtime
+        ]
+        listings = _list_directories(directory, changed)
 
-def _get_latest_directory_structure(
-    directory_path: Union[str, "os.PathLike[str]"], hostname: str | None = None
-) -> list[dict[str, str]]:
-    """Call `tree` on the remote or mounted filesystem.
+    LOGGER.debug("Rescanned %s of %s directories in %s", len(listings), len(mtimes), directory.name)
 
-    If `directory_path` exists locally, then call tree directly,
-    otherwise interpret the path as a remote.
+    return _save_directory_index(directory, listings, mtimes, set(existing) - set(mtimes))
+
+
+def _call_tree(
+    tree_args: list[str],
+    paths: list[str],
+    hostname: str | None = None,
+    allow_missing: bool = False,
+) -> list[dict[str, Any]]:
+    """Call `tree` with the given arguments on one or more paths on the remote
+    or mounted filesystem.
+
+    If `hostname` is not provided, the paths must exist locally, otherwise
+    they are interpreted as paths on the remote.
 
     Args:
-        directory_path: The path to the directory.
-        hostname: The hostname of the remote server, if the path is remote.
+        tree_args: The arguments to pass to `tree`, e.g., `["-Jsf"]`.
+        paths: The paths to pass to `tree`.
+        hostname: The hostname of the remote server, if the paths are remote.
+        allow_missing: Whether to allow (local) paths that do not exist, which will
+            be reported by `tree` itself.
 
     Returns:
-        A dictionary of the `tree` output.
+        The parsed JSON output of `tree`.
 
     """
 
-    tree_command = ["tree", "-Jsf"]
     tree_timefmt = "%s"
 
-    def _call_local_tree(directory_path: Union[str, "os.PathLike[str]"]) -> list[dict[str, Any]]:
+    def _call_local_tree(paths: list[str]) -> list[dict[str, Any]]:
         """Call `tree` in a local directory.
 
         Args:
-            directory_path: The path to the folder on the local filesystem.
+            paths: The paths to the folders on the local filesystem.
 
         Returns:
             A dictionary of the `tree` output.
 
         """
-        command = tree_command + [str(directory_path), "--timefmt", tree_timefmt]
+        command = ["tree", *tree_args, *paths, "--timefmt", tree_timefmt]
         process = subprocess.Popen(  # noqa: S603
             command,
             stdout=subprocess.PIPE,
@@ -212,28 +533,24 @@ def _get_latest_directory_structure(
 
         return json.loads(stdout)
 
-    def _call_remote_tree(
-        directory_path: Union[str, "os.PathLike[str]"], hostname: str
-    ) -> list[dict[str, Any]]:
+    def _call_remote_tree(paths: list[str], hostname: str) -> list[dict[str, Any]]:
         """Call `tree` on a remote system.
 
         Args:
-            directory_path: The path to the folder on the remote filesystem.
+            paths: The paths to the folders on the remote filesystem.
             hostname: The hostname of the remote server.
 
         Returns:
             A dictionary of the `tree` output.
 
         """
-        command = f"ssh {hostname} 'PATH=$PATH:~/ {' '.join(tree_command)} \"{directory_path}\" --timefmt {tree_timefmt}'"
-        process = subprocess.Popen(  # noqa: S602,S607
-            command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        # Paths may include names read from the remote or given in requests, so every
+        # argument is quoted for the remote shell and no local shell is used
+        command = "PATH=$PATH:~/ " + shlex.join(
+            ["tree", *tree_args, *paths, "--timefmt", tree_timefmt]
         )
-        LOGGER.debug("Calling %s", command)
-        try:
-            stdout, stderr = process.communicate(timeout=20)
-        except Exception as exc:
-            raise RuntimeError(f"Remote tree process {command!r} returned: {exc!r}")
+        result = run_ssh_command(hostname, command, timeout=20)
+        stdout, stderr = result.stdout, result.stderr
         if stderr:
             # Do not return the bare stderr, but instead specialise the error message to common errors
             if "WARNING: REMOTE HOST IDENTIFICATION HAS CHANGED!" in stderr.decode("utf-8"):
@@ -258,7 +575,7 @@ def _get_latest_directory_structure(
                 msg = "Can no longer access the configured directory on the remote system; please contact the administrator of this datalab deployment."
                 LOGGER.error(
                     "Remote directory %s on %s no longer accessible. Response: %s",
-                    directory_path,
+                    paths,
                     hostname,
                     stdout.decode("utf-8"),
                 )
@@ -266,7 +583,7 @@ def _get_latest_directory_structure(
                 msg = "Remote tree process failed with an unhandled error; please contact the administrator of this datalab deployment."
                 LOGGER.error(
                     "Remote directory syncing for  %s on %s failed. Response: %s",
-                    directory_path,
+                    paths,
                     hostname,
                     stdout.decode("utf-8"),
                 )
@@ -274,14 +591,36 @@ def _get_latest_directory_structure(
             raise RuntimeError(msg)
 
     if hostname:
-        LOGGER.debug("Calling remote %s on %s", tree_command, directory_path)
-        dir_structure = _call_remote_tree(directory_path, hostname)
+        LOGGER.debug("Calling remote tree %s on %s", tree_args, paths)
+        return _call_remote_tree(paths, hostname)
 
-    elif os.path.isdir(directory_path):
-        dir_structure = _call_local_tree(directory_path)
+    if allow_missing or all(os.path.isdir(path) for path in paths):
+        return _call_local_tree(paths)
+
+    raise RuntimeError(f"Unable to find directory {paths[0]!r} locally or remotely.")
 
-    else:
-        raise RuntimeError(f"Unable to find directory {directory_path!r} locally or remotely.")
+
+def _get_latest_directory_structure(
+    directory_path: Union[str, "os.PathLike[str]"],
+    hostname: str | None = None,
+    tree_args: list[str] | None = None,
+) -> list[dict[str, str]]:
+    """Call `tree` on the remote or mounted filesystem.
+
+    If `directory_path` exists locally, then call tree directly,
+    otherwise interpret the path as a remote.
+
+    Args:
+        directory_path: The path to the directory.
+        hostname: The hostname of the remote server, if the path is remote.
+        tree_args: The arguments to pass to `tree`, defaulting to `["-Jsf"]`;
+            `-f` is required.
+
+    Returns:
+        A dictionary of the `tree` output.
+
+    """
+    dir_structure = _call_tree(tree_args or ["-Jsf"], [str(directory_path)], hostname)
 
     # `tree` returned [{"type": "unknown", "contents": [{"error": "opening dir"}]}] for errors
     # which needs to be handled here
@@ -335,35 +674,59 @@ def _fix_tree_paths(
             _fix_tree_paths(subtree["contents"], root_path)
 
 
-def _save_directory_structure(
+def _save_directory_index(
     directory: RemoteFilesystem,
-    dir_structure: list[dict[str, Any]],
+    listings: dict[str, list[dict[str, Any]]],
+    mtimes: dict[str, str | None],
+    removed: Iterable[str] = (),
 ) -> datetime.datetime:
-    """Upserts the tree structure of each directory to the `remoteFilesystems`
-    collection in the database.
+    """Upserts the listing of each rescanned directory to the `remoteDirectories`
+    collection, removes directories that no longer exist, and marks the remote as
+    updated in the `remoteFilesystems` collection.
 
     Args:
         directory: The remote filesystem object to update.
-        dir_structure: The directory structure info.
+        listings: The entries of each rescanned directory, keyed by relative path.
+        mtimes: The modification times of all directories, keyed by relative path.
+        removed: The relative paths of directories that no longer exist.
 
     Returns:
         The last updated timestamp.
 
     """
-    collection = pydatalab.mongo.get_database().remoteFilesystems
+    database = pydatalab.mongo.get_database()
 
     last_updated = datetime.datetime.now(tz=datetime.timezone.utc)
     last_updated = last_updated.replace(microsecond=0)
 
-    result = collection.update_one(
+    operations: list[ReplaceOne | DeleteMany] = [
+        ReplaceOne(
+            {"remote": directory.name, "path": path},
+            {
+                "remote": directory.name,
+                "path": path,
+                "mtime": mtimes.get(path),
+                "contents": contents,
+                "last_updated": last_updated,
+            },
+            upsert=True,
+        )
+        for path, contents in listings.items()
+    ]
+    if removed := list(removed):
+        operations.append(DeleteMany({"remote": directory.name, "path": {"$in": removed}}))
+    if operations:
+        database.remoteDirectories.bulk_write(operations, ordered=False)
+
+    result = database.remoteFilesystems.update_one(
         {"name": directory.name},
         {
             "$set": {
-                "contents": dir_structure,
                 "last_updated": last_updated,
                 "type": "toplevel",
-                "_lock": None,
-            }
+                "indexed": True,
+            },
+            "$unset": {"contents": ""},
         },
         upsert=True,
     )
@@ -377,106 +740,90 @@ def _save_directory_structure(
     return last_updated
 
 
-def _acquire_lock_dir_structure(
-    directory: RemoteFilesystem,
-) -> bool:
-    """Attempt to acquire the lock on the directory structure to hint to other processes
-    to not update it.
+def _load_directory_structure(
+    directory: RemoteFilesystem, path: str | None = None
+) -> list[dict[str, Any]]:
+    """Load the stored directory structure of the given remote from its index.
 
-    Parameters:
-        directory: The remote filesystem entry to lock.
+    Args:
+        directory: The remote filesystem to load.
+        path: If provided, only return the entries of this directory (relative to
+            the top level), otherwise return the full nested tree.
 
     Returns:
-        `True` if the lock was acquired, `False` otherwise.
+        The entries of the requested directory.
 
     """
-    client = pydatalab.mongo._get_active_mongo_client()
-    with client.start_session() as session:
-        collection = client.get_database().remoteFilesystems
-        doc = collection.find_one({"name": directory.name}, projection=["_lock"], session=session)
-        if doc and doc.get("_lock") is not None:
-            pid = doc["_lock"].get("pid")
-            ctime = doc["_lock"].get("ctime")
-            lock_age = datetime.datetime.now(tz=datetime.timezone.utc) - ctime
-            if lock_age > datetime.timedelta(minutes=CONFIG.REMOTE_CACHE_MIN_AGE):
-                LOGGER.debug(
-                    "Lock for %s already held by process %s for %s, forcing this process to acquire lock",
-                    directory.name,
-                    pid,
-                    lock_age,
-                )
-            else:
-                LOGGER.debug(
-                    "Lock for %s already held by process %s since %s", directory.name, pid, ctime
-                )
-                return False
+    collection = pydatalab.mongo.get_database().remoteDirectories
+    if path is not None:
+        path = _normalize_directory_path(path)
+        doc = collection.find_one({"remote": directory.name, "path": path})
+        if doc is None:
+            raise FileNotFoundError(f"No directory {path!r} found in {directory.name!r}")
+        return doc["contents"]
+
+    listings = {
+        doc["path"]: doc["contents"]
+        for doc in collection.find(
+            {"remote": directory.name}, projection={"path": 1, "contents": 1, "_id": 0}
+        )
+    }
+    return _assemble_directory_tree(listings)
+
+
+def _acquire_refresh_lease(directory: RemoteFilesystem, owner: str) -> bool:
+    """Atomically acquire the lease on refreshing the given remote, if it is not
+    held or has expired.
+
+    Parameters:
+        directory: The remote filesystem entry to lease.
+        owner: An identifier for the lease holder.
+
+    Returns:
+        `True` if the lease was acquired, `False` otherwise.
 
-        collection.update_one(
-            {"name": directory.name},
+    """
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    collection = pydatalab.mongo.get_database().remoteFilesystems
+    try:
+        collection.find_one_and_update(
+            {
+                "name": directory.name,
+                "$or": [{"_lock": None}, {"_lock.expires_at": {"$lt": now}}],
+            },
             {
                 "$set": {
                     "_lock": {
+                        "owner": owner,
                         "pid": os.getpid(),
-                        "ctime": datetime.datetime.now(tz=datetime.timezone.utc),
+                        "ctime": now,
+                        "expires_at": now + _REFRESH_LEASE,
                     }
                 }
             },
             upsert=True,
-            session=session,
         )
-        LOGGER.debug("Acquired lock for %s as PID %s", directory.name, os.getpid())
+    except DuplicateKeyError:
+        # The document exists but the lease is held: the upsert collides with the unique name
+        LOGGER.debug("Lease for refreshing %s already held", directory.name)
+        return False
 
+    LOGGER.debug("Acquired lease for refreshing %s as %s", directory.name, owner)
     return True
 
 
-def _release_lock_dir_structure(directory) -> bool:
-    """Attempt to release the lock on the directory structure.
-
-    Parameters:
-        directory: The remote filesystem entry to lock.
-
-    Returns:
-        `True` if the lock was released successfully, `False` otherwise.
+def _release_refresh_lease(
+    directory: RemoteFilesystem, owner: str, error: str | None = None
+) -> None:
+    """Release the lease on refreshing the given remote, if still held by `owner`,
+    recording the error of a failed refresh (or clearing it after a successful one).
 
     """
-    client = pydatalab.mongo._get_active_mongo_client()
-    with client.start_session() as session:
-        collection = client.get_database().remoteFilesystems
-        doc = collection.find_one({"name": directory.name}, session=session)
-        if doc:
-            if doc.get("_lock") is not None:
-                pid = doc["_lock"].get("pid")
-
-                if pid != os.getpid():
-                    LOGGER.debug(
-                        "PID %s tried to release lock for %s, but lock was held by PID %s",
-                        os.getpid(),
-                        directory.name,
-                        pid,
-                    )
-                    return False
-
-            if doc.get("contents") is None:
-                # If the lock is held by this process, but the directory structure has not been updated, then delete it
-                collection.delete_one({"name": directory.name}, session=session)
-                LOGGER.debug(
-                    "PID %s is removed dir_structure stub %s",
-                    os.getpid(),
-                    doc,
-                )
-                return True
-
-            # Otherwise just release the lock
-            collection.update_one(
-                {"name": directory.name}, {"$set": {"_lock": None}}, session=session
-            )
-            LOGGER.debug(
-                "PID %s released locked on %s",
-                os.getpid(),
-                directory.name,
-            )
-
-    return True
+    pydatalab.mongo.get_database().remoteFilesystems.update_one(
+        {"name": directory.name, "_lock.owner": owner},
+        {"$set": {"_lock": None, "last_error": error}},
+    )
+    LOGGER.debug("Released lease for refreshing %s as %s", directory.name, owner)
 
 
 def _get_cached_directory_structure(
@@ -8,6 +8,7 @@ from pydantic import ValidationError
 from pymongo.results import InsertOneResult, UpdateResult
 
 from pydatalab.config import CONFIG
+from pydatalab.item_edges import remove_incoming_edges, sync_item_edges_matching
 from pydatalab.logger import logged_route
 from pydatalab.models.collections import Collection
 from pydatalab.mongo import flask_mongo
@@ -191,11 +192,12 @@ def create_collection():
         if None in item_ids:
             item_ids.remove(None)
 
+        starting_members_query = {
+            "item_id": {"$in": list(item_ids)},
+            **get_default_permissions(user_only=True),
+        }
         results: UpdateResult = flask_mongo.db.items.update_many(
-            {
-                "item_id": {"$in": list(item_ids)},
-                **get_default_permissions(user_only=True),
-            },
+            starting_members_query,
             {
                 "$push": {
                     "relationships": {
@@ -205,6 +207,7 @@ def create_collection():
                 }
             },
         )
+        sync_item_edges_matching(starting_members_query)
 
         data_model.num_items = results.modified_count
 
@@ -345,6 +348,7 @@ def delete_collection(collection_id: str):
                     }
                 },
             )
+            remove_incoming_edges(collection_immutable_id, "collections")
 
     return (
         jsonify(
@@ -434,6 +438,8 @@ def add_items_to_collection(collection_id):
             }
         },
     )
+    if update_result.modified_count:
+        sync_item_edges_matching({"refcode": {"$in": refcodes}, **get_default_permissions()})
 
     if update_result.matched_count == 0:
         return (jsonify({"status": "error", "message": "Unable to add to collection."}), 400)
@@ -478,6 +484,8 @@ def remove_items_from_collection(collection_id):
             }
         },
     )
+    if update_result.modified_count:
+        sync_item_edges_matching({"refcode": {"$in": refcodes}, **get_default_permissions()})
 
     if update_result.matched_count == 0:
         return jsonify({"status": "error", "message": "No matching items found."}), 404
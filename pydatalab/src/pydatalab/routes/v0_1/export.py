@@ -1,18 +1,21 @@
 import os
-import tempfile
 import uuid
 from datetime import datetime, timezone
-from pathlib import Path
 
-from flask import Blueprint, current_app, jsonify, request, send_file
+from flask import Blueprint, jsonify, request, send_file
 from flask_login import current_user
 
 from pydatalab.config import CONFIG
-from pydatalab.export import create_eln_file
+from pydatalab.export import (
+    cleanup_export_artifacts,
+    create_eln_file,
+    get_export_digest,
+    get_export_directory,
+)
 from pydatalab.models.export_task import ExportStatus, ExportTask
 from pydatalab.mongo import flask_mongo
 from pydatalab.permissions import PUBLIC_USER_ID, active_users_or_get_only
-from pydatalab.scheduler import export_scheduler
+from pydatalab.scheduler import job_scheduler, report_progress
 
 EXPORT = Blueprint("export", __name__)
 
@@ -28,20 +31,38 @@ def _do_export(
     item_id: str | None = None,
     export_type: str = "collection",
     related_item_ids: list[str] | None = None,
+    content_digest: str | None = None,
 ):
     try:
         flask_mongo.db.export_tasks.update_one(
             {"task_id": task_id}, {"$set": {"status": ExportStatus.PROCESSING}}
         )
 
-        export_dir = Path(tempfile.gettempdir()) / "eln-exports"
+        export_dir = get_export_directory()
         export_dir.mkdir(exist_ok=True, parents=True)
 
-        output_path = export_dir / f"{task_id}.eln"
-        if export_type == "collection":
-            create_eln_file(str(output_path), collection_id=collection_id)
-        elif export_type in ["item", "graph"]:
-            create_eln_file(str(output_path), item_id=item_id, related_item_ids=related_item_ids)
+        # Archives are named by their content digest so that identical exports share
+        # a single file, which is written under a temporary name and then moved into
+        # place so that concurrent identical exports cannot clobber one another
+        output_path = export_dir / f"{content_digest or task_id}.eln"
+        partial_path = export_dir / f"{task_id}.eln.partial"
+        try:
+            if export_type == "collection":
+                create_eln_file(
+                    str(partial_path),
+                    collection_id=collection_id,
+                    progress_callback=report_progress,
+                )
+            elif export_type in ["item", "graph"]:
+                create_eln_file(
+                    str(partial_path),
+                    item_id=item_id,
+                    related_item_ids=related_item_ids,
+                    progress_callback=report_progress,
+                )
+            os.replace(partial_path, output_path)
+        finally:
+            partial_path.unlink(missing_ok=True)
 
         flask_mongo.db.export_tasks.update_one(
             {"task_id": task_id},
@@ -54,6 +75,8 @@ def _do_export(
             },
         )
 
+        job_scheduler.add_job(cleanup_export_artifacts, job_id="cleanup-export-artifacts")
+
     except Exception as e:
         flask_mongo.db.export_tasks.update_one(
             {"task_id": task_id},
@@ -67,19 +90,40 @@ def _do_export(
         )
 
 
-def _generate_export_in_background(
-    task_id: str,
-    app,
-    collection_id: str | None = None,
-    item_id: str | None = None,
-    export_type: str = "collection",
-    related_item_ids: list[str] | None = None,
-):
-    if app is not None:
-        with app.app_context():
-            _do_export(task_id, collection_id, item_id, export_type, related_item_ids)
-    else:
-        _do_export(task_id, collection_id, item_id, export_type, related_item_ids)
+def _reuse_export(export_task: ExportTask):
+    """Complete the given export task immediately if an identical export, i.e., one
+    with the same content digest, has already produced an archive that is still on disk.
+
+    Returns:
+        The response for the reused export, or `None` if there is nothing to reuse.
+
+    """
+    previous = flask_mongo.db.export_tasks.find_one(
+        {"content_digest": export_task.content_digest, "status": ExportStatus.READY},
+        sort=[("completed_at", -1)],
+    )
+    if not previous or not previous.get("file_path"):
+        return None
+
+    # Mark the archive as used so that it is kept by the cleanup task
+    try:
+        os.utime(previous["file_path"])
+    except FileNotFoundError:
+        return None
+
+    export_task.status = ExportStatus.READY
+    export_task.file_path = previous["file_path"]
+    export_task.completed_at = datetime.now(tz=timezone.utc)
+    flask_mongo.db.export_tasks.insert_one(export_task.dict(exclude_none=False))
+
+    return jsonify(
+        {
+            "status": "success",
+            "task_id": export_task.task_id,
+            "status_url": f"/exports/{export_task.task_id}/status",
+            "download_url": f"/exports/{export_task.task_id}/download",
+        }
+    ), 200
 
 
 @EXPORT.route("/collections/<string:collection_id>/export", methods=["POST"])
@@ -99,25 +143,32 @@ def start_collection_export(collection_id: str):
     else:
         creator_id = PUBLIC_USER_ID
 
+    content_digest = get_export_digest(collection_id=collection_id)
+
     export_task = ExportTask(
         task_id=task_id,
         collection_id=collection_id,
         export_type="collection",
         creator_id=creator_id,
         status=ExportStatus.PENDING,
+        content_digest=content_digest,
     )
 
-    flask_mongo.db.export_tasks.insert_one(export_task.dict(exclude_none=False))
+    if reused := _reuse_export(export_task):
+        return reused
 
-    try:
-        app = current_app._get_current_object()
-    except RuntimeError:
-        app = None
+    flask_mongo.db.export_tasks.insert_one(export_task.dict(exclude_none=False))
 
-    export_scheduler.add_job(
-        func=_generate_export_in_background,
-        args=[task_id, app, collection_id, None, "collection", None],
+    job_scheduler.add_job(
+        func=_do_export,
+        kwargs={
+            "task_id": task_id,
+            "collection_id": collection_id,
+            "export_type": "collection",
+            "content_digest": content_digest,
+        },
         job_id=f"export_{task_id}",
+        queue="exports",
     )
 
     return jsonify(
@@ -139,6 +190,11 @@ def get_export_status(task_id: str):
         "created_at": task["created_at"].isoformat() if task.get("created_at") else None,
     }
 
+    if task["status"] in (ExportStatus.PENDING, ExportStatus.PROCESSING):
+        job = job_scheduler.get_job(f"export_{task_id}")
+        if job:
+            response["progress"] = job.get("progress")
+
     if task["status"] == ExportStatus.READY:
         response["download_url"] = f"/exports/{task_id}/download"
         response["completed_at"] = (
@@ -180,6 +236,9 @@ def download_export(task_id: str):
 
     filename = f"{task.get('collection_id') or task.get('item_id')}.eln"
 
+    # Mark the archive as used so that it is kept by the cleanup task
+    os.utime(file_path)
+
     return send_file(
         file_path, as_attachment=True, download_name=filename, mimetype="application/vnd.eln+zip"
     )
@@ -217,6 +276,8 @@ def start_item_export(item_id: str):
             ), 400
         export_type = "graph"
 
+    content_digest = get_export_digest(item_id=item_id, related_item_ids=related_item_ids)
+
     export_task = ExportTask(
         task_id=task_id,
         collection_id=None,
@@ -224,19 +285,25 @@ def start_item_export(item_id: str):
         export_type=export_type,
         creator_id=creator_id,
         status=ExportStatus.PENDING,
+        content_digest=content_digest,
     )
 
-    flask_mongo.db.export_tasks.insert_one(export_task.dict(exclude_none=False))
+    if reused := _reuse_export(export_task):
+        return reused
 
-    try:
-        app = current_app._get_current_object()
-    except RuntimeError:
-        app = None
+    flask_mongo.db.export_tasks.insert_one(export_task.dict(exclude_none=False))
 
-    export_scheduler.add_job(
-        func=_generate_export_in_background,
-        args=[task_id, app, None, item_id, export_type, related_item_ids],
+    job_scheduler.add_job(
+        func=_do_export,
+        kwargs={
+            "task_id": task_id,
+            "item_id": item_id,
+            "export_type": export_type,
+            "related_item_ids": related_item_ids,
+            "content_digest": content_digest,
+        },
         job_id=f"export_{task_id}",
+        queue="exports",
     )
 
     return jsonify(
@@ -1,16 +1,31 @@
+import mimetypes
 import os
+from urllib.parse import quote
 
 from bson import ObjectId
 from bson.errors import InvalidId
-from flask import Blueprint, jsonify, request, send_from_directory
+from flask import Blueprint, Response, jsonify, request, send_file, send_from_directory
 from flask_login import current_user
 from pymongo import ReturnDocument
+from werkzeug.datastructures import ContentRange
+from werkzeug.exceptions import (
+    BadRequest,
+    LengthRequired,
+    NotFound,
+    RequestedRangeNotSatisfiable,
+    RequestEntityTooLarge,
+)
+from werkzeug.security import safe_join
 from werkzeug.utils import secure_filename
+from werkzeug.wsgi import wrap_file
 
 import pydatalab.mongo
-from pydatalab import file_utils
+from pydatalab import file_utils, uploads
 from pydatalab.config import CONFIG
+from pydatalab.derivatives import image_derivative, image_pyramid, pyramid_tile
 from pydatalab.permissions import PUBLIC_USER_ID, active_users_or_get_only, get_default_permissions
+from pydatalab.remote_filesystems import find_remote_files
+from pydatalab.storage import ensure_local_file, get_storage, resolve_file_directory
 
 FILES = Blueprint("files", __name__)
 
@@ -20,11 +35,122 @@ FILES = Blueprint("files", __name__)
 def _(): ...
 
 
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+"""The time, in seconds, for which clients may cache a specific revision of a file."""
+
+
+def _file_etag(file_doc: dict) -> str:
+    """Return a strong ETag for the current contents of a file: its content hash,
+    if known, otherwise its ID and revision.
+
+    """
+    digest = (file_doc.get("metadata") or {}).get("sha256")
+    if digest:
+        return digest
+    return f"{file_doc['_id']}-{file_doc.get('revision') or 1}"
+
+
+def _set_file_caching(response: Response, etag: str, immutable: bool) -> Response:
+    """Mark a file response as cacheable by the requesting user only: indefinitely
+    if the URL identifies a specific revision, otherwise subject to revalidation.
+
+    """
+    response.set_etag(etag)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    if immutable:
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+
+def _send_stored_file(key: str, filename: str) -> Response:
+    """Stream a file, or the requested byte range of it, from the storage backend."""
+    storage = get_storage()
+    try:
+        size = storage.size(key)
+    except FileNotFoundError:
+        raise NotFound()
+
+    start, stop = 0, size
+    if request.range is not None:
+        byte_range = request.range.range_for_length(size)
+        if byte_range is None:
+            raise RequestedRangeNotSatisfiable(length=size)
+        start, stop = byte_range
+
+    stream = storage.open(key, start=start, end=stop - 1) if request.range else storage.open(key)
+    response = Response(
+        wrap_file(request.environ, stream),
+        mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream",
+        direct_passthrough=True,
+    )
+    response.content_length = stop - start
+    response.accept_ranges = "bytes"
+    if request.range is not None:
+        response.status_code = 206
+        response.content_range = ContentRange("bytes", start, stop, size)
+    return response
+
+
+def _send_image_derivative(file_doc: dict, derivative: str) -> Response:
+    """Send a derivative of an image file, generating it if required: one of the
+    named sizes in `DERIVATIVE_SIZES`, the manifest of its tiled `pyramid`, or a
+    `tile` of the pyramid specified by the `level`, `x` and `y` query parameters.
+
+    """
+    location = (
+        ensure_local_file(file_doc["location"], (file_doc.get("metadata") or {}).get("sha256"))
+        if file_doc.get("location")
+        else None
+    )
+    if not location or not os.path.isfile(location):
+        raise NotFound()
+
+    try:
+        if derivative == "pyramid":
+            manifest = image_pyramid(file_doc, location)
+            if manifest is None:
+                raise NotFound("The image is small enough to be displayed without tiles.")
+            return jsonify(manifest)
+        if derivative == "tile":
+            path = pyramid_tile(
+                file_doc,
+                location,
+                request.args.get("level", 0, type=int),
+                request.args.get("x", 0, type=int),
+                request.args.get("y", 0, type=int),
+            )
+        else:
+            path = image_derivative(file_doc, location, derivative)
+    except ValueError as exc:
+        raise BadRequest(str(exc))
+    except FileNotFoundError as exc:
+        raise NotFound(str(exc))
+
+    return send_file(path, etag=False, conditional=True)
+
+
 @FILES.route("/files/<string:file_id>/<string:filename>", methods=["GET"])
 def get_file(file_id: str, filename: str):
     """If this user has the appropriate permissions, return the file with the
     given database ID and filename.
 
+    Responses carry a strong ETag derived from the file contents (or revision),
+    so that unchanged files are revalidated with a `304 Not Modified` rather than
+    downloaded again, and support byte ranges (e.g., for seeking in media). If the
+    `revision` query parameter matches the current revision of the file, the
+    response may be cached indefinitely.
+
+    For images, the `derivative` query parameter requests a cached, reduced
+    resolution version of the file instead (see `pydatalab.derivatives`), e.g.,
+    `?derivative=thumbnail` or `?derivative=web`, or, for very large images, the
+    manifest (`?derivative=pyramid`) or a tile (`?derivative=tile&level=0&x=0&y=0`)
+    of its tiled pyramid.
+
     Parameters:
         file_id: The file ID in the database.
         filename: The filename in the database.
@@ -37,7 +163,8 @@ def get_file(file_id: str, filename: str):
         # so just 401
         _file_id = file_id
     if not pydatalab.mongo.flask_mongo.db.items.find_one(
-        {"file_ObjectIds": {"$in": [_file_id]}, **get_default_permissions(user_only=False)}
+        {"file_ObjectIds": {"$in": [_file_id]}, **get_default_permissions(user_only=False)},
+        projection={"_id": 1},
     ):
         return (
             jsonify(
@@ -50,8 +177,53 @@ def get_file(file_id: str, filename: str):
             401,
         )
 
-    path = os.path.join(CONFIG.FILE_DIRECTORY, secure_filename(file_id))
-    return send_from_directory(path, filename)
+    file_doc = pydatalab.mongo.flask_mongo.db.files.find_one(
+        {"_id": _file_id}, projection={"revision": 1, "metadata.sha256": 1, "location": 1}
+    )
+    if not file_doc:
+        raise NotFound()
+
+    etag = _file_etag(file_doc)
+    derivative = request.args.get("derivative")
+    if derivative:
+        etag += f"-{derivative}"
+        if derivative == "tile":
+            etag += "-{level}-{x}-{y}".format(
+                **{key: request.args.get(key, 0, type=int) for key in ("level", "x", "y")}
+            )
+    immutable = request.args.get("revision", type=int) == (file_doc.get("revision") or 1)
+    if request.if_none_match.contains(etag):
+        return _set_file_caching(Response(status=304), etag, immutable)
+
+    if derivative:
+        return _set_file_caching(_send_image_derivative(file_doc, derivative), etag, immutable)
+
+    secure_id = secure_filename(file_id)
+    path = resolve_file_directory(secure_id)
+    storage = get_storage()
+    if not storage.is_local and not (path / secure_filename(filename)).is_file():
+        # Stream the file from the object store rather than waiting to cache it locally
+        response = _send_stored_file(f"{secure_id}/{secure_filename(filename)}", filename)
+        return _set_file_caching(response, etag, immutable)
+
+    if CONFIG.FILE_SENDFILE == "x-accel-redirect":
+        file_path = safe_join(str(path), filename)
+        if file_path is None or not os.path.isfile(file_path):
+            raise NotFound()
+        # nginx serves the file (including any byte range) from its internal location
+        response = Response(
+            mimetype=mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        )
+        response.headers["X-Accel-Redirect"] = quote(
+            CONFIG.FILE_ACCEL_REDIRECT_PREFIX.rstrip("/")
+            + "/"
+            + os.path.relpath(file_path, CONFIG.FILE_DIRECTORY)
+        )
+        return _set_file_caching(response, etag, immutable)
+
+    # Handles byte ranges, and `X-Sendfile` if enabled via `FILE_SENDFILE`
+    response = send_from_directory(path, filename, etag=etag, conditional=True)
+    return _set_file_caching(response, etag, immutable)
 
 
 @FILES.route("/upload-file/", methods=["POST"])
@@ -115,6 +287,117 @@ def upload():
     )
 
 
+def _uploader_id() -> ObjectId:
+    if not CONFIG.TESTING:
+        return current_user.person.immutable_id
+    return PUBLIC_USER_ID
+
+
+@FILES.route("/uploads/", methods=["POST"])
+def initiate_chunked_upload():
+    """Start a resumable, chunked upload of a single file.
+
+    The JSON body must contain the `item_id` to attach the file to, the `filename`
+    and the total `size` in bytes, and optionally `last_modified` and the database
+    ID of a file to replace (`replace_file`).
+
+    The contents are then sent with `PUT /uploads/<upload_id>?offset=<offset>`
+    requests, each with a raw chunk of at most `chunk_size` bytes as the body,
+    before completing the upload with `POST /uploads/<upload_id>/finalize`.
+    If a chunk fails, `GET /uploads/<upload_id>` returns the offset to resume from.
+
+    """
+    if not current_user.is_authenticated and not CONFIG.TESTING:
+        return (
+            jsonify(
+                {
+                    "status": "error",
+                    "title": "Not Authorized",
+                    "detail": "File upload requires login.",
+                }
+            ),
+            401,
+        )
+
+    request_json = request.get_json()
+    try:
+        item_id = request_json["item_id"]
+        filename = request_json["filename"]
+        size = int(request_json["size"])
+        replace_file = request_json.get("replace_file")
+        replace_file = ObjectId(replace_file) if replace_file not in (None, "null") else None
+    except (KeyError, TypeError, ValueError, InvalidId) as exc:
+        raise BadRequest(f"Invalid upload request: {exc!r}")
+
+    upload = uploads.initiate_upload(
+        filename,
+        size,
+        item_id,
+        _uploader_id(),
+        last_modified=request_json.get("last_modified"),
+        replace_file=replace_file,
+    )
+    return jsonify({"status": "success", **upload}), 201
+
+
+@FILES.route("/uploads/<string:upload_id>", methods=["GET"])
+def get_chunked_upload(upload_id: str):
+    """Return the state of a chunked upload, including the `offset` of the next chunk."""
+    return jsonify({"status": "success", **uploads.get_upload(upload_id, _uploader_id())}), 200
+
+
+@FILES.route("/uploads/<string:upload_id>", methods=["PUT"])
+def put_upload_chunk(upload_id: str):
+    """Write the raw request body as the chunk of the upload at the `offset` query
+    parameter. `MAX_CONTENT_LENGTH` applies to each chunk.
+
+    """
+    if request.content_length is None:
+        raise LengthRequired("Upload chunks must be sent with a Content-Length header.")
+    if request.content_length > CONFIG.MAX_CONTENT_LENGTH:
+        raise RequestEntityTooLarge()
+    try:
+        offset = int(request.args["offset"])
+    except (KeyError, ValueError):
+        raise BadRequest("An integer `offset` query parameter is required.")
+
+    upload = uploads.write_upload_chunk(
+        upload_id, offset, request.stream, request.content_length, _uploader_id()
+    )
+    return jsonify({"status": "success", **upload}), 200
+
+
+@FILES.route("/uploads/<string:upload_id>/finalize", methods=["POST"])
+def finalize_chunked_upload(upload_id: str):
+    """Complete a chunked upload once all chunks have been received, optionally
+    verifying the `sha256` hex digest given in the JSON body.
+
+    """
+    request_json = request.get_json(silent=True) or {}
+    file_information = uploads.finalize_upload(
+        upload_id, _uploader_id(), sha256=request_json.get("sha256")
+    )
+    is_update = file_information.pop("is_update")
+    return (
+        jsonify(
+            {
+                "status": "success",
+                "file_id": str(file_information["_id"]),
+                "file_information": file_information,
+                "is_update": is_update,
+            }
+        ),
+        201,
+    )
+
+
+@FILES.route("/uploads/<string:upload_id>", methods=["DELETE"])
+def abort_chunked_upload(upload_id: str):
+    """Discard a chunked upload and any data received so far."""
+    uploads.abort_upload(upload_id, _uploader_id())
+    return jsonify({"status": "success"}), 200
+
+
 @FILES.route("/add-remote-file-to-sample/", methods=["POST"])
 def add_remote_file_to_sample():
     if not current_user.is_authenticated and not CONFIG.TESTING:
@@ -154,9 +437,118 @@ def add_remote_file_to_sample():
     )
 
 
+@FILES.route("/add-remote-files-to-sample/", methods=["POST"])
+def add_remote_files_to_sample():
+    """Attach many files from one remote filesystem to an item in a single request.
+
+    The JSON body must contain the `item_id`, the `toplevel_name` of the remote,
+    and either a list of file `paths` relative to the top level of the remote,
+    or a `glob` pattern for the file names in one of its directories
+    (e.g., `/data/run42/*.xy`), or both.
+
+    Files that fail to transfer are reported under `errors`, and the remaining
+    files are still attached.
+
+    """
+    if not current_user.is_authenticated and not CONFIG.TESTING:
+        return (
+            jsonify(
+                {
+                    "status": "error",
+                    "title": "Not Authorized",
+                    "detail": "Adding a file to a sample requires login.",
+                }
+            ),
+            401,
+        )
+
+    request_json = request.get_json()
+    item_id = request_json.get("item_id")
+    paths = request_json.get("paths") or []
+    pattern = request_json.get("glob")
+    if (
+        not item_id
+        or not (paths or pattern)
+        or not isinstance(paths, list)
+        or not all(isinstance(path, str) for path in paths)
+        or not isinstance(pattern, str | None)
+    ):
+        return (
+            jsonify(
+                {
+                    "status": "error",
+                    "title": "Invalid Argument",
+                    "detail": "An `item_id` and a list of `paths` or a `glob` pattern are required.",
+                }
+            ),
+            400,
+        )
+
+    for remote in CONFIG.REMOTE_FILESYSTEMS:
+        if remote.name == request_json.get("toplevel_name"):
+            break
+    else:
+        return (
+            jsonify(
+                {
+                    "status": "error",
+                    "title": "Not Found",
+                    "detail": f"No remote found with name {request_json.get('toplevel_name')!r}",
+                }
+            ),
+            404,
+        )
+
+    try:
+        file_entries = find_remote_files(remote, paths=paths, pattern=pattern)
+    except FileNotFoundError as exc:
+        return jsonify({"status": "error", "title": "Not Found", "detail": str(exc)}), 404
+    except ValueError as exc:
+        return jsonify({"status": "error", "title": "Invalid Argument", "detail": str(exc)}), 400
+
+    if not file_entries:
+        return (
+            jsonify(
+                {
+                    "status": "error",
+                    "title": "Not Found",
+                    "detail": f"No files matching {pattern!r} found in {remote.name!r}",
+                }
+            ),
+            404,
+        )
+
+    if not CONFIG.TESTING:
+        creator_id = current_user.person.immutable_id
+    else:
+        creator_id = ObjectId(24 * "0")
+
+    try:
+        attached_files, errors = file_utils.add_files_from_remote_directory(
+            file_entries, item_id, creator_ids=[creator_id]
+        )
+    except ValueError as exc:
+        return jsonify({"status": "error", "title": "Invalid Argument", "detail": str(exc)}), 400
+
+    return (
+        jsonify(
+            {
+                "status": "success" if attached_files else "error",
+                "file_ids": [str(file["_id"]) for file in attached_files],
+                "file_information": attached_files,
+                "errors": errors,
+            }
+        ),
+        201 if attached_files else 502,
+    )
+
+
 @FILES.route("/delete-file-from-sample/", methods=["POST"])
 def delete_file_from_sample():
-    """Remove a file from a sample, but don't delete the actual file (for now)"""
+    """Remove a file from a sample. The stored contents are only deleted once
+    the file is no longer attached to any item and no other file shares them.
+
+    """
 
     if not current_user.is_authenticated and not CONFIG.TESTING:
         return (
@@ -174,24 +566,17 @@ def delete_file_from_sample():
 
     item_id = request_json["item_id"]
     file_id = ObjectId(request_json["file_id"])
-    result = pydatalab.mongo.flask_mongo.db.items.update_one(
-        {"item_id": item_id, **get_default_permissions(user_only=True)},
-        {"$pull": {"file_ObjectIds": file_id}},
-    )
-    if result.modified_count != 1:
+    try:
+        updated_file_entry = file_utils.remove_file_from_sample(item_id, file_id)
+    except OSError as exc:
         return (
             jsonify(
                 status="error",
                 message=f"Not authorized to perform file removal from sample {item_id=}",
-                output=result.raw_result,
+                output=str(exc),
             ),
             401,
         )
-    updated_file_entry = pydatalab.mongo.flask_mongo.db.files.find_one_and_update(
-        {"_id": file_id},
-        {"$pull": {"item_ids": item_id}},
-        return_document=ReturnDocument.AFTER,
-    )
 
     if not updated_file_entry:
         return (
@@ -1,16 +1,289 @@
+import datetime
+from collections import Counter, defaultdict
+from collections.abc import Iterable
+
+from bson import ObjectId
+from bson.errors import InvalidId
 from flask import Blueprint, jsonify, request
+from werkzeug.exceptions import BadRequest
 
+from pydatalab.item_graph import get_item_graph_documents
 from pydatalab.mongo import flask_mongo
 from pydatalab.permissions import active_users_or_get_only, get_default_permissions
 
 GRAPHS = Blueprint("graphs", __name__)
 
+_GRAPH_PROJECTION = {"item_id": 1, "name": 1, "type": 1, "relationships": 1}
+
+# Requests for deeper item neighbourhoods are clamped to this depth
+_MAX_GRAPH_DEPTH = 10
+
 
 @GRAPHS.before_request
 @active_users_or_get_only
 def _(): ...
 
 
+def _get_item_neighbourhood(item_id: str, max_depth: int) -> list[dict]:
+    """Fetch an item and all items within `max_depth` relationships of it
+    in a single aggregation.
+
+    Relationships are followed in both directions with two `$graphLookup` stages:
+    outwards through the item's own `relationships` (e.g., its parents) and inwards
+    through the `relationships` of other items that reference it (e.g., its children).
+    Each traversal continues in the same direction, i.e., following lineage, and only
+    visits items that the current user has permission to see.
+
+    Parameters:
+        item_id: The ID of the item at the centre of the graph.
+        max_depth: The maximum number of relationships to follow away from the item.
+
+    Returns:
+        The projected documents of the item and its neighbourhood, with the
+        requested item first, or an empty list if the item cannot be found.
+
+    """
+    permissions = get_default_permissions(user_only=False)
+    pipeline: list[dict] = [{"$match": {"item_id": item_id, **permissions}}]
+
+    if max_depth >= 1:
+        traversal = {
+            "from": "items",
+            "maxDepth": max_depth - 1,
+            "restrictSearchWithMatch": permissions,
+        }
+        pipeline += [
+            {
+                "$graphLookup": {
+                    **traversal,
+                    "startWith": {"$ifNull": ["$relationships.item_id", []]},
+                    "connectFromField": "relationships.item_id",
+                    "connectToField": "item_id",
+                    "as": "outgoing",
+                }
+            },
+            {
+                "$graphLookup": {
+                    **traversal,
+                    "startWith": "$item_id",
+                    "connectFromField": "item_id",
+                    "connectToField": "relationships.item_id",
+                    "as": "incoming",
+                }
+            },
+        ]
+
+    pipeline.append(
+        {
+            "$project": {
+                **_GRAPH_PROJECTION,
+                **{
+                    f"{direction}.{field}": 1
+                    for direction in ("outgoing", "incoming")
+                    for field in _GRAPH_PROJECTION
+                },
+            }
+        }
+    )
+
+    results = list(flask_mongo.db.items.aggregate(pipeline))
+    if not results:
+        return []
+
+    main_item = results[0]
+    documents = [main_item]
+    seen = {item_id}
+    for document in main_item.pop("outgoing", []) + main_item.pop("incoming", []):
+        if document["item_id"] not in seen:
+            seen.add(document["item_id"])
+            documents.append(document)
+
+    return documents
+
+
+def _parse_datetime_arg(name: str) -> datetime.datetime | None:
+    """Parse an ISO-format date(time) query parameter as a naive UTC datetime,
+    matching the datetimes returned by the database.
+
+    """
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(value)
+    except ValueError:
+        raise BadRequest(f"Invalid ISO date for {name!r}: {value!r}")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _filter_graph_documents(
+    documents: Iterable[dict],
+    types: set[str] | None = None,
+    collection_immutable_id: ObjectId | None = None,
+    creator_id: ObjectId | None = None,
+    date_from: datetime.datetime | None = None,
+    date_to: datetime.datetime | None = None,
+) -> list[dict]:
+    """Filter the cached graph documents by type, collection membership,
+    creator and date window.
+
+    """
+
+    def _naive(date: datetime.datetime) -> datetime.datetime:
+        if date.tzinfo is not None:
+            return date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return date
+
+    filtered = []
+    for document in documents:
+        if types and document.get("type") not in types:
+            continue
+        if collection_immutable_id is not None and not any(
+            relationship.get("type") == "collections"
+            and relationship.get("immutable_id") == collection_immutable_id
+            for relationship in document.get("relationships") or []
+        ):
+            continue
+        if creator_id is not None and creator_id not in (document.get("creator_ids") or []):
+            continue
+        if date_from is not None or date_to is not None:
+            date = document.get("date")
+            if date is None:
+                continue
+            date = _naive(date)
+            if (date_from is not None and date < date_from) or (
+                date_to is not None and date > date_to
+            ):
+                continue
+        filtered.append(document)
+
+    return filtered
+
+
+def _collapse_nodes(
+    nodes: list[dict], edges: list[dict], clusters: dict[str, dict]
+) -> tuple[list[dict], list[dict]]:
+    """Replace each node that is mapped to a cluster with a single node for that
+    cluster, merging the edges of its members and dropping any within the cluster.
+
+    Parameters:
+        nodes: The Cytoscape nodes of the graph.
+        edges: The Cytoscape edges of the graph.
+        clusters: A mapping from node ID to the data of the cluster node it should
+            be collapsed into (which must include an `id`).
+
+    Returns:
+        The new nodes and edges.
+
+    """
+    cluster_nodes: dict[str, dict] = {}
+    for node in nodes:
+        cluster = clusters.get(node["data"]["id"])
+        if cluster is not None:
+            cluster_node = cluster_nodes.setdefault(
+                cluster["id"], {"data": {**cluster, "cluster": True, "count": 0}}
+            )
+            cluster_node["data"]["count"] += 1
+
+    new_nodes = [
+        node
+        for node in nodes
+        if node["data"]["id"] not in clusters and node["data"]["id"] not in cluster_nodes
+    ] + list(cluster_nodes.values())
+
+    merged_edges: dict[str, dict] = {}
+    for edge in edges:
+        source = clusters.get(edge["data"]["source"], {}).get("id", edge["data"]["source"])
+        target = clusters.get(edge["data"]["target"], {}).get("id", edge["data"]["target"])
+        if source == target:
+            continue
+        edge_id = f"{source}->{target}"
+        if edge_id in merged_edges:
+            merged_edges[edge_id]["data"]["value"] += edge["data"]["value"]
+        else:
+            merged_edges[edge_id] = {
+                "data": {
+                    "id": edge_id,
+                    "source": source,
+                    "target": target,
+                    "value": edge["data"]["value"],
+                }
+            }
+
+    return new_nodes, list(merged_edges.values())
+
+
+def _collection_clusters(documents: list[dict], collections_by_id: dict) -> dict[str, dict]:
+    """Map each item that is a member of a collection to a cluster node for
+    the first of its collections.
+
+    """
+    clusters = {}
+    for document in documents:
+        for relationship in document.get("relationships") or []:
+            if relationship.get("type") != "collections":
+                continue
+            collection_data = collections_by_id.get(relationship["immutable_id"])
+            if collection_data:
+                clusters[document["item_id"]] = {
+                    "id": f"Collection: {collection_data['collection_id']}",
+                    "name": collection_data["title"],
+                    "type": collection_data["type"],
+                    "shape": "triangle",
+                }
+                break
+    return clusters
+
+
+def _family_clusters(nodes: list[dict], edges: list[dict], max_family_size: int) -> dict[str, dict]:
+    """Map the leaf children of any parent with more than `max_family_size`
+    of them to a single cluster node per family.
+
+    """
+    node_types = {node["data"]["id"]: node["data"]["type"] for node in nodes}
+    degree: Counter[str] = Counter()
+    children = defaultdict(list)
+    for edge in edges:
+        degree[edge["data"]["source"]] += 1
+        degree[edge["data"]["target"]] += 1
+        children[edge["data"]["source"]].append(edge["data"]["target"])
+
+    clusters = {}
+    for parent, family in children.items():
+        leaves = [
+            child
+            for child in family
+            if degree[child] == 1 and child in node_types and child not in clusters
+        ]
+        if len(leaves) <= max_family_size:
+            continue
+        cluster = {
+            "id": f"Family: {parent}",
+            "name": f"{len(leaves)} children of {parent}",
+            "type": Counter(node_types[leaf] for leaf in leaves).most_common(1)[0][0],
+        }
+        clusters.update({leaf: cluster for leaf in leaves})
+
+    return clusters
+
+
+def _limit_nodes(nodes: list[dict], edges: list[dict], limit: int) -> tuple[list[dict], list[dict]]:
+    """Keep only the `limit` best-connected nodes, and the edges between them."""
+    degree: Counter[str] = Counter()
+    for edge in edges:
+        degree[edge["data"]["source"]] += 1
+        degree[edge["data"]["target"]] += 1
+
+    nodes = sorted(nodes, key=lambda node: -degree[node["data"]["id"]])[:limit]
+    kept = {node["data"]["id"] for node in nodes}
+    edges = [
+        edge for edge in edges if edge["data"]["source"] in kept and edge["data"]["target"] in kept
+    ]
+    return nodes, edges
+
+
 @GRAPHS.route("/item-graph", methods=["GET"])
 @GRAPHS.route("/item-graph/<item_id>", methods=["GET"])
 def get_graph_cy_format(
@@ -19,13 +292,54 @@ def get_graph_cy_format(
     hide_collections: bool = True,
     max_depth: int = 1,
 ):
+    """Return the Cytoscape nodes and edges of either the neighbourhood of a
+    given item, or the whole deployment.
+
+    The neighbourhood of an item extends up to `max_depth` relationships away
+    from it (default 1, at most `_MAX_GRAPH_DEPTH`).
+
+    The whole-deployment graph is served from a cache that is invalidated by item
+    writes, and accepts the following additional query parameters:
+
+    - `types`: a comma-separated list of item types to include,
+    - `creator_id`: only include items created by the person with this immutable ID,
+    - `date_from`/`date_to`: only include items with a `date` in this ISO-format window,
+    - `cluster_collections`: collapse the members of each collection into a single node,
+    - `max_family_size`: collapse the childless children of any item with more than
+      this many into a single node,
+    - `limit`: the maximum number of nodes to return, keeping the best-connected.
+
+    """
     collection_id = request.args.get("collection_id", type=str)
     hide_collections = request.args.get(
         "hide_collections", default=True, type=lambda v: v.lower() == "true"
     )
     max_depth = request.args.get("max_depth", default=1, type=int)
+    if max_depth < 0:
+        raise BadRequest(f"Invalid max_depth {max_depth!r}, must be a non-negative integer")
+    max_depth = min(max_depth, _MAX_GRAPH_DEPTH)
+
+    cluster_collections = request.args.get(
+        "cluster_collections", default=False, type=lambda v: v.lower() == "true"
+    )
+    max_family_size = request.args.get("max_family_size", type=int)
+    if max_family_size is not None and max_family_size <= 0:
+        raise BadRequest(f"Invalid max_family_size {max_family_size!r}, must be a positive integer")
+    limit = request.args.get("limit", type=int)
+    if limit is not None and limit <= 0:
+        raise BadRequest(f"Invalid limit {limit!r}, must be a positive integer")
+    types = {t for t in request.args.get("types", default="", type=str).split(",") if t}
+    creator_id = None
+    if request.args.get("creator_id"):
+        try:
+            creator_id = ObjectId(request.args["creator_id"])
+        except InvalidId:
+            raise BadRequest(f"Invalid creator ID {request.args['creator_id']!r}")
+    date_from = _parse_datetime_arg("date_from")
+    date_to = _parse_datetime_arg("date_to")
 
     if item_id is None:
+        collection_immutable_id = None
         if collection_id is not None:
             collection_immutable_id = flask_mongo.db.collections.find_one(
                 {"collection_id": collection_id, **get_default_permissions(user_only=False)},
@@ -39,89 +353,49 @@ def get_graph_cy_format(
                     404,
                 )
             collection_immutable_id = collection_immutable_id["_id"]
-            query = {
-                "$and": [
-                    {"relationships.immutable_id": collection_immutable_id},
-                    {"relationships.type": "collections"},
-                ]
-            }
-        else:
-            query = {}
-        all_documents = flask_mongo.db.items.find(
-            {**query, **get_default_permissions(user_only=False)},
-            projection={"item_id": 1, "name": 1, "type": 1, "relationships": 1},
+
+        all_documents = _filter_graph_documents(
+            get_item_graph_documents(get_default_permissions(user_only=False)),
+            types=types,
+            collection_immutable_id=collection_immutable_id,
+            creator_id=creator_id,
+            date_from=date_from,
+            date_to=date_to,
         )
         node_ids: set[str] = {document["item_id"] for document in all_documents}
-        all_documents.rewind()
 
     else:
-        main_item = flask_mongo.db.items.find_one(
-            {
-                "item_id": item_id,
-                **get_default_permissions(user_only=False),
-            },
-            projection={"item_id": 1, "name": 1, "type": 1, "relationships": 1},
-        )
+        all_documents = _get_item_neighbourhood(item_id, max_depth)
 
-        if not main_item:
+        if not all_documents:
             return (
                 jsonify(status="error", message=f"Item {item_id} not found or no permission"),
                 404,
             )
 
-        node_ids = {item_id}
-        all_documents = [main_item]
-
-        def add_related_items(current_item_id: str, current_depth: int):
-            if current_depth > max_depth:
-                return
-
-            current_item = flask_mongo.db.items.find_one(
-                {
-                    "item_id": current_item_id,
-                    **get_default_permissions(user_only=False),
-                },
-                projection={"item_id": 1, "name": 1, "type": 1, "relationships": 1},
-            )
+        node_ids = {document["item_id"] for document in all_documents}
 
-            if not current_item:
-                return
-
-            for relationship in current_item.get("relationships", []) or []:
-                if relationship.get("item_id") and relationship["item_id"] not in node_ids:
-                    node_ids.add(relationship["item_id"])
-                    related_item = flask_mongo.db.items.find_one(
-                        {
-                            "item_id": relationship["item_id"],
-                            **get_default_permissions(user_only=False),
-                        },
-                        projection={"item_id": 1, "name": 1, "type": 1, "relationships": 1},
-                    )
-                    if related_item:
-                        all_documents.append(related_item)
-                        add_related_items(relationship["item_id"], current_depth + 1)
-
-            incoming_items = list(
-                flask_mongo.db.items.find(
+    # Resolve all referenced collections in a single query, rather than one per relationship
+    cluster_collections = cluster_collections and item_id is None and not collection_id
+    collections_by_id: dict = {}
+    if not collection_id and (not hide_collections or cluster_collections):
+        collection_immutable_ids = {
+            relationship["immutable_id"]
+            for document in all_documents
+            for relationship in document.get("relationships") or []
+            if relationship.get("type") == "collections"
+        }
+        if collection_immutable_ids:
+            collections_by_id = {
+                collection["_id"]: collection
+                for collection in flask_mongo.db.collections.find(
                     {
-                        "relationships": {
-                            "$elemMatch": {
-                                "item_id": current_item_id,
-                            }
-                        },
+                        "_id": {"$in": list(collection_immutable_ids)},
                         **get_default_permissions(user_only=False),
                     },
-                    projection={"item_id": 1, "name": 1, "type": 1, "relationships": 1},
+                    projection={"collection_id": 1, "title": 1, "type": 1},
                 )
-            )
-
-            for incoming_item in incoming_items:
-                if incoming_item["item_id"] not in node_ids:
-                    node_ids.add(incoming_item["item_id"])
-                    all_documents.append(incoming_item)
-                    add_related_items(incoming_item["item_id"], current_depth + 1)
-
-        add_related_items(item_id, 1)
+            }
 
     nodes = []
     edges = []
@@ -137,13 +411,7 @@ def get_graph_cy_format(
             if relationship.get("type") == "collections" and not collection_id:
                 if hide_collections:
                     continue
-                collection_data = flask_mongo.db.collections.find_one(
-                    {
-                        "_id": relationship["immutable_id"],
-                        **get_default_permissions(user_only=False),
-                    },
-                    projection={"collection_id": 1, "title": 1, "type": 1},
-                )
+                collection_data = collections_by_id.get(relationship["immutable_id"])
                 if collection_data:
                     if relationship["immutable_id"] not in node_collections:
                         _id = f"Collection: {collection_data['collection_id']}"
@@ -226,4 +494,30 @@ def get_graph_cy_format(
         or node["data"]["id"].startswith("Collection:")
     ]
 
-    return (jsonify(status="success", nodes=nodes, edges=edges), 200)
+    if item_id is not None:
+        return (jsonify(status="success", nodes=nodes, edges=edges), 200)
+
+    if cluster_collections:
+        nodes, edges = _collapse_nodes(
+            nodes, edges, _collection_clusters(all_documents, collections_by_id)
+        )
+
+    if max_family_size is not None:
+        nodes, edges = _collapse_nodes(
+            nodes, edges, _family_clusters(nodes, edges, max_family_size)
+        )
+
+    total_nodes = len(nodes)
+    if limit is not None and total_nodes > limit:
+        nodes, edges = _limit_nodes(nodes, edges, limit)
+
+    return (
+        jsonify(
+            status="success",
+            nodes=nodes,
+            edges=edges,
+            total_nodes=total_nodes,
+            truncated=len(nodes) < total_nodes,
+        ),
+        200,
+    )
@@ -137,15 +137,14 @@ def list_block_types():
                         id=block_type,
                         type="block_type",
                         attributes={
-                            "name": getattr(block, "name", ""),
-                            "description": getattr(block, "description", ""),
-                            "version": getattr(block, "version", __version__),
-                            "accepted_file_extensions": getattr(
-                                block, "accepted_file_extensions", []
-                            ),
+                            "name": block.name,
+                            "description": block.description,
+                            "version": block.version,
+                            "accepted_file_extensions": block.accepted_file_extensions,
                         },
                     )
-                    for block_type, block in BLOCK_TYPES.items()
+                    # Block metadata is listed without importing the blocks themselves
+                    for block_type, block in BLOCK_TYPES.info().items()
                 ],
                 meta=Meta(query=request.query_string),
             ).json()
@@ -157,7 +156,12 @@ def get_all_items_models():
     return Item.__subclasses__()
 
 
+@lru_cache(maxsize=1)
 def generate_schemas():
+    """Returns the JSON schemas of all item types (and collections), which are
+    generated on first use rather than on import.
+
+    """
     schemas: dict[str, dict] = {}
 
     for model_class in get_all_items_models() + [Collection]:
@@ -168,10 +172,6 @@ def generate_schemas():
     return schemas
 
 
-# Generate once on import
-SCHEMAS = generate_schemas()
-
-
 @INFO.route("/info/types", methods=["GET"])
 def list_supported_types():
     """Returns a list of supported schemas."""
@@ -189,7 +189,7 @@ def list_supported_types():
                             "schema": schema,
                         },
                     )
-                    for item_type, schema in SCHEMAS.items()
+                    for item_type, schema in generate_schemas().items()
                 ],
                 meta=Meta(query=request.query_string),
             ).json()
@@ -200,7 +200,8 @@ def list_supported_types():
 @INFO.route("/info/types/<string:item_type>", methods=["GET"])
 def get_schema_type(item_type):
     """Returns the schema of the given type."""
-    if item_type not in SCHEMAS:
+    schemas = generate_schemas()
+    if item_type not in schemas:
         return jsonify(
             {"status": "error", "detail": f"Item type {item_type} not found for this deployment"}
         ), 404
@@ -214,7 +215,7 @@ def get_schema_type(item_type):
                     attributes={
                         "version": __version__,
                         "api_version": __api_version__,
-                        "schema": SCHEMAS[item_type],
+                        "schema": schemas[item_type],
                     },
                 ),
                 meta=Meta(query=request.query_string),
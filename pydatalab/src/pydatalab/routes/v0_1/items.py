@@ -10,12 +10,16 @@ from deepdiff import DeepDiff
 from flask import Blueprint, jsonify, redirect, request
 from flask_login import current_user
 from pydantic import ValidationError
+from pymongo import ReturnDocument
 from pymongo.command_cursor import CommandCursor
 from pymongo.errors import DuplicateKeyError
 from werkzeug.exceptions import BadRequest, Conflict, NotFound
 
 from pydatalab.apps import BLOCK_TYPES
 from pydatalab.config import CONFIG
+from pydatalab.file_utils import sync_live_files
+from pydatalab.item_edges import get_incoming_edges, remove_item_edges, sync_item_edges
+from pydatalab.item_graph import invalidate_item_graph
 from pydatalab.logger import LOGGER
 from pydatalab.models import ITEM_MODELS, ItemVersion
 from pydatalab.models.items import Item
@@ -26,7 +30,7 @@ from pydatalab.models.versions import (
     RestoreVersionRequest,
     VersionAction,
 )
-from pydatalab.mongo import ITEMS_FTS_FIELDS, flask_mongo
+from pydatalab.mongo import flask_mongo, get_items_fts_fields
 from pydatalab.permissions import (
     PUBLIC_USER_ID,
     access_token_or_active_users,
@@ -406,7 +410,7 @@ def search_items():
         query = query.strip("'")
 
         match_obj = {
-            "$or": [{field: {"$regex": query, "$options": "i"}} for field in ITEMS_FTS_FIELDS]
+            "$or": [{field: {"$regex": query, "$options": "i"}} for field in get_items_fts_fields()]
         }
         match_obj = {"$and": [get_default_permissions(user_only=False), match_obj]}
         if types is not None:
@@ -439,7 +443,7 @@ def search_items():
             match_obj = {
                 "$or": [
                     {"$and": [{field: {"$regex": query, "$options": "i"}} for query in query_parts]}
-                    for field in ITEMS_FTS_FIELDS
+                    for field in get_items_fts_fields()
                 ]
             }
             LOGGER.debug(
@@ -668,6 +672,8 @@ def _create_sample(
     if not result.acknowledged:
         raise BadRequest(f"Failed to add new item {new_sample['item_id']!r} to database.")
 
+    sync_item_edges([{**data_model.dict(), "_id": result.inserted_id}])
+
     # Save initial version snapshot after successful item creation
     try:
         save_version_snapshot(data_model.refcode, action=VersionAction.CREATED)
@@ -941,6 +947,8 @@ def _process_item_permissions(
             400,
         )
 
+    invalidate_item_graph()
+
     return {"status": "success"}, 200
 
 
@@ -1018,7 +1026,7 @@ def delete_sample():
 
     item = flask_mongo.db.items.find_one(
         {"item_id": item_id, **get_default_permissions(user_only=True, deleting=True)},
-        {"refcode": 1},
+        {"refcode": 1, "_id": 1},
     )
 
     if not item:
@@ -1048,6 +1056,7 @@ def delete_sample():
         )
 
     flask_mongo.db.api_keys.delete_many({"refcode": item["refcode"], "type": "access_token"})
+    remove_item_edges(item["_id"])
 
     return jsonify({"status": "success"}), 200
 
@@ -1134,38 +1143,18 @@ def get_item_data(
 
     doc = ItemModel(**doc)
 
-    # find any documents with relationships that mention this document
-    relationships_query_results = flask_mongo.db.items.find(
-        filter={
-            "$or": [
-                {"relationships.item_id": doc.item_id},
-                {"relationships.refcode": doc.refcode},
-                {"relationships.immutable_id": doc.immutable_id},
-            ]
-        },
-        projection={
-            "item_id": 1,
-            "refcode": 1,
-            "relationships": {
-                "$elemMatch": {
-                    "$or": [
-                        {"item_id": doc.item_id},
-                        {"refcode": doc.refcode},
-                    ],
-                },
-            },
-        },
-    )
+    # check all live files for newer versions at once, rather than per block
+    if doc.files:
+        doc.files = sync_live_files(doc.files)
 
-    # loop over and collect all 'outer' relationships presented by other items
+    # find any edges from other items that point at this document
     incoming_relationships: dict[RelationshipType, set[str]] = {}
-    for d in relationships_query_results:
-        for k in d["relationships"]:
-            if k["relation"] not in incoming_relationships:
-                incoming_relationships[k["relation"]] = set()
-            incoming_relationships[k["relation"]].add(
-                d["item_id"] or d["refcode"] or d["immutable_id"]
-            )
+    for edge in get_incoming_edges((doc.item_id, doc.refcode, doc.immutable_id)):
+        if edge.get("target_type") == "collections":
+            continue
+        incoming_relationships.setdefault(edge["relation"], set()).add(
+            edge.get("source_item_id") or edge.get("source_refcode") or edge["source"]
+        )
 
     # loop over and aggregate all 'inner' relationships presented by this item
     inlined_relationships: dict[RelationshipType, set[str]] = {}
@@ -1415,6 +1404,7 @@ def restore_version(refcode):
 
     # Perform the restore first
     flask_mongo.db.items.update_one({"refcode": refcode}, {"$set": restored_data})
+    sync_item_edges([{**current_item, **restored_data}])
 
     # Extract user information for hybrid storage approach
     user_id = None
@@ -1553,11 +1543,13 @@ def save_item():
 
         updated_data["blocks_obj"][block_id] = block.to_db()
 
-    # Bit of a hack for now: starting materials and equipment should be editable by anyone,
-    # so we adjust the query above to be more permissive when the user is requesting such an item
-    # but before returning we need to check that the actual item did indeed have that type
+    # The client may send the version it last saw; if so, the write is conditioned on it
+    expected_version = updated_data.pop("version", None)
+
+    # Write permissions already let through starting materials and equipment, which
+    # are editable by anyone, so a single read suffices to resolve the current state
     item = flask_mongo.db.items.find_one(
-        {"item_id": item_id, **get_default_permissions(user_only=False)}
+        {"item_id": item_id, **get_default_permissions(user_only=True)}
     )
 
     if not item:
@@ -1580,24 +1572,16 @@ def save_item():
             400,
         )
 
-    # Increment version number on the item itself
-    updated_data["version"] = item.get("version", 0) + 1
-
-    user_only = item["type"] not in ("starting_materials", "equipment")
-
-    item = flask_mongo.db.items.find_one(
-        {"item_id": item_id, **get_default_permissions(user_only=user_only)}
-    )
-
-    if not item:
-        return (
-            jsonify(
-                status="error",
-                message=f"Unable to find item with appropriate permissions and {item_id=}.",
-            ),
-            404,
+    current_version = item.get("version")
+    if expected_version is not None and expected_version != current_version:
+        raise Conflict(
+            f"Item {item_id!r} has been modified elsewhere (version {current_version}, "
+            f"expected {expected_version}); reload the item before saving."
         )
 
+    # Increment version number on the item itself
+    updated_data["version"] = (current_version or 0) + 1
+
     if updated_data.get("collections", []):
         try:
             updated_data["collections"] = _check_collections(updated_data)
@@ -1630,27 +1614,31 @@ def save_item():
     item.pop("collections")
     item.pop("creators")
 
-    # Update the item FIRST (transaction safety: item update before version save)
-    result = flask_mongo.db.items.update_one(
-        {"item_id": item_id, **get_default_permissions(user_only=True)},
+    # Update the item FIRST (transaction safety: item update before version save), only if
+    # no other write has landed since it was read
+    updated_item = flask_mongo.db.items.find_one_and_update(
+        {
+            "item_id": item_id,
+            "version": current_version,
+            **get_default_permissions(user_only=True),
+        },
         {"$set": item},
+        return_document=ReturnDocument.AFTER,
     )
 
-    if result.matched_count != 1:
-        return (
-            jsonify(
-                status="error",
-                message=f"{item_id} item update failed. no subdocument matched",
-                output=result.raw_result,
-            ),
-            400,
+    if updated_item is None:
+        raise Conflict(
+            f"Item {item_id!r} was modified by another request while saving; "
+            "reload the item before saving."
         )
 
+    sync_item_edges([updated_item])
+
     # Now save a version AFTER successful item update
     # If this fails, we log but don't fail the request since item was already saved
     try:
         save_version_resp_dict, save_version_status = save_version_snapshot(
-            refcode, action=VersionAction.MANUAL_SAVE
+            refcode, action=VersionAction.MANUAL_SAVE, item=updated_item
         )
         if save_version_status != 200:
             LOGGER.error(
@@ -1665,7 +1653,14 @@ def save_item():
             str(e),
         )
 
-    return jsonify(status="success", last_modified=updated_data["last_modified"]), 200
+    return (
+        jsonify(
+            status="success",
+            last_modified=updated_data["last_modified"],
+            version=updated_data["version"],
+        ),
+        200,
+    )
 
 
 @ITEMS.route("/items/<refcode>/access-token-info", methods=["GET"])
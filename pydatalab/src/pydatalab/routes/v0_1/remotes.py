@@ -37,8 +37,8 @@ def _(): ...
 def list_remote_directories():
     """Returns the most recent directory structures from the server.
 
-    If the cache is missing or is older than some configured time,
-    then it will be reconstructed.
+    If the cache is older than some configured time, it will be refreshed
+    in the background and the current cache returned in the meantime.
 
     """
     if (
@@ -78,8 +78,9 @@ def list_remote_directories():
     response["meta"] = {}
     response["meta"]["remotes"] = [json.loads(d.json()) for d in CONFIG.REMOTE_FILESYSTEMS]
     if all_directory_structures:
-        oldest_update = min(d["last_updated"] for d in all_directory_structures)
-        response["meta"]["oldest_cache_update"] = oldest_update.isoformat()
+        updates = [d["last_updated"] for d in all_directory_structures if d["last_updated"]]
+        if updates:
+            response["meta"]["oldest_cache_update"] = min(updates).isoformat()
         response["data"] = all_directory_structures
     return jsonify(response), 200
 
@@ -92,6 +93,11 @@ def get_remote_directory(remote_id: str):
     """Returns the directory structure from the server for the
     given configured remote name.
 
+    If the `path` query parameter is provided, only the entries of that
+    directory (relative to the top level of the remote) are returned, with
+    subdirectories listed without their contents, so that clients can browse
+    large remotes one level at a time.
+
     """
     if not current_user.is_authenticated and not CONFIG.TESTING:
         return (
@@ -135,7 +141,9 @@ def get_remote_directory(remote_id: str):
             404,
         )
 
-    directory_structure = get_directory_structure(remote_obj, invalidate_cache=invalidate_cache)
+    directory_structure = get_directory_structure(
+        remote_obj, invalidate_cache=invalidate_cache, path=request.args.get("path")
+    )
 
     response: dict[str, Any] = {}
     response["meta"] = {}
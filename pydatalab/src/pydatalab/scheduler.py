@@ -1,46 +1,463 @@
-from apscheduler.executors.pool import ThreadPoolExecutor
-from apscheduler.jobstores.memory import MemoryJobStore
-from apscheduler.schedulers.background import BackgroundScheduler
+"""A persistent background job queue for work that should not block requests,
+e.g., exports, backups and cache refreshes.
 
+Jobs are stored in the `jobs` collection and are run by pools of worker threads
+(configured per queue by `CONFIG.JOB_QUEUES`) in each server process. Workers
+claim jobs atomically and hold a lease on them while they run, which is renewed
+by a heartbeat; if a process dies, its jobs become claimable again once their
+lease expires. Failed jobs are retried with exponential backoff up to their
+`max_attempts`. Periodic jobs registered with `add_periodic_job` are queued by
+every process while its workers are running, and deduplicated by their job ID.
+
+Job functions are stored by import path, so must be importable module-level
+functions, and their arguments must be BSON-serializable. When the scheduler has
+been attached to an app with `init_app`, jobs are run inside its app context.
+
+The worker pools of each process are started lazily, by its first request or the
+first job it queues, rather than when the app is created, so that with gunicorn's
+`--preload` option they are started in each forked worker process rather than in
+the master process (threads do not survive a fork).
+
+"""
+
+import importlib
+import os
+import socket
+import threading
+import time
+import uuid
+from collections.abc import Callable
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from pydatalab.config import CONFIG
+from pydatalab.logger import LOGGER
+from pydatalab.metrics import observe
+from pydatalab.models.jobs import Job, JobStatus
+from pydatalab.mongo import get_database
+
+__all__ = ("JobScheduler", "job_scheduler", "report_progress")
+
+_current_job = threading.local()
+
+
+def _func_path(func: Callable | str) -> str:
+    """Return the import path of a job function, in the form `module:qualname`."""
+    if isinstance(func, str):
+        return func
+    qualname = func.__qualname__
+    if "<" in qualname:
+        raise ValueError(f"Job functions must be importable module-level functions, not {func!r}")
+    return f"{func.__module__}:{qualname}"
+
+
+def _resolve_func(path: str) -> Callable:
+    """Import the job function with the given `module:qualname` import path."""
+    module_name, _, qualname = path.partition(":")
+    target: Any = importlib.import_module(module_name)
+    for attr in qualname.split("."):
+        target = getattr(target, attr)
+    return target
+
+
+def report_progress(fraction: float | None, message: str | None = None) -> None:
+    """Report the progress of the job running in the current thread, if any,
+    which also renews its lease.
+
+    Parameters:
+        fraction: The fraction of the job completed, between 0 and 1.
+        message: An optional description of the current step.
+
+    """
+    job_id = getattr(_current_job, "job_id", None)
+    if job_id is None:
+        return
+
+    update: dict[str, Any] = {
+        "lease_expires_at": datetime.now(tz=timezone.utc)
+        + timedelta(seconds=CONFIG.JOB_LEASE_SECONDS)
+    }
+    if fraction is not None:
+        update["progress"] = min(max(fraction, 0.0), 1.0)
+    if message is not None:
+        update["progress_message"] = message
+
+    try:
+        get_database().jobs.update_one(
+            {"job_id": job_id, "lease_owner": _current_job.worker_id}, {"$set": update}
+        )
+    except PyMongoError as exc:
+        LOGGER.warning("Unable to report progress for job %s: %s", job_id, exc)
+
+
+class JobScheduler:
+    """Enqueues jobs in the database and runs the configured worker pools."""
 
-class ExportScheduler:
     _instance = None
-    _scheduler = None
+    _app = None
+    _pid: int | None = None
+    _start_lock = threading.Lock()
+    _threads: list[threading.Thread] = []
+    _wake: dict[str, threading.Event] = {}
+    _stop = threading.Event()
+    _periodic: dict[str, dict[str, Any]] = {}
+
+    poll_interval: float = 2.0
+    """Seconds between checks for new jobs by idle workers."""
 
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
         return cls._instance
 
-    def init_scheduler(self):
-        if self._scheduler is None:
-            jobstores = {"default": MemoryJobStore()}
-            # TODO: Make max_workers configurable via settings
-            executors = {"default": ThreadPoolExecutor(1)}
-            # max_instances: max concurrent instances of the same job
-            job_defaults = {"coalesce": False, "max_instances": 1}
+    def init_app(self, app) -> None:
+        """Run jobs within the context of the given app, starting the worker pools
+        of each process on its first request (see `ensure_started`).
+
+        """
+        self._app = app
+        app.before_request(self.ensure_started)
+
+    def ensure_started(self) -> None:
+        """Start the worker pools in the current process, if the scheduler has been
+        attached to an app, is not in testing mode and they are not already running.
+
+        """
+        if self._app is not None and not CONFIG.TESTING:
+            self.start()
+
+    def start(self) -> None:
+        """Start the worker threads for each configured queue, if not already running
+        in the current process.
+
+        """
+        if self._pid == os.getpid() and self._threads:
+            return
+
+        with self._start_lock:
+            if self._pid == os.getpid() and self._threads:
+                return
+            self._start()
+
+    def _start(self) -> None:
+        # Any threads recorded by the parent of a forked process are not running in it
+        self._threads.clear()
+        self._pid = os.getpid()
+        self._stop.clear()
+        host = f"{socket.gethostname()}:{os.getpid()}"
+        for queue, num_workers in CONFIG.JOB_QUEUES.items():
+            self._wake.setdefault(queue, threading.Event())
+            for ind in range(num_workers):
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(queue, f"{host}:{queue}:{ind}"),
+                    name=f"datalab-jobs-{queue}-{ind}",
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+        thread = threading.Thread(
+            target=self._queue_periodic_jobs, name="datalab-jobs-periodic", daemon=True
+        )
+        thread.start()
+        self._threads.append(thread)
 
-            self._scheduler = BackgroundScheduler(
-                jobstores=jobstores, executors=executors, job_defaults=job_defaults, timezone="UTC"
+        LOGGER.info("Started background job workers for queues %s", CONFIG.JOB_QUEUES)
+
+    def shutdown(self) -> None:
+        """Stop the worker threads once their current jobs have finished."""
+        self._stop.set()
+        for event in self._wake.values():
+            event.set()
+        self._threads.clear()
+
+    def add_job(
+        self,
+        func: Callable | str,
+        args: list | None = None,
+        kwargs: dict | None = None,
+        job_id: str | None = None,
+        queue: str = "default",
+        priority: int = 0,
+        max_attempts: int = 1,
+        retry_delay: float = 30,
+    ) -> str:
+        """Add a job to the given queue.
+
+        If a job with the same ID is already pending or running, it is left in
+        place rather than queued twice; a completed or failed job with the same
+        ID is replaced.
+
+        Parameters:
+            func: The module-level function to run, or its `module:qualname` import path.
+            args: Positional arguments for the function.
+            kwargs: Keyword arguments for the function.
+            job_id: A unique ID for the job, generated if not provided.
+            queue: The queue to add the job to.
+            priority: Jobs with a higher priority are run first within each queue.
+            max_attempts: The number of times to try the job before marking it as failed.
+            retry_delay: Seconds to wait before the first retry, doubling on each attempt.
+
+        Returns:
+            The ID of the job.
+
+        """
+        if queue not in CONFIG.JOB_QUEUES:
+            LOGGER.warning("Job queue %r has no workers configured in `JOB_QUEUES`", queue)
+
+        job = Job(
+            job_id=job_id or str(uuid.uuid4()),
+            queue=queue,
+            func=_func_path(func),
+            args=list(args or []),
+            kwargs=dict(kwargs or {}),
+            priority=priority,
+            max_attempts=max_attempts,
+            retry_delay=retry_delay,
+        )
+        document = job.dict()
+
+        jobs = get_database().jobs
+        replaced = jobs.replace_one(
+            {
+                "job_id": job.job_id,
+                "status": {"$in": [JobStatus.COMPLETED, JobStatus.FAILED]},
+            },
+            document,
+        )
+        if not replaced.matched_count:
+            try:
+                jobs.insert_one(document)
+            except DuplicateKeyError:
+                LOGGER.debug("Job %s is already queued", job.job_id)
+
+        self.ensure_started()
+        if queue in self._wake:
+            self._wake[queue].set()
+
+        return job.job_id
+
+    def add_periodic_job(
+        self,
+        func: Callable | str,
+        interval: float,
+        job_id: str,
+        args: list | None = None,
+        kwargs: dict | None = None,
+        queue: str = "default",
+    ) -> None:
+        """Queue a job every `interval` seconds while the workers are running,
+        starting immediately.
+
+        As every server process queues the job under the same ID, it is only run
+        by one worker at a time, but may run more often than `interval` across
+        processes; periodic jobs should therefore be cheap when there is nothing
+        to do.
+
+        Parameters:
+            func: The module-level function to run, or its `module:qualname` import path.
+            interval: Seconds between queueing the job.
+            job_id: The ID under which to queue the job.
+            args: Positional arguments for the function.
+            kwargs: Keyword arguments for the function.
+            queue: The queue to add the job to.
+
+        """
+        self._periodic[job_id] = {
+            "func": _func_path(func),
+            "interval": interval,
+            "args": args,
+            "kwargs": kwargs,
+            "queue": queue,
+            "next_run": 0.0,
+        }
+
+    def _queue_periodic_jobs(self) -> None:
+        """Queue each periodic job when it is due, until the scheduler is shut down."""
+        while not self._stop.is_set():
+            now = time.monotonic()
+            for job_id, spec in list(self._periodic.items()):
+                if now < spec["next_run"]:
+                    continue
+                spec["next_run"] = now + spec["interval"]
+                try:
+                    self.add_job(
+                        spec["func"],
+                        args=spec["args"],
+                        kwargs=spec["kwargs"],
+                        job_id=job_id,
+                        queue=spec["queue"],
+                    )
+                except PyMongoError as exc:
+                    LOGGER.warning("Unable to queue periodic job %s: %s", job_id, exc)
+            self._stop.wait(self.poll_interval)
+
+    def get_job(self, job_id: str) -> dict | None:
+        """Return the stored document of the job with the given ID, if it exists."""
+        return get_database().jobs.find_one({"job_id": job_id}, projection={"_id": 0})
+
+    def _claim(self, queue: str, worker_id: str) -> dict | None:
+        """Atomically claim the next runnable job in the queue, i.e., the pending
+        job with the highest priority, or any running job whose lease has expired.
+
+        """
+        now = datetime.now(tz=timezone.utc)
+        return get_database().jobs.find_one_and_update(
+            {
+                "queue": queue,
+                "$or": [
+                    {"status": JobStatus.PENDING, "run_after": {"$lte": now}},
+                    {"status": JobStatus.RUNNING, "lease_expires_at": {"$lt": now}},
+                ],
+            },
+            {
+                "$set": {
+                    "status": JobStatus.RUNNING,
+                    "lease_owner": worker_id,
+                    "lease_expires_at": now + timedelta(seconds=CONFIG.JOB_LEASE_SECONDS),
+                    "started_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("priority", -1), ("created_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _finish(self, job: dict, worker_id: str, update: dict) -> None:
+        get_database().jobs.update_one(
+            {"job_id": job["job_id"], "lease_owner": worker_id},
+            {"$set": {**update, "lease_owner": None, "lease_expires_at": None}},
+        )
+
+    def _heartbeat(self, job_id: str, worker_id: str, done: threading.Event) -> None:
+        """Renew the lease on a running job until it has finished."""
+        interval = CONFIG.JOB_LEASE_SECONDS / 3
+        while not done.wait(interval):
+            try:
+                get_database().jobs.update_one(
+                    {"job_id": job_id, "lease_owner": worker_id},
+                    {
+                        "$set": {
+                            "lease_expires_at": datetime.now(tz=timezone.utc)
+                            + timedelta(seconds=CONFIG.JOB_LEASE_SECONDS)
+                        }
+                    },
+                )
+            except PyMongoError as exc:
+                LOGGER.warning("Unable to renew lease on job %s: %s", job_id, exc)
+
+    def run_next(self, queue: str, worker_id: str | None = None) -> bool:
+        """Claim and run the next job in the given queue, if there is one.
+
+        Parameters:
+            queue: The queue to take a job from.
+            worker_id: An identifier for the worker holding the lease on the job.
+
+        Returns:
+            Whether a job was run.
+
+        """
+        worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        job = self._claim(queue, worker_id)
+        if job is None:
+            return False
+
+        if job["attempts"] > job["max_attempts"]:
+            LOGGER.error("Job %s was abandoned by its previous worker", job["job_id"])
+            self._finish(
+                job,
+                worker_id,
+                {
+                    "status": JobStatus.FAILED,
+                    "completed_at": datetime.now(tz=timezone.utc),
+                    "error_message": "The job's lease expired before it completed.",
+                },
             )
-            self._scheduler.start()
-        return self._scheduler
+            return True
+
+        done = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(job["job_id"], worker_id, done), daemon=True
+        )
+        heartbeat.start()
+        _current_job.job_id = job["job_id"]
+        _current_job.worker_id = worker_id
+
+        start = time.perf_counter()
+        try:
+            LOGGER.info("Running job %s (%s)", job["job_id"], job["func"])
+            func = _resolve_func(job["func"])
+            if self._app is not None:
+                with self._app.app_context():
+                    func(*job["args"], **job["kwargs"])
+            else:
+                func(*job["args"], **job["kwargs"])
+        except Exception as exc:
+            LOGGER.exception("Job %s failed on attempt %s", job["job_id"], job["attempts"])
+            now = datetime.now(tz=timezone.utc)
+            if job["attempts"] < job["max_attempts"]:
+                delay = job["retry_delay"] * 2 ** (job["attempts"] - 1)
+                update = {
+                    "status": JobStatus.PENDING,
+                    "run_after": now + timedelta(seconds=delay),
+                    "error_message": str(exc),
+                }
+            else:
+                update = {
+                    "status": JobStatus.FAILED,
+                    "completed_at": now,
+                    "error_message": str(exc),
+                }
+            self._finish(job, worker_id, update)
+            self._observe_duration(job, start, update["status"])
+        else:
+            self._finish(
+                job,
+                worker_id,
+                {
+                    "status": JobStatus.COMPLETED,
+                    "progress": 1.0,
+                    "completed_at": datetime.now(tz=timezone.utc),
+                    "error_message": None,
+                },
+            )
+            self._observe_duration(job, start, JobStatus.COMPLETED)
+        finally:
+            done.set()
+            _current_job.job_id = None
+            _current_job.worker_id = None
+
+        return True
 
-    def get_scheduler(self):
-        if self._scheduler is None:
-            self.init_scheduler()
-        return self._scheduler
+    @staticmethod
+    def _observe_duration(job: dict, start: float, status: JobStatus) -> None:
+        """Record the duration of a job attempt, by its outcome (`pending` for
+        attempts that will be retried).
 
-    def add_job(self, func, args, job_id=None):
-        """Add a job to the scheduler."""
-        scheduler = self.get_scheduler()
-        if not scheduler:
-            raise RuntimeError("Failed to initialize scheduler")
-        return scheduler.add_job(func=func, args=args, id=job_id, replace_existing=True)
+        """
+        observe(
+            "job_duration",
+            time.perf_counter() - start,
+            queue=job["queue"],
+            func=job["func"],
+            status=status.value,
+        )
 
-    def shutdown(self):
-        if self._scheduler and self._scheduler.running:
-            self._scheduler.shutdown()
+    def _work(self, queue: str, worker_id: str) -> None:
+        """Run jobs from the queue until the scheduler is shut down."""
+        wake = self._wake[queue]
+        while not self._stop.is_set():
+            try:
+                if self.run_next(queue, worker_id):
+                    continue
+            except PyMongoError as exc:
+                LOGGER.warning("Job worker %s unable to reach the database: %s", worker_id, exc)
+            wake.wait(self.poll_interval)
+            wake.clear()
 
 
-export_scheduler = ExportScheduler()
+job_scheduler = JobScheduler()
@@ -0,0 +1,115 @@
+"""Helpers for running commands on SSH-accessible remote filesystems.
+
+Commands are run with OpenSSH connection multiplexing (`ControlMaster`), so that
+the first command to a host opens a master connection that is kept open for
+`CONFIG.SSH_CONTROL_PERSIST` seconds and reused by subsequent commands (including
+`scp`) from any server process, avoiding a new SSH handshake per command.
+
+"""
+
+import datetime
+import os
+import shlex
+import subprocess
+import tempfile
+from collections.abc import Iterable
+from pathlib import Path
+
+from pydatalab.config import CONFIG
+from pydatalab.logger import LOGGER
+
+__all__ = ("ssh_options", "run_ssh_command", "stat_remote_files")
+
+
+def _control_directory() -> Path:
+    """Return the private directory holding the control sockets of master connections."""
+    directory = Path(tempfile.gettempdir()) / f"datalab-ssh-{os.getuid()}"
+    directory.mkdir(mode=0o700, exist_ok=True)
+    return directory
+
+
+def ssh_options() -> list[str]:
+    """Return the command-line options that enable connection multiplexing for
+    `ssh` and `scp`, or an empty list if it has been disabled.
+
+    """
+    if CONFIG.SSH_CONTROL_PERSIST is None:
+        return []
+
+    return [
+        "-o",
+        "ControlMaster=auto",
+        "-o",
+        f"ControlPath={_control_directory() / '%C'}",
+        "-o",
+        f"ControlPersist={CONFIG.SSH_CONTROL_PERSIST}",
+    ]
+
+
+def run_ssh_command(
+    hostname: str, command: str, timeout: float = 20
+) -> subprocess.CompletedProcess[bytes]:
+    """Run a shell command on the given host over a multiplexed connection.
+
+    Arguments:
+        hostname: The host to connect to, in any form accepted by `ssh`.
+        command: The command to run in the remote shell; any arguments should
+            already be quoted (e.g., with `shlex.quote`).
+        timeout: The number of seconds to wait for the command to finish.
+
+    Raises:
+        RuntimeError: If the command could not be run or timed out.
+
+    Returns:
+        The completed process, with captured stdout and stderr.
+
+    """
+    args = ["ssh", *ssh_options(), hostname, command]
+    LOGGER.debug("Calling %s", args)
+    try:
+        return subprocess.run(args, capture_output=True, timeout=timeout, check=False)  # noqa: S603
+    except (OSError, subprocess.SubprocessError) as exc:
+        raise RuntimeError(f"Remote process {command!r} on {hostname} failed: {exc!r}")
+
+
+def stat_remote_files(
+    hostname: str, paths: Iterable[str], timeout: float = 20
+) -> dict[str, datetime.datetime]:
+    """Get the last modification time of many files on a remote host with a
+    single `stat` command.
+
+    Arguments:
+        hostname: The host to connect to.
+        paths: The full paths of the files on the remote host.
+        timeout: The number of seconds to wait for the command to finish.
+
+    Returns:
+        The last modification time of each file, keyed by the given path. Files
+        that could not be accessed are omitted.
+
+    """
+    paths = list(dict.fromkeys(paths))
+    if not paths:
+        return {}
+
+    command = "stat -c '%Y %n' -- " + " ".join(shlex.quote(path) for path in paths)
+    process = run_ssh_command(hostname, command, timeout=timeout)
+    requested = set(paths)
+
+    # `stat` still reports the files it can access if others are missing
+    timestamps: dict[str, datetime.datetime] = {}
+    for line in process.stdout.decode("utf-8").splitlines():
+        mtime, _, path = line.partition(" ")
+        if mtime.isdigit() and path in requested:
+            timestamps[path] = datetime.datetime.fromtimestamp(int(mtime), tz=datetime.timezone.utc)
+
+    if missing := [path for path in paths if path not in timestamps]:
+        LOGGER.debug(
+            "Unable to stat %s files on %s: %s (%s)",
+            len(missing),
+            hostname,
+            missing,
+            process.stderr.decode("utf-8").strip(),
+        )
+
+    return timestamps
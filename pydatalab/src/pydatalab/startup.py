@@ -0,0 +1,223 @@
+"""Tools for measuring the startup cost of the server, i.e., the time taken to
+import its modules (via Python's `-X importtime`) and to create the app, so that
+regressions (e.g., a heavy dependency imported at the top level of a module)
+can be caught by the test suite or with `invoke dev.profile-startup`.
+
+The test suite always checks that none of `STARTUP_FORBIDDEN_MODULES` are
+imported, but only checks the wall-clock budgets, which depend on the machine
+running the tests, when the `PYDATALAB_TEST_STARTUP_BUDGETS` environment
+variable is set.
+
+Profiles are taken in a fresh interpreter, so that they are not affected by any
+modules that have already been imported by the calling process.
+
+"""
+
+import json
+import os
+import subprocess
+import sys
+from typing import Any
+
+from pydantic import BaseModel
+
+__all__ = (
+    "IMPORT_BUDGET",
+    "CREATE_APP_BUDGET",
+    "STARTUP_FORBIDDEN_MODULES",
+    "ImportTiming",
+    "StartupProfile",
+    "profile_startup",
+    "check_startup_budget",
+)
+
+IMPORT_BUDGET: float = 5.0
+"""The default maximum time, in seconds, to import `pydatalab.main`."""
+
+CREATE_APP_BUDGET: float = 10.0
+"""The default maximum time, in seconds, taken by `create_app` with an existing database."""
+
+STARTUP_FORBIDDEN_MODULES: tuple[str, ...] = (
+    "bokeh",
+    "matplotlib",
+    "navani",
+    "nmrglue",
+    "renishawWiRE",
+    "pybaselines",
+    "matador",
+    "langchain_core",
+)
+"""Heavy dependencies (of blocks) that should only be imported when first used."""
+
+_PROFILE_SCRIPT = """
+import json, sys, time
+config_override = json.loads(sys.stdin.read())
+start = time.perf_counter()
+import {module}
+import_time = time.perf_counter() - start
+create_app_time = None
+if config_override is not None:
+    from pydatalab.main import create_app
+    start = time.perf_counter()
+    create_app(config_override, env_file=False)
+    create_app_time = time.perf_counter() - start
+print(json.dumps({{"import_time": import_time, "create_app_time": create_app_time}}))
+"""
+
+
+class ImportTiming(BaseModel):
+    """The time taken to import a single module, as reported by `-X importtime`."""
+
+    module: str
+    """The fully qualified name of the module."""
+
+    self_time: float
+    """The time spent importing the module itself, in seconds."""
+
+    cumulative_time: float
+    """The time spent importing the module and all of the modules it imported, in seconds."""
+
+    depth: int
+    """The nesting level of the import, with 0 for modules imported directly by the profile."""
+
+
+class StartupProfile(BaseModel):
+    """The measured startup cost of the server."""
+
+    import_time: float
+    """The wall-clock time taken to import the profiled module, in seconds."""
+
+    create_app_time: float | None
+    """The wall-clock time taken by `create_app`, in seconds, if it was profiled."""
+
+    imports: list[ImportTiming]
+    """The time taken to import each module, in the order the imports completed."""
+
+    def slowest_imports(self, n: int = 20, cumulative: bool = False) -> list[ImportTiming]:
+        """Return the `n` most expensive imports, by self or cumulative time."""
+        key = "cumulative_time" if cumulative else "self_time"
+        return sorted(self.imports, key=lambda timing: getattr(timing, key), reverse=True)[:n]
+
+    def imported(self, module: str) -> bool:
+        """Return whether the given module (or any submodule of it) was imported."""
+        return any(
+            timing.module == module or timing.module.startswith(f"{module}.")
+            for timing in self.imports
+        )
+
+
+def _parse_importtime(output: str) -> list[ImportTiming]:
+    """Parse the `import time:` lines written to stderr by `-X importtime`."""
+    timings = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        try:
+            self_us, cumulative_us, name = line[len("import time:") :].split("|", 2)
+            self_time, cumulative_time = int(self_us) / 1e6, int(cumulative_us) / 1e6
+        except ValueError:
+            # The header line
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        timings.append(
+            ImportTiming(
+                module=name.strip(),
+                self_time=self_time,
+                cumulative_time=cumulative_time,
+                depth=max(depth, 0),
+            )
+        )
+    return timings
+
+
+def profile_startup(
+    module: str = "pydatalab.main",
+    config_override: dict[str, Any] | None = None,
+    create_app: bool = False,
+    env: dict[str, str] | None = None,
+) -> StartupProfile:
+    """Profile the startup of the server in a fresh interpreter.
+
+    Parameters:
+        module: The module to import.
+        config_override: Config values to create the app with.
+        create_app: Whether to also time `create_app` (which requires a
+            database connection) after the import.
+        env: Any additional environment variables to set for the interpreter.
+
+    Returns:
+        The measured startup profile.
+
+    Raises:
+        RuntimeError: If the import or app creation fails.
+
+    """
+    result = subprocess.run(  # noqa: S603
+        [sys.executable, "-X", "importtime", "-c", _PROFILE_SCRIPT.format(module=module)],
+        input=json.dumps((config_override or {}) if create_app else None, default=str),
+        capture_output=True,
+        text=True,
+        env={**os.environ, **(env or {})},
+        check=False,
+    )
+    if result.returncode != 0:
+        errors = [
+            line for line in result.stderr.splitlines() if not line.startswith("import time:")
+        ]
+        raise RuntimeError(f"Unable to profile the startup of {module}: {os.linesep.join(errors)}")
+
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    return StartupProfile(
+        import_time=timings["import_time"],
+        create_app_time=timings["create_app_time"],
+        imports=_parse_importtime(result.stderr),
+    )
+
+
+def check_startup_budget(
+    profile: StartupProfile,
+    import_budget: float | None = None,
+    create_app_budget: float | None = None,
+    forbidden_modules: tuple[str, ...] = (),
+) -> list[str]:
+    """Check a startup profile against the given budgets.
+
+    Parameters:
+        profile: The profile to check.
+        import_budget: The maximum time allowed for the import, in seconds.
+        create_app_budget: The maximum time allowed for `create_app`, in seconds.
+        forbidden_modules: Modules that must not be imported on startup.
+
+    Returns:
+        A description of each budget that was exceeded.
+
+    """
+    failures = []
+    if import_budget is not None and profile.import_time > import_budget:
+        nested_imports = [
+            timing
+            for timing in profile.slowest_imports(len(profile.imports), cumulative=True)
+            if timing.depth > 0
+        ]
+        slowest = ", ".join(
+            f"{timing.module} ({timing.cumulative_time:.3f} s)" for timing in nested_imports[:5]
+        )
+        failures.append(
+            f"Import took {profile.import_time:.3f} s, more than the budget of "
+            f"{import_budget:.3f} s; slowest imports: {slowest}"
+        )
+    if (
+        create_app_budget is not None
+        and profile.create_app_time is not None
+        and profile.create_app_time > create_app_budget
+    ):
+        failures.append(
+            f"`create_app` took {profile.create_app_time:.3f} s, more than the budget of "
+            f"{create_app_budget:.3f} s"
+        )
+    failures.extend(
+        f"{module} was imported on startup"
+        for module in forbidden_modules
+        if profile.imported(module)
+    )
+    return failures
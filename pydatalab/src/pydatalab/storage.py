@@ -0,0 +1,485 @@
+"""Storage backends for the contents of files attached to items.
+
+Every stored file is identified by a key of the form `<file_id>/<filename>`,
+and has a local path under `CONFIG.FILE_DIRECTORY` (see `file_directory`),
+which is where files are written when they are first saved and where parsers
+read them from.
+
+By default, `CONFIG.FILE_DIRECTORY` is the file store itself (`LocalStorage`).
+If `CONFIG.FILE_STORAGE` is configured, the contents of each file are also
+written to an S3-compatible object store (`S3Storage`) and
+`CONFIG.FILE_DIRECTORY` becomes a local read-through cache: a file that is
+missing locally, or whose local copy is out of date (e.g., because it was
+replaced via another server), is fetched before it is used. A local copy is
+current if it matches the SHA-256 digest recorded for the file in the database,
+which is checked without contacting the object store; files without a recorded
+digest (e.g., live files synced from remotes) are instead checked against the
+ETag of the stored object. This allows several API servers to share the same
+files without a shared filesystem.
+
+"""
+
+import abc
+import hashlib
+import io
+import json
+import os
+import shutil
+from pathlib import Path
+from typing import IO
+
+from pydatalab.config import CONFIG, ObjectStorage
+from pydatalab.logger import LOGGER
+from pydatalab.metrics import record_cache
+
+__all__ = (
+    "StorageBackend",
+    "LocalStorage",
+    "S3Storage",
+    "get_storage",
+    "file_key",
+    "file_directory",
+    "resolve_file_directory",
+    "persist_file",
+    "ensure_local_file",
+    "delete_stored_file",
+    "fetch_stored_files",
+    "StoredFileMismatchError",
+)
+
+_COPY_BUFSIZE = 1024 * 1024
+
+
+def file_directory(file_id: str) -> Path:
+    """Return the directory in which to store the file with the given database ID.
+
+    Files are fanned out over two levels of subdirectories named after a hash of
+    the ID, i.e., `FILE_DIRECTORY/ab/cd/<file_id>/`, so that no single directory
+    holds more than a few thousand entries.
+
+    """
+    file_id = str(file_id)
+    shard = hashlib.sha256(file_id.encode()).hexdigest()
+    return Path(CONFIG.FILE_DIRECTORY) / shard[:2] / shard[2:4] / file_id
+
+
+def legacy_file_directory(file_id: str) -> Path:
+    """Return the directory of a file stored in the original, flat layout,
+    i.e., `FILE_DIRECTORY/<file_id>/`.
+
+    """
+    return Path(CONFIG.FILE_DIRECTORY) / str(file_id)
+
+
+def resolve_file_directory(file_id: str) -> Path:
+    """Return the directory that currently holds the file with the given ID,
+    in either the sharded or the legacy flat layout, defaulting to the sharded
+    layout if neither exists.
+
+    """
+    directory = file_directory(file_id)
+    if not directory.is_dir():
+        legacy_directory = legacy_file_directory(file_id)
+        if legacy_directory.is_dir():
+            return legacy_directory
+    return directory
+
+
+def file_key(location: str | Path) -> str:
+    """Return the storage key, `<file_id>/<filename>`, of the file stored at the
+    given local path (in either layout).
+
+    """
+    location = Path(location)
+    return f"{location.parent.name}/{location.name}"
+
+
+def _key_path(key: str) -> Path:
+    """Return the local path of the file with the given key."""
+    file_id, filename = key.split("/", 1)
+    return resolve_file_directory(file_id) / filename
+
+
+class StoredFileMismatchError(RuntimeError):
+    """Raised when the contents of a stored object do not match the digest
+    recorded for the file in the database.
+
+    """
+
+
+def _cache_record_path(path: Path) -> Path:
+    """Return the path at which the SHA-256 digest of a locally cached copy of an
+    object, and the ETag of the object it was fetched from, are recorded.
+
+    """
+    return path.with_name(f".{path.name}.cache.json")
+
+
+def _mismatch_record_path(path: Path) -> Path:
+    """Return the path at which the last object found not to match the digest
+    expected for a file is recorded, so that it is not fetched repeatedly.
+
+    """
+    return path.with_name(f".{path.name}.mismatch.json")
+
+
+def _read_record(path: Path) -> dict[str, str] | None:
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _hash_file(path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(_COPY_BUFSIZE):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class _RangeReader(io.RawIOBase):
+    """A read-only stream over at most `length` bytes of an open file."""
+
+    def __init__(self, f: IO[bytes], length: int | None):
+        self._f = f
+        self._remaining = length
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        size = len(buffer)
+        if self._remaining is not None:
+            size = min(size, self._remaining)
+        data = self._f.read(size)
+        buffer[: len(data)] = data
+        if self._remaining is not None:
+            self._remaining -= len(data)
+        return len(data)
+
+    def close(self) -> None:
+        self._f.close()
+        super().close()
+
+
+class StorageBackend(abc.ABC):
+    """The interface of a store of file contents, addressed by `file_key`."""
+
+    is_local: bool = False
+    """Whether the local path of each file is the stored file itself."""
+
+    @abc.abstractmethod
+    def open(self, key: str, start: int = 0, end: int | None = None) -> IO[bytes]:
+        """Open a stream of the contents of the file with the given key.
+
+        Parameters:
+            key: The key of the file.
+            start: The offset of the first byte to read.
+            end: The offset of the last byte to read (inclusive), or `None` to
+                read to the end of the file.
+
+        Raises:
+            FileNotFoundError: If there is no file with the given key.
+
+        """
+
+    @abc.abstractmethod
+    def write(self, key: str, stream: IO[bytes]) -> None:
+        """Store the contents of the stream under the given key, replacing any
+        existing file.
+
+        """
+
+    @abc.abstractmethod
+    def size(self, key: str) -> int:
+        """Return the size in bytes of the file with the given key.
+
+        Raises:
+            FileNotFoundError: If there is no file with the given key.
+
+        """
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> None:
+        """Delete the file with the given key, if it exists."""
+
+    @abc.abstractmethod
+    def local_path(self, key: str, sha256: str | None = None) -> Path:
+        """Return a local path at which the current contents of the file with
+        the given key can be read, fetching them first if required.
+
+        Parameters:
+            key: The key of the file.
+            sha256: The expected SHA-256 digest of the file contents, if known,
+                used to check whether an existing local copy is current.
+
+        Raises:
+            FileNotFoundError: If there is no file with the given key.
+
+        """
+
+    def upload(self, key: str, path: str | Path) -> None:
+        """Store the contents of the local file at `path` under the given key."""
+        with open(path, "rb") as f:
+            self.write(key, f)
+
+
+class LocalStorage(StorageBackend):
+    """Stores files directly in `CONFIG.FILE_DIRECTORY`."""
+
+    is_local = True
+
+    def open(self, key: str, start: int = 0, end: int | None = None) -> IO[bytes]:
+        f = open(_key_path(key), "rb")
+        f.seek(start)
+        if start == 0 and end is None:
+            return f
+        return io.BufferedReader(
+            _RangeReader(f, None if end is None else max(end - start + 1, 0)),
+            buffer_size=_COPY_BUFSIZE,
+        )
+
+    def write(self, key: str, stream: IO[bytes]) -> None:
+        path = _key_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_name(f".{path.name}.partial")
+        with open(partial, "wb") as f:
+            shutil.copyfileobj(stream, f, _COPY_BUFSIZE)
+        os.replace(partial, path)
+
+    def size(self, key: str) -> int:
+        return _key_path(key).stat().st_size
+
+    def delete(self, key: str) -> None:
+        _key_path(key).unlink(missing_ok=True)
+
+    def local_path(self, key: str, sha256: str | None = None) -> Path:
+        path = _key_path(key)
+        if not path.is_file():
+            raise FileNotFoundError(f"No stored file with key {key!r}")
+        return path
+
+    def upload(self, key: str, path: str | Path) -> None:
+        # Files are saved in place, so there is only something to do if the path differs
+        if Path(path).resolve() != _key_path(key).resolve():
+            super().upload(key, path)
+
+
+class S3Storage(StorageBackend):
+    """Stores files in a bucket of an S3-compatible object store (e.g., AWS S3,
+    MinIO or Ceph), keeping local copies in `CONFIG.FILE_DIRECTORY` as a
+    read-through cache.
+
+    Credentials are read by `boto3` from its usual sources, e.g., the
+    `AWS_ACCESS_KEY_ID` and `AWS_SECRET_ACCESS_KEY` environment variables.
+
+    """
+
+    def __init__(self, config: ObjectStorage):
+        try:
+            import boto3
+        except ImportError as exc:
+            raise RuntimeError(
+                "The `boto3` package is required to store files in an object store."
+            ) from exc
+
+        self.config = config
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=str(config.endpoint_url) if config.endpoint_url else None,
+            region_name=config.region_name,
+        )
+
+    def _object_key(self, key: str) -> str:
+        return f"{self.config.prefix}{key}"
+
+    def _head(self, key: str) -> dict:
+        from botocore.exceptions import ClientError
+
+        try:
+            return self.client.head_object(Bucket=self.config.bucket, Key=self._object_key(key))
+        except ClientError as exc:
+            if exc.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                raise FileNotFoundError(f"No stored file with key {key!r}") from exc
+            raise
+
+    def open(self, key: str, start: int = 0, end: int | None = None) -> IO[bytes]:
+        return self._get(key, start, end)["Body"]
+
+    def _get(self, key: str, start: int = 0, end: int | None = None) -> dict:
+        from botocore.exceptions import ClientError
+
+        kwargs = {}
+        if start or end is not None:
+            kwargs["Range"] = f"bytes={start}-{'' if end is None else end}"
+        try:
+            response = self.client.get_object(
+                Bucket=self.config.bucket, Key=self._object_key(key), **kwargs
+            )
+        except ClientError as exc:
+            if exc.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                raise FileNotFoundError(f"No stored file with key {key!r}") from exc
+            raise
+        return response
+
+    def write(self, key: str, stream: IO[bytes]) -> None:
+        # Uses multipart uploads for large files, so the stream is never held in memory
+        self.client.upload_fileobj(stream, self.config.bucket, self._object_key(key))
+
+    def size(self, key: str) -> int:
+        return self._head(key)["ContentLength"]
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.config.bucket, Key=self._object_key(key))
+
+    def upload(self, key: str, path: str | Path) -> None:
+        self.client.upload_file(str(path), self.config.bucket, self._object_key(key))
+        # Record the version of the local copy, so that it is not fetched again
+        _cache_record_path(Path(path)).write_text(
+            json.dumps({"sha256": _hash_file(Path(path)), "etag": self._head(key)["ETag"]})
+        )
+        _mismatch_record_path(Path(path)).unlink(missing_ok=True)
+
+    def local_path(self, key: str, sha256: str | None = None) -> Path:
+        """Return the local copy of the file, only fetching it from the object store
+        if it is missing or out of date.
+
+        If `sha256` is given, the local copy is current if it has that digest,
+        without contacting the object store. Otherwise, it is current if it was
+        fetched from (or uploaded as) the current version of the stored object.
+
+        Raises:
+            FileNotFoundError: If there is no file with the given key.
+            StoredFileMismatchError: If the stored object does not have the digest
+                `sha256`. The local copy is then left as-is, and the object is not
+                fetched again until it changes.
+
+        """
+        path = _key_path(key)
+        record = _read_record(_cache_record_path(path)) if path.is_file() else None
+        if record is not None and (
+            record.get("sha256") == sha256
+            if sha256 is not None
+            else record.get("etag") == self._head(key)["ETag"]
+        ):
+            record_cache("object_store", hit=True)
+            return path
+
+        mismatch = _read_record(_mismatch_record_path(path))
+        if (
+            sha256 is not None
+            and mismatch is not None
+            and mismatch.get("sha256") == sha256
+            and mismatch.get("etag") == self._head(key)["ETag"]
+        ):
+            raise StoredFileMismatchError(
+                f"Stored object {key!r} does not have the expected digest {sha256}"
+            )
+
+        record_cache("object_store", hit=False)
+        LOGGER.debug("Fetching %s from the object store", key)
+        response = self._get(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_name(f".{path.name}.partial")
+        digest = hashlib.sha256()
+        with open(partial, "wb") as f:
+            while chunk := response["Body"].read(_COPY_BUFSIZE):
+                digest.update(chunk)
+                f.write(chunk)
+
+        if sha256 is not None and digest.hexdigest() != sha256:
+            partial.unlink()
+            _mismatch_record_path(path).write_text(
+                json.dumps({"sha256": sha256, "etag": response["ETag"]})
+            )
+            raise StoredFileMismatchError(
+                f"Stored object {key!r} has digest {digest.hexdigest()}, expected {sha256}"
+            )
+
+        os.replace(partial, path)
+        _cache_record_path(path).write_text(
+            json.dumps({"sha256": digest.hexdigest(), "etag": response["ETag"]})
+        )
+        _mismatch_record_path(path).unlink(missing_ok=True)
+        return path
+
+
+_STORAGE: tuple[str, StorageBackend] | None = None
+
+
+def get_storage() -> StorageBackend:
+    """Return the storage backend for the current configuration."""
+    global _STORAGE
+    config_key = CONFIG.FILE_STORAGE.json() if CONFIG.FILE_STORAGE else ""
+    if _STORAGE is None or _STORAGE[0] != config_key:
+        backend = S3Storage(CONFIG.FILE_STORAGE) if CONFIG.FILE_STORAGE else LocalStorage()
+        _STORAGE = (config_key, backend)
+    return _STORAGE[1]
+
+
+def persist_file(location: str | Path) -> None:
+    """Store the current contents of the file saved at the given local path,
+    e.g., after it has been uploaded or synced from a remote.
+
+    """
+    get_storage().upload(file_key(location), location)
+
+
+def ensure_local_file(location: str, sha256: str | None = None) -> str:
+    """Return a local path at which the current contents of the file with the
+    given stored location can be read: the location itself, its path in whichever
+    layout currently holds it (e.g., while files are being migrated), or a local
+    copy fetched from the storage backend. If the file cannot be found, or the
+    stored file does not match the given digest, the location is returned as-is.
+
+    Parameters:
+        location: The stored location of the file.
+        sha256: The SHA-256 digest of the file recorded in the database, if any,
+            which an existing local copy must match to be used.
+
+    """
+    storage = get_storage()
+    key = file_key(location)
+    try:
+        return str(storage.local_path(key, sha256=sha256))
+    except FileNotFoundError:
+        return location
+    except StoredFileMismatchError as exc:
+        # Fall back to whatever is stored locally, rather than failing the request
+        LOGGER.error("Using the local copy of %s, which may be out of date: %s", key, exc)
+        return location
+    except Exception as exc:
+        LOGGER.warning("Unable to fetch %s from the file store: %s", key, exc)
+        return location
+
+
+def delete_stored_file(location: str | Path) -> None:
+    """Delete the stored contents of the file with the given local path from the
+    storage backend (the local copy itself is handled by the caller).
+
+    """
+    storage = get_storage()
+    if not storage.is_local:
+        storage.delete(file_key(location))
+        _cache_record_path(Path(location)).unlink(missing_ok=True)
+        _mismatch_record_path(Path(location)).unlink(missing_ok=True)
+
+
+def fetch_stored_files() -> int:
+    """Fetch the current version of every stored file into the local cache, e.g.,
+    so that a backup of `CONFIG.FILE_DIRECTORY` is complete.
+
+    Returns:
+        The number of files checked.
+
+    """
+    from pydatalab.mongo import get_database
+
+    count = 0
+    for file_doc in get_database().files.find(
+        {"location": {"$ne": None}}, projection={"location": 1, "metadata.sha256": 1}
+    ):
+        ensure_local_file(file_doc["location"], (file_doc.get("metadata") or {}).get("sha256"))
+        count += 1
+    return count
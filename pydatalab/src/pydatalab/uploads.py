@@ -0,0 +1,475 @@
+"""Resumable, chunked uploads of large files.
+
+An upload is initiated with the size of the file (`initiate_upload`), then its
+contents are sent as a series of chunks at increasing offsets
+(`write_upload_chunk`), each of which is streamed straight from the request
+into a partial file under `CONFIG.FILE_DIRECTORY`, so that memory use is bounded
+by the read buffer rather than the file size. Each chunk is a separate request,
+so `MAX_CONTENT_LENGTH` applies per chunk rather than to the whole file. Once
+all bytes have been received, `finalize_upload` moves the partial file into
+place and creates (or updates) the file entry.
+
+The state of each upload is stored in the `uploads` collection: if a chunk is
+interrupted, the partial file is truncated back to the end of the last complete
+chunk, and the client can resume from the offset reported by `get_upload`.
+The SHA-256 checksum is computed as chunks arrive and kept in memory by the
+process that received them; if the next chunk arrives at another process (or
+after a restart), the hash is rebuilt from the partial file first.
+
+"""
+
+import datetime
+import hashlib
+import os
+import pathlib
+import threading
+import uuid
+from collections import OrderedDict
+from typing import IO, Any
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from werkzeug.exceptions import BadRequest, Conflict, HTTPException, NotFound
+from werkzeug.utils import secure_filename
+
+from pydatalab.blobs import release_blob, store_blob
+from pydatalab.config import CONFIG
+from pydatalab.file_utils import get_space_available_bytes
+from pydatalab.logger import LOGGER
+from pydatalab.models import File
+from pydatalab.models.uploads import Upload, UploadStatus
+from pydatalab.mongo import flask_mongo, get_database
+from pydatalab.permissions import get_default_permissions
+from pydatalab.prewarm import enqueue_prewarm
+from pydatalab.storage import file_directory, persist_file
+
+__all__ = (
+    "initiate_upload",
+    "get_upload",
+    "write_upload_chunk",
+    "finalize_upload",
+    "abort_upload",
+    "remove_expired_uploads",
+)
+
+UPLOADS_DIRECTORY = ".uploads"
+"""The subdirectory of `CONFIG.FILE_DIRECTORY` in which partial uploads are stored
+(on the same filesystem as the files they become), which is excluded from backups."""
+
+_READ_BUFSIZE = 1024 * 1024
+_WRITER_LEASE = datetime.timedelta(minutes=10)
+_MAX_CACHED_HASHES = 64
+
+_hashes_lock = threading.Lock()
+_hashes: OrderedDict[str, tuple[int, Any]] = OrderedDict()
+
+
+class InsufficientStorage(HTTPException):
+    code = 507
+    description = "Insufficient space available on disk to store the file."
+
+
+def _partial_path(upload_id: str) -> pathlib.Path:
+    return pathlib.Path(CONFIG.FILE_DIRECTORY) / UPLOADS_DIRECTORY / f"{upload_id}.partial"
+
+
+def _expiry() -> datetime.datetime:
+    return datetime.datetime.now(tz=datetime.timezone.utc) + datetime.timedelta(
+        seconds=CONFIG.UPLOAD_EXPIRY
+    )
+
+
+def _public(upload: Upload) -> dict[str, Any]:
+    """The fields of an upload that are returned to the client."""
+    return {
+        "upload_id": upload.upload_id,
+        "filename": upload.filename,
+        "size": upload.size,
+        "offset": upload.received,
+        "status": upload.status,
+        "chunk_size": min(CONFIG.UPLOAD_CHUNK_SIZE, CONFIG.MAX_CONTENT_LENGTH),
+        "expires_at": upload.expires_at,
+    }
+
+
+def _get_hash(upload_id: str, offset: int):
+    """Return the running SHA-256 hash of the first `offset` bytes of the upload,
+    rebuilding it from the partial file if it is not held by this process.
+
+    """
+    with _hashes_lock:
+        cached = _hashes.pop(upload_id, None)
+    if cached is not None and cached[0] == offset:
+        return cached[1]
+
+    LOGGER.debug("Rebuilding checksum of the first %s bytes of upload %s", offset, upload_id)
+    digest = hashlib.sha256()
+    with open(_partial_path(upload_id), "rb") as f:
+        remaining = offset
+        while remaining > 0:
+            data = f.read(min(_READ_BUFSIZE, remaining))
+            if not data:
+                raise RuntimeError(f"Partial file for upload {upload_id} is shorter than {offset}")
+            digest.update(data)
+            remaining -= len(data)
+    return digest
+
+
+def _store_hash(upload_id: str, offset: int, digest) -> None:
+    with _hashes_lock:
+        _hashes[upload_id] = (offset, digest)
+        while len(_hashes) > _MAX_CACHED_HASHES:
+            _hashes.popitem(last=False)
+
+
+def _load_upload(upload_id: str, creator_id: ObjectId) -> Upload:
+    doc = flask_mongo.db.uploads.find_one({"upload_id": upload_id, "creator_id": creator_id})
+    if doc is None:
+        raise NotFound(f"No upload found with ID {upload_id!r}")
+    return Upload(**doc)
+
+
+def initiate_upload(
+    filename: str,
+    size: int,
+    item_id: str,
+    creator_id: ObjectId,
+    last_modified: str | None = None,
+    replace_file: ObjectId | None = None,
+) -> dict[str, Any]:
+    """Start a chunked upload of a file of the given size to an item.
+
+    Parameters:
+        filename: The name of the file being uploaded.
+        size: The total size of the file in bytes.
+        item_id: The ID of the item to attach the file to.
+        creator_id: The ID of the user uploading the file.
+        last_modified: An isoformat datetime for the last modification of the file.
+        replace_file: The database ID of an existing file to replace, if any.
+
+    Returns:
+        The state of the new upload, including its `upload_id`, the `offset`
+        of the next chunk and the suggested `chunk_size`.
+
+    """
+    if size < 0:
+        raise BadRequest("The upload size must be non-negative.")
+
+    if not flask_mongo.db.items.find_one(
+        {"item_id": item_id, **get_default_permissions(user_only=True)}, projection={"_id": 1}
+    ):
+        raise BadRequest(f"item_id is invalid: {item_id}")
+
+    if replace_file is not None and not flask_mongo.db.files.find_one(
+        {"_id": replace_file, **get_default_permissions(user_only=False)}, projection={"_id": 1}
+    ):
+        raise BadRequest(f"No file found to replace with ID {replace_file}")
+
+    if get_space_available_bytes() < size:
+        raise InsufficientStorage(
+            f"Cannot store file: insufficient space available on disk (required: {size // 1024**3} GB). Please contact your datalab administrator."
+        )
+
+    upload = Upload(
+        upload_id=uuid.uuid4().hex,
+        filename=secure_filename(filename),
+        original_name=filename,
+        size=size,
+        item_id=item_id,
+        replace_file=replace_file,
+        creator_id=creator_id,
+        last_modified=last_modified,
+        expires_at=_expiry(),
+    )
+    if not upload.filename:
+        raise BadRequest(f"Invalid filename: {filename!r}")
+
+    partial = _partial_path(upload.upload_id)
+    partial.parent.mkdir(exist_ok=True)
+    partial.touch(exist_ok=False)
+    _store_hash(upload.upload_id, 0, hashlib.sha256())
+
+    flask_mongo.db.uploads.insert_one(upload.dict())
+    LOGGER.debug("Initiated upload %s of %s bytes", upload.upload_id, size)
+    return _public(upload)
+
+
+def get_upload(upload_id: str, creator_id: ObjectId) -> dict[str, Any]:
+    """Return the state of an upload, so that an interrupted client can resume
+    from its `offset`.
+
+    """
+    return _public(_load_upload(upload_id, creator_id))
+
+
+def write_upload_chunk(
+    upload_id: str,
+    offset: int,
+    stream: IO[bytes],
+    length: int,
+    creator_id: ObjectId,
+) -> dict[str, Any]:
+    """Write a chunk of an upload, read from the given stream, at the given offset.
+
+    The offset must match the number of bytes received so far. If the stream
+    ends early or fails, the partial file is truncated back to the offset so
+    that the chunk can be sent again.
+
+    Parameters:
+        upload_id: The ID of the upload.
+        offset: The position of the chunk in the file.
+        stream: The stream to read the chunk from, e.g., the request body.
+        length: The length of the chunk in bytes.
+        creator_id: The ID of the user uploading the file.
+
+    Returns:
+        The updated state of the upload.
+
+    """
+    upload = _load_upload(upload_id, creator_id)
+    if upload.status != UploadStatus.UPLOADING:
+        raise Conflict(f"Upload {upload_id!r} is already being finalized.")
+    if offset != upload.received:
+        raise Conflict(
+            f"Chunk offset {offset} does not match the expected offset {upload.received}."
+        )
+    if offset + length > upload.size:
+        raise BadRequest(
+            f"Chunk of {length} bytes at {offset} exceeds the upload size {upload.size}."
+        )
+
+    # Claim the upload so that concurrent requests cannot write the same range
+    writer = uuid.uuid4().hex
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    claimed = flask_mongo.db.uploads.find_one_and_update(
+        {
+            "upload_id": upload_id,
+            "received": offset,
+            "status": UploadStatus.UPLOADING,
+            "$or": [{"writer": None}, {"writer_expires_at": {"$lt": now}}],
+        },
+        {"$set": {"writer": writer, "writer_expires_at": now + _WRITER_LEASE}},
+    )
+    if claimed is None:
+        raise Conflict(f"Another chunk of upload {upload_id!r} is currently being written.")
+
+    received = 0
+    try:
+        digest = _get_hash(upload_id, offset)
+        with open(_partial_path(upload_id), "r+b") as f:
+            f.seek(offset)
+            f.truncate()
+            while received < length:
+                data = stream.read(min(_READ_BUFSIZE, length - received))
+                if not data:
+                    break
+                f.write(data)
+                digest.update(data)
+                received += len(data)
+        if received != length:
+            raise BadRequest(f"Received {received} of the expected {length} bytes.")
+    except BaseException:
+        with open(_partial_path(upload_id), "r+b") as f:
+            f.truncate(offset)
+        flask_mongo.db.uploads.update_one(
+            {"upload_id": upload_id, "writer": writer}, {"$set": {"writer": None}}
+        )
+        raise
+
+    _store_hash(upload_id, offset + length, digest)
+    updated = flask_mongo.db.uploads.find_one_and_update(
+        {"upload_id": upload_id, "writer": writer},
+        {
+            "$set": {
+                "received": offset + length,
+                "writer": None,
+                "writer_expires_at": None,
+                "expires_at": _expiry(),
+            }
+        },
+        return_document=ReturnDocument.AFTER,
+    )
+    if updated is None:
+        raise Conflict(f"Upload {upload_id!r} was modified while writing the chunk.")
+
+    return _public(Upload(**updated))
+
+
+def finalize_upload(
+    upload_id: str, creator_id: ObjectId, sha256: str | None = None
+) -> dict[str, Any]:
+    """Complete an upload once all of its bytes have been received, moving the
+    file into place and creating (or updating) its database entry.
+
+    Parameters:
+        upload_id: The ID of the upload.
+        creator_id: The ID of the user uploading the file.
+        sha256: The hex digest of the file computed by the client, which must
+            match the checksum of the received data if provided.
+
+    Returns:
+        The saved metadata for the file, with the added key `is_update`.
+
+    """
+    upload = _load_upload(upload_id, creator_id)
+    if upload.received != upload.size:
+        raise Conflict(f"Only {upload.received} of {upload.size} bytes have been received.")
+
+    claimed = flask_mongo.db.uploads.find_one_and_update(
+        {"upload_id": upload_id, "status": UploadStatus.UPLOADING, "writer": None},
+        {"$set": {"status": UploadStatus.FINALIZING}},
+    )
+    if claimed is None:
+        raise Conflict(f"Upload {upload_id!r} is being written to or finalized elsewhere.")
+
+    digest = _get_hash(upload_id, upload.size).hexdigest()
+    if sha256 is not None and sha256.lower() != digest:
+        # Leave the upload in place so that the client can inspect or abort it
+        flask_mongo.db.uploads.update_one(
+            {"upload_id": upload_id}, {"$set": {"status": UploadStatus.UPLOADING}}
+        )
+        raise BadRequest(f"Checksum mismatch: received data has SHA-256 {digest}, not {sha256}.")
+
+    last_modified = (
+        upload.last_modified or datetime.datetime.now(tz=datetime.timezone.utc).isoformat()
+    )
+
+    if upload.replace_file is not None:
+        file_info = _replace_file(upload, digest, last_modified)
+    else:
+        file_info = _save_new_file(upload, digest, last_modified)
+
+    flask_mongo.db.uploads.delete_one({"upload_id": upload_id})
+    with _hashes_lock:
+        _hashes.pop(upload_id, None)
+
+    LOGGER.debug("Finalized upload %s as file %s", upload_id, file_info["_id"])
+    return file_info
+
+
+def _save_new_file(upload: Upload, digest: str, last_modified: str) -> dict[str, Any]:
+    new_file_document = File(
+        name=upload.filename,
+        original_name=upload.original_name,
+        location=None,
+        url_path=None,
+        extension=os.path.splitext(upload.filename)[1],
+        source="uploaded",
+        size=upload.size,
+        item_ids=[upload.item_id],
+        blocks=[],
+        last_modified=last_modified,
+        time_added=last_modified,
+        metadata={"sha256": digest},
+        representation=None,
+        source_server_name=None,
+        source_path=None,
+        last_modified_remote=None,
+        is_live=False,
+        revision=1,
+        creator_ids=[upload.creator_id],
+    )
+
+    result = flask_mongo.db.files.insert_one(new_file_document.dict())
+    inserted_id = result.inserted_id
+
+    new_directory = file_directory(inserted_id)
+    file_location = str(new_directory / upload.filename)
+    new_directory.mkdir(parents=True, exist_ok=False)
+    os.replace(_partial_path(upload.upload_id), file_location)
+    store_blob(file_location, digest)
+    persist_file(file_location)
+
+    updated_file_entry = flask_mongo.db.files.find_one_and_update(
+        {"_id": inserted_id},
+        {"$set": {"location": file_location, "size": os.path.getsize(file_location)}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+    sample_update_result = flask_mongo.db.items.update_one(
+        {"item_id": upload.item_id, **get_default_permissions(user_only=True)},
+        {"$push": {"file_ObjectIds": inserted_id}},
+    )
+    if sample_update_result.modified_count != 1:
+        raise OSError(
+            f"db operation failed when trying to insert new file ObjectId into sample: {upload.item_id}"
+        )
+
+    enqueue_prewarm(inserted_id, upload.item_id, updated_file_entry["name"])
+
+    ret = File(**updated_file_entry).dict()
+    ret.update({"_id": inserted_id, "is_update": False})
+    return ret
+
+
+def _replace_file(upload: Upload, digest: str, last_modified: str) -> dict[str, Any]:
+    previous_file_entry = flask_mongo.db.files.find_one(
+        {"_id": upload.replace_file}, projection={"metadata.sha256": 1}
+    )
+    previous_digest = ((previous_file_entry or {}).get("metadata") or {}).get("sha256")
+
+    updated_file_entry = flask_mongo.db.files.find_one_and_update(
+        {"_id": upload.replace_file, **get_default_permissions(user_only=False)},
+        {
+            "$set": {
+                "last_modified": last_modified,
+                "source": "remote",
+                "is_live": False,
+                "size": upload.size,
+                "metadata.sha256": digest,
+            },
+            "$inc": {"revision": 1},
+        },
+        return_document=ReturnDocument.AFTER,
+    )
+    if not updated_file_entry:
+        raise NotFound(f"No file found to replace with ID {upload.replace_file}")
+
+    file_info = File(**updated_file_entry)
+    if file_info.location is None:
+        raise RuntimeError(f"Cannot update file with no location set: {file_info}")
+
+    # The previous contents may be shared with other files, so are replaced rather than overwritten
+    os.replace(_partial_path(upload.upload_id), file_info.location)
+    store_blob(file_info.location, digest)
+    persist_file(file_info.location)
+    if previous_digest:
+        release_blob(previous_digest)
+
+    enqueue_prewarm(upload.replace_file, (file_info.item_ids or [None])[0], file_info.name)
+
+    ret = file_info.dict()
+    ret.update({"_id": upload.replace_file, "is_update": True})
+    return ret
+
+
+def abort_upload(upload_id: str, creator_id: ObjectId) -> None:
+    """Discard an upload and any data received so far."""
+    upload = _load_upload(upload_id, creator_id)
+    if upload.status != UploadStatus.UPLOADING:
+        raise Conflict(f"Upload {upload_id!r} is being finalized.")
+    flask_mongo.db.uploads.delete_one({"upload_id": upload_id})
+    _partial_path(upload_id).unlink(missing_ok=True)
+    with _hashes_lock:
+        _hashes.pop(upload_id, None)
+
+
+def remove_expired_uploads() -> int:
+    """Discard all incomplete uploads that have not received a chunk within
+    `CONFIG.UPLOAD_EXPIRY` seconds, returning the number removed.
+
+    """
+    uploads = get_database().uploads
+    now = datetime.datetime.now(tz=datetime.timezone.utc)
+    removed = 0
+    for doc in uploads.find(
+        {"expires_at": {"$lt": now}, "status": UploadStatus.UPLOADING},
+        projection={"upload_id": 1},
+    ):
+        if uploads.delete_one({"_id": doc["_id"], "expires_at": {"$lt": now}}).deleted_count:
+            _partial_path(doc["upload_id"]).unlink(missing_ok=True)
+            removed += 1
+
+    if removed:
+        LOGGER.info("Removed %s expired uploads", removed)
+    return removed
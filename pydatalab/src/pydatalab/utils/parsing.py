@@ -0,0 +1,173 @@
+"""Incremental parsing of delimited text files that are appended to while
+they are being measured (e.g., live exports from cyclers or diffractometers).
+
+The parsed rows are cached alongside the byte offset of the end of the last
+complete line, so that when the file grows, only the new tail needs to be
+parsed. The cache is only reused when the file has not shrunk and the bytes
+at the start of the file and just before the cached offset are unchanged;
+otherwise the whole file is parsed again.
+
+"""
+
+import hashlib
+import io
+import os
+import pickle
+from pathlib import Path
+from typing import Any
+
+import pandas as pd
+
+from pydatalab.logger import LOGGER
+from pydatalab.metrics import record_cache
+
+__all__ = ("read_appended_table", "cached_read_csv_kwargs")
+
+_CACHE_VERSION = 1
+_VERIFY_BYTES = 4096
+"""The number of bytes at the start of the file, and before the cached offset,
+that must be unchanged for the cached rows to be reused."""
+
+
+def _digest(f: io.BufferedReader, start: int, end: int) -> str:
+    f.seek(start)
+    return hashlib.sha256(f.read(end - start)).hexdigest()
+
+
+def _load_cache(cache_path: Path, kwargs: dict[str, Any]) -> dict | None:
+    if not cache_path.exists():
+        return None
+    try:
+        with open(cache_path, "rb") as f:
+            cache = pickle.load(f)  # noqa: S301
+    except Exception as exc:
+        LOGGER.warning("Ignoring unreadable parse cache %s: %s", cache_path, exc)
+        return None
+
+    if cache.get("version") != _CACHE_VERSION or cache.get("kwargs") != repr(
+        sorted(kwargs.items())
+    ):
+        return None
+    return cache
+
+
+def cached_read_csv_kwargs(cache_path: str | Path) -> dict[str, Any] | None:
+    """Return the `pandas.read_csv` keyword arguments used to build the given
+    cache, if it exists, so that callers that detect the file format on the
+    first parse can skip detection on subsequent calls.
+
+    """
+    cache_path = Path(cache_path)
+    if not cache_path.exists():
+        return None
+    try:
+        with open(cache_path, "rb") as f:
+            cache = pickle.load(f)  # noqa: S301
+    except Exception:
+        return None
+    if cache.get("version") != _CACHE_VERSION:
+        return None
+    return cache.get("read_csv_kwargs")
+
+
+def _save_cache(cache_path: Path, cache: dict) -> None:
+    partial = cache_path.with_name(cache_path.name + ".partial")
+    with open(partial, "wb") as f:
+        pickle.dump(cache, f)
+    os.replace(partial, cache_path)
+
+
+def _parse_rows(data: bytes, columns: list, kwargs: dict[str, Any]) -> pd.DataFrame:
+    """Parse header-less rows with the columns of an earlier full parse."""
+    kwargs = {k: v for k, v in kwargs.items() if k not in ("skiprows", "header", "names")}
+    return pd.read_csv(io.BytesIO(data), header=None, names=columns, **kwargs)
+
+
+def read_appended_table(
+    location: str | Path, cache_path: str | Path, **read_csv_kwargs
+) -> pd.DataFrame:
+    """Read a delimited text file with `pandas.read_csv`, parsing only the
+    data appended since the previous call where possible.
+
+    Any header lines must be handled by the keyword arguments of the first
+    (full) parse; subsequent calls parse the new rows with the column names
+    found by that parse. A trailing incomplete line (e.g., one that is still
+    being written) is included in the returned data but not cached, so it
+    will be parsed again once complete.
+
+    Parameters:
+        location: The path of the file to read.
+        cache_path: Where to store the parsed rows and offset between calls.
+        **read_csv_kwargs: Keyword arguments to pass to `pandas.read_csv`.
+
+    Returns:
+        The parsed data, with a default integer index.
+
+    """
+    cache_path = Path(cache_path)
+    cache = _load_cache(cache_path, read_csv_kwargs)
+
+    with open(location, "rb") as f:
+        size = f.seek(0, os.SEEK_END)
+
+        if cache is not None:
+            offset = cache["offset"]
+            head_end = min(offset, _VERIFY_BYTES)
+            tail_start = max(offset - _VERIFY_BYTES, 0)
+            if (
+                size < offset
+                or _digest(f, 0, head_end) != cache["head_digest"]
+                or _digest(f, tail_start, offset) != cache["tail_digest"]
+            ):
+                LOGGER.debug(
+                    "File %s has changed before offset %s; parsing again", location, offset
+                )
+                cache = None
+        record_cache("appended_table", hit=cache is not None)
+
+        if cache is None:
+            offset = 0
+            f.seek(0)
+            new_data = f.read()
+        else:
+            f.seek(offset)
+            new_data = f.read(size - offset)
+
+    complete_end = new_data.rfind(b"\n") + 1
+    complete, incomplete = new_data[:complete_end], new_data[complete_end:]
+
+    if cache is None:
+        # A file without any complete lines is parsed as a whole, and not cached
+        if not complete:
+            return pd.read_csv(io.BytesIO(incomplete), **read_csv_kwargs)
+        rows = pd.read_csv(io.BytesIO(complete), **read_csv_kwargs)
+        columns = list(rows.columns)
+    else:
+        columns = cache["columns"]
+        rows = cache["data"]
+        if complete.strip():
+            rows = pd.concat(
+                [rows, _parse_rows(complete, columns, read_csv_kwargs)], ignore_index=True
+            )
+
+    if complete:
+        new_offset = offset + complete_end
+        with open(location, "rb") as f:
+            cache = {
+                "version": _CACHE_VERSION,
+                "kwargs": repr(sorted(read_csv_kwargs.items())),
+                "read_csv_kwargs": read_csv_kwargs,
+                "offset": new_offset,
+                "head_digest": _digest(f, 0, min(new_offset, _VERIFY_BYTES)),
+                "tail_digest": _digest(f, max(new_offset - _VERIFY_BYTES, 0), new_offset),
+                "columns": columns,
+                "data": rows,
+            }
+        _save_cache(cache_path, cache)
+
+    if incomplete.strip():
+        rows = pd.concat(
+            [rows, _parse_rows(incomplete, columns, read_csv_kwargs)], ignore_index=True
+        )
+
+    return rows
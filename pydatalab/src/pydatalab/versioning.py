@@ -86,6 +86,7 @@ def save_version_snapshot(
     refcode: str,
     action: VersionAction = VersionAction.MANUAL_SAVE,
     permission_filter: dict | None = None,
+    item: dict | None = None,
 ) -> tuple[dict, int]:
     """Save the current state of an item as a version snapshot.
 
@@ -102,6 +103,8 @@ def save_version_snapshot(
             - VersionAction.RESTORED: Version created after restoring to a previous version
         permission_filter: Optional MongoDB filter to apply for permission checking.
             If None, no permission check is performed.
+        item: Optional raw item document to snapshot, e.g., as returned by a
+            `find_one_and_update`, to avoid re-reading the item from the database.
 
     Returns:
         Tuple of (response_dict, status_code)
@@ -112,12 +115,14 @@ def save_version_snapshot(
     if len(refcode.split(":")) != 2:
         refcode = f"{CONFIG.IDENTIFIER_PREFIX}:{refcode}"
 
-    # Build query with optional permission filter
-    query = {"refcode": refcode}
-    if permission_filter:
-        query.update(permission_filter)
+    if item is None:
+        # Build query with optional permission filter
+        query = {"refcode": refcode}
+        if permission_filter:
+            query.update(permission_filter)
+
+        item = flask_mongo.db.items.find_one(query)
 
-    item = flask_mongo.db.items.find_one(query)
     if not item:
         raise NotFound(f"Item {refcode} not found.")
 
@@ -45,6 +45,52 @@ def generate_schemas(_):
 dev.add_task(generate_schemas)
 
 
+@task
+def profile_startup(
+    _,
+    create_app: bool = False,
+    top: int = 20,
+    import_budget: float | None = None,
+    create_app_budget: float | None = None,
+):
+    """Profiles the time taken to import the server (and optionally, to create the app
+    with the configured database), listing the most expensive imports and exiting with
+    an error if any of the given budgets (in seconds) are exceeded.
+
+    """
+    from pydatalab.startup import (
+        STARTUP_FORBIDDEN_MODULES,
+        check_startup_budget,
+        profile_startup,
+    )
+
+    profile = profile_startup(create_app=create_app)
+
+    print(f"{'self [s]':>10} {'cumulative [s]':>15}  module")
+    for timing in profile.slowest_imports(top, cumulative=True):
+        print(
+            f"{timing.self_time:10.3f} {timing.cumulative_time:15.3f}  "
+            f"{'  ' * timing.depth}{timing.module}"
+        )
+    print(f"\nImport: {profile.import_time:.3f} s")
+    if profile.create_app_time is not None:
+        print(f"create_app: {profile.create_app_time:.3f} s")
+
+    failures = check_startup_budget(
+        profile,
+        import_budget=float(import_budget) if import_budget else None,
+        create_app_budget=float(create_app_budget) if create_app_budget else None,
+        forbidden_modules=STARTUP_FORBIDDEN_MODULES,
+    )
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if failures:
+        raise SystemExit(1)
+
+
+dev.add_task(profile_startup)
+
+
 @task
 def create_mongo_indices(_):
     """This task creates the default MongoDB indices defined in the main code."""
@@ -178,6 +224,18 @@ def repair_files(_, resync: bool = True):
 admin.add_task(repair_files)
 
 
+@task
+def repair_item_edges(_):
+    """Rebuild the `item_edges` collection from the relationships stored on each item."""
+    from pydatalab.item_edges import rebuild_item_edges
+
+    count = rebuild_item_edges()
+    print(f"Rebuilt item edges for {count} items")
+
+
+admin.add_task(repair_item_edges)
+
+
 @task
 def add_missing_refcodes(_):
     """Generates refcodes for any items that are missing them."""
@@ -196,6 +254,23 @@ def add_missing_refcodes(_):
 migration.add_task(add_missing_refcodes)
 
 
+@task
+def migrate_file_layout(_, batch_size: int = 1000, max_batches: int | None = None):
+    """Moves any files stored directly under `FILE_DIRECTORY/<file_id>/` into the
+    sharded layout, `FILE_DIRECTORY/ab/cd/<file_id>/`, in batches. The server can
+    keep running during the migration, and an interrupted migration can be resumed
+    by running this task again.
+
+    """
+    from pydatalab.file_utils import migrate_file_layout
+
+    moved = migrate_file_layout(batch_size=batch_size, max_batches=max_batches)
+    print(f"Moved {moved} file directories into the sharded layout")
+
+
+migration.add_task(migrate_file_layout)
+
+
 def _check_id(id=None, base_url=None, api_key=None):
     """Checks the given item ID served at the base URL and logs the result."""
     import requests
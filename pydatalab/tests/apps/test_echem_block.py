@@ -1,11 +1,13 @@
 from pathlib import Path
 
+import pandas as pd
 import pytest
 from navani.echem import echem_file_loader
 
 from pydatalab.apps.echem.utils import (
     compute_gpcl_differential,
     filter_df_by_cycle_index,
+    load_appendable_echem_file,
     reduce_echem_cycle_sampling,
 )
 
@@ -81,3 +83,41 @@ def test_plot(reduced_echem_dataframe):
     differential_df = compute_gpcl_differential(reduced_echem_dataframe, mode="dV/dQ")
     layout = double_axes_echem_plot([differential_df], mode="dV/dQ")
     assert layout
+
+
+def test_load_appendable_echem_file(tmp_path, monkeypatch):
+    """Checks that a growing Ivium export is parsed incrementally and gives
+    the same result as parsing the whole file with navani."""
+    location = tmp_path / "live.txt"
+    cache_path = tmp_path / "live.RAW_ROWS.pkl"
+    lines = ["time /s\tI /mA\tE /V\n"] + [
+        f"{t}\t{1.0 if (t // 10) % 2 else -1.0}\t{3.0 + 0.01 * t}\n" for t in range(40)
+    ]
+
+    location.write_text("".join(lines[:21]))
+    df = load_appendable_echem_file(location, cache_path)
+    assert len(df) == 20
+    assert cache_path.exists()
+
+    # Append new rows, including a partially written final line
+    with open(location, "a") as f:
+        f.write("".join(lines[21:]) + "40\t1.0")
+
+    parsed_chunks = []
+    read_csv = pd.read_csv
+
+    def _read_csv(buffer, *args, **kwargs):
+        parsed_chunks.append(buffer.getvalue())
+        return read_csv(buffer, *args, **kwargs)
+
+    monkeypatch.setattr("pydatalab.utils.parsing.pd.read_csv", _read_csv)
+    df = load_appendable_echem_file(location, cache_path)
+    monkeypatch.undo()
+
+    assert parsed_chunks == ["".join(lines[21:]).encode(), b"40\t1.0"]
+    assert len(df) == 41
+    pd.testing.assert_frame_equal(df, echem_file_loader(location), check_dtype=False)
+
+    # Rewriting the file invalidates the cached rows
+    location.write_text("".join(lines[:11]))
+    assert len(load_appendable_echem_file(location, cache_path)) == 10
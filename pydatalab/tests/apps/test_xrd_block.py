@@ -14,6 +14,23 @@ def test_load(f):
         assert all(y in df.columns for y in y_options)
 
 
+def test_load_incremental(tmp_path):
+    source = Path(__file__).parent.parent.parent / "example_data" / "XRD" / "example_bmb.xye"
+    lines = source.read_text().splitlines(keepends=True)
+    location = tmp_path / "live.xye"
+
+    location.write_text("".join(lines[: len(lines) // 2]))
+    partial_df, _, _ = XRDBlock.load_pattern(location, incremental=True)
+    assert location.with_suffix(".XRD_ROWS.pkl").exists()
+
+    location.write_text("".join(lines))
+    df, _, _ = XRDBlock.load_pattern(location, incremental=True)
+    expected_df, _, _ = XRDBlock.load_pattern(source)
+    assert len(partial_df) < len(df)
+    assert len(df) == len(expected_df)
+    assert (df["intensity"].values == expected_df["intensity"].values).all()
+
+
 def test_event():
     block = XRDBlock(item_id="test-id")
     assert block.data["wavelength"] == 1.54060
@@ -3,14 +3,21 @@ Does not test backup scheduling.
 
 """
 
+import io
+import json
 import shutil
+import subprocess
 import tarfile
 import time
+from pathlib import Path
 
 import pytest
+from bson import ObjectId
 
-from pydatalab.backups import create_backup
-from pydatalab.config import BackupStrategy
+from pydatalab.backups import create_backup, prune_object_store, restore_snapshot, take_snapshot
+from pydatalab.blobs import blob_path
+from pydatalab.config import CONFIG, BackupStrategy
+from pydatalab.storage import file_directory
 
 # Check whether mongodump (and mongorestore by extension) is present; skip backup tests if not
 mongodump_present = pytest.mark.skipif(
@@ -18,6 +25,36 @@ mongodump_present = pytest.mark.skipif(
 )
 
 
+def _upload_file(client, filepath: Path, item_id: str) -> str:
+    """Upload a file to the given item and return its database ID."""
+    with open(filepath, "rb") as f:
+        response = client.post(
+            "/upload-file/",
+            buffered=True,
+            content_type="multipart/form-data",
+            data={
+                "item_id": item_id,
+                "file": [(f, filepath.name)],
+                "type": "application/octet-stream",
+                "replace_file": "null",
+                "relativePath": "null",
+            },
+        )
+    assert response.status_code == 201
+    return response.json["file_id"]
+
+
+def _clear_deployment(database) -> None:
+    """Remove all stored files and the collections describing them."""
+    for path in Path(CONFIG.FILE_DIRECTORY).iterdir():
+        if path.is_dir():
+            shutil.rmtree(path)
+        else:
+            path.unlink()
+    for collection in ("items", "files", "blobs"):
+        database.drop_collection(collection)
+
+
 @mongodump_present
 def test_backup_creation(
     client, database, default_filepath, insert_default_sample, default_sample, tmp_path
@@ -38,6 +75,7 @@ def test_backup_creation(
             },
         )
     assert response.status_code == 201
+    file_doc = database.files.find_one({"_id": ObjectId(response.json["file_id"])})
 
     strategy = BackupStrategy(
         hostname=None,
@@ -64,9 +102,302 @@ def test_backup_creation(
     backup = backups.pop()
 
     with tarfile.open(backup, mode="r:gz") as tar:
-        members = {m.name for m in tar.getmembers()}
+        members = {m.name: m for m in tar.getmembers()}
 
     assert any(m.startswith("mongodb/") for m in members)
-    # Only one file is backed up but the tar file reports a "member" for the containing directory too
-    assert sum(1 for m in members if m.startswith("files/")) == 2
+    # Only one file is backed up, but it is stored both at its own path and as a blob that
+    # the path is hardlinked to, and the tar file reports a "member" for each containing
+    # directory too
+    stored_paths = [
+        Path(file_doc["location"]).relative_to(CONFIG.FILE_DIRECTORY),
+        blob_path(file_doc["metadata"]["sha256"]).relative_to(CONFIG.FILE_DIRECTORY),
+    ]
+    assert {m for m in members if m.startswith("files/")} == {
+        f"files/{path.as_posix()}"
+        for stored in stored_paths
+        for path in (stored, *stored.parents[:-1])
+    }
+    # Files are stored in the sharded `ab/cd/<file_id>/` layout, so with the blob store
+    # there are 3 + 4 members
+    assert (
+        stored_paths[0].parts[:3]
+        == file_directory(file_doc["_id"]).relative_to(CONFIG.FILE_DIRECTORY).parts
+    )
+    assert sum(1 for m in members if m.startswith("files/")) == 7
+    # The contents are archived once, with the other path as a link to them
+    assert sorted(members[f"files/{path.as_posix()}"].islnk() for path in stored_paths) == [
+        False,
+        True,
+    ]
     assert sum(1 for m in members if m.startswith("config/")) == 1
+
+
+@mongodump_present
+@pytest.mark.parametrize(
+    "suffix",
+    [
+        ".tar",
+        ".tar.gz",
+        pytest.param(
+            ".tar.zst",
+            marks=pytest.mark.skipif(shutil.which("zstd") is None, reason="zstd not installed"),
+        ),
+    ],
+)
+def test_backup_restore_round_trip(
+    client,
+    database,
+    default_filepath,
+    insert_default_sample,
+    default_sample,
+    tmp_path,
+    monkeypatch,
+    suffix,
+):
+    """Test that a snapshot of an item with an uploaded file can be restored
+    into an empty deployment, with the file linked to its blob again.
+
+    """
+    import pydatalab.backups
+
+    # Split the database archive across several tar members
+    monkeypatch.setattr(pydatalab.backups, "_ARCHIVE_PART_SIZE", 1024)
+
+    file_id = _upload_file(client, default_filepath, default_sample.item_id)
+    file_doc = database.files.find_one({"_id": ObjectId(file_id)})
+    location = Path(file_doc["location"])
+
+    snapshot = tmp_path / f"snapshot{suffix}"
+    take_snapshot(snapshot)
+
+    _clear_deployment(database)
+    assert not location.exists()
+
+    restore_snapshot(snapshot)
+
+    assert database.items.find_one({"item_id": default_sample.item_id})
+    assert database.files.find_one({"_id": ObjectId(file_id)})["location"] == str(location)
+    assert location.read_bytes() == default_filepath.read_bytes()
+    assert location.samefile(blob_path(file_doc["metadata"]["sha256"]))
+
+    # Restoring over the existing deployment should also work
+    restore_snapshot(snapshot)
+    assert location.read_bytes() == default_filepath.read_bytes()
+
+
+@mongodump_present
+def test_restore_legacy_layout_snapshot(
+    client, database, default_filepath, insert_default_sample, default_sample, tmp_path
+):
+    """Test that a snapshot of files in the legacy flat layout can be restored and
+    then migrated into the sharded layout.
+
+    """
+    from pydatalab.file_utils import migrate_file_layout
+
+    file_id = _upload_file(client, default_filepath, default_sample.item_id)
+    location = Path(database.files.find_one({"_id": ObjectId(file_id)})["location"])
+
+    # Move the file back into the flat layout, as stored by older versions
+    legacy_directory = Path(CONFIG.FILE_DIRECTORY) / file_id
+    shutil.move(location.parent, legacy_directory)
+    database.files.update_one(
+        {"_id": ObjectId(file_id)},
+        {"$set": {"location": str(legacy_directory / default_filepath.name)}},
+    )
+
+    snapshot = tmp_path / "snapshot.tar.gz"
+    take_snapshot(snapshot)
+    _clear_deployment(database)
+    restore_snapshot(snapshot)
+
+    assert (legacy_directory / default_filepath.name).exists()
+    assert not location.exists()
+
+    assert migrate_file_layout(batch_size=1) >= 1
+    assert not legacy_directory.exists()
+    assert database.files.find_one({"_id": ObjectId(file_id)})["location"] == str(location)
+    assert location.read_bytes() == default_filepath.read_bytes()
+
+    file_response = client.get(f"/files/{file_id}/{default_filepath.name}")
+    assert file_response.status_code == 200
+    file_response.close()
+
+
+@mongodump_present
+def test_incremental_backup_creation(
+    client, database, default_filepath, insert_default_sample, default_sample, tmp_path
+):
+    """Test that incremental backups store unchanged files only once."""
+    with open(default_filepath, "rb") as f:
+        response = client.post(
+            "/upload-file/",
+            buffered=True,
+            content_type="multipart/form-data",
+            data={
+                "item_id": default_sample.item_id,
+                "file": [(f, default_filepath.name)],
+                "type": "application/octet-stream",
+                "replace_file": "null",
+                "relativePath": "null",
+            },
+        )
+    assert response.status_code == 201
+
+    strategy = BackupStrategy(
+        hostname=None,
+        location=tmp_path,
+        frequency="5 4 * * *",
+        retention=2,
+        incremental=True,
+    )
+
+    create_backup(strategy)
+    objects = set((tmp_path / "objects").glob("*/*"))
+    assert objects
+
+    time.sleep(1)
+    create_backup(strategy)
+    time.sleep(1)
+    create_backup(strategy)
+
+    snapshots = sorted((tmp_path / "snapshots").iterdir())
+    assert len(snapshots) == 2
+
+    manifests = [json.loads((snapshot / "manifest.json").read_text()) for snapshot in snapshots]
+    assert manifests[0]["files"] == manifests[1]["files"]
+    assert len(manifests[1]["files"]) == 1
+    assert manifests[1]["mongodb"]
+
+    # Every referenced object is present, and nothing else is kept
+    referenced = {
+        entry["sha256"]
+        for manifest in manifests
+        for section in ("files", "mongodb")
+        for entry in manifest[section].values()
+    }
+    assert {path.name for path in (tmp_path / "objects").glob("*/*")} == referenced
+
+
+@mongodump_present
+def test_incremental_backup_restore_round_trip(
+    client,
+    database,
+    default_filepath,
+    insert_default_sample,
+    default_sample,
+    tmp_path,
+    monkeypatch,
+):
+    """Test that the latest incremental snapshot can be restored into an empty
+    deployment once older snapshots have been pruned.
+
+    """
+    import pydatalab.backups
+
+    # Split the database archive across several objects
+    monkeypatch.setattr(pydatalab.backups, "_ARCHIVE_PART_SIZE", 1024)
+
+    file_id = _upload_file(client, default_filepath, default_sample.item_id)
+    file_doc = database.files.find_one({"_id": ObjectId(file_id)})
+    location = Path(file_doc["location"])
+
+    strategy = BackupStrategy(
+        hostname=None,
+        location=tmp_path,
+        frequency="5 4 * * *",
+        retention=1,
+        incremental=True,
+    )
+    create_backup(strategy)
+    time.sleep(1)
+    create_backup(strategy)
+
+    (snapshot,) = (tmp_path / "snapshots").iterdir()
+    manifest = json.loads((snapshot / "manifest.json").read_text())
+    assert len(manifest["mongodb"]) > 1
+    assert all(name.startswith("dump.archive.") for name in manifest["mongodb"])
+
+    _clear_deployment(database)
+    restore_snapshot(snapshot)
+
+    assert database.items.find_one({"item_id": default_sample.item_id})
+    assert database.files.find_one({"_id": ObjectId(file_id)})["location"] == str(location)
+    assert location.read_bytes() == default_filepath.read_bytes()
+    assert location.samefile(blob_path(file_doc["metadata"]["sha256"]))
+
+
+def test_prune_object_store(tmp_path):
+    object_store = tmp_path / "objects"
+    for digest in ("aa11", "bb22"):
+        (object_store / digest[:2]).mkdir(parents=True)
+        (object_store / digest[:2] / digest).write_bytes(b"")
+
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(
+        json.dumps(
+            {"files": {"a.txt": {"sha256": "aa11", "size": 0, "mtime_ns": 0}}, "mongodb": {}}
+        )
+    )
+
+    assert prune_object_store(object_store, [manifest]) == 1
+    assert [path.name for path in object_store.glob("*/*")] == ["aa11"]
+
+
+def test_transient_files_are_not_backed_up(tmp_path):
+    """Partial uploads and regenerable caches should be left out of snapshots."""
+    from pydatalab.backups import _add_tree_to_store, _backup_filter, _excluded_from_backup
+
+    file_directory = tmp_path / "files"
+    (file_directory / ".uploads").mkdir(parents=True)
+    (file_directory / ".uploads" / "upload.partial").write_bytes(b"half a file")
+    (file_directory / ".derivatives" / "file_id" / "0").mkdir(parents=True)
+    (file_directory / ".derivatives" / "file_id" / "0" / "web.webp").write_bytes(b"image")
+    (file_directory / ".blobs" / "ab" / "abc.derivatives").mkdir(parents=True)
+    (file_directory / ".blobs" / "ab" / "abc.derivatives" / "web.webp").write_bytes(b"image")
+    (file_directory / ".blobs" / "ab" / "abc.RAW_PARSED.pkl").write_bytes(b"parsed")
+    (file_directory / ".blobs" / "ab" / "abc").write_bytes(b"a whole file")
+    (file_directory / "ab" / "cd" / "file_id").mkdir(parents=True)
+    (file_directory / "ab" / "cd" / "file_id" / "data.txt").write_bytes(b"a whole file")
+
+    entries, _ = _add_tree_to_store(
+        file_directory, tmp_path / "objects", exclude=_excluded_from_backup
+    )
+    assert list(entries) == [".blobs/ab/abc", "ab/cd/file_id/data.txt"]
+
+    with tarfile.open(tmp_path / "snapshot.tar", mode="w") as tar:
+        for path in file_directory.iterdir():
+            tar.add(path, arcname=f"files/{path.name}", filter=_backup_filter)
+    with tarfile.open(tmp_path / "snapshot.tar", mode="r") as tar:
+        assert {name for name in tar.getnames() if tar.getmember(name).isfile()} == {
+            "files/.blobs/ab/abc",
+            "files/ab/cd/file_id/data.txt",
+        }
+
+
+@mongodump_present
+@pytest.mark.skipif(shutil.which("zstd") is None, reason="zstd not installed")
+def test_zstd_backup_creation(client, database, insert_default_sample, tmp_path):
+    """Test that a zstd-compressed backup streams the database archive into the snapshot."""
+    strategy = BackupStrategy(
+        hostname=None,
+        location=tmp_path,
+        frequency="5 4 * * *",
+        retention=1,
+        compression="zstd",
+    )
+    create_backup(strategy)
+
+    (backup,) = tmp_path.glob("*")
+    assert backup.name.endswith(".tar.zst")
+
+    decompressed = subprocess.run(  # noqa: S603
+        ["zstd", "--decompress", "--stdout", str(backup)],  # noqa: S607
+        capture_output=True,
+        check=True,
+    ).stdout
+    with tarfile.open(fileobj=io.BytesIO(decompressed), mode="r") as tar:
+        members = {m.name for m in tar.getmembers()}
+
+    assert "mongodb/dump.archive.00000" in members
+    assert "config/config.json" in members
@@ -647,10 +647,18 @@ def test_create_sample_with_example_files(
     if block_type == "xrd":
         assert response.json["new_block_data"]["computed"]["peak_data"] is not None
 
-    # For the media block, check that a TIF image is present and can be saved correctly
+    # For the media block, check that the TIF image is served as a web-friendly derivative,
+    # and that the block can be saved correctly
     if block_type == "media":
         block_data = response.json["new_block_data"]
-        assert "b64_encoded_image" in block_data
+        assert "b64_encoded_image" not in block_data
+
+        file_response = admin_client.get(
+            f"/files/{file_id}/{example_file.name}", query_string={"derivative": "web"}
+        )
+        assert file_response.status_code == 200
+        assert file_response.mimetype in ("image/webp", "image/png")
+        file_response.close()
 
         response = admin_client.get(f"/get-item-data/{sample_id}")
         assert response.status_code == 200
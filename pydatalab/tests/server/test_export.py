@@ -29,7 +29,7 @@ def sample_collection(database, user_id):
 
 @pytest.fixture
 def mock_scheduler():
-    with patch("pydatalab.routes.v0_1.export.export_scheduler") as mock_sched:
+    with patch("pydatalab.routes.v0_1.export.job_scheduler") as mock_sched:
         mock_sched.add_job = MagicMock(return_value=None)
         yield mock_sched
 
@@ -366,3 +366,105 @@ def test_start_item_export_with_related_items(
 
     database.export_tasks.delete_one({"task_id": data["task_id"]})
     database.items.delete_one({"item_id": related_item["item_id"]})
+
+
+def test_identical_exports_reuse_archive(
+    client, sample_collection, mock_scheduler, database, monkeypatch
+):
+    """Test that an export of unchanged content reuses the existing archive,
+    and that archives over the disk quota are cleaned up.
+
+    """
+    from pydatalab.config import CONFIG
+    from pydatalab.export import cleanup_export_artifacts
+    from pydatalab.routes.v0_1.export import _do_export
+
+    collection_id = sample_collection["collection_id"]
+
+    response = client.post(f"/collections/{collection_id}/export")
+    assert response.status_code == 202
+    first_task_id = response.json["task_id"]
+    _do_export(**mock_scheduler.add_job.call_args.kwargs["kwargs"])
+
+    first_task = database.export_tasks.find_one({"task_id": first_task_id})
+    assert first_task["status"] == ExportStatus.READY
+    assert first_task["content_digest"]
+    assert Path(first_task["file_path"]).name == f"{first_task['content_digest']}.eln"
+
+    mock_scheduler.add_job.reset_mock()
+    response = client.post(f"/collections/{collection_id}/export")
+    assert response.status_code == 200
+    assert response.json["download_url"] == f"/exports/{response.json['task_id']}/download"
+    assert not mock_scheduler.add_job.called
+
+    second_task = database.export_tasks.find_one({"task_id": response.json["task_id"]})
+    assert second_task["status"] == ExportStatus.READY
+    assert second_task["file_path"] == first_task["file_path"]
+
+    # Changing the exported content should produce a new archive
+    database.collections.update_one(
+        {"collection_id": collection_id}, {"$set": {"title": "A new title"}}
+    )
+    response = client.post(f"/collections/{collection_id}/export")
+    assert response.status_code == 202
+    assert mock_scheduler.add_job.called
+
+    monkeypatch.setattr(CONFIG, "EXPORT_ARTIFACT_MAX_BYTES", 0)
+    cleanup_export_artifacts()
+    assert not os.path.exists(first_task["file_path"])
+    for task_id in (first_task_id, second_task["task_id"]):
+        assert database.export_tasks.find_one({"task_id": task_id})["status"] == (
+            ExportStatus.EXPIRED
+        )
+
+    database.export_tasks.delete_many({"collection_id": collection_id})
+
+
+def test_export_cleanup_is_periodic(app):
+    from pydatalab.scheduler import job_scheduler
+
+    assert job_scheduler._periodic["cleanup-export-artifacts"]["func"] == (
+        "pydatalab.export:cleanup_export_artifacts"
+    )
+
+
+def test_block_edits_invalidate_reused_archive(
+    client, insert_default_sample, mock_scheduler, database
+):
+    """Test that adding, editing or deleting a block, which does not change the
+    item version, produces a new archive rather than reusing a stale one.
+
+    """
+    from pydatalab.routes.v0_1.export import _do_export
+
+    item_id = insert_default_sample.item_id
+
+    def _export() -> int:
+        mock_scheduler.add_job.reset_mock()
+        response = client.post(f"/items/{item_id}/export", json={})
+        if response.status_code == 202:
+            _do_export(**mock_scheduler.add_job.call_args.kwargs["kwargs"])
+        return response.status_code
+
+    response = client.post(
+        "/add-data-block/", json={"block_type": "comment", "item_id": item_id, "index": 0}
+    )
+    assert response.status_code == 200
+    block_data = response.json["new_block_obj"]
+
+    assert _export() == 202
+    assert _export() == 200
+
+    block_data["freeform_comment"] = "An edited comment"
+    response = client.post("/update-block/", json={"block_data": block_data})
+    assert response.status_code == 200
+    assert _export() == 202
+    assert _export() == 200
+
+    response = client.post(
+        "/delete-block/", json={"item_id": item_id, "block_id": block_data["block_id"]}
+    )
+    assert response.status_code == 200
+    assert _export() == 202
+
+    database.export_tasks.delete_many({"item_id": item_id})
@@ -31,11 +31,15 @@ def test_generate_ro_crate_metadata():
         },
     ]
 
-    with patch("pydatalab.export.flask_mongo.db.files.find_one") as mock_find:
-        mock_find.return_value = {"name": "test_file.txt"}
+    with patch("pydatalab.export.flask_mongo.db.files.find") as mock_find:
+        mock_find.return_value = [
+            {"_id": ObjectId("507f1f77bcf86cd799439011"), "name": "test_file.txt"}
+        ]
 
         metadata = generate_ro_crate_metadata(collection_data, child_items)
 
+    mock_find.assert_called_once()
+
     assert metadata["@context"] == "https://w3id.org/ro/crate/1.1/context"
     assert isinstance(metadata["@graph"], list)
 
@@ -49,6 +53,7 @@ def test_generate_ro_crate_metadata():
     assert sample1["@type"] == "Dataset"
     assert sample1["name"] == "Sample 1"
     assert sample1["identifier"] == "sample1"
+    assert sample1["hasPart"] == [{"@id": "./sample1/test_file.txt"}]
 
 
 def test_create_eln_file_items(database, tmp_path, user_id):
@@ -183,3 +188,55 @@ def test_create_eln_file_collection_not_found(tmp_path):
     output_file = tmp_path / "test.eln"
     with pytest.raises(ValueError, match="Collection .* not found"):
         create_eln_file("nonexistent_collection", str(output_file))
+
+
+def test_create_eln_file_streams_attached_files(database, tmp_path, user_id):
+    """Check that attached files are written into the archive from their stored
+    location, with already-compressed formats stored without recompression.
+
+    """
+    file_dir = tmp_path / "files"
+    file_dir.mkdir()
+    text_file = file_dir / "data.txt"
+    text_file.write_text("1 2 3\n" * 1000)
+    image_file = file_dir / "image.png"
+    image_file.write_bytes(b"\x89PNG" + bytes(1000))
+
+    file_ids = [ObjectId(), ObjectId()]
+    database.files.insert_many(
+        [
+            {"_id": file_ids[0], "name": "data.txt", "location": str(text_file)},
+            {"_id": file_ids[1], "name": "image.png", "location": str(image_file)},
+        ]
+    )
+    sample_id = ObjectId()
+    database.items.insert_one(
+        {
+            "_id": sample_id,
+            "item_id": "test_sample_with_files",
+            "name": "Test Sample",
+            "type": "samples",
+            "refcode": "test:FILES1",
+            "file_ObjectIds": file_ids,
+            "creator_ids": [user_id],
+        }
+    )
+
+    output_path = tmp_path / "test_files.eln"
+
+    try:
+        create_eln_file(output_path, item_id="test_sample_with_files")
+
+        with zipfile.ZipFile(output_path, "r") as zf:
+            prefix = "test_sample_with_files/test_sample_with_files"
+            text_info = zf.getinfo(f"{prefix}/data.txt")
+            image_info = zf.getinfo(f"{prefix}/image.png")
+
+            assert text_info.compress_type == zipfile.ZIP_DEFLATED
+            assert image_info.compress_type == zipfile.ZIP_STORED
+            assert zf.read(text_info) == text_file.read_bytes()
+            assert zf.read(image_info) == image_file.read_bytes()
+
+    finally:
+        database.items.delete_one({"_id": sample_id})
+        database.files.delete_many({"_id": {"$in": file_ids}})
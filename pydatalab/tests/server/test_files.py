@@ -1,8 +1,12 @@
+import hashlib
 import shutil
+from pathlib import Path
 
 import pytest
+from bson import ObjectId
 
 from pydatalab.config import CONFIG
+from pydatalab.storage import file_directory
 
 
 def test_too_large_upload(client, tmpdir, insert_default_sample, default_sample):  # pylint: disable=unused-argument
@@ -71,7 +75,7 @@ def test_get_file_and_delete(client, default_filepath, default_sample):
 
     assert (
         response.json["item_data"]["files"][0]["location"]
-        == f"{CONFIG.FILE_DIRECTORY}/{file_id}/{default_filepath.name}"
+        == f"{file_directory(file_id)}/{default_filepath.name}"
     )
     assert response.json["item_data"]["files"][0]["name"] == default_filepath.name
     assert response.json["item_data"]["files"][0]["size"] == 2465718
@@ -252,3 +256,308 @@ def test_file_download_sudo_mode(
     assert response.status_code == 200
     assert len(response.data) == 2465718
     response.close()
+
+
+@pytest.mark.skipif(shutil.which("tree") is None, reason="`tree` utility not installed locally")
+def test_add_remote_files_to_sample(client, database, insert_default_sample, default_sample):  # pylint: disable=unused-argument
+    response = client.post(
+        "/add-remote-files-to-sample/",
+        json={
+            "item_id": default_sample.item_id,
+            "toplevel_name": "example_data",
+            "paths": ["/XRD/example_bmb.xye"],
+            "glob": "/XRD/Scan_C*.xrdml",
+        },
+    )
+    assert response.status_code == 201
+    assert response.json["status"] == "success"
+    assert response.json["errors"] == []
+    file_ids = response.json["file_ids"]
+    assert len(file_ids) == 11
+    assert [f["name"] for f in response.json["file_information"]][:2] == [
+        "example_bmb.xye",
+        "Scan_C1.xrdml",
+    ]
+    assert all(f["location"] for f in response.json["file_information"])
+
+    item = database.items.find_one({"item_id": default_sample.item_id})
+    assert [str(_id) for _id in item["file_ObjectIds"][-11:]] == file_ids
+
+    response = client.post(
+        "/add-remote-files-to-sample/",
+        json={
+            "item_id": default_sample.item_id,
+            "toplevel_name": "example_data",
+            "paths": ["/XRD/missing.xye"],
+        },
+    )
+    assert response.status_code == 404
+
+    for paths, glob in (
+        (["/XRD/example\x00bmb.xye"], None),
+        (["/XRD/.."], None),
+        (["/XRD/../XRD/example_bmb.xye"], None),
+        ([], "/XRD\x00/*.xrdml"),
+    ):
+        response = client.post(
+            "/add-remote-files-to-sample/",
+            json={
+                "item_id": default_sample.item_id,
+                "toplevel_name": "example_data",
+                "paths": paths,
+                "glob": glob,
+            },
+        )
+        assert response.status_code == 400, (paths, glob)
+
+
+def test_chunked_upload(client, default_filepath, insert_default_sample, default_sample):  # pylint: disable=unused-argument
+    contents = default_filepath.read_bytes()
+    response = client.post(
+        "/uploads/",
+        json={
+            "item_id": default_sample.item_id,
+            "filename": default_filepath.name,
+            "size": len(contents),
+        },
+    )
+    assert response.status_code == 201
+    upload_id = response.json["upload_id"]
+    assert response.json["offset"] == 0
+
+    chunk_size = len(contents) // 3 + 1
+    response = client.put(
+        f"/uploads/{upload_id}?offset=0",
+        data=contents[:chunk_size],
+        content_type="application/octet-stream",
+    )
+    assert response.status_code == 200
+    assert response.json["offset"] == chunk_size
+
+    # Chunks must be sent at the current offset, which can be queried to resume
+    response = client.put(
+        f"/uploads/{upload_id}?offset=0",
+        data=contents[:chunk_size],
+        content_type="application/octet-stream",
+    )
+    assert response.status_code == 409
+    assert client.get(f"/uploads/{upload_id}").json["offset"] == chunk_size
+
+    # Finalizing before all chunks have been received fails
+    assert client.post(f"/uploads/{upload_id}/finalize", json={}).status_code == 409
+
+    offset = chunk_size
+    while offset < len(contents):
+        response = client.put(
+            f"/uploads/{upload_id}?offset={offset}",
+            data=contents[offset : offset + chunk_size],
+            content_type="application/octet-stream",
+        )
+        assert response.status_code == 200
+        offset = response.json["offset"]
+
+    response = client.post(
+        f"/uploads/{upload_id}/finalize",
+        json={"sha256": hashlib.sha256(contents).hexdigest()},
+    )
+    assert response.status_code == 201
+    assert response.json["is_update"] is False
+    file_information = response.json["file_information"]
+    assert file_information["size"] == len(contents)
+    assert file_information["metadata"]["sha256"] == hashlib.sha256(contents).hexdigest()
+
+    response = client.get(f"/files/{response.json['file_id']}/{default_filepath.name}")
+    assert response.status_code == 200
+    assert response.data == contents
+    response.close()
+
+    assert client.get(f"/uploads/{upload_id}").status_code == 404
+
+
+def test_chunked_upload_limits_chunk_size(client, insert_default_sample, default_sample):  # pylint: disable=unused-argument
+    response = client.post(
+        "/uploads/",
+        json={
+            "item_id": default_sample.item_id,
+            "filename": "large.bin",
+            "size": CONFIG.MAX_CONTENT_LENGTH * 2,
+        },
+    )
+    assert response.status_code == 201
+    upload_id = response.json["upload_id"]
+    assert response.json["chunk_size"] <= CONFIG.MAX_CONTENT_LENGTH
+
+    response = client.put(
+        f"/uploads/{upload_id}?offset=0",
+        data=b"\0" * (CONFIG.MAX_CONTENT_LENGTH + 1),
+        content_type="application/octet-stream",
+    )
+    assert response.status_code == 413
+    assert client.get(f"/uploads/{upload_id}").json["offset"] == 0
+
+    assert client.delete(f"/uploads/{upload_id}").status_code == 200
+    assert client.get(f"/uploads/{upload_id}").status_code == 404
+
+
+def test_uploads_are_deduplicated(client, default_filepath, insert_default_sample, default_sample):  # pylint: disable=unused-argument
+    from pydatalab.blobs import blob_path
+
+    file_informations = []
+    for _ in range(2):
+        with open(default_filepath, "rb") as f:
+            response = client.post(
+                "/upload-file/",
+                buffered=True,
+                content_type="multipart/form-data",
+                data={
+                    "item_id": default_sample.item_id,
+                    "file": [(f, default_filepath.name)],
+                    "type": "application/octet-stream",
+                    "replace_file": "null",
+                    "relativePath": "null",
+                },
+            )
+        assert response.status_code == 201
+        file_informations.append(response.json["file_information"])
+
+    digest = hashlib.sha256(default_filepath.read_bytes()).hexdigest()
+    assert [info["metadata"]["sha256"] for info in file_informations] == [digest, digest]
+    blob = blob_path(digest)
+    assert all(Path(info["location"]).samefile(blob) for info in file_informations)
+
+    # The stored contents are only removed with the last file that references them
+    for ind, info in enumerate(file_informations):
+        response = client.post(
+            "/delete-file-from-sample/",
+            json={"item_id": default_sample.item_id, "file_id": info["_id"]},
+        )
+        assert response.status_code == 200
+        assert not Path(info["location"]).exists()
+        assert blob.exists() == (ind == 0)
+
+
+def test_legacy_file_layout_migration(
+    client, database, default_filepath, insert_default_sample, default_sample
+):  # pylint: disable=unused-argument
+    from pydatalab.file_utils import migrate_file_layout
+
+    with open(default_filepath, "rb") as f:
+        response = client.post(
+            "/upload-file/",
+            buffered=True,
+            content_type="multipart/form-data",
+            data={
+                "item_id": default_sample.item_id,
+                "file": [(f, default_filepath.name)],
+                "type": "application/octet-stream",
+                "replace_file": "null",
+                "relativePath": "null",
+            },
+        )
+    assert response.status_code == 201
+    file_id = response.json["file_information"]["_id"]
+    location = Path(response.json["file_information"]["location"])
+    assert location.parent == file_directory(file_id)
+
+    # Move the file back into the flat layout, as stored by older versions
+    legacy_directory = Path(CONFIG.FILE_DIRECTORY) / file_id
+    shutil.move(location.parent, legacy_directory)
+    database.files.update_one(
+        {"_id": ObjectId(file_id)},
+        {"$set": {"location": str(legacy_directory / default_filepath.name)}},
+    )
+
+    file_response = client.get(f"/files/{file_id}/{default_filepath.name}")
+    assert file_response.status_code == 200
+    file_response.close()
+
+    assert migrate_file_layout(batch_size=1) >= 1
+    assert not legacy_directory.exists()
+    assert database.files.find_one({"_id": ObjectId(file_id)})["location"] == str(location)
+    assert location.exists()
+
+    file_response = client.get(f"/files/{file_id}/{default_filepath.name}")
+    assert file_response.status_code == 200
+    file_response.close()
+
+
+def test_get_file_caching_and_ranges(
+    client, default_filepath, insert_default_sample, default_sample
+):  # pylint: disable=unused-argument
+    with open(default_filepath, "rb") as f:
+        response = client.post(
+            "/upload-file/",
+            buffered=True,
+            content_type="multipart/form-data",
+            data={
+                "item_id": default_sample.item_id,
+                "file": [(f, default_filepath.name)],
+                "type": "application/octet-stream",
+                "replace_file": "null",
+                "relativePath": "null",
+            },
+        )
+    assert response.status_code == 201
+    file_information = response.json["file_information"]
+    url = f"/files/{file_information['_id']}/{default_filepath.name}"
+    contents = default_filepath.read_bytes()
+
+    response = client.get(url)
+    assert response.status_code == 200
+    etag, _ = response.get_etag()
+    assert etag == file_information["metadata"]["sha256"]
+    assert response.cache_control.private
+    assert response.cache_control.no_cache
+    assert response.accept_ranges == "bytes"
+    response.close()
+
+    response = client.get(url, headers={"If-None-Match": f'"{etag}"'})
+    assert response.status_code == 304
+    assert not response.data
+
+    response = client.get(url, headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.data == contents[100:200]
+    assert response.content_range.to_header() == f"bytes 100-199/{len(contents)}"
+    response.close()
+
+    # A URL for the current revision can be cached indefinitely
+    response = client.get(url, query_string={"revision": file_information["revision"]})
+    assert response.status_code == 200
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age > 0
+    response.close()
+
+    response = client.get(url, query_string={"revision": file_information["revision"] + 1})
+    assert not response.cache_control.immutable
+    response.close()
+
+
+def test_uploads_are_prewarmed(
+    app, client, database, example_data_dir, insert_default_sample, default_sample
+):  # pylint: disable=unused-argument
+    from pydatalab.derivatives import derivative_directory
+    from pydatalab.prewarm import prewarm_file
+
+    filepath = example_data_dir / "media" / "grey_group_logo.tif"
+    with open(filepath, "rb") as f:
+        response = client.post(
+            "/upload-file/",
+            buffered=True,
+            content_type="multipart/form-data",
+            data={
+                "item_id": default_sample.item_id,
+                "file": [(f, filepath.name)],
+                "type": "application/octet-stream",
+                "replace_file": "null",
+                "relativePath": "null",
+            },
+        )
+    assert response.status_code == 201
+    file_id = response.json["file_information"]["_id"]
+    assert database.jobs.count_documents({"job_id": f"prewarm-{file_id}"}) == 1
+
+    with app.app_context():
+        assert "media" in prewarm_file(file_id, default_sample.item_id)
+    file_doc = database.files.find_one({"_id": ObjectId(file_id)})
+    assert derivative_directory(file_doc).is_dir()
@@ -80,3 +80,15 @@ def test_info_endpoint_includes_max_upload_bytes(client, app):
     assert isinstance(attributes["max_upload_bytes"], int)
     assert attributes["max_upload_bytes"] > 0
     assert attributes["max_upload_bytes"] == 10 * 1000 * 1000
+
+
+def test_metrics_endpoint_is_admin_only(admin_client, client, unauthenticated_client, monkeypatch):
+    from pydatalab.config import CONFIG
+
+    pytest.importorskip("prometheus_client")
+    monkeypatch.setattr(CONFIG, "METRICS_ENABLED", True)
+    monkeypatch.setattr(CONFIG, "METRICS_TOKEN", None)
+
+    assert unauthenticated_client.get("/metrics").status_code == 401
+    assert client.get("/metrics").status_code == 401
+    assert admin_client.get("/metrics").status_code == 200
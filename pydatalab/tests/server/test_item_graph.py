@@ -153,3 +153,129 @@ def test_single_starting_material(admin_client, client):
     ).json
     assert len(admin_graph["nodes"]) == 4
     assert len(admin_graph["edges"]) == 3
+
+
+def test_graph_max_depth(client):
+    """Check that the neighbourhood of an item follows lineage in both directions
+    up to the requested depth.
+
+    """
+    chain = ["depth-0", "depth-1", "depth-2", "depth-3", "depth-4"]
+    for ind, item_id in enumerate(chain):
+        constituents = []
+        if ind > 0:
+            constituents = [
+                {"item": {"item_id": chain[ind - 1], "type": "samples"}, "quantity": None}
+            ]
+        sample = Sample(item_id=item_id, synthesis_constituents=constituents)
+        creation = client.post("/new-sample/", json={"new_sample_data": json.loads(sample.json())})
+        assert creation.status_code == 201
+
+    graph = client.get("/item-graph/depth-2").json
+    assert {n["data"]["id"] for n in graph["nodes"]} == {"depth-1", "depth-2", "depth-3"}
+    assert len(graph["edges"]) == 2
+
+    graph = client.get("/item-graph/depth-2?max_depth=2").json
+    assert {n["data"]["id"] for n in graph["nodes"]} == set(chain)
+    assert len(graph["edges"]) == 4
+
+    graph = client.get("/item-graph/depth-0?max_depth=3").json
+    assert {n["data"]["id"] for n in graph["nodes"]} == set(chain[:4])
+    assert len(graph["edges"]) == 3
+
+    graph = client.get("/item-graph/depth-0?max_depth=0").json
+    assert {n["data"]["id"] for n in graph["nodes"]} == {"depth-0"}
+
+    graph = client.get("/item-graph/depth-0?max_depth=1000000").json
+    assert {n["data"]["id"] for n in graph["nodes"]} == set(chain)
+
+    assert client.get("/item-graph/depth-0?max_depth=-1").status_code == 400
+    assert client.get("/item-graph/not-a-real-item").status_code == 404
+
+
+def test_item_edges_follow_relationships(client, database):
+    """Check that the `item_edges` collection tracks relationships as items are
+    created, saved and deleted, and that it can be rebuilt from scratch.
+
+    """
+    from pydatalab.item_edges import rebuild_item_edges
+
+    for item_id, constituents in (
+        ("edge-parent", []),
+        (
+            "edge-child",
+            [{"item": {"item_id": "edge-parent", "type": "samples"}, "quantity": None}],
+        ),
+    ):
+        sample = Sample(item_id=item_id, synthesis_constituents=constituents)
+        creation = client.post("/new-sample/", json={"new_sample_data": json.loads(sample.json())})
+        assert creation.status_code == 201
+
+    child = database.items.find_one({"item_id": "edge-child"})
+    edges = list(database.item_edges.find({"source": child["_id"]}))
+    assert len(edges) == 1
+    assert edges[0]["target_item_id"] == "edge-parent"
+    assert edges[0]["relation"] == "parent"
+
+    response = client.get("/get-item-data/edge-parent")
+    assert response.json["child_items"] == ["edge-child"]
+
+    num_edges = database.item_edges.count_documents({})
+    assert rebuild_item_edges(database=database) == database.items.count_documents({})
+    assert database.item_edges.count_documents({}) == num_edges
+
+    response = client.post("/delete-sample/", json={"item_id": "edge-child"})
+    assert response.status_code == 200
+    assert database.item_edges.count_documents({"source": child["_id"]}) == 0
+
+    response = client.get("/get-item-data/edge-parent")
+    assert response.json["child_items"] == []
+
+
+def test_whole_graph_filters_and_clusters(client):
+    """Check that the cached whole-deployment graph is invalidated by item writes,
+    and can be filtered, clustered and limited on the server.
+
+    """
+    children = [f"family-child-{ind}" for ind in range(4)]
+    for item_id, constituents in [("family-parent", [])] + [
+        (child, [{"item": {"item_id": "family-parent", "type": "samples"}, "quantity": None}])
+        for child in children
+    ]:
+        sample = Sample(item_id=item_id, synthesis_constituents=constituents)
+        creation = client.post("/new-sample/", json={"new_sample_data": json.loads(sample.json())})
+        assert creation.status_code == 201
+
+    graph = client.get("/item-graph").json
+    node_ids = {n["data"]["id"] for n in graph["nodes"]}
+    assert {"family-parent", *children} <= node_ids
+    assert not graph["truncated"]
+
+    graph = client.get("/item-graph?max_family_size=3").json
+    node_ids = {n["data"]["id"] for n in graph["nodes"]}
+    assert not node_ids & set(children)
+    family = next(n for n in graph["nodes"] if n["data"]["id"] == "Family: family-parent")
+    assert family["data"]["count"] == 4
+    assert {"id": "family-parent->Family: family-parent", "value": 4}.items() <= next(
+        e["data"] for e in graph["edges"] if e["data"]["target"] == "Family: family-parent"
+    ).items()
+
+    graph = client.get("/item-graph?limit=1").json
+    assert len(graph["nodes"]) == 1
+    assert graph["truncated"]
+    assert graph["total_nodes"] > 1
+    assert client.get("/item-graph?limit=0").status_code == 400
+    assert client.get("/item-graph?max_family_size=0").status_code == 400
+    assert client.get("/item-graph?limit=-1").status_code == 400
+
+    graph = client.get("/item-graph?types=cells").json
+    assert all(n["data"]["type"] == "cells" for n in graph["nodes"])
+
+    graph = client.get("/item-graph?date_to=1900-01-01").json
+    assert graph["nodes"] == []
+    assert client.get("/item-graph?date_from=yesterday").status_code == 400
+
+    response = client.post("/delete-sample/", json={"item_id": children[0]})
+    assert response.status_code == 200
+    graph = client.get("/item-graph").json
+    assert children[0] not in {n["data"]["id"] for n in graph["nodes"]}
@@ -585,6 +585,41 @@ class TestAutoVersioning:
         item = flask_mongo.db.items.find_one({"refcode": refcode})
         assert item["version"] == original_version + 1
 
+    def test_save_item_stale_version_conflicts(self, client, sample_with_version):
+        """Test that saving with an outdated version is rejected rather than overwriting."""
+        from pydatalab.mongo import flask_mongo
+
+        refcode = sample_with_version.refcode
+        original_version = sample_with_version.version
+
+        item_data = sample_with_version.dict(exclude_unset=False)
+        item_data["description"] = "First editor"
+        response = client.post(
+            "/save-item/", json={"item_id": sample_with_version.item_id, "data": item_data}
+        )
+        assert response.status_code == 200
+        assert response.json["version"] == original_version + 1
+
+        # A second editor still holding the original version should be refused
+        item_data["description"] = "Second editor"
+        response = client.post(
+            "/save-item/", json={"item_id": sample_with_version.item_id, "data": item_data}
+        )
+        assert response.status_code == 409
+        assert response.json["status"] == "error"
+
+        item = flask_mongo.db.items.find_one({"refcode": refcode})
+        assert item["description"] == "First editor"
+        assert item["version"] == original_version + 1
+
+        # Saving against the returned version succeeds
+        item_data["version"] = original_version + 1
+        response = client.post(
+            "/save-item/", json={"item_id": sample_with_version.item_id, "data": item_data}
+        )
+        assert response.status_code == 200
+        assert response.json["version"] == original_version + 2
+
 
 class TestActionFields:
     """Tests specifically for validating action field values across different operations."""
@@ -0,0 +1,122 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from pydatalab.models.jobs import JobStatus
+from pydatalab.scheduler import job_scheduler, report_progress
+
+# A queue with no configured workers, so that jobs are only run when requested by the tests
+QUEUE = "test-queue"
+
+RUN_ORDER: list[str] = []
+
+
+def _record(name: str):
+    report_progress(0.5, f"Recording {name}")
+    RUN_ORDER.append(name)
+
+
+def _fail(message: str):
+    raise RuntimeError(message)
+
+
+@pytest.fixture
+def jobs(app, database):
+    RUN_ORDER.clear()
+    yield database.jobs
+    database.jobs.delete_many({"queue": QUEUE})
+
+
+def test_jobs_run_in_priority_order(jobs):
+    job_scheduler.add_job(_record, args=["low"], queue=QUEUE, priority=0)
+    job_scheduler.add_job(_record, args=["high"], queue=QUEUE, priority=10)
+    job_id = job_scheduler.add_job(_record, kwargs={"name": "middle"}, queue=QUEUE, priority=5)
+
+    while job_scheduler.run_next(QUEUE):
+        pass
+
+    assert RUN_ORDER == ["high", "middle", "low"]
+
+    job = job_scheduler.get_job(job_id)
+    assert job["status"] == JobStatus.COMPLETED
+    assert job["attempts"] == 1
+    assert job["progress"] == 1.0
+    assert job["progress_message"] == "Recording middle"
+    assert job["lease_owner"] is None
+
+
+def test_duplicate_job_ids_are_not_queued_twice(jobs):
+    job_scheduler.add_job(_record, args=["first"], job_id="dedupe", queue=QUEUE)
+    job_scheduler.add_job(_record, args=["second"], job_id="dedupe", queue=QUEUE)
+    assert jobs.count_documents({"job_id": "dedupe"}) == 1
+
+    assert job_scheduler.run_next(QUEUE)
+    assert not job_scheduler.run_next(QUEUE)
+    assert RUN_ORDER == ["first"]
+
+    # Once completed, a job with the same ID can be queued again
+    job_scheduler.add_job(_record, args=["third"], job_id="dedupe", queue=QUEUE)
+    assert job_scheduler.run_next(QUEUE)
+    assert RUN_ORDER == ["first", "third"]
+
+
+def test_failed_jobs_are_retried(jobs):
+    job_id = job_scheduler.add_job(_fail, args=["oops"], queue=QUEUE, max_attempts=2, retry_delay=0)
+
+    assert job_scheduler.run_next(QUEUE)
+    job = job_scheduler.get_job(job_id)
+    assert job["status"] == JobStatus.PENDING
+    assert job["error_message"] == "oops"
+
+    assert job_scheduler.run_next(QUEUE)
+    job = job_scheduler.get_job(job_id)
+    assert job["status"] == JobStatus.FAILED
+    assert job["attempts"] == 2
+
+    assert not job_scheduler.run_next(QUEUE)
+
+
+def test_expired_leases_can_be_claimed(jobs):
+    job_id = job_scheduler.add_job(_record, args=["recovered"], queue=QUEUE, max_attempts=2)
+
+    # Simulate a worker that claimed the job and then died
+    jobs.update_one(
+        {"job_id": job_id},
+        {
+            "$set": {
+                "status": JobStatus.RUNNING,
+                "lease_owner": "dead-worker",
+                "lease_expires_at": datetime.now(tz=timezone.utc) - timedelta(minutes=1),
+                "attempts": 1,
+            }
+        },
+    )
+
+    assert job_scheduler.run_next(QUEUE)
+    assert RUN_ORDER == ["recovered"]
+    assert job_scheduler.get_job(job_id)["status"] == JobStatus.COMPLETED
+
+
+def test_workers_are_restarted_after_fork(app, monkeypatch):
+    """Worker threads started before a fork (e.g., by gunicorn's `--preload`) do not
+    run in the child process, so each process should start its own.
+    """
+    import os
+
+    from pydatalab.config import CONFIG
+
+    started = []
+
+    def _start():
+        started.append(os.getpid())
+        job_scheduler._pid = os.getpid()
+        job_scheduler._threads.append(object())
+
+    monkeypatch.setattr(CONFIG, "TESTING", False)
+    monkeypatch.setattr(job_scheduler, "_threads", [object()])
+    monkeypatch.setattr(job_scheduler, "_pid", -1)
+    monkeypatch.setattr(job_scheduler, "_start", _start)
+
+    job_scheduler.ensure_started()
+    job_scheduler.ensure_started()
+    assert started == [os.getpid()]
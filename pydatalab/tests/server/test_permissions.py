@@ -443,3 +443,17 @@ def test_admin_super_user_mode(admin_client, client):
     # Admin can still PATCH/DELETE user's item without ?sudo=1 (non-GET methods unaffected)
     response = admin_client.patch(f"/items/{user_refcode}/permissions", json={"creators": []})
     assert response.status_code == 200
+
+
+def test_server_permissions(app):
+    """Test that `server_permissions()` opens up permissions only within its scope."""
+    from pydatalab.permissions import get_default_permissions, server_permissions
+
+    with app.test_request_context("/"):
+        restricted = get_default_permissions(user_only=False)
+        assert restricted != {}
+
+        with server_permissions():
+            assert get_default_permissions(user_only=False) == {}
+
+        assert get_default_permissions(user_only=False) == restricted
@@ -6,10 +6,13 @@ from pathlib import Path
 import pytest
 
 from pydatalab.config import CONFIG, RemoteFilesystem
+from pydatalab.models.jobs import JobStatus
 from pydatalab.remote_filesystems import (
     get_directory_structure,
     get_directory_structures,
+    refresh_directory_structure,
 )
+from pydatalab.scheduler import job_scheduler
 
 """The Unix `tree` utility is required for many of these tests,
 this variable checks whether it is installed locally."""
@@ -19,6 +22,17 @@ if _ == 0:
     TREE_AVAILABLE = True
 
 
+def _wait_for_refresh(name: str, timeout: float = 30) -> None:
+    """Wait for the background refresh job of the given remote to finish."""
+    start = time.monotonic()
+    while time.monotonic() - start < timeout:
+        job = job_scheduler.get_job(f"refresh-remote-{name}")
+        if job and job["status"] in (JobStatus.COMPLETED, JobStatus.FAILED):
+            return
+        time.sleep(0.1)
+    raise TimeoutError(f"Refresh of {name} did not finish within {timeout} s")
+
+
 @pytest.mark.skipif(not TREE_AVAILABLE, reason="`tree` utility not installed locally")
 def test_get_directory_structure_local(random_string):
     """Check that the file directory cache is used on the second
@@ -29,12 +43,14 @@ def test_get_directory_structure_local(random_string):
     test_dir = RemoteFilesystem(**{"path": Path(__file__).parent.parent, "name": dir_name})
     dir_structure = get_directory_structure(test_dir)
     dir_structure.pop("last_updated")
+    dir_structure.pop("age")
     assert dir_structure
     assert dir_structure.pop("status") == "updated"
     assert all(k in dir_structure for k in ("type", "name", "contents"))
     assert all(k in dir_structure["contents"][0] for k in ("type", "name", "size", "time"))
     dir_structure_cached = get_directory_structure(test_dir)
     last_updated_cached = dir_structure_cached.pop("last_updated")
+    assert dir_structure_cached.pop("age") >= 0
     assert dir_structure_cached.pop("status") == "cached"
     assert dir_structure_cached == dir_structure
     assert last_updated_cached
@@ -53,11 +69,18 @@ def test_get_directory_structure_local(random_string):
     assert last_updated_cached == last_updated_cached_again
 
     try:
-        # Set the minimum cache age to 0 and make sure that this does indeed invalidate the cache
+        # Set the minimum cache age to 0 and make sure that this does indeed invalidate the cache,
+        # while serving the current cache until the background refresh has finished
         # Need to sleep to allow microsecond precision differences
         CONFIG.REMOTE_CACHE_MIN_AGE = 0
         time.sleep(1)
-        dir_structure_cached_again = get_directory_structure(test_dir, invalidate_cache=True)
+        dir_structure_stale = get_directory_structure(test_dir, invalidate_cache=True)
+        assert dir_structure_stale["status"] == "refreshing"
+        assert dir_structure_stale["last_updated"] == last_updated_cached
+        assert dir_structure_stale["age"] >= 1
+
+        _wait_for_refresh(dir_name)
+        dir_structure_cached_again = get_directory_structure(test_dir, invalidate_cache=False)
         last_updated_cached_again = dir_structure_cached_again.pop("last_updated")
         assert last_updated_cached != last_updated_cached_again
 
@@ -137,3 +160,171 @@ def test_scp_escape_spaces():
         _escape_spaces_scp_path(r"ssh://host:path_without_spaces")
         == r"ssh://host:path_without_spaces"
     )
+
+
+@pytest.mark.skipif(not TREE_AVAILABLE, reason="`tree` utility not installed locally")
+def test_directory_index_rescans_changed_directories(random_string, tmp_path, monkeypatch):
+    """Check that a refresh only rescans directories whose mtime has changed,
+    and that single directories can be listed lazily.
+
+    """
+    import pydatalab.remote_filesystems
+
+    (tmp_path / "a" / "b").mkdir(parents=True)
+    (tmp_path / "a" / "file.txt").write_text("a")
+    (tmp_path / "c").mkdir()
+    test_dir = RemoteFilesystem(name=random_string, path=tmp_path)
+
+    dir_structure = get_directory_structure(test_dir)
+    assert dir_structure["status"] == "updated"
+    assert {entry["name"] for entry in dir_structure["contents"]} == {"a", "c"}
+
+    rescanned: list[list[str]] = []
+    list_directories = pydatalab.remote_filesystems._list_directories
+
+    def _record_list_directories(directory, paths):
+        rescanned.append(list(paths))
+        return list_directories(directory, paths)
+
+    monkeypatch.setattr(pydatalab.remote_filesystems, "_list_directories", _record_list_directories)
+    time.sleep(1)
+    (tmp_path / "a" / "b" / "new.txt").write_text("b")
+    assert refresh_directory_structure(test_dir)
+
+    # Only the top level (whose mtime is not reported by `tree`) and the changed directory
+    assert rescanned == [["/", "/a/b/"]]
+
+    listing = get_directory_structure(test_dir, path="/a/b/")
+    assert listing["path"] == "/a/b/"
+    assert [entry["name"] for entry in listing["contents"]] == ["new.txt"]
+
+    listing = get_directory_structure(test_dir, path="a")
+    assert {entry["name"] for entry in listing["contents"]} == {"b", "file.txt"}
+    assert all("contents" not in entry for entry in listing["contents"])
+
+
+def test_refresh_lease_is_exclusive(database, random_string):
+    """Check that only one process can hold the lease on refreshing a remote,
+    and that an expired lease can be taken over.
+
+    """
+    from pydatalab.remote_filesystems import _acquire_refresh_lease, _release_refresh_lease
+
+    test_dir = RemoteFilesystem(name=random_string, path="this_directory_does_not_exist")
+    assert _acquire_refresh_lease(test_dir, "first")
+    assert not _acquire_refresh_lease(test_dir, "second")
+
+    # Another owner cannot release the lease
+    _release_refresh_lease(test_dir, "second")
+    assert not _acquire_refresh_lease(test_dir, "second")
+
+    database.remoteFilesystems.update_one(
+        {"name": random_string},
+        {"$set": {"_lock.expires_at": datetime.datetime.now(tz=datetime.timezone.utc)}},
+    )
+    assert _acquire_refresh_lease(test_dir, "second")
+    _release_refresh_lease(test_dir, "second")
+    assert _acquire_refresh_lease(test_dir, "first")
+
+
+def test_stat_remote_files_is_batched(monkeypatch):
+    """Check that the modification times of many remote files are fetched
+    with one command, and that inaccessible files are skipped.
+    """
+    import pydatalab.ssh
+
+    commands = []
+
+    def _fake_run_ssh_command(hostname, command, timeout=20):
+        commands.append((hostname, command))
+        return sp.CompletedProcess(
+            args=[],
+            returncode=1,
+            stdout=b"1700000000 /data/cycle 1.mpr\n1700000100 /data/cycle2.mpr\n",
+            stderr=b"stat: cannot statx '/data/missing.mpr': No such file or directory\n",
+        )
+
+    monkeypatch.setattr(pydatalab.ssh, "run_ssh_command", _fake_run_ssh_command)
+
+    timestamps = pydatalab.ssh.stat_remote_files(
+        "fake.host", ["/data/cycle 1.mpr", "/data/cycle2.mpr", "/data/missing.mpr"]
+    )
+    assert len(commands) == 1
+    assert commands[0][1] == (
+        "stat -c '%Y %n' -- '/data/cycle 1.mpr' /data/cycle2.mpr /data/missing.mpr"
+    )
+    assert timestamps == {
+        "/data/cycle 1.mpr": datetime.datetime.fromtimestamp(1700000000, tz=datetime.timezone.utc),
+        "/data/cycle2.mpr": datetime.datetime.fromtimestamp(1700000100, tz=datetime.timezone.utc),
+    }
+
+
+def test_sync_mounted_file_only_copies_appended_data(tmp_path):
+    """Check that growing files on mounted remotes are synced by appending,
+    and that other changes are copied in full.
+    """
+    from pydatalab.file_utils import _sync_file_with_remote
+
+    remote = tmp_path / "remote.mpr"
+    local = tmp_path / "local.mpr"
+
+    remote.write_bytes(b"a" * 1000)
+    sync_info = _sync_file_with_remote(str(remote), str(local))
+    assert sync_info["method"] == "copy"
+    assert sync_info["bytes_transferred"] == 1000
+
+    with open(remote, "ab") as f:
+        f.write(b"b" * 10)
+    sync_info = _sync_file_with_remote(str(remote), str(local))
+    assert sync_info["method"] == "append"
+    assert sync_info["bytes_transferred"] == 10
+    assert local.read_bytes() == remote.read_bytes()
+
+    remote.write_bytes(b"c" * 2000)
+    sync_info = _sync_file_with_remote(str(remote), str(local))
+    assert sync_info["method"] == "copy"
+    assert sync_info["bytes_transferred"] == 2000
+    assert local.read_bytes() == remote.read_bytes()
+
+
+def test_remote_tree_quotes_paths(monkeypatch, tmp_path):
+    """Check that paths passed to `tree` on a remote cannot inject commands into
+    either the local or the remote shell.
+    """
+    import sys
+
+    import pydatalab.remote_filesystems
+
+    # Stand in for `tree` on the remote, reporting the arguments it received
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    fake_tree = bin_dir / "tree"
+    fake_tree.write_text(
+        f"#!{sys.executable}\nimport json, sys\nprint(json.dumps([{{'argv': sys.argv[1:]}}]))\n"
+    )
+    fake_tree.chmod(0o755)
+
+    commands = []
+
+    def _fake_run_ssh_command(hostname, command, timeout=20):
+        # Run the command in a shell, as `ssh` would on the remote
+        commands.append((hostname, command))
+        return sp.run(  # noqa: S603
+            ["sh", "-c", command],  # noqa: S607
+            capture_output=True,
+            env={"PATH": f"{bin_dir}:/usr/bin:/bin", "HOME": str(tmp_path)},
+            cwd=tmp_path,
+            check=False,
+        )
+
+    monkeypatch.setattr(pydatalab.remote_filesystems, "run_ssh_command", _fake_run_ssh_command)
+
+    paths = [
+        "/data/it's $(touch injected) `touch injected`",
+        '/data/"; touch injected; echo "',
+    ]
+    result = pydatalab.remote_filesystems._call_tree(["-Jsf"], paths, hostname="fake.host")
+    assert result == [{"argv": ["-Jsf", *paths, "--timefmt", "%s"]}]
+    assert len(commands) == 1
+    assert commands[0][0] == "fake.host"
+    assert not (tmp_path / "injected").exists()
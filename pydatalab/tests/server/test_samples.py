@@ -154,6 +154,9 @@ def test_create_indices(real_mongo_client):
 
     assert all(name in names for name in expected_index_names)
 
+    # Indexes that already exist as specified are not recreated
+    assert create_default_indices(real_mongo_client) == []
+
 
 @pytest.mark.parametrize(
     "query,expected_result_ids",
@@ -0,0 +1,21 @@
+import os
+
+import pytest
+
+from pydatalab.startup import CREATE_APP_BUDGET, check_startup_budget, profile_startup
+
+
+@pytest.mark.skipif(
+    not os.environ.get("PYDATALAB_TEST_STARTUP_BUDGETS"),
+    reason="wall-clock budgets are only checked when PYDATALAB_TEST_STARTUP_BUDGETS is set",
+)
+def test_create_app_is_within_budget(app, app_config):  # pylint: disable=unused-argument
+    # The `app` fixture has already created the database indexes, as on a restart
+    profile = profile_startup(
+        config_override={**app_config, "TESTING": True},
+        create_app=True,
+    )
+    assert profile.create_app_time is not None
+
+    failures = check_startup_budget(profile, create_app_budget=CREATE_APP_BUDGET)
+    assert not failures, failures
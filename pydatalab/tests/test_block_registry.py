@@ -0,0 +1,45 @@
+import subprocess
+import sys
+
+from pydatalab.apps import APP_BLOCKS, BLOCK_TYPES
+from pydatalab.blocks.registry import BlockInfo, BlockRegistry, import_block
+
+
+def test_block_info_is_read_without_importing_blocks():
+    script = """
+import sys
+from pydatalab.apps import BLOCK_TYPES
+info = BLOCK_TYPES.info()
+assert "xrd" in info and "cycle" in info, info
+assert ".mpr" in info["cycle"].accepted_file_extensions
+loaded = [m for m in sys.modules if m.startswith("pydatalab.apps.") or m in ("bokeh", "navani")]
+assert not loaded, loaded
+print(BLOCK_TYPES["xrd"].__name__)
+"""
+    result = subprocess.run(  # noqa: S603
+        [sys.executable, "-c", script], capture_output=True, text=True, check=False
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "XRDBlock"
+
+
+def test_block_info_matches_block_classes():
+    for blocktype, info in BLOCK_TYPES.info().items():
+        block = BLOCK_TYPES[blocktype]
+        assert block.blocktype == blocktype
+        assert info.dict(exclude={"target"}) == BlockInfo.from_block(block).dict(exclude={"target"})
+
+
+def test_unavailable_blocks_are_skipped():
+    registry = BlockRegistry(
+        [],
+        {
+            "pydatalab.apps._canary:CanaryBlock": (),
+            "pydatalab.apps.xrd:XRDBlock": ("a_module_that_is_not_installed",),
+            "pydatalab.apps.ftir:FTIRBlock": (),
+        },
+    )
+    assert list(registry) == ["ftir"]
+    assert "ftir" in registry
+    assert registry["ftir"] is import_block("pydatalab.apps.ftir:FTIRBlock")
+    assert "pydatalab.apps._canary:CanaryBlock" in APP_BLOCKS
@@ -0,0 +1,71 @@
+import json
+
+import pytest
+from bson import ObjectId
+
+from pydatalab.config import CONFIG
+from pydatalab.derivatives import (
+    DERIVATIVE_SIZES,
+    PYRAMID_MIN_SIZE,
+    TILE_SIZE,
+    derivative_directory,
+    image_derivative,
+    image_pyramid,
+    pyramid_tile,
+)
+
+
+@pytest.fixture
+def file_directory_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(CONFIG, "FILE_DIRECTORY", tmp_path)
+    return tmp_path
+
+
+def test_image_derivatives(file_directory_path, example_data_dir):
+    from PIL import Image
+
+    location = example_data_dir / "media" / "grey_group_logo.tif"
+    file_doc = {"_id": ObjectId(), "revision": 1, "metadata": {}}
+
+    for name, size in DERIVATIVE_SIZES.items():
+        path = image_derivative(file_doc, location, name)
+        with Image.open(path) as image:
+            assert max(image.size) <= size
+
+    # Small images are displayed without a pyramid
+    assert image_pyramid(file_doc, location) is None
+    with pytest.raises(FileNotFoundError):
+        pyramid_tile(file_doc, location, 0, 0, 0)
+
+    # Derivatives of previous revisions are removed when a new revision is processed
+    old_directory = derivative_directory(file_doc)
+    image_derivative({**file_doc, "revision": 2}, location, "web")
+    assert not old_directory.exists()
+
+    with pytest.raises(ValueError):
+        image_derivative(file_doc, location, "huge")
+
+
+def test_image_pyramid(file_directory_path, tmp_path):
+    from PIL import Image
+
+    width, height = PYRAMID_MIN_SIZE + 100, 64
+    location = tmp_path / "wide.tif"
+    Image.new("I;16", (width, height), 1000).save(location)
+    file_doc = {"_id": ObjectId(), "revision": 1, "metadata": {"sha256": "ab" * 32}}
+
+    manifest = image_pyramid(file_doc, location)
+    assert manifest is not None
+    assert json.loads(json.dumps(manifest)) == manifest
+    assert (manifest["width"], manifest["height"]) == (width, height)
+    assert manifest["tile_size"] == TILE_SIZE
+    assert manifest["levels"][0]["columns"] == -(-width // TILE_SIZE)
+    assert manifest["levels"][-1]["columns"] == manifest["levels"][-1]["rows"] == 1
+
+    with Image.open(pyramid_tile(file_doc, location, 0, 0, 0)) as tile:
+        assert tile.size == (TILE_SIZE, height)
+    last_column = manifest["levels"][0]["columns"] - 1
+    with Image.open(pyramid_tile(file_doc, location, 0, last_column, 0)) as tile:
+        assert tile.size == (width - last_column * TILE_SIZE, height)
+    with pytest.raises(FileNotFoundError):
+        pyramid_tile(file_doc, location, 0, last_column + 1, 0)
@@ -0,0 +1,119 @@
+import os
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import pytest
+from flask import Flask
+
+import pydatalab.metrics
+from pydatalab.config import CONFIG
+
+pytest.importorskip("prometheus_client")
+
+
+@pytest.fixture
+def metrics_app(monkeypatch):
+    monkeypatch.setattr(CONFIG, "METRICS_ENABLED", True)
+    monkeypatch.setattr(CONFIG, "METRICS_TOKEN", "scraper-token")
+    monkeypatch.setattr(pydatalab.metrics, "_job_queue_depths", lambda: {("default", "pending"): 3})
+    app = Flask(__name__)
+    pydatalab.metrics.init_app(app)
+
+    @app.route("/items/<item_id>")
+    def get_item(item_id):
+        return item_id
+
+    return app
+
+
+def test_metrics_endpoint(metrics_app):
+    client = metrics_app.test_client()
+    assert client.get("/items/abc").status_code == 200
+    assert client.get("/items/def").status_code == 200
+    assert client.get("/missing").status_code == 404
+
+    pydatalab.metrics.record_cache("test_cache", hit=True)
+    with pydatalab.metrics.measure("block_render_duration", blocktype="test"):
+        pass
+
+    response = client.get("/metrics", headers={"Authorization": "Bearer scraper-token"})
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain")
+    body = response.get_data(as_text=True)
+    assert 'datalab_http_requests_total{endpoint="get_item",method="GET",status="200"}' in body
+    assert 'endpoint="unmatched",method="GET",status="404"' in body
+    assert 'datalab_http_request_duration_seconds_count{endpoint="get_item",method="GET"}' in body
+    assert 'datalab_cache_requests_total{cache="test_cache",result="hit"}' in body
+    assert 'datalab_block_render_duration_seconds_count{blocktype="test"}' in body
+    assert 'datalab_job_queue_depth{queue="default",status="pending"} 3.0' in body
+
+
+def test_metrics_endpoint_requires_token(metrics_app, monkeypatch):
+    client = metrics_app.test_client()
+    assert client.get("/metrics").status_code == 401
+    assert (
+        client.get("/metrics", headers={"Authorization": "Bearer wrong-token"}).status_code == 401
+    )
+
+    monkeypatch.setattr(CONFIG, "METRICS_TOKEN", None)
+    assert client.get("/metrics", headers={"Authorization": "Bearer "}).status_code == 401
+
+
+def test_metrics_endpoint_disabled(metrics_app, monkeypatch):
+    monkeypatch.setattr(CONFIG, "METRICS_ENABLED", False)
+    response = metrics_app.test_client().get(
+        "/metrics", headers={"Authorization": "Bearer scraper-token"}
+    )
+    assert response.status_code == 404
+
+
+def test_mongo_command_metrics(monkeypatch):
+    monkeypatch.setattr(CONFIG, "METRICS_ENABLED", True)
+    listener = pydatalab.metrics.MongoCommandMetrics()
+    event = SimpleNamespace(
+        command_name="find",
+        command={"find": "metrics_test", "filter": {}},
+        connection_id=("localhost", 27017),
+        request_id=1,
+        operation_id=1,
+        duration_micros=2500,
+    )
+    listener.started(event)
+    listener.succeeded(event)
+    assert not listener._collections
+
+    body, _ = pydatalab.metrics.generate_metrics()
+    assert (
+        b'datalab_mongodb_command_duration_seconds_count{collection="metrics_test",command="find"} 1.0'
+        in body
+    )
+
+
+def test_metrics_are_aggregated_across_processes(tmp_path):
+    """Metrics recorded by separate processes (e.g., gunicorn workers) should be
+    reported together when the multiprocess directory is set.
+
+    """
+    script = """
+import sys
+from pydatalab.config import CONFIG
+import pydatalab.metrics
+CONFIG.METRICS_ENABLED = True
+pydatalab.metrics._job_queue_depths = lambda: {}
+if sys.argv[1] == "record":
+    pydatalab.metrics.record_cache("shared", hit=True)
+else:
+    sys.stdout.write(pydatalab.metrics.generate_metrics()[0].decode())
+"""
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+    for mode in ("record", "record", "report"):
+        result = subprocess.run(  # noqa: S603
+            [sys.executable, "-c", script, mode],
+            capture_output=True,
+            text=True,
+            env=env,
+            check=False,
+        )
+        assert result.returncode == 0, result.stderr
+    assert 'datalab_cache_requests_total{cache="shared",result="hit"} 2.0' in result.stdout
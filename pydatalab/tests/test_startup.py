@@ -0,0 +1,43 @@
+import os
+
+from pydatalab.startup import (
+    IMPORT_BUDGET,
+    STARTUP_FORBIDDEN_MODULES,
+    _parse_importtime,
+    check_startup_budget,
+    profile_startup,
+)
+
+
+def test_parse_importtime():
+    output = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |     pydatalab.logger
+import time:      1500 |       1620 |   pydatalab.config
+import time:       300 |       1920 | pydatalab.main
+"""
+    timings = _parse_importtime(output)
+    assert [(t.module, t.depth) for t in timings] == [
+        ("pydatalab.logger", 2),
+        ("pydatalab.config", 1),
+        ("pydatalab.main", 0),
+    ]
+    assert timings[1].self_time == 0.0015
+    assert timings[2].cumulative_time == 0.00192
+
+
+def test_import_does_not_load_heavy_modules():
+    """Check that no heavy dependencies are imported on startup. The wall-clock
+    import budget depends on the machine, so is only also checked when the
+    `PYDATALAB_TEST_STARTUP_BUDGETS` environment variable is set.
+
+    """
+    profile = profile_startup("pydatalab.main")
+    assert profile.imported("pydatalab.main")
+    assert profile.create_app_time is None
+
+    failures = check_startup_budget(
+        profile,
+        import_budget=IMPORT_BUDGET if os.environ.get("PYDATALAB_TEST_STARTUP_BUDGETS") else None,
+        forbidden_modules=STARTUP_FORBIDDEN_MODULES,
+    )
+    assert not failures, failures
@@ -0,0 +1,136 @@
+import hashlib
+import io
+
+import pytest
+
+from pydatalab.config import CONFIG, ObjectStorage
+from pydatalab.storage import (
+    LocalStorage,
+    S3Storage,
+    StoredFileMismatchError,
+    ensure_local_file,
+    file_directory,
+    file_key,
+)
+
+FILE_ID = "6500000000000000000000aa"
+CONTENTS = b"0123456789" * 1000
+
+
+@pytest.fixture
+def file_directory_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(CONFIG, "FILE_DIRECTORY", tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def s3_storage(file_directory_path):
+    """An `S3Storage` backed by a local stand-in for an S3-compatible server."""
+    pytest.importorskip("boto3")
+    moto_server = pytest.importorskip("moto.server")
+
+    server = moto_server.ThreadedMotoServer(port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    with pytest.MonkeyPatch.context() as m:
+        m.setenv("AWS_ACCESS_KEY_ID", "testing")
+        m.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+        storage = S3Storage(
+            ObjectStorage(
+                bucket="datalab",
+                endpoint_url=f"http://{host}:{port}",
+                region_name="us-east-1",
+                prefix="files/",
+            )
+        )
+        storage.client.create_bucket(Bucket="datalab")
+        yield storage
+    server.stop()
+
+
+def test_file_key_is_independent_of_layout(file_directory_path):
+    assert file_key(file_directory(FILE_ID) / "data.txt") == f"{FILE_ID}/data.txt"
+    assert file_key(file_directory_path / FILE_ID / "data.txt") == f"{FILE_ID}/data.txt"
+
+
+def test_local_storage(file_directory_path):
+    storage = LocalStorage()
+    key = f"{FILE_ID}/data.txt"
+
+    with pytest.raises(FileNotFoundError):
+        storage.local_path(key)
+
+    storage.write(key, io.BytesIO(CONTENTS))
+    assert storage.local_path(key) == file_directory(FILE_ID) / "data.txt"
+    assert storage.size(key) == len(CONTENTS)
+
+    with storage.open(key) as f:
+        assert f.read() == CONTENTS
+    with storage.open(key, start=5, end=14) as f:
+        assert f.read() == CONTENTS[5:15]
+    with storage.open(key, start=9995) as f:
+        assert f.read() == CONTENTS[9995:]
+
+    storage.delete(key)
+    with pytest.raises(FileNotFoundError):
+        storage.size(key)
+
+
+def test_local_storage_legacy_layout(file_directory_path):
+    legacy_location = file_directory_path / FILE_ID / "data.txt"
+    legacy_location.parent.mkdir()
+    legacy_location.write_bytes(CONTENTS)
+
+    assert LocalStorage().local_path(f"{FILE_ID}/data.txt") == legacy_location
+    # A stored location in the other layout is resolved to the existing file
+    assert ensure_local_file(str(file_directory(FILE_ID) / "data.txt")) == str(legacy_location)
+
+
+def test_s3_storage(s3_storage):
+    key = f"{FILE_ID}/data.txt"
+    location = file_directory(FILE_ID) / "data.txt"
+    location.parent.mkdir(parents=True)
+    location.write_bytes(CONTENTS)
+
+    s3_storage.upload(key, location)
+    assert s3_storage.size(key) == len(CONTENTS)
+    with s3_storage.open(key, start=5, end=14) as f:
+        assert f.read() == CONTENTS[5:15]
+
+    # The local copy matches the expected digest, so is used without contacting the
+    # object store
+    with pytest.MonkeyPatch.context() as m:
+        m.setattr(s3_storage, "client", None)
+        assert s3_storage.local_path(key, sha256=hashlib.sha256(CONTENTS).hexdigest()) == location
+
+    # Without a digest, the local copy is checked against the stored object
+    assert s3_storage.local_path(key) == location
+
+    # A missing local copy is fetched from the object store
+    location.unlink()
+    assert s3_storage.local_path(key).read_bytes() == CONTENTS
+
+    # As is a local copy that is out of date, whether or not the digest is known
+    s3_storage.write(key, io.BytesIO(CONTENTS[::-1]))
+    assert s3_storage.local_path(key).read_bytes() == CONTENTS[::-1]
+    s3_storage.write(key, io.BytesIO(CONTENTS))
+    assert (
+        s3_storage.local_path(key, sha256=hashlib.sha256(CONTENTS).hexdigest()).read_bytes()
+        == CONTENTS
+    )
+
+    # A stored object that does not match the expected digest is not used, and is
+    # not fetched again until it changes
+    unexpected = hashlib.sha256(b"unexpected").hexdigest()
+    with pytest.raises(StoredFileMismatchError):
+        s3_storage.local_path(key, sha256=unexpected)
+    assert location.read_bytes() == CONTENTS
+    with pytest.MonkeyPatch.context() as m:
+        m.setattr(s3_storage, "_get", None)
+        with pytest.raises(StoredFileMismatchError):
+            s3_storage.local_path(key, sha256=unexpected)
+
+    s3_storage.delete(key)
+    location.unlink()
+    with pytest.raises(FileNotFoundError):
+        s3_storage.local_path(key)
@@ -943,7 +943,10 @@ export function saveItem(item_id) {
       if (response_json.status === "success") {
         store.commit("updateItemData", {
           item_id: item_id,
-          item_data: { last_modified: response_json.last_modified },
+          item_data: {
+            last_modified: response_json.last_modified,
+            version: response_json.version,
+          },
         });
         store.commit("setItemSaved", { item_id: item_id, isSaved: true });
         store.state.all_item_data[item_id].display_order.forEach((block_id) => {
@@ -1114,6 +1117,9 @@ export async function addRemoteFileToSample(file_entry, item_id) {
  * @param {string|null} options.item_id - The item ID to fetch graph for
  * @param {string|null} options.collection_id - The collection ID to filter by
  * @param {number} options.max_depth - Maximum depth for related items (default: 1)
+ * @param {number|null} options.limit - Maximum number of nodes in the whole-deployment graph
+ * @param {number|null} options.max_family_size - Collapse larger families into a single node
+ * @param {boolean} options.cluster_collections - Collapse collection members into a single node
  * @param {boolean} options.updateStore - Whether to update Vuex store (default: true)
  * @returns {Promise<Object|void>} Returns graph data if updateStore is false, void otherwise
  */
@@ -1121,6 +1127,9 @@ export async function getItemGraph({
   item_id = null,
   collection_id = null,
   max_depth = 1,
+  limit = null,
+  max_family_size = null,
+  cluster_collections = false,
   updateStore = true,
 } = {}) {
   // Short-circuit and do not send request if user is not logged in
@@ -1138,6 +1147,15 @@ export async function getItemGraph({
   if (max_depth != null && max_depth > 1) {
     params.append("max_depth", max_depth.toString());
   }
+  if (limit != null) {
+    params.append("limit", limit.toString());
+  }
+  if (max_family_size != null) {
+    params.append("max_family_size", max_family_size.toString());
+  }
+  if (cluster_collections) {
+    params.append("cluster_collections", "true");
+  }
   if (params.toString()) {
     url = url + "?" + params.toString();
   }